@@ -0,0 +1,131 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Buffered stanza memory benchmark.
+
+Parses <message/> stanzas received over many simulated connections (each
+with its own stream reader), builds `Message` objects from them and keeps
+them all, as a server queueing messages for offline or slow recipients
+would do. Reports the memory used per buffered message (growth of the
+maximum resident set size), with the element and attribute name interning
+enabled and disabled.
+
+Each combination is run in a separate process.
+"""
+
+import os
+import sys
+import resource
+import argparse
+import subprocess
+
+STREAM_HEAD = (b"<stream:stream xmlns='jabber:client'"
+                b" xmlns:stream='http://etherx.jabber.org/streams'"
+                b" version='1.0'>")
+
+MESSAGE = (b"<message from='juliet@example.com/balcony'"
+            b" to='romeo@example.net' type='chat' id='m{0}'>"
+            b"<body>Wherefore art thou, Romeo?</body>"
+            b"<thread>e0ffe42b28561960c6b12b944a092794b9683a38</thread>"
+            b"<delay xmlns='urn:xmpp:delay' from='example.com'"
+                                    b" stamp='2002-09-10T23:08:25Z'/>"
+            b"</message>")
+
+ETREES = ["xml.etree.ElementTree", "xml.etree.cElementTree"]
+BACKENDS = ["etree", "expat", "expat-lazy"]
+
+def run(backend, connections, messages, decode):
+    """Parse the messages and keep them.
+
+    :Return: bytes of memory used per message
+    """
+    # pylint: disable=W0612
+    from pyxmpp2.xmppparser import XMLStreamHandler, XML_PARSERS
+    from pyxmpp2.message import Message
+    class QueueingHandler(XMLStreamHandler):
+        """Stream handler keeping the messages received."""
+        def __init__(self, queue):
+            XMLStreamHandler.__init__(self)
+            self.queue = queue
+        def stream_start(self, element):
+            pass
+        def stream_end(self):
+            pass
+        def stream_element(self, element):
+            message = Message(element)
+            if decode:
+                message.body # pylint: disable=W0104
+            self.queue.append(message)
+    queue = []
+    data = [MESSAGE.replace(b"{0}", str(i).encode("ascii"))
+                                                    for i in range(messages)]
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    for dummy in range(connections):
+        reader = XML_PARSERS[backend](QueueingHandler(queue))
+        reader.feed(STREAM_HEAD)
+        for stanza in data:
+            reader.feed(stanza)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss
+    return rss * 1024.0 / len(queue)
+
+def child(args):
+    """Run the benchmark for a single combination, in the child process."""
+    from pyxmpp2 import utils
+    from pyxmpp2.xmppparser import XML_PARSERS
+    if args.backend not in XML_PARSERS:
+        print "unavailable"
+        return
+    if args.no_intern:
+        utils._INTERNED_NAMES.clear() # pylint: disable=W0212
+        utils.MAX_INTERNED_NAMES = 0
+    memory = run(args.backend, args.connections, args.messages, args.decode)
+    print "{0:.0f}".format(memory)
+
+def main():
+    """Parse the command-line arguments and run the benchmark."""
+    parser = argparse.ArgumentParser(description = __doc__.strip())
+    parser.add_argument("--connections", type = int, default = 50,
+                                    help = "Number of connections")
+    parser.add_argument("--messages", type = int, default = 1000,
+                                    help = "Number of messages received over"
+                                                        " each connection")
+    parser.add_argument("--decode", action = "store_true",
+                                    help = "Decode the message bodies")
+    parser.add_argument("--backend", help = "Run a single backend with the"
+                                " ElementTree selected by PYXMPP2_ETREE, in"
+                                " the current process")
+    parser.add_argument("--no-intern", action = "store_true",
+                                    help = "Disable the name interning")
+    args = parser.parse_args()
+
+    if args.backend:
+        child(args)
+        return
+
+    print "{0:24s} {1:12s} {2:>16s} {3:>16s}".format("ElementTree",
+                        "parser", "bytes/message", "not interned")
+    for etree in ETREES:
+        for backend in BACKENDS:
+            results = []
+            for no_intern in (False, True):
+                env = dict(os.environ, PYXMPP2_ETREE = etree)
+                command = [sys.executable, __file__, "--backend", backend,
+                        "--connections", str(args.connections),
+                        "--messages", str(args.messages)]
+                if args.decode:
+                    command.append("--decode")
+                if no_intern:
+                    command.append("--no-intern")
+                process = subprocess.Popen(command, env = env,
+                                        stdout = subprocess.PIPE,
+                                        stderr = subprocess.PIPE)
+                output = process.communicate()[0].strip()
+                if process.returncode or output == "unavailable":
+                    output = "unavailable"
+                results.append(output)
+            print "{0:24s} {1:12s} {2:>16s} {3:>16s}".format(etree, backend,
+                                                                    *results)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Receiving side TLS handshake benchmark.
+
+Runs a `TCPTransport` based listener in a main loop and a number of client
+threads making TLS connections to it. Reports handshakes per second and the
+longest main loop iteration, with the handshakes run in the main loop thread
+and in a `WorkerPool`.
+"""
+
+import os
+import ssl
+import time
+import socket
+import logging
+import argparse
+import threading
+
+from pyxmpp2.settings import XMPPSettings
+from pyxmpp2.transport import TCPTransport
+from pyxmpp2.xmppparser import XMLStreamHandler
+from pyxmpp2.server.listener import TCPListener
+from pyxmpp2.mainloop.select import SelectMainLoop
+from pyxmpp2.mainloop.threads import WorkerPool
+from pyxmpp2.streamtls import SSLContextFactory
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "pyxmpp2", "test",
+                                                                    "data")
+
+class ClosingTarget(XMLStreamHandler):
+    """Stream handler closing the transport when the peer disconnects."""
+    def __init__(self, server, transport):
+        XMLStreamHandler.__init__(self)
+        self.server = server
+        self.transport = transport
+    def stream_start(self, element):
+        pass
+    def stream_end(self):
+        self.stream_eof()
+    def stream_element(self, element):
+        pass
+    def stream_eof(self):
+        self.server.done.append(self.transport)
+
+class Server(object):
+    """TLS server using the pyxmpp2 transport."""
+    def __init__(self, settings):
+        self.settings = settings
+        self.context = SSLContextFactory(settings).get_context(True)
+        self.listener = TCPListener(socket.AF_INET, ("127.0.0.1", 0),
+                                                                self.accept)
+        self.address = self.listener._socket.getsockname()
+        self.loop = SelectMainLoop(settings, [self.listener])
+        self.done = []
+        self.max_iteration = 0.0
+        self.running = True
+
+    def accept(self, sock, address):
+        """Handle an accepted connection."""
+        # pylint: disable=W0613
+        transport = TCPTransport(self.settings, sock)
+        transport.set_target(ClosingTarget(self, transport))
+        transport.starttls(ssl_context = self.context, server_side = True)
+        self.loop.add_handler(transport)
+
+    def run(self):
+        """The server thread function."""
+        while self.running:
+            start = time.time()
+            self.loop.loop_iteration(0.1)
+            self.max_iteration = max(self.max_iteration, time.time() - start)
+            while self.done:
+                transport = self.done.pop()
+                self.loop.remove_handler(transport)
+                transport.close()
+
+def client(address, count, ca_file):
+    """Make `count` TLS connections to `address`."""
+    context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+    context.verify_mode = ssl.CERT_REQUIRED
+    context.load_verify_locations(ca_file)
+    for dummy in range(count):
+        sock = socket.create_connection(address)
+        tls_sock = context.wrap_socket(sock)
+        tls_sock.close()
+
+def run(args, executor):
+    """Run the benchmark once.
+
+    :Return: (handshakes per second, longest main loop iteration)
+    """
+    settings = XMPPSettings({
+                    u"tls_verify_peer": False,
+                    u"tls_cert_file": args.cert,
+                    u"tls_key_file": args.key,
+                    u"tls_handshake_executor": executor,
+                            })
+    server = Server(settings)
+    server.listener.prepare()
+    server_thread = threading.Thread(target = server.run)
+    server_thread.start()
+    clients = [threading.Thread(target = client, args = (server.address,
+                                    args.connections, args.cacert))
+                                            for dummy in range(args.clients)]
+    start = time.time()
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    duration = time.time() - start
+    server.running = False
+    server_thread.join()
+    server.listener.close()
+    return args.clients * args.connections / duration, server.max_iteration
+
+def main():
+    """Parse the command-line arguments and run the benchmark."""
+    parser = argparse.ArgumentParser(description = __doc__.strip())
+    parser.add_argument("--cert", default = os.path.join(DATA_DIR,
+                                                                "server.pem"),
+                                    help = "Server certificate file")
+    parser.add_argument("--key", default = os.path.join(DATA_DIR,
+                                                            "server-key.pem"),
+                                    help = "Server private key file")
+    parser.add_argument("--cacert", default = os.path.join(DATA_DIR,
+                                                                    "ca.pem"),
+                                    help = "CA certificate file")
+    parser.add_argument("--clients", type = int, default = 8,
+                                    help = "Number of client threads")
+    parser.add_argument("--connections", type = int, default = 50,
+                                    help = "Connections per client thread")
+    parser.add_argument("--workers", type = int, default = 4,
+                                    help = "Worker threads for the handshakes")
+    parser.add_argument("--debug", action = "store_true",
+                                    help = "Print debug messages")
+    args = parser.parse_args()
+    if args.debug:
+        logging.basicConfig(level = logging.DEBUG)
+
+    rate, max_iteration = run(args, None)
+    print "main loop thread: {0:8.1f} handshakes/s, longest loop iteration" \
+                        " {1:.1f} ms".format(rate, max_iteration * 1000)
+    pool = WorkerPool(args.workers, u"tls")
+    try:
+        rate, max_iteration = run(args, pool)
+    finally:
+        pool.stop(True, 2)
+    print "worker pool ({0}):  {1:8.1f} handshakes/s, longest loop" \
+                " iteration {2:.1f} ms".format(args.workers, rate,
+                                                        max_iteration * 1000)
+
+if __name__ == "__main__":
+    main()
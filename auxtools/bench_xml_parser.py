@@ -0,0 +1,149 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+XML stream parser benchmark.
+
+Feeds a stream built from the stanzas of the test/data/stream.xml file,
+repeated many times, to the stream reader backends selectable with the
+'xml_parser' setting, combined with the ElementTree implementations
+selectable with the PYXMPP2_ETREE environment variable. The data is fed in
+fixed size chunks, as a transport would.
+
+Each combination is run in a separate process. Reports stanzas parsed per
+second and memory used per stanza (growth of the maximum resident set size
+while all the parsed stanzas are kept).
+"""
+
+import os
+import re
+import sys
+import time
+import resource
+import argparse
+import subprocess
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "pyxmpp2", "test",
+                                                                    "data")
+
+STREAM_START_RE = re.compile(br"(.*?<stream:stream[^>]*>)(.*)"
+                                        br"(</stream:stream>\s*)$", re.DOTALL)
+
+# (ElementTree implementation, xml_parser setting value)
+COMBINATIONS = [
+        ("xml.etree.ElementTree", "etree"),
+        ("xml.etree.ElementTree", "expat"),
+        ("xml.etree.ElementTree", "expat-lazy"),
+        ("xml.etree.cElementTree", "etree"),
+        ("xml.etree.cElementTree", "expat"),
+        ("xml.etree.cElementTree", "expat-lazy"),
+        ("lxml.etree", "etree"),
+        ("lxml.etree", "lxml"),
+        ]
+
+def make_stream(path, repeat):
+    """Build the benchmark input.
+
+    :Return: the stream data
+    """
+    with open(path, "rb") as stream_file:
+        data = stream_file.read()
+    head, body, tail = STREAM_START_RE.match(data).groups()
+    return head + body * repeat + tail
+
+def run(backend, data, chunk_size, keep):
+    """Parse `data` with the `backend` reader.
+
+    :Return: (seconds, stanzas parsed, bytes of memory used per stanza)
+    """
+    # pylint: disable=W0612
+    from pyxmpp2.xmppparser import XMLStreamHandler, XML_PARSERS
+    class CountingHandler(XMLStreamHandler):
+        """Stream handler counting (and optionally keeping) the stanzas."""
+        def __init__(self):
+            XMLStreamHandler.__init__(self)
+            self.count = 0
+            self.stanzas = []
+        def stream_start(self, element):
+            pass
+        def stream_end(self):
+            pass
+        def stream_element(self, element):
+            self.count += 1
+            if keep:
+                self.stanzas.append(element)
+    handler = CountingHandler()
+    reader = XML_PARSERS[backend](handler)
+    chunks = [data[i:i + chunk_size] for i in range(0, len(data),
+                                                                chunk_size)]
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    for chunk in chunks:
+        reader.feed(chunk)
+    reader.feed(b"")
+    duration = time.time() - start
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss
+    return duration, handler.count, rss * 1024.0 / max(handler.count, 1)
+
+def child(args):
+    """Run the benchmark for a single combination, in the child process."""
+    from pyxmpp2.xmppparser import XML_PARSERS
+    if args.backend not in XML_PARSERS:
+        print "unavailable"
+        return
+    data = make_stream(args.input, args.repeat)
+    best = None
+    for dummy in range(args.rounds):
+        duration, count, dummy = run(args.backend, data, args.chunk_size,
+                                                                    False)
+        if best is None or duration < best:
+            best = duration
+    dummy, dummy, memory = run(args.backend, data, args.chunk_size, True)
+    print "{0:.0f} {1:.0f}".format(count / best, memory)
+
+def main():
+    """Parse the command-line arguments and run the benchmark."""
+    parser = argparse.ArgumentParser(description = __doc__.strip())
+    parser.add_argument("--input", default = os.path.join(DATA_DIR,
+                                                                "stream.xml"),
+                                    help = "Stream to take the stanzas from")
+    parser.add_argument("--repeat", type = int, default = 20000,
+                                    help = "Number of times the stanzas are"
+                                                                " repeated")
+    parser.add_argument("--chunk-size", type = int, default = 4096,
+                                    help = "Size of data chunks fed to the"
+                                                                " parser")
+    parser.add_argument("--rounds", type = int, default = 3,
+                                    help = "Number of runs per combination,"
+                                                    " the best one is shown")
+    parser.add_argument("--backend", help = "Run a single backend with the"
+                                " ElementTree selected by PYXMPP2_ETREE, in"
+                                " the current process")
+    args = parser.parse_args()
+
+    if args.backend:
+        child(args)
+        return
+
+    print "{0:24s} {1:8s} {2:>12s} {3:>14s}".format("ElementTree",
+                                "parser", "stanzas/s", "bytes/stanza")
+    for etree, backend in COMBINATIONS:
+        env = dict(os.environ, PYXMPP2_ETREE = etree)
+        command = [sys.executable, __file__, "--backend", backend,
+                    "--input", args.input, "--repeat", str(args.repeat),
+                    "--chunk-size", str(args.chunk_size),
+                    "--rounds", str(args.rounds)]
+        process = subprocess.Popen(command, env = env,
+                                stdout = subprocess.PIPE,
+                                stderr = subprocess.PIPE)
+        output = process.communicate()[0].strip()
+        if process.returncode or output == "unavailable":
+            print "{0:24s} {1:8s} {2:>12s}".format(etree, backend,
+                                                            "unavailable")
+            continue
+        rate, memory = output.split()
+        print "{0:24s} {1:8s} {2:>12s} {3:>14s}".format(etree, backend,
+                                                            rate, memory)
+
+if __name__ == "__main__":
+    main()
@@ -103,6 +103,7 @@ class ResourceBindingHandler(StreamFeatureHandler, XMPPFeatureHandler):
     def __init__(self, settings = None):
         self.stream = None
         self.settings = settings if settings else XMPPSettings()
+        self.pipelined = False
 
     def make_stream_features(self, stream, features):
         """Add resource binding feature to the <features/> element of the
@@ -133,6 +134,16 @@ class ResourceBindingHandler(StreamFeatureHandler, XMPPFeatureHandler):
         self.bind(stream, resource)
         return StreamFeatureHandled("Resource binding", mandatory = True)
 
+    def pipeline_stream_features(self, stream, features):
+        """Bind a resource, when the peer is expected to offer resource
+        binding.
+
+        [initiating entity only]
+        """
+        ret = self.handle_stream_features(stream, features)
+        self.pipelined = ret is not None
+        return ret
+
     def bind(self, stream, resource):
         """Bind to a resource.
 
@@ -165,6 +176,7 @@ class ResourceBindingHandler(StreamFeatureHandler, XMPPFeatureHandler):
 
         Set `streambase.StreamBase.me` to the full JID negotiated."""
         # pylint: disable-msg=R0201
+        self.pipelined = False
         payload = stanza.get_payload(ResourceBindingPayload)
         jid = payload.jid
         if not jid:
@@ -178,7 +190,19 @@ class ResourceBindingHandler(StreamFeatureHandler, XMPPFeatureHandler):
 
         [initiating entity only]
 
+        When the request has been sent before the stream features were
+        received and the peer has not offered resource binding, continue
+        the stream negotiation instead.
+
         :raise FatalStreamError:"""
+        pipelined, self.pipelined = self.pipelined, False
+        features = self.stream.features
+        if pipelined and features is not None and (
+                                    features.find(FEATURE_BIND) is None):
+            logger.debug("Pipelined resource binding failed: {0}"
+                                                .format(stanza.error))
+            self.stream._got_features(features) # pylint: disable=W0212
+            return
         raise FatalStreamError("Resource binding failed")
 
     @iq_set_stanza_handler(ResourceBindingPayload)
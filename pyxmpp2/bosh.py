@@ -0,0 +1,735 @@
+#
+# (C) Copyright 2011 Jacek Konieczny <jajcus@jajcus.net>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version
+# 2.1 as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+
+"""XMPP over BOSH.
+
+The BOSH transport carries the XMPP stream in HTTP requests and responses
+exchanged with a connection manager. All the stanzas waiting to be sent go in
+the body of a single request and the connection manager holds some requests
+until it has anything to send back (long polling). The requests are sent over
+a small pool of persistent HTTP/1.1 connections.
+
+Only the client (initiating entity) side is implemented.
+
+Normative reference:
+  - `XEP-0124 <http://xmpp.org/extensions/xep-0124.html>`__
+  - `XEP-0206 <http://xmpp.org/extensions/xep-0206.html>`__
+"""
+
+from __future__ import absolute_import, division
+
+__docformat__ = "restructuredtext en"
+
+import socket
+import threading
+import logging
+import random
+
+from xml.sax.saxutils import quoteattr
+
+try:
+    # pylint: disable=E0611,F0401
+    from urllib.parse import urlsplit
+except ImportError:
+    from urlparse import urlsplit
+
+from .etree import ElementTree
+from .constants import STREAM_NS, STREAM_ROOT_TAG, XML_LANG_QNAME
+from .constants import BOSH_NS, BOSH_QNP, XBOSH_NS, XBOSH_QNP
+from .settings import XMPPSettings
+from .exceptions import DNSError
+from .exceptions import StreamParseError, StanzaLimitExceeded
+from .streamevents import ResolvingAddressEvent
+from .streamevents import ConnectedEvent, ConnectingEvent, DisconnectedEvent
+from .xmppserializer import XMPPSerializer
+from .xmppparser import parse_document
+from .interfaces import XMPPTransport
+from .boshconnection import BOSHConnection
+
+# pylint: disable=W0611
+from . import resolver
+
+logger = logging.getLogger("pyxmpp2.bosh")
+
+BODY_TAG = BOSH_QNP + u"body"
+XBOSH_VERSION_QNAME = XBOSH_QNP + u"version"
+
+BOSH_VERSION = u"1.11"
+
+class BOSHTransport(XMPPTransport):
+    """XMPP over BOSH (XEP-0124, XEP-0206).
+
+    The HTTP connections of the transport (`BOSHConnection` objects) are
+    added to the main loop given, when the transport starts connecting.
+
+    XMPP content received in the responses is passed to the stream in the
+    order of the requests ('rid'), whichever connection it arrives on.
+
+    :Ivariables:
+        - `lock`: the lock protecting this object
+        - `settings`: settings for this object
+        - `hostname`: host name of the connection manager
+        - `ssl_context`: SSL context for 'https:' connections
+        - `closed`: `True` when the transport has been closed
+        - `_main_loop`: the main loop the connections are added to
+        - `_connections`: the HTTP connection pool
+        - `_state`: transport state (one of: `None`, "resolve-hostname",
+          "resolving-hostname", "connect", "connected", "closing", "closed",
+          "aborted")
+        - `_stream`: the stream associated with this transport
+        - `_serializer`: XML serializer for the stanzas sent
+        - `_pending`: serialized stanzas waiting to be sent
+        - `_sid`: BOSH session id
+        - `_rid`: 'rid' of the next request
+        - `_next_rid_in`: 'rid' of the next response to process
+        - `_responses`: responses received, waiting for the earlier ones
+        - `_delivering`: `True` while a thread is passing the responses to
+          the stream (with `lock` released), the other threads leave their
+          responses in `_responses` for it
+        - `_requests`: maximum number of requests in progress
+        - `_hold`: number of requests the connection manager may hold
+        - `_restart`: `True` when the stream is to be restarted
+        - `_restart_rid`: 'rid' of the restart request
+        - `_terminate_rid`: 'rid' of the session termination request
+        - `_dst_addrs`: addresses of the connection manager
+    :Types:
+        - `lock`: :std:`threading.RLock`
+        - `settings`: `XMPPSettings`
+        - `hostname`: `unicode`
+        - `ssl_context`: :std:`ssl.SSLContext`
+        - `closed`: `bool`
+        - `_main_loop`: `pyxmpp2.mainloop.interfaces.MainLoop`
+        - `_connections`: `list` of `BOSHConnection`
+        - `_state`: `unicode`
+        - `_stream`: `streambase.StreamBase`
+        - `_serializer`: `XMPPSerializer`
+        - `_pending`: `list` of `bytes`
+        - `_sid`: `unicode`
+        - `_rid`: `int`
+        - `_next_rid_in`: `int`
+        - `_responses`: `dict`
+        - `_delivering`: `bool`
+        - `_requests`: `int`
+        - `_hold`: `int`
+        - `_restart`: `bool`
+        - `_restart_rid`: `int`
+        - `_terminate_rid`: `int`
+        - `_dst_addrs`: `list` of (family, sockaddr) tuples
+    """
+    # pylint: disable=R0902
+    def __init__(self, main_loop, settings = None):
+        """Initialize the `BOSHTransport` object.
+
+        :Parameters:
+            - `main_loop`: the main loop to use for the HTTP connections
+            - `settings`: XMPP settings to use
+        :Types:
+            - `main_loop`: `pyxmpp2.mainloop.interfaces.MainLoop`
+            - `settings`: `XMPPSettings`
+        """
+        if settings:
+            self.settings = settings
+        else:
+            self.settings = XMPPSettings()
+        self.lock = threading.RLock()
+        self._main_loop = main_loop
+        self._connections = []
+        self.hostname = None
+        self.ssl_context = None
+        self.closed = False
+        self._port = None
+        self._path = None
+        self._host_header = None
+        self._dst_addrs = None
+        self._state = None
+        self._stream = None
+        self._serializer = None
+        self._pending = []
+        self._sid = None
+        self._rid = random.randint(1 << 20, 1 << 40)
+        self._next_rid_in = None
+        self._responses = {}
+        self._delivering = False
+        # with `_hold` requests held there must still be a connection
+        # to send data on, and something must be held to receive data
+        self._requests = max(2, self.settings["bosh_requests"])
+        self._hold = max(1, min(self.settings["bosh_hold"],
+                                                        self._requests - 1))
+        self._restart = False
+        self._restart_rid = None
+        self._terminate_rid = None
+        self._requests_sent = 0
+        self._stanzas_sent = 0
+        self._max_batch = 0
+        self._connections_opened = 0
+        self._event_queue = self.settings["event_queue"]
+        self._auth_properties = {}
+
+    def _set_state(self, state):
+        """Set `_state`."""
+        logger.debug(" _set_state({0!r})".format(state))
+        self._state = state
+
+    def connect_url(self, url):
+        """Start connecting to a BOSH connection manager.
+
+        :Parameters:
+            - `url`: the 'http:' or 'https:' URL of the connection manager
+        :Types:
+            - `url`: `unicode`
+        """
+        parts = urlsplit(url)
+        if parts.scheme == "http":
+            port = 80
+        elif parts.scheme == "https":
+            port = 443
+        else:
+            raise ValueError("Not a BOSH URL: {0!r}".format(url))
+        with self.lock:
+            if parts.port:
+                port = parts.port
+            self.hostname = parts.hostname
+            self._port = port
+            self._host_header = parts.netloc.rsplit("@", 1)[-1]
+            self._path = parts.path or u"/"
+            if parts.query:
+                self._path += u"?" + parts.query
+            if parts.scheme == "https":
+                factory = self.settings["tls_context_factory"]
+                self.ssl_context = factory.get_context(False)
+                self._auth_properties['security-layer'] = "TLS"
+            else:
+                self._auth_properties['security-layer'] = None
+            self._auth_properties['service-hostname'] = self.hostname
+            try:
+                res = socket.getaddrinfo(self.hostname, port,
+                            socket.AF_UNSPEC, socket.SOCK_STREAM, 0,
+                                                    socket.AI_NUMERICHOST)
+            except socket.gaierror:
+                self._set_state("resolve-hostname")
+            else:
+                self._dst_addrs = [(res[0][0], res[0][4])]
+                self._set_state("connect")
+            self._connections = [BOSHConnection(self)
+                                            for dummy in range(self._requests)]
+        for connection in self._connections:
+            self._main_loop.add_handler(connection)
+
+    def prepare(self):
+        """Start the next connection step: look up the connection manager
+        address and notify the stream when ready.
+
+        Called by the `BOSHConnection.prepare` of the connections.
+
+        :Return: timeout for the next `prepare` call
+        """
+        with self.lock:
+            if self._state == "resolve-hostname":
+                self._set_state("resolving-hostname")
+                self.event(ResolvingAddressEvent(self.hostname))
+                resolver = self.settings["dns_resolver"] # pylint: disable=W0621
+                resolver.resolve_address(self.hostname,
+                                                callback = self._got_addresses)
+                return 0
+            if self._state != "connect":
+                return None
+            self._set_state("connected")
+            stream = self._stream
+        if stream:
+            stream.transport_connected()
+        return None
+
+    def _got_addresses(self, addrs):
+        """Handle the address lookup result.
+
+        :Parameters:
+            - `addrs`: list of (family, address) tuples
+        """
+        with self.lock:
+            if self._state != "resolving-hostname":
+                return
+            if not addrs:
+                self._set_state("aborted")
+                raise DNSError("Could not resolve address record for {0!r}"
+                                                    .format(self.hostname))
+            self._dst_addrs = [(family, (addr, self._port))
+                                                for (family, addr) in addrs]
+            self._set_state("connect")
+
+    def next_address(self):
+        """Return the address to connect to. The addresses are tried in
+        turns, so a failed one is not used for the next attempt.
+
+        [called with `lock` acquired]
+
+        :Returntype: (family, sockaddr) tuple
+        """
+        addr = self._dst_addrs.pop(0)
+        self._dst_addrs.append(addr)
+        return addr
+
+    def connection_started(self, sockaddr):
+        """Called by a `BOSHConnection` when it starts connecting.
+
+        Only the first connection of the session is reported to the stream.
+
+        [called with `lock` acquired]
+        """
+        if not self._connections_opened:
+            self.event(ConnectingEvent(sockaddr))
+
+    def connection_established(self, connection):
+        """Called by a `BOSHConnection` when its TCP connection is
+        established.
+
+        [called with `lock` acquired]
+        """
+        # pylint: disable=W0613
+        self._connections_opened += 1
+        if self._connections_opened == 1:
+            self._auth_properties['remote-ip'] = self._dst_addrs[-1][1][0]
+            self.event(ConnectedEvent(self._dst_addrs[-1][1]))
+
+    def set_target(self, stream):
+        """Make the `stream` the target for this transport instance.
+
+        :Parameters:
+            - `stream`: the stream handler to receive stream content
+              from the transport
+        :Types:
+            - `stream`: `StreamBase`
+        """
+        with self.lock:
+            if self._stream:
+                raise ValueError("Target stream already set")
+            self._stream = stream
+
+    def _make_body(self, attrs, payload = b""):
+        """Build the <body/> element of a request.
+
+        :Parameters:
+            - `attrs`: (name, value) pairs of the attributes
+            - `payload`: serialized content of the element
+        :Types:
+            - `attrs`: `list`
+            - `payload`: `bytes`
+
+        :Returntype: `bytes`
+        """
+        tag = u"<body" + u"".join(u" {0}={1}".format(name, quoteattr(value))
+                                                    for name, value in attrs)
+        tag += u" xmlns='{0}' xmlns:xmpp='{1}'".format(BOSH_NS, XBOSH_NS)
+        if not payload:
+            return (tag + u"/>").encode("utf-8")
+        return (tag + u">").encode("utf-8") + payload + b"</body>"
+
+    def _send_body(self, attrs, payload = b""):
+        """Send a request with the next 'rid' over a free connection from
+        the pool, reusing an established connection if possible.
+
+        [called with `lock` acquired]
+
+        :Return: the 'rid' of the request
+        """
+        rid = self._rid
+        self._rid += 1
+        attrs = [(u"rid", unicode(rid))] + attrs
+        if self._sid is not None:
+            attrs.append((u"sid", self._sid))
+        body = self._make_body(attrs, payload)
+        request = (u"POST {0} HTTP/1.1\r\n"
+                    u"Host: {1}\r\n"
+                    u"Content-Type: text/xml; charset=utf-8\r\n"
+                    u"Content-Length: {2}\r\n"
+                    u"\r\n").format(self._path, self._host_header,
+                                                len(body)).encode("utf-8")
+        free = [conn for conn in self._connections if not conn.busy]
+        connected = [conn for conn in free if conn.connected]
+        connection = (connected or free)[0]
+        self._requests_sent += 1
+        connection.send_request(rid, request + body)
+        return rid
+
+    def _send_pending(self):
+        """Send requests with all the stanzas waiting, keeping up to
+        the :r:`bosh_hold setting` requests (empty, if there is nothing to
+        send) for the connection manager to hold.
+
+        [called with `lock` acquired]
+        """
+        if self._sid is None or self._state != "connected":
+            return
+        while True:
+            in_progress = len([conn for conn in self._connections
+                                                            if conn.busy])
+            if in_progress >= self._requests:
+                break
+            if not self._pending and in_progress >= self._hold:
+                break
+            payload = b"".join(self._pending)
+            self._stanzas_sent += len(self._pending)
+            self._max_batch = max(self._max_batch, len(self._pending))
+            self._pending = []
+            self._send_body([], payload)
+
+    def send_stream_head(self, stanza_namespace, stream_from, stream_to,
+                        stream_id = None, version = u'1.0', language = None):
+        """
+        Request a new BOSH session or, after `restart`, a stream restart.
+
+        :Parameters:
+            - `stanza_namespace`: namespace of stream stanzas (e.g.
+              'jabber:client')
+            - `stream_from`: the 'from' attribute of the stream. May be `None`.
+            - `stream_to`: the 'to' attribute of the stream. May be `None`.
+            - `version`: the 'version' of the stream.
+            - `language`: the 'xml:lang' of the stream
+        :Types:
+            - `stanza_namespace`: `unicode`
+            - `stream_from`: `unicode`
+            - `stream_to`: `unicode`
+            - `version`: `unicode`
+            - `language`: `unicode`
+        """
+        # pylint: disable=R0913,W0613
+        with self.lock:
+            prefixes = {STREAM_NS: u"stream"}
+            prefixes.update(self.settings["extra_ns_prefixes"])
+            self._serializer = XMPPSerializer(stanza_namespace, prefixes)
+            attrs = []
+            if stream_to:
+                attrs.append((u"to", stream_to))
+            if language is not None:
+                attrs.append((u"xml:lang", language))
+            if self._sid is None:
+                attrs += [
+                        (u"content", u"text/xml; charset=utf-8"),
+                        (u"hold", unicode(self._hold)),
+                        (u"wait", unicode(self.settings["bosh_wait"])),
+                        (u"ver", BOSH_VERSION),
+                        (u"xmpp:version", version),
+                        ]
+                if stream_from:
+                    attrs.append((u"from", stream_from))
+                self._next_rid_in = self._send_body(attrs)
+            elif self._restart:
+                attrs.append((u"xmpp:restart", u"true"))
+                self._restart = False
+                self._restart_rid = self._send_body(attrs)
+            else:
+                raise RuntimeError("BOSH session already started")
+
+    def restart(self):
+        """Restart the stream after SASL authentication."""
+        with self.lock:
+            self._restart = True
+            self._serializer = None
+
+    def send_stream_tail(self):
+        """
+        Terminate the BOSH session. Stanzas still waiting are sent
+        in the same request.
+        """
+        with self.lock:
+            if self._state != "connected" or self._sid is None:
+                logger.debug(u"Cannot terminate the session: not connected")
+                return
+            payload = b"".join(self._pending)
+            self._pending = []
+            self._terminate_rid = self._send_body([(u"type", u"terminate")],
+                                                                    payload)
+            self._serializer = None
+            self._set_state("closing")
+
+    def send_element(self, element):
+        """
+        Send an element via the transport. The element is sent with the
+        next request, together with any other element waiting.
+        """
+        with self.lock:
+            if self._state != "connected" or not self._serializer:
+                logger.debug("Dropping element: {0!r}".format(element))
+                return
+            data = self._serializer.emit_standalone(element)
+            self._pending.append(data.encode("utf-8"))
+            self._send_pending()
+
+    def got_response(self, connection, rid, status, data):
+        """Handle an HTTP response received by a `BOSHConnection`.
+
+        [called with `lock` acquired]
+
+        :Parameters:
+            - `connection`: the connection
+            - `rid`: 'rid' of the request
+            - `status`: HTTP status code
+            - `data`: response body
+        :Types:
+            - `connection`: `BOSHConnection`
+            - `rid`: `int`
+            - `status`: `int`
+            - `data`: `bytes`
+        """
+        # pylint: disable=W0613
+        if self._state in ("closed", "aborted"):
+            return
+        if status != 200:
+            logger.warning("BOSH request failed with HTTP status {0}"
+                                                            .format(status))
+            self._abort()
+            return
+        self._responses[rid] = data
+        if self._delivering:
+            # another thread is passing the earlier responses to the stream
+            # (the lock is released then) and will process this one too
+            return
+        self._delivering = True
+        try:
+            while self._next_rid_in in self._responses:
+                rid = self._next_rid_in
+                data = self._responses.pop(rid)
+                self._next_rid_in += 1
+                self._process_body(rid, data)
+                if self._state in ("closed", "aborted"):
+                    return
+        finally:
+            self._delivering = False
+        self._send_pending()
+
+    def request_failed(self, connection, fatal = False):
+        """Handle a request that could not be completed.
+
+        [called with `lock` acquired]
+
+        :Parameters:
+            - `connection`: the connection
+            - `fatal`: `True` if retrying makes no sense
+        """
+        # pylint: disable=W0613
+        if self._state in ("closed", "aborted"):
+            return
+        logger.warning("BOSH request failed")
+        self._abort()
+
+    def _process_body(self, rid, data):
+        """Process the <body/> element received.
+
+        The body is parsed with the stream reader selected by the
+        :r:`xml_parser setting`, so the stanza limits and filters apply to
+        its children.
+
+        [called with `lock` acquired]
+
+        :Parameters:
+            - `rid`: 'rid' of the request answered
+            - `data`: the response body
+        """
+        stream = self._stream
+        try:
+            body, elements = parse_document(data, self.settings)
+        except StanzaLimitExceeded, err:
+            self.lock.release() # not to deadlock with the stream
+            try:
+                stream.stream_limit_exceeded(unicode(err))
+            finally:
+                self.lock.acquire()
+            return
+        except StreamParseError, err:
+            self.lock.release() # not to deadlock with the stream
+            try:
+                stream.stream_parse_error(unicode(err))
+            finally:
+                self.lock.acquire()
+            return
+        if body.tag != BODY_TAG:
+            self.lock.release()
+            try:
+                stream.stream_parse_error(u"Not a BOSH <body/> element")
+            finally:
+                self.lock.acquire()
+            return
+        root = None
+        if self._sid is None:
+            self._sid = body.get(u"sid")
+            if self._sid is None:
+                logger.warning("No 'sid' in the BOSH session creation"
+                                                                " response")
+                self._abort()
+                return
+            requests = body.get(u"requests")
+            if requests is not None and requests.isdigit():
+                self._requests = max(1, min(int(requests),
+                                                    len(self._connections)))
+            hold = body.get(u"hold")
+            if hold is not None and hold.isdigit():
+                # keep at least one request held (we never poll), even when
+                # the connection manager allows a single request only
+                self._hold = max(1, min(int(hold), self._requests - 1))
+            root = self._make_root(body)
+        elif rid == self._restart_rid:
+            self._restart_rid = None
+            root = self._make_root(body)
+        terminate = body.get(u"type") == u"terminate"
+        if terminate:
+            condition = body.get(u"condition")
+            if condition:
+                logger.warning("BOSH session terminated: {0}"
+                                                        .format(condition))
+            self._set_state("closing")
+        self.lock.release() # not to deadlock with the stream
+        try:
+            if root is not None:
+                stream.stream_start(root)
+            for element in elements:
+                stream.stream_element(element)
+            if terminate or rid == self._terminate_rid:
+                stream.stream_eof()
+        finally:
+            self.lock.acquire()
+        if terminate or rid == self._terminate_rid:
+            self._close()
+
+    @staticmethod
+    def _make_root(body):
+        """Make the stream root element for the stream from the session
+        creation or stream restart response.
+
+        :Parameters:
+            - `body`: the <body/> element received
+        :Types:
+            - `body`: :etree:`ElementTree.Element`
+
+        :Returntype: :etree:`ElementTree.Element`
+        """
+        root = ElementTree.Element(STREAM_ROOT_TAG)
+        if body.get(u"from"):
+            root.set(u"from", body.get(u"from"))
+        stream_id = body.get(u"authid") or body.get(u"sid")
+        if stream_id:
+            root.set(u"id", stream_id)
+        root.set(u"version", body.get(XBOSH_VERSION_QNAME, u"1.0"))
+        if body.get(XML_LANG_QNAME):
+            root.set(XML_LANG_QNAME, body.get(XML_LANG_QNAME))
+        return root
+
+    def _abort(self):
+        """Close the transport on a fatal error and notify the stream.
+
+        [called with `lock` acquired]
+        """
+        self._set_state("aborted")
+        stream = self._stream
+        self.lock.release() # not to deadlock with the stream
+        try:
+            if stream:
+                stream.stream_eof()
+        finally:
+            self.lock.acquire()
+        self._close()
+
+    @property
+    def http_stats(self):
+        """HTTP counters of the transport: requests sent ('requests_sent'),
+        connections opened ('connections_opened'), stanzas sent
+        ('stanzas_sent') and the biggest number of stanzas sent in a single
+        request ('max_batch').
+
+        :Returntype: `dict`
+        """
+        with self.lock:
+            return {
+                    "requests_sent": self._requests_sent,
+                    "connections_opened": self._connections_opened,
+                    "stanzas_sent": self._stanzas_sent,
+                    "max_batch": self._max_batch,
+                    }
+
+    def is_connected(self):
+        """
+        Check if the transport is connected.
+
+        :Return: `True` if is connected.
+        """
+        return self._state == "connected"
+
+    def disconnect(self):
+        """Terminate the BOSH session gracefully."""
+        logger.debug("BOSHTransport.disconnect()")
+        with self.lock:
+            if self._state == "connected" and self._sid is not None:
+                self.send_stream_tail()
+            elif self._state != "closing":
+                self._close()
+
+    def close(self):
+        """Close the transport immediately, so it won't expect more
+        events."""
+        with self.lock:
+            self._close()
+
+    def _close(self):
+        """Same as `close` but expects `lock` acquired.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        if self._state != "aborted":
+            self._set_state("closed")
+        for connection in self._connections:
+            connection.close()
+            self._main_loop.remove_handler(connection)
+        self.event(DisconnectedEvent(self._host_header))
+
+    def event(self, event):
+        """Pass an event to the target stream or just log it."""
+        logger.debug(u"BOSH transport event: {0}".format(event))
+        if self._stream:
+            event.stream = self._stream
+        self._event_queue.put(event)
+
+    @property
+    def auth_properties(self):
+        return self._auth_properties
+
+XMPPSettings.add_setting(u"bosh_requests", type = int, default = 2,
+        validator = XMPPSettings.get_int_range_validator(2, 1024),
+        doc = u"""Maximum number of simultaneous BOSH requests, which is also
+the number of HTTP connections kept. The value announced by the connection
+manager is used if lower. At least 2 requests are needed, so data may be
+sent while a request is held."""
+    )
+XMPPSettings.add_setting(u"bosh_hold", type = int, default = 1,
+        validator = XMPPSettings.get_int_range_validator(1, 1024),
+        doc = u"""Maximum number of BOSH requests the connection manager may
+keep waiting for data to send back. Must be lower than the
+:r:`bosh_requests setting`, so there is always a way to send data (the value
+is lowered if it is not). At least one request is held, as the transport
+does not poll for incoming data."""
+    )
+XMPPSettings.add_setting(u"bosh_wait", type = int, default = 60,
+        validator = XMPPSettings.validate_positive_int,
+        doc = u"""Maximum time (in seconds) the BOSH connection manager may
+hold a request."""
+    )
+XMPPSettings.add_setting(u"bosh_max_retries", type = int, default = 1,
+        validator = XMPPSettings.get_int_range_validator(0, 1024),
+        doc = u"""Number of times a BOSH request is resent over a new
+connection after a network failure, before the session is considered
+lost."""
+    )
+
+# vi: sts=4 et sw=4
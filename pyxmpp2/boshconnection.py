@@ -0,0 +1,515 @@
+#
+# (C) Copyright 2011 Jacek Konieczny <jajcus@jajcus.net>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version
+# 2.1 as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+
+"""HTTP connections of the BOSH transport.
+
+A `BOSHConnection` sends the requests of a `bosh.BOSHTransport` over a single
+persistent HTTP/1.1 connection (optionally with TLS) to the connection
+manager and passes the responses back to the transport.
+"""
+
+from __future__ import absolute_import, division
+
+__docformat__ = "restructuredtext en"
+
+import socket
+import threading
+import errno
+import logging
+import ssl
+import os
+
+from .mainloop.interfaces import IOHandler, PrepareAgain
+from .cert import get_certificate_from_ssl_socket
+from .utils import parse_http_head, http_header_tokens
+from .connector import BLOCKING_ERRORS
+
+logger = logging.getLogger("pyxmpp2.boshconnection")
+
+# maximum size of the HTTP response head
+MAX_HEAD_SIZE = 16384
+
+class BOSHConnection(IOHandler):
+    """A persistent HTTP/1.1 connection of the `bosh.BOSHTransport` pool.
+
+    A single request at a time is sent over the connection (no pipelining).
+    The connection is kept open for the next request, unless the server
+    closes it.
+
+    :Ivariables:
+        - `transport`: the transport owning the connection
+        - `lock`: the lock protecting the object (the same as of the
+          transport)
+        - `requests_sent`: number of requests sent over the connection
+        - `_socket`: the socket currently used
+        - `_state`: connection state: `None` (no socket), "connecting",
+          "tls-handshake", "ready" (connected, idle) or "request"
+        - `_tls_want`: "read" or "write", depending on what the TLS
+          handshake waits for
+        - `_rid`: 'rid' of the request in progress
+        - `_request`: the request in progress
+        - `_out`: the part of the request not sent yet
+        - `_in`: data received
+        - `_retries`: number of times the current request has been resent
+    :Types:
+        - `transport`: `bosh.BOSHTransport`
+        - `lock`: :std:`threading.RLock`
+        - `requests_sent`: `int`
+        - `_socket`: :std:`socket.socket`
+        - `_state`: `unicode`
+        - `_tls_want`: `unicode`
+        - `_rid`: `int`
+        - `_request`: `bytes`
+        - `_out`: `bytes`
+        - `_in`: `bytearray`
+        - `_retries`: `int`
+    """
+    # pylint: disable=R0902
+    def __init__(self, transport):
+        """Initialize the `BOSHConnection` object.
+
+        :Parameters:
+            - `transport`: the transport owning the connection
+        :Types:
+            - `transport`: `bosh.BOSHTransport`
+        """
+        self.transport = transport
+        self.lock = transport.lock
+        self._cond = threading.Condition(self.lock)
+        self.requests_sent = 0
+        self._socket = None
+        self._state = None
+        self._tls_want = None
+        self._rid = None
+        self._request = None
+        self._out = b""
+        self._in = bytearray()
+        self._retries = 0
+
+    def __repr__(self):
+        return "<BOSHConnection {0!r} rid={1!r}>".format(self._state,
+                                                                self._rid)
+
+    @property
+    def busy(self):
+        """`True` when a request is in progress."""
+        return self._rid is not None
+
+    @property
+    def connected(self):
+        """`True` when the connection is established and may be reused."""
+        return self._state == "ready"
+
+    def send_request(self, rid, request):
+        """Send a request over the connection, connecting first if needed.
+
+        [called with `lock` acquired]
+
+        :Parameters:
+            - `rid`: the BOSH 'rid' of the request
+            - `request`: the complete HTTP request
+        :Types:
+            - `rid`: `int`
+            - `request`: `bytes`
+        """
+        self._rid = rid
+        self._request = request
+        self._retries = 0
+        self._start_request()
+
+    def _start_request(self):
+        """Start sending the current request.
+
+        [called with `lock` acquired]
+        """
+        self._out = self._request
+        self._in = bytearray()
+        self.requests_sent += 1
+        if self._state == "ready":
+            self._state = "request"
+            self._do_write()
+        elif self._socket is None:
+            self._connect()
+        self._cond.notify()
+
+    def _connect(self):
+        """Start connecting to the connection manager.
+
+        [called with `lock` acquired]
+        """
+        family, sockaddr = self.transport.next_address()
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        self._socket = sock
+        self._state = "connecting"
+        self.transport.connection_started(sockaddr)
+        try:
+            sock.connect(sockaddr)
+        except socket.error, err:
+            if err.args[0] not in BLOCKING_ERRORS:
+                self._failed(err)
+
+    def _connected(self):
+        """Handle connection success.
+
+        [called with `lock` acquired]
+        """
+        self.transport.connection_established(self)
+        context = self.transport.ssl_context
+        if context is None:
+            self._state = "request"
+            self._do_write()
+            return
+        self._socket = context.wrap_socket(self._socket,
+                                do_handshake_on_connect = False,
+                                server_hostname = self.transport.hostname)
+        self._state = "tls-handshake"
+        self._tls_handshake()
+
+    def _tls_handshake(self):
+        """Continue the TLS handshake and verify the server certificate when
+        done.
+
+        [called with `lock` acquired]
+        """
+        try:
+            self._socket.do_handshake()
+        except ssl.SSLError, err:
+            if err.args[0] == ssl.SSL_ERROR_WANT_READ:
+                self._tls_want = "read"
+                return
+            elif err.args[0] == ssl.SSL_ERROR_WANT_WRITE:
+                self._tls_want = "write"
+                return
+            self._failed(err)
+            return
+        except socket.error, err:
+            self._failed(err)
+            return
+        self._tls_want = None
+        if self.transport.settings["tls_verify_peer"]:
+            cert = get_certificate_from_ssl_socket(self._socket)
+            if not cert or not cert.validated or not cert.verify_server(
+                                                self.transport.hostname, None):
+                logger.warning("BOSH server certificate not valid for {0!r}"
+                                        .format(self.transport.hostname))
+                self._close_socket()
+                self._rid = None
+                self.transport.request_failed(self, fatal = True)
+                return
+        self._state = "request"
+        self._do_write()
+
+    def _do_write(self):
+        """Send as much of the request as possible without blocking.
+
+        [called with `lock` acquired]
+        """
+        while self._out:
+            try:
+                sent = self._socket.send(self._out)
+            except ssl.SSLError, err:
+                if err.args[0] in (ssl.SSL_ERROR_WANT_WRITE,
+                                                    ssl.SSL_ERROR_WANT_READ):
+                    break
+                self._failed(err)
+                return
+            except socket.error, err:
+                if err.args[0] == errno.EINTR:
+                    continue
+                if err.args[0] in BLOCKING_ERRORS:
+                    break
+                self._failed(err)
+                return
+            self._out = self._out[sent:]
+
+    def _failed(self, err):
+        """Handle connection or I/O error: resend the request in progress
+        over a new connection or report the failure to the transport.
+
+        [called with `lock` acquired]
+        """
+        logger.debug("BOSH connection failed: {0}".format(err))
+        self._close_socket()
+        if self._rid is None:
+            return
+        if self._retries < self.transport.settings["bosh_max_retries"]:
+            self._retries += 1
+            logger.debug("Resending request {0}".format(self._rid))
+            self.requests_sent -= 1
+            self._start_request()
+            return
+        self._rid = None
+        self._request = None
+        self.transport.request_failed(self)
+
+    def _close_socket(self):
+        """Close the socket.
+
+        [called with `lock` acquired]
+        """
+        if self._socket is not None:
+            try:
+                self._socket.close()
+            except socket.error:
+                pass
+        self._socket = None
+        self._state = None
+        self._tls_want = None
+        self._cond.notify()
+
+    def _read_response(self):
+        """Check if the complete response has been received and pass it
+        to the transport.
+
+        [called with `lock` acquired]
+        """
+        end = self._in.find(b"\r\n\r\n")
+        if end < 0:
+            if len(self._in) > MAX_HEAD_SIZE:
+                self._failed(u"HTTP response head too long")
+            return
+        status, headers = parse_http_head(bytes(self._in[:end]))
+        start = end + 4
+        if b"chunked" in http_header_tokens(headers, b"transfer-encoding"):
+            body = self._decode_chunked(start)
+            if body is None:
+                return
+        else:
+            try:
+                length = int(headers.get(b"content-length", b"0"))
+            except ValueError:
+                self._failed(u"Bad Content-Length")
+                return
+            if len(self._in) < start + length:
+                return
+            body = bytes(self._in[start:start + length])
+        status = status.split(None, 2)
+        try:
+            code = int(status[1])
+        except (IndexError, ValueError):
+            code = 0
+        rid = self._rid
+        self._rid = None
+        self._request = None
+        self._in = bytearray()
+        if (status[0] != b"HTTP/1.1"
+                or b"close" in http_header_tokens(headers, b"connection")):
+            self._close_socket()
+        else:
+            self._state = "ready"
+        self.transport.got_response(self, rid, code, body)
+
+    def _decode_chunked(self, start):
+        """Decode response body in the chunked transfer encoding.
+
+        [called with `lock` acquired]
+
+        :Parameters:
+            - `start`: offset of the body in the input buffer
+
+        :Return: the body or `None` if not complete yet
+        """
+        chunks = []
+        pos = start
+        while True:
+            end = self._in.find(b"\r\n", pos)
+            if end < 0:
+                return None
+            try:
+                size = int(bytes(self._in[pos:end]).split(b";", 1)[0], 16)
+            except ValueError:
+                self._failed(u"Bad HTTP chunk")
+                return None
+            pos = end + 2
+            if size == 0:
+                break
+            if len(self._in) < pos + size + 2:
+                return None
+            chunks.append(bytes(self._in[pos:pos + size]))
+            pos += size + 2
+        # skip trailers
+        if self._in.find(b"\r\n", pos) < 0:
+            return None
+        return b"".join(chunks)
+
+    def fileno(self):
+        """Return file descriptor to poll or select."""
+        with self.lock:
+            if self._socket is not None:
+                return self._socket.fileno()
+        return None
+
+    def prepare(self):
+        """Drive the transport state machine (see `bosh.BOSHTransport.prepare`).
+
+        The socket may change between requests, so the main loop is asked to
+        call this method on every iteration.
+        """
+        return PrepareAgain(self.transport.prepare())
+
+    def _can_read(self):
+        """Check if the connection should be polled for input.
+
+        [called with `lock` acquired]
+        """
+        if self._socket is None:
+            return False
+        if self._state == "tls-handshake":
+            return self._tls_want == "read"
+        return self._state in ("ready", "request")
+
+    def _can_write(self):
+        """Check if the connection should be polled for output.
+
+        [called with `lock` acquired]
+        """
+        if self._socket is None:
+            return False
+        if self._state == "connecting":
+            return True
+        if self._state == "tls-handshake":
+            return self._tls_want == "write"
+        return self._state == "request" and bool(self._out)
+
+    def is_readable(self):
+        """
+        :Return: `True` when the I/O channel can be read
+        """
+        with self.lock:
+            return self._can_read()
+
+    def is_writable(self):
+        """
+        :Return: `True` when there is a request to send
+        """
+        with self.lock:
+            return self._can_write()
+
+    def wait_for_readability(self):
+        """
+        Stop current thread until the channel is readable.
+
+        :Return: `False` if it won't be readable (e.g. is closed)
+        """
+        with self.lock:
+            while not self._can_read():
+                if self.transport.closed:
+                    return False
+                self._cond.wait()
+            return True
+
+    def wait_for_writability(self):
+        """
+        Stop current thread until the channel is writable.
+
+        :Return: `False` if it won't be writable (e.g. is closed)
+        """
+        with self.lock:
+            while not self._can_write():
+                if self.transport.closed:
+                    return False
+                self._cond.wait()
+            return True
+
+    def handle_write(self):
+        """
+        Handle the 'channel writable' state: finish connecting or send
+        the request.
+        """
+        with self.lock:
+            if self._state == "connecting":
+                error = self._socket.getsockopt(socket.SOL_SOCKET,
+                                                            socket.SO_ERROR)
+                if error in BLOCKING_ERRORS:
+                    return
+                if error not in (0, errno.EISCONN):
+                    self._failed(socket.error(error, os.strerror(error)))
+                    return
+                self._connected()
+            elif self._state == "tls-handshake":
+                self._tls_handshake()
+            elif self._state == "request":
+                self._do_write()
+
+    def handle_read(self):
+        """
+        Handle the 'channel readable' state: read the response.
+        """
+        with self.lock:
+            if self._socket is None:
+                return
+            if self._state == "tls-handshake":
+                self._tls_handshake()
+                return
+            while self._socket is not None:
+                try:
+                    data = self._socket.recv(65536)
+                except ssl.SSLError, err:
+                    if err.args[0] in (ssl.SSL_ERROR_WANT_READ,
+                                                    ssl.SSL_ERROR_WANT_WRITE):
+                        break
+                    self._failed(err)
+                    return
+                except socket.error, err:
+                    if err.args[0] == errno.EINTR:
+                        continue
+                    if err.args[0] in BLOCKING_ERRORS:
+                        break
+                    self._failed(err)
+                    return
+                if not data:
+                    self._failed(u"Connection closed by the server")
+                    return
+                if self._state != "request":
+                    self._failed(u"Unexpected data from the server")
+                    return
+                self._in += data
+                self._read_response()
+
+    def handle_hup(self):
+        """
+        Handle the 'channel hungup' state.
+        """
+        with self.lock:
+            if self._socket is not None and not self.busy:
+                self._close_socket()
+
+    def handle_err(self):
+        """
+        Handle an error reported.
+        """
+        with self.lock:
+            if self._socket is not None:
+                self._failed(u"Socket error")
+
+    def handle_nval(self):
+        """
+        Handle an invalid file descriptor.
+        """
+        with self.lock:
+            if self._socket is not None:
+                self._failed(u"Invalid file descriptor")
+
+    def close(self):
+        """Close the connection."""
+        with self.lock:
+            self._rid = None
+            self._request = None
+            self._close_socket()
+
+# vi: sts=4 et sw=4
@@ -24,7 +24,8 @@ providing in the constructor: a client JID, settings and handlers providing
 application behaviour (the list may contain a single handler object which will
 be 'the application). The `Client` class will provide some other handlers:
 `StreamTLSHandler`, `StreamSASLHandler`, `SessionHandler`,
-`ResourceBindingHandler` and `RosterClient`. The last one is available via the
+`ResourceBindingHandler`, `KeepaliveManager`, `PingProvider` and
+`RosterClient`. The last one is available via the
 `Client.roster_client` attribute and should be used to manipulate the roster.
 The roster itself is available via the `Client.roster` property.
 
@@ -57,13 +58,19 @@ from .mainloop import main_loop_factory
 from .interfaces import EventHandler, event_handler
 from .interfaces import TimeoutHandler, timeout_handler
 from .streamevents import DisconnectedEvent, AuthenticatedEvent
-from .streamevents import AuthorizedEvent
+from .streamevents import AuthorizedEvent, StreamResumedEvent
 from .transport import TCPTransport
+from .websocket import WebSocketTransport
+from .bosh import BOSHTransport
 from .settings import XMPPSettings
 from .session import SessionHandler
 from .streamtls import StreamTLSHandler
 from .streamsasl import StreamSASLHandler
+from .streamcompression import StreamCompressionHandler
+from .streammanagement import StreamManagementHandler
 from .binding import ResourceBindingHandler
+from .keepalive import KeepaliveManager
+from .ext.ping import PingProvider
 from .stanzaprocessor import StanzaProcessor
 from .roster import RosterClient
 from .presence import Presence
@@ -162,16 +169,44 @@ class Client(StanzaProcessor, TimeoutHandler, EventHandler):
                 logger.debug("Closing the previously used stream.")
                 self._close_stream()
 
-            transport = TCPTransport(self.settings)
-            
+            bosh_url = self.settings["bosh_url"]
+            websocket_url = self.settings["websocket_url"]
+            if bosh_url:
+                transport = BOSHTransport(self.main_loop, self.settings)
+                direct_tls = False
+            elif websocket_url:
+                transport = WebSocketTransport(self.settings)
+                direct_tls = websocket_url.startswith(u"wss:")
+            else:
+                transport = TCPTransport(self.settings)
+                direct_tls = self.settings["direct_tls"]
+            if direct_tls:
+                port = self.settings["c2s_direct_tls_port"]
+                service = self.settings["c2s_direct_tls_service"]
+            else:
+                port = self.settings["c2s_port"]
+                service = self.settings["c2s_service"]
             addr = self.settings["server"]
             if addr:
                 service = None
             else:
                 addr = self.jid.domain
-                service = self.settings["c2s_service"]
 
-            transport.connect(addr, self.settings["c2s_port"], service)
+            if direct_tls:
+                for handler in self._base_handlers:
+                    if isinstance(handler, StreamTLSHandler):
+                        handler.make_direct_tls_connection(transport,
+                                                            self.jid.domain)
+                        break
+                else:
+                    raise ValueError("Direct TLS requested, but no"
+                                                    " StreamTLSHandler found")
+            if bosh_url:
+                transport.connect_url(bosh_url)
+            elif websocket_url:
+                transport.connect_url(websocket_url)
+            else:
+                transport.connect(addr, port, service)
             handlers = self._base_handlers
             handlers += self.handlers + [self]
             self.clear_response_handlers()
@@ -241,6 +276,17 @@ class Client(StanzaProcessor, TimeoutHandler, EventHandler):
             if presence:
                 self.send(presence)
 
+    @event_handler(StreamResumedEvent)
+    def _stream_resumed(self, event):
+        """Handle the `StreamResumedEvent`: the session continues, so
+        the initial presence is not sent again.
+        """
+        with self.lock:
+            if event.stream != self.stream:
+                return
+            self.me = event.stream.me
+            self.peer = event.stream.peer
+
     @event_handler(DisconnectedEvent)
     def _stream_disconnected(self, event):
         """Handle stream disconnection event.
@@ -283,8 +329,13 @@ class Client(StanzaProcessor, TimeoutHandler, EventHandler):
         tls_handler = StreamTLSHandler(self.settings)
         sasl_handler = StreamSASLHandler(self.settings)
         session_handler = SessionHandler()
+        compression_handler = StreamCompressionHandler(self.settings)
+        sm_handler = StreamManagementHandler(self.settings)
         binding_handler = ResourceBindingHandler(self.settings)
-        return [tls_handler, sasl_handler, binding_handler, session_handler]
+        keepalive_manager = KeepaliveManager(self.settings)
+        return [tls_handler, sasl_handler, compression_handler,
+                            sm_handler, binding_handler, session_handler,
+                            keepalive_manager, PingProvider()]
 
     def roster_client_factory(self):
         """Creates the `RosterClient` instance for the `roster_client`
@@ -322,6 +373,20 @@ XMPPSettings.add_setting(u"c2s_service", default = "xmpp-client",
     doc = """SRV service name for client to server connections."""
     )
 
+XMPPSettings.add_setting(u"c2s_direct_tls_port", default = 5223,
+    type = int, validator = XMPPSettings.get_int_range_validator(1, 65536),
+    cmdline_help = "Port number for Direct TLS XMPP client connections",
+    doc = """Port number for client to server connections when the
+:r:`direct_tls setting` is enabled."""
+    )
+
+XMPPSettings.add_setting(u"c2s_direct_tls_service", default = "xmpps-client",
+    type = unicode,
+    cmdline_help = "SRV service name for Direct TLS XMPP client connections",
+    doc = """SRV service name for client to server connections when the
+:r:`direct_tls setting` is enabled."""
+    )
+
 XMPPSettings.add_setting(u"server", type = unicode, basic = True,
     cmdline_help = "Server address. (Default: use SRV lookup)",
     doc = """Server address to connect to. By default a DNS SRV record look-up
@@ -329,6 +394,18 @@ is done for the requested JID domain part and if that fails - 'A' or 'AAAA'
 record lookup for the same domain. This setting may be used to force using
 a specific server or when SRV look-ups are not available."""
     )
+XMPPSettings.add_setting(u"websocket_url", type = unicode,
+    cmdline_help = "XMPP WebSocket endpoint URL. (Default: use TCP)",
+    doc = """URL ('ws:' or 'wss:') of the XMPP WebSocket endpoint
+(:RFC:`7395`) to connect to instead of a TCP connection to the server.
+For a 'wss:' URL TLS is established before the WebSocket handshake."""
+    )
+XMPPSettings.add_setting(u"bosh_url", type = unicode,
+    cmdline_help = "XMPP BOSH connection manager URL. (Default: use TCP)",
+    doc = """URL ('http:' or 'https:') of the BOSH connection manager
+(XEP-0206) to connect through instead of a TCP connection to the server.
+Takes precedence over the :r:`websocket_url setting`."""
+    )
 XMPPSettings.add_setting(u"default_stanza_timeout", type = float, default = 300,
         validator = XMPPSettings.validate_positive_float,
         cmdline_help = "Time in seconds to wait for a stanza response",
@@ -0,0 +1,478 @@
+#
+# (C) Copyright 2011 Jacek Konieczny <jajcus@jajcus.net>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version
+# 2.1 as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+
+"""Establishing TCP connections for the XMPP transports.
+
+`TCPConnector` resolves the service name (SRV and address records) and
+races connection attempts to the addresses found (Happy Eyeballs,
+:RFC:`8305`). It is a base class of `transport.TCPTransport`.
+"""
+
+from __future__ import absolute_import, division
+
+__docformat__ = "restructuredtext en"
+
+import socket
+import select
+import errno
+import logging
+import time
+import os
+
+from functools import partial
+
+from .settings import XMPPSettings
+from .exceptions import DNSError
+from .streamevents import ResolvingSRVEvent, ResolvingAddressEvent
+from .streamevents import ConnectingEvent
+
+# pylint: disable=W0611
+from . import resolver
+
+logger = logging.getLogger("pyxmpp2.connector")
+
+BLOCKING_ERRORS = set()
+for __name in ['EAGAIN', 'EWOULDBLOCK', 'WSAEWOULDBLOCK', 'EINPROGRESS']:
+    if hasattr(errno, __name):
+        BLOCKING_ERRORS.add(getattr(errno, __name))
+
+AF_UNIX = getattr(socket, "AF_UNIX", None)
+
+
+def interleave_families(addrs):
+    """Reorder a list of address tuples (with the address family as the first
+    item) so the address families alternate, as recommended by :RFC:`8305`.
+
+    The order of addresses within a family is preserved and the family
+    of the first address on the list goes first.
+
+    :Parameters:
+        - `addrs`: the address list
+    :Types:
+        - `addrs`: `list` of tuples
+
+    :Returntype: `list` of tuples
+    """
+    families = []
+    by_family = {}
+    for addr in addrs:
+        family = addr[0]
+        if family not in by_family:
+            families.append(family)
+            by_family[family] = []
+        by_family[family].append(addr)
+    result = []
+    while families:
+        for family in list(families):
+            result.append(by_family[family].pop(0))
+            if not by_family[family]:
+                families.remove(family)
+    return result
+
+class TCPConnector(object):
+    """Connection establishment part of the `transport.TCPTransport`.
+
+    The subclass provides the `lock`, `settings`, `_socket`, `_family`,
+    `_dst_addr` and `_state` attributes and the `_set_state`, `event`,
+    `_clear_write_queue`, `_wait_for_connect` and `_connected` methods.
+
+    :Ivariables:
+        - `_connect_attempts`: list of (socket, family, sockaddr, hostname)
+          tuples for the connection attempts in progress
+        - `_connect_error`: the last connection error
+        - `_next_attempt_time`: time when the next connection attempt may be
+          started, even if the previous ones are still in progress
+        - `_dst_addrs`: list of (family, sockaddr, hostname) candidates to
+          connect to
+        - `_dst_hostname`: hostname the transport is connected to
+        - `_dst_name`: requested domain name of the remote service
+        - `_dst_nameports`: list of (hostname, port) candidates to connect to
+        - `_dst_port`: requested port of the remote service
+        - `_dst_resolving`: number of address lookups in progress
+        - `_dst_service`: requested service name (e.g. 'xmpp-client')
+    :Types:
+        - `_connect_attempts`: `list`
+        - `_connect_error`: :std:`socket.error`
+        - `_next_attempt_time`: `float`
+        - `_dst_addrs`: list of tuples
+        - `_dst_hostname`: `unicode`
+        - `_dst_name`: `unicode`
+        - `_dst_nameports`: list of tuples
+        - `_dst_port`: `int`
+        - `_dst_resolving`: `int`
+        - `_dst_service`: `unicode`
+    """
+    # pylint: disable=E1101
+    def __init__(self):
+        """Initialize the `TCPConnector` part of a transport."""
+        self._dst_name = None
+        self._dst_port = None
+        self._dst_service = None
+        self._dst_nameports = None
+        self._dst_hostname = None
+        self._dst_addrs = None
+        self._dst_resolving = 0
+        self._connect_attempts = []
+        self._connect_error = None
+        self._next_attempt_time = 0
+
+    def connect(self, addr, port = None, service = None):
+        """Start establishing TCP connection with given address.
+
+        One of: `port` or `service` must be provided and `addr` must be 
+        a domain name and not an IP address if `port` is not given.
+
+        When `service` is given try an SRV lookup for that service
+        at domain `addr`. If `service` is not given or `addr` is an IP address, 
+        or the SRV lookup fails, connect to `port` at host `addr` directly.
+
+        [initiating entity only]
+
+        :Parameters:
+            - `addr`: peer name or IP address
+            - `port`: port number to connect to
+            - `service`: service name (to be resolved using SRV DNS records)
+        """
+        with self.lock:
+            self._connect(addr, port, service)
+
+    def _connect(self, addr, port, service):
+        """Same as `connect`, but assumes `lock` acquired.
+        """
+        self._dst_name = addr
+        self._dst_port = port
+        family = None
+        try:
+            res = socket.getaddrinfo(addr, port, socket.AF_UNSPEC,
+                                socket.SOCK_STREAM, 0, socket.AI_NUMERICHOST)
+            family = res[0][0]
+            sockaddr = res[0][4]
+        except socket.gaierror:
+            family = None
+            sockaddr = None
+
+        if family is not None:
+            if not port:
+                raise ValueError("No port number given with literal IP address")
+            self._dst_service = None
+            self._family = family
+            self._dst_addrs = [(family, sockaddr, None)]
+            self._set_state("connect")
+        elif service is not None:
+            self._dst_service = service
+            self._set_state("resolve-srv")
+            self._dst_name = addr
+        elif port:
+            self._dst_nameports = [(self._dst_name, self._dst_port)]
+            self._dst_service = None
+            self._set_state("resolve-hostname")
+        else:
+            raise ValueError("No port number and no SRV service name given")
+
+    def connect_unix(self, path):
+        """Start connecting to a Unix domain socket. No DNS look-ups are
+        done.
+
+        [initiating entity only]
+
+        :Parameters:
+            - `path`: file system path of the socket
+        :Types:
+            - `path`: `unicode`
+        """
+        if AF_UNIX is None:
+            raise ValueError("Unix domain sockets not supported")
+        with self.lock:
+            self._dst_name = path
+            self._dst_port = None
+            self._dst_service = None
+            self._family = AF_UNIX
+            self._dst_addrs = [(AF_UNIX, path, None)]
+            self._set_state("connect")
+
+    def _resolve_srv(self):
+        """Start resolving the SRV record.
+        """
+        resolver = self.settings["dns_resolver"] # pylint: disable=W0621
+        self._set_state("resolving-srv")
+        self.event(ResolvingSRVEvent(self._dst_name, self._dst_service))
+        resolver.resolve_srv(self._dst_name, self._dst_service, "tcp",
+                                                    callback = self._got_srv)
+
+    def _got_srv(self, addrs):
+        """Handle SRV lookup result.
+        
+        :Parameters:
+            - `addrs`: properly sorted list of (hostname, port) tuples
+        """
+        with self.lock:
+            if not addrs:
+                self._dst_service = None
+                if self._dst_port:
+                    self._dst_nameports = [(self._dst_name, self._dst_port)]
+                else:
+                    self._dst_nameports = []
+                    self._set_state("aborted")
+                    raise DNSError("Could not resolve SRV for service {0!r}"
+                            " on host {1!r} and fallback port number not given"
+                                    .format(self._dst_service, self._dst_name))
+            elif addrs == [(".", 0)]:
+                self._dst_nameports = []
+                self._set_state("aborted")
+                raise DNSError("Service {0!r} not available on host {1!r}"
+                                    .format(self._dst_service, self._dst_name))
+            else:
+                self._dst_nameports = addrs
+            self._set_state("resolve-hostname")
+
+    def _resolve_hostname(self):
+        """Start hostname resolution for the next names to try.
+
+        Up to :r:`connect_srv_targets setting` names are resolved at once,
+        so connections to their addresses can be raced against each other.
+
+        [called with `lock` acquired]
+        """
+        self._set_state("resolving-hostname")
+        resolver = self.settings["dns_resolver"] # pylint: disable=W0621
+        logger.debug("_dst_nameports: {0!r}".format(self._dst_nameports))
+        if self._dst_addrs is None:
+            self._dst_addrs = []
+        count = max(1, self.settings["connect_srv_targets"])
+        nameports = self._dst_nameports[:count]
+        del self._dst_nameports[:count]
+        self._dst_resolving += len(nameports)
+        for name, port in nameports:
+            self.event(ResolvingAddressEvent(name))
+            resolver.resolve_address(name, callback = partial(
+                                self._got_addresses, name, port),
+                                allow_cname = self._dst_service is None)
+
+    def _got_addresses(self, name, port, addrs):
+        """Handler DNS address record lookup result.
+
+        The addresses are added to the list of connection candidates, which
+        may already be in use if connection attempts to other names are in
+        progress.
+
+        :Parameters:
+            - `name`: the name requested
+            - `port`: port number to connect to
+            - `addrs`: list of (family, address) tuples
+        """
+        with self.lock:
+            if self._dst_resolving > 0:
+                self._dst_resolving -= 1
+            if self._state in ("connected", "closing", "closed", "aborted"):
+                return
+            if addrs:
+                self._dst_addrs = interleave_families(self._dst_addrs
+                        + [(family, (addr, port), name)
+                                                for (family, addr) in addrs])
+                if self._state != "connecting":
+                    self._set_state("connect")
+                return
+            if self._state == "connecting" or self._dst_addrs \
+                                                    or self._dst_resolving:
+                return
+            if self._dst_nameports:
+                self._set_state("resolve-hostname")
+                return
+            self._dst_addrs = []
+            self._set_state("aborted")
+            raise DNSError("Could not resolve address record for {0!r}"
+                                                            .format(name))
+
+    def _start_connect(self):
+        """Start connecting to the next address on the `_dst_addrs` list.
+
+        The new attempt is added to `_connect_attempts`.
+
+        [ called with `lock` acquired ]
+
+        :Return: `True` if the connection has been established immediately
+        """
+        family, addr, name = self._dst_addrs.pop(0)
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        try:
+            sock.connect(addr)
+        except socket.error, err:
+            logger.debug("Connect error: {0}".format(err))
+            if err.args[0] in BLOCKING_ERRORS:
+                self._connect_attempts.append((sock, family, addr, name))
+                self.event(ConnectingEvent(addr))
+                return False
+            sock.close()
+            self._connect_error = err
+            # start the next attempt immediately
+            self._next_attempt_time = 0
+            return False
+        self._connect_attempts.append((sock, family, addr, name))
+        self._connect_won(sock)
+        return True
+
+    def _race_connect(self):
+        """Run the connection attempts (Happy Eyeballs, :RFC:`8305`).
+
+        A new attempt to the next candidate address is started every
+        :r:`connect_attempt_delay setting` seconds, or as soon as all the
+        attempts in progress fail. The first attempt to succeed wins and the
+        other ones are abandoned.
+
+        The socket of the oldest attempt in progress is exposed as `_socket`,
+        so the main loop wakes up when it connects; the other attempts are
+        checked on each `prepare` call.
+
+        [called with `lock` acquired]
+
+        :Return: timeout for the next `prepare` call
+        """
+        if self._check_connect_attempts():
+            return None
+        now = time.time()
+        while self._dst_addrs and (not self._connect_attempts
+                                        or now >= self._next_attempt_time):
+            self._next_attempt_time = now + \
+                                    self.settings["connect_attempt_delay"]
+            if self._start_connect():
+                return None
+        if self._connect_attempts:
+            self._set_state("connecting")
+            sock = self._connect_attempts[0][0]
+            if self._socket is not sock:
+                self._socket = sock
+                self._dst_addr = self._connect_attempts[0][2]
+                self._family = self._connect_attempts[0][1]
+            self._wait_for_connect()
+            if self._dst_addrs:
+                timeout = max(0, self._next_attempt_time - now)
+            else:
+                timeout = None
+            if len(self._connect_attempts) > 1:
+                interval = self.settings["connect_attempt_delay"] / 5
+                if timeout is None or timeout > interval:
+                    timeout = interval
+            return timeout
+        self._socket = None
+        if self._dst_resolving:
+            self._set_state("resolving-hostname")
+            return None
+        elif self._dst_nameports:
+            self._set_state("resolve-hostname")
+            return 0
+        self._set_state("aborted")
+        self._clear_write_queue()
+        if self._connect_error:
+            raise self._connect_error # pylint: disable=E0702
+        raise DNSError("No addresses to connect to")
+
+    def _check_connect_attempts(self):
+        """Check the connection attempts in progress, drop the failed ones
+        and finish connecting if any succeeded.
+
+        [called with `lock` acquired]
+
+        :Return: `True` if connected
+        """
+        if not self._connect_attempts:
+            return False
+        socks = [attempt[0] for attempt in self._connect_attempts]
+        try:
+            _unused, writable, failed = select.select([], socks, socks, 0)
+        except select.error, err:
+            if err.args[0] == errno.EINTR:
+                return False
+            raise
+        for attempt in list(self._connect_attempts):
+            sock, addr = attempt[0], attempt[2]
+            if sock not in writable and sock not in failed:
+                continue
+            error = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if error in (0, errno.EISCONN):
+                self._connect_won(sock)
+                return True
+            if error in BLOCKING_ERRORS:
+                continue
+            logger.debug("Connect to {0!r} failed: {1}".format(addr,
+                                                        os.strerror(error)))
+            self._connect_error = socket.error(error, os.strerror(error))
+            self._connect_attempts.remove(attempt)
+            sock.close()
+            if sock is self._socket:
+                self._socket = None
+            # start the next attempt immediately
+            self._next_attempt_time = 0
+        return False
+
+    def _connect_won(self, sock):
+        """Use the socket of a successful connection attempt and abandon the
+        other attempts.
+
+        [called with `lock` acquired]
+
+        :Parameters:
+            - `sock`: the connected socket
+        """
+        for attempt in self._connect_attempts:
+            if attempt[0] is sock:
+                self._family = attempt[1]
+                self._dst_addr = attempt[2]
+                self._dst_hostname = attempt[3]
+            else:
+                attempt[0].close()
+        self._connect_attempts = []
+        self._dst_addrs = []
+        self._dst_nameports = []
+        self._socket = sock
+        self._connected()
+
+    def _abort_connect_attempts(self):
+        """Close sockets of any connection attempts in progress.
+
+        [called with `lock` acquired]
+        """
+        for attempt in self._connect_attempts:
+            if attempt[0] is self._socket:
+                continue
+            attempt[0].close()
+        self._connect_attempts = []
+
+    def _continue_connect(self):
+        """Continue connecting.
+
+        [called with `lock` acquired]
+        """
+        if self._state != "connecting":
+            return
+        self._race_connect()
+
+XMPPSettings.add_setting(u"connect_attempt_delay", type = float,
+        default = 0.25,
+        validator = XMPPSettings.validate_positive_float,
+        doc = u"""Time (in seconds) to wait for a connection attempt to
+succeed before starting a parallel attempt to the next address (the
+'Connection Attempt Delay' of :RFC:`8305`)."""
+    )
+XMPPSettings.add_setting(u"connect_srv_targets", type = int, default = 2,
+        validator = XMPPSettings.validate_positive_int,
+        doc = u"""Number of SRV targets resolved together, so connections
+to their addresses can be raced. Further targets are tried only when all
+connection attempts to these fail."""
+    )
+
+# vi: sts=4 et sw=4
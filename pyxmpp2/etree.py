@@ -81,7 +81,7 @@ def element_to_unicode(element):
     """
     if hasattr(ElementTree, 'tounicode'):
         # pylint: disable=E1103
-        return ElementTree.tounicode("element")
+        return ElementTree.tounicode(element)
     elif sys.version_info.major < 3:
         return unicode(ElementTree.tostring(element))
     else:
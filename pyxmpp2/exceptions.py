@@ -62,6 +62,11 @@ class StreamParseError(FatalStreamError):
     """Raised when invalid XML is received in an XMPP stream."""
     pass
 
+class StanzaLimitExceeded(StreamParseError):
+    """Raised when an element received in an XMPP stream exceeds the
+    parser limits (:r:`max_stanza_size setting` and related)."""
+    pass
+
 class DNSError(FatalStreamError):
     """Raised when no host name could be resolved for the target."""
     pass
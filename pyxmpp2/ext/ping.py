@@ -0,0 +1,80 @@
+#
+# (C) Copyright 2011 Jacek Konieczny <jajcus@jajcus.net>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version
+# 2.1 as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+
+"""XMPP Ping.
+
+To answer pings add a `PingProvider` instance to your handlers. Pings are
+sent by the `pyxmpp2.keepalive.KeepaliveManager`.
+
+Normative reference:
+  - `XEP-0199 <http://xmpp.org/extensions/xep-0199.html>`__
+"""
+
+from __future__ import absolute_import, division
+
+__docformat__ = "restructuredtext en"
+
+import logging
+
+from ..etree import ElementTree
+
+from ..iq import Iq
+from ..interfaces import XMPPFeatureHandler, feature_uri
+from ..interfaces import iq_get_stanza_handler
+from ..interfaces import StanzaPayload, payload_element_name
+
+logger = logging.getLogger("pyxmpp2.ext.ping")
+
+PING_NS = u"urn:xmpp:ping"
+PING_TAG = u"{urn:xmpp:ping}ping"
+
+@payload_element_name(PING_TAG)
+class PingPayload(StanzaPayload):
+    """XMPP Ping (XEP-0199) stanza payload."""
+    @classmethod
+    def from_xml(cls, element):
+        # pylint: disable=W0613
+        return cls()
+
+    def as_xml(self):
+        return ElementTree.Element(PING_TAG)
+
+@feature_uri(PING_NS)
+class PingProvider(XMPPFeatureHandler):
+    """Answers XMPP Ping (XEP-0199) requests."""
+    # pylint: disable=R0903
+    @iq_get_stanza_handler(PingPayload)
+    def handle_ping_iq_get(self, stanza):
+        """Handler <iq type="get"/> for a ping."""
+        # pylint: disable=R0201
+        return stanza.make_result_response()
+
+def make_ping(to_jid = None):
+    """Make a ping request.
+
+    :Parameters:
+        - `to_jid`: the entity to ping
+    :Types:
+        - `to_jid`: `pyxmpp2.jid.JID`
+
+    :Returntype: `Iq`
+    """
+    stanza = Iq(to_jid = to_jid, stanza_type = "get")
+    stanza.set_payload(PingPayload())
+    return stanza
+
+# vi: sts=4 et sw=4
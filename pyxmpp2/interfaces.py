@@ -171,6 +171,21 @@ class XMPPTransport:
         """
         pass
 
+    def dump_traffic(self, reason, level = logging.DEBUG, once = False):
+        """Log the most recent data sent and received, if the transport
+        keeps it.
+
+        :Parameters:
+            - `reason`: why the traffic is dumped
+            - `level`: logging level to use
+            - `once`: do nothing if the traffic has already been dumped
+        :Types:
+            - `reason`: `unicode`
+            - `level`: `int`
+            - `once`: `bool`
+        """
+        pass
+
     @property
     def auth_properties(self):
         """Channel properties for authentication and authorization.
@@ -483,6 +498,31 @@ class StreamFeatureHandler:
         # pylint: disable-msg=W0613,R0201
         return False
 
+    def pipeline_stream_features(self, stream, features):
+        """Handle features expected from the stream peer, before they are
+        actually received (pipelined stream negotiation).
+
+        Only handlers able to recover when the prediction turns out wrong
+        should send anything here.
+
+        [initiator only]
+
+        :Parameters:
+            - `stream`: the stream
+            - `features`: the features element received from the peer
+              on a previous connection
+        :Types:
+            - `stream`: `StreamBase`
+            - `features`: :etree:`ElementTree.Element`
+
+        :Return:
+            - `StreamFeatureHandled` instance if a request has been sent
+              in advance
+            - `None` otherwise
+        """
+        # pylint: disable-msg=W0613,R0201
+        return None
+
     def make_stream_features(self, stream, features):
         """Update the features element announced by the stream.
 
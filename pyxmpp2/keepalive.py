@@ -0,0 +1,412 @@
+#
+# (C) Copyright 2011 Jacek Konieczny <jajcus@jajcus.net>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version
+# 2.1 as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+
+"""Connection keepalive.
+
+Idle connections are kept alive with whitespace keepalives or XMPP pings
+and the peers not answering the pings are declared dead.
+
+All the streams handled by a `KeepaliveManager` share a single timer wheel,
+driven by one timeout handler, so the cost of a tick does not depend on the
+number of connections.
+
+Normative reference:
+  - `RFC 6120 <http://xmpp.org/rfcs/rfc6120.html>`__ (section 4.6.1)
+  - `XEP-0199 <http://xmpp.org/extensions/xep-0199.html>`__
+"""
+
+from __future__ import absolute_import, division
+
+__docformat__ = "restructuredtext en"
+
+import time
+import math
+import logging
+import threading
+
+from .settings import XMPPSettings
+from .streamevents import StreamConnectedEvent, DisconnectedEvent
+from .interfaces import EventHandler, event_handler
+from .interfaces import TimeoutHandler, timeout_handler
+from .ext.ping import make_ping
+
+logger = logging.getLogger("pyxmpp2.keepalive")
+
+class TimerWheel(object):
+    """Hierarchical timer wheel.
+
+    Timers are put into one of `levels` wheels of ``2**bits`` slots each,
+    the first wheel slot being one tick long, the next wheel slot covering
+    the whole lower wheel. Adding or removing a timer is O(1), each
+    tick costs O(1) plus the timers expired or moved to a lower wheel.
+
+    Timers are identified by arbitrary hashable keys.
+
+    :Ivariables:
+        - `tick`: tick length in seconds
+        - `origin`: time of the tick 0
+        - `current`: number of the last tick processed
+        - `_bits`: number of bits of a wheel index
+        - `_mask`: wheel index mask
+        - `_wheels`: list of wheels, lists of sets of keys each
+        - `_timers`: mapping of keys to (expiry tick, wheel set) tuples
+    :Types:
+        - `tick`: `float`
+        - `origin`: `float`
+        - `current`: `int`
+        - `_bits`: `int`
+        - `_mask`: `int`
+        - `_wheels`: `list` of `list` of `set`
+        - `_timers`: `dict`
+    """
+    def __init__(self, tick = 1.0, bits = 8, levels = 4, now = None):
+        if now is None:
+            now = time.time()
+        self.tick = tick
+        self.origin = now
+        self.current = 0
+        self._bits = bits
+        self._mask = (1 << bits) - 1
+        self._wheels = [[set() for dummy in range(1 << bits)]
+                                                    for dummy in range(levels)]
+        self._timers = {}
+
+    def __len__(self):
+        return len(self._timers)
+
+    def __contains__(self, key):
+        return key in self._timers
+
+    def add(self, key, delay):
+        """Schedule a timer, replacing the previous one with the same key.
+
+        :Parameters:
+            - `key`: the timer key
+            - `delay`: time (in seconds) from the last tick processed to
+              the timer expiration
+        :Types:
+            - `delay`: `float`
+        """
+        self.remove(key)
+        ticks = max(1, int(math.ceil(delay / self.tick)))
+        self._insert(key, self.current + ticks)
+
+    def remove(self, key):
+        """Cancel a timer. Do nothing if there is no timer with the key.
+
+        :Parameters:
+            - `key`: the timer key
+        """
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer[1].discard(key)
+
+    def _insert(self, key, expires):
+        """Put a timer into the wheel slot matching its expiry tick.
+
+        :Parameters:
+            - `key`: the timer key
+            - `expires`: the expiry tick
+        :Types:
+            - `expires`: `int`
+        """
+        delta = expires - self.current
+        last = len(self._wheels) - 1
+        for level in range(last + 1):
+            if level == last or delta < 1 << (self._bits * (level + 1)):
+                break
+        index = (expires >> (self._bits * level)) & self._mask
+        slot = self._wheels[level][index]
+        slot.add(key)
+        self._timers[key] = (expires, slot)
+
+    def advance(self, now = None):
+        """Process all the ticks up to `now`.
+
+        :Parameters:
+            - `now`: current time (default: ``time.time()``)
+        :Types:
+            - `now`: `float`
+
+        :Return: keys of the timers expired
+        :Returntype: `list`
+        """
+        if now is None:
+            now = time.time()
+        target = int((now - self.origin) / self.tick)
+        expired = []
+        while self.current < target:
+            if not self._timers:
+                self.current = target
+                break
+            self.current += 1
+            index = self.current & self._mask
+            if index == 0:
+                self._cascade()
+            slot = self._wheels[0][index]
+            if not slot:
+                continue
+            keys = list(slot)
+            slot.clear()
+            for key in keys:
+                expires = self._timers.pop(key)[0]
+                if expires > self.current:
+                    # scheduled beyond the range of the highest wheel
+                    self._insert(key, expires)
+                else:
+                    expired.append(key)
+        return expired
+
+    def _cascade(self):
+        """Move timers from the higher wheel slots, which have become
+        current, to the lower wheels."""
+        for level in range(1, len(self._wheels)):
+            index = (self.current >> (self._bits * level)) & self._mask
+            slot = self._wheels[level][index]
+            keys = list(slot)
+            slot.clear()
+            for key in keys:
+                self._insert(key, self._timers[key][0])
+            if index != 0:
+                break
+
+class _StreamState(object):
+    """Keepalive state of a single stream.
+
+    :Ivariables:
+        - `stream`: the stream
+        - `added`: time when the stream has been added
+        - `ping_sent`: time when the unanswered ping has been sent
+        - `missed`: number of the pings not answered in time
+    """
+    # pylint: disable=R0903
+    __slots__ = ("stream", "added", "ping_sent", "missed")
+    def __init__(self, stream, now):
+        self.stream = stream
+        self.added = now
+        self.ping_sent = None
+        self.missed = 0
+
+class KeepaliveManager(EventHandler, TimeoutHandler):
+    """Keeps the idle streams alive and detects the dead ones.
+
+    Each stream connected is checked when it may have been idle for
+    the :r:`keepalive_interval setting`. If nothing has been received
+    (or, in the "whitespace" mode, sent) since then, a keepalive is sent:
+    a single space character or, in the "ping" mode, an XMPP ping
+    request, when the stream is authenticated. Any data received
+    in :r:`keepalive_ping_timeout setting` seconds answers a ping. After
+    :r:`keepalive_max_missed setting` unanswered pings in a row the peer is
+    declared dead and the connection closed.
+
+    Only transports providing the `last_read` and `last_write` attributes and
+    the `send_keepalive` method (like `transport.TCPTransport`) are handled.
+
+    Must be added to the main loop to receive the events and timeouts. May
+    be shared by any number of streams.
+
+    :Ivariables:
+        - `settings`: the settings used
+        - `wheel`: the timer wheel scheduling the checks
+        - `lock`: lock protecting the object
+        - `_states`: mapping of streams to their keepalive state
+    :Types:
+        - `settings`: `XMPPSettings`
+        - `wheel`: `TimerWheel`
+        - `lock`: :std:`threading.RLock`
+        - `_states`: `dict` of `_StreamState`
+    """
+    def __init__(self, settings = None):
+        if settings is None:
+            settings = XMPPSettings()
+        self.settings = settings
+        self.wheel = TimerWheel(settings["keepalive_tick"])
+        self.lock = threading.RLock()
+        self._states = {}
+
+    def add_stream(self, stream):
+        """Start watching a stream.
+
+        Done automatically on `StreamConnectedEvent`.
+
+        :Parameters:
+            - `stream`: the stream
+        :Types:
+            - `stream`: `streambase.StreamBase`
+        """
+        if not self.settings["keepalive"]:
+            return
+        if not hasattr(stream.transport, "send_keepalive"):
+            return
+        with self.lock:
+            if stream in self._states:
+                return
+            self._states[stream] = _StreamState(stream, time.time())
+            self.wheel.add(stream, self.settings["keepalive_interval"])
+
+    def remove_stream(self, stream):
+        """Stop watching a stream.
+
+        Done automatically on `DisconnectedEvent`.
+
+        :Parameters:
+            - `stream`: the stream
+        :Types:
+            - `stream`: `streambase.StreamBase`
+        """
+        with self.lock:
+            self._states.pop(stream, None)
+            self.wheel.remove(stream)
+
+    @event_handler(StreamConnectedEvent)
+    def handle_stream_connected(self, event):
+        """Start watching a stream just connected."""
+        if event.stream is not None:
+            self.add_stream(event.stream)
+
+    @event_handler(DisconnectedEvent)
+    def handle_disconnected(self, event):
+        """Stop watching a stream disconnected."""
+        if event.stream is not None:
+            self.remove_stream(event.stream)
+
+    @timeout_handler(1)
+    def _tick(self):
+        """Check the streams due.
+
+        :Return: delay (in seconds) before the next tick
+        """
+        now = time.time()
+        with self.lock:
+            for stream in self.wheel.advance(now):
+                state = self._states.get(stream)
+                if state is not None:
+                    self._check_stream(state, now)
+        return self.wheel.tick
+
+    def _check_stream(self, state, now):
+        """Send a keepalive, if needed, and schedule the next check.
+
+        [called with `lock` acquired]
+
+        :Parameters:
+            - `state`: the stream state
+            - `now`: current time
+        :Types:
+            - `state`: `_StreamState`
+            - `now`: `float`
+        """
+        stream = state.stream
+        transport = stream.transport
+        if transport is None or not transport.is_connected():
+            self.remove_stream(stream)
+            return
+        last_read = transport.last_read
+        if last_read is None:
+            last_read = state.added
+        if state.ping_sent is not None:
+            if last_read >= state.ping_sent:
+                state.ping_sent = None
+                state.missed = 0
+            else:
+                state.missed += 1
+                logger.debug("No ping response from {0} ({1} missed)"
+                                        .format(stream.peer, state.missed))
+                if state.missed >= self.settings["keepalive_max_missed"]:
+                    self._peer_dead(state)
+                    return
+                self._send_ping(state, now)
+                return
+        interval = self.settings["keepalive_interval"]
+        mode = self.settings["keepalive"]
+        if mode == "ping":
+            last_activity = last_read
+        else:
+            last_activity = max(last_read, transport.last_write or 0)
+        idle = now - last_activity
+        if idle < interval:
+            self.wheel.add(stream, interval - idle)
+            return
+        if mode == "ping" and (stream.authenticated
+                                            or stream.peer_authenticated):
+            self._send_ping(state, now)
+        else:
+            logger.debug("Sending whitespace keepalive to {0}"
+                                                        .format(stream.peer))
+            transport.send_keepalive()
+            self.wheel.add(stream, interval)
+
+    def _send_ping(self, state, now):
+        """Send a ping and schedule the response check.
+
+        [called with `lock` acquired]
+        """
+        stream = state.stream
+        logger.debug("Sending ping to {0}".format(stream.peer))
+        state.ping_sent = now
+        stream.send(make_ping(stream.peer))
+        self.wheel.add(stream, self.settings["keepalive_ping_timeout"])
+
+    def _peer_dead(self, state):
+        """Close the connection of a stream, which peer does not respond.
+
+        [called with `lock` acquired]
+        """
+        stream = state.stream
+        logger.warning("{0} does not respond to pings, closing the connection"
+                                                        .format(stream.peer))
+        self.remove_stream(stream)
+        stream.transport.close()
+
+def _validate_keepalive(value):
+    """Validator for the :r:`keepalive setting`."""
+    if not value:
+        return None
+    if value not in ("whitespace", "ping"):
+        raise ValueError("Bad keepalive mode: {0!r}".format(value))
+    return value
+
+XMPPSettings.add_setting(u"keepalive", type = unicode, default = None,
+        validator = _validate_keepalive,
+        cmdline_help = u"Keepalive mode: 'whitespace' or 'ping'",
+        doc = u"""Keepalive mode for idle connections: "whitespace"
+(a single space character sent), "ping" (XEP-0199 ping sent once
+authenticated, peers not answering declared dead) or `None` (disabled)."""
+    )
+XMPPSettings.add_setting(u"keepalive_interval", type = float, default = 60,
+        validator = XMPPSettings.validate_positive_float,
+        cmdline_help = u"Keepalive interval",
+        doc = u"""Number of seconds a connection may be idle before
+a keepalive is sent."""
+    )
+XMPPSettings.add_setting(u"keepalive_ping_timeout", type = float,
+        default = 30,
+        validator = XMPPSettings.validate_positive_float,
+        doc = u"""Number of seconds to wait for an answer to a keepalive
+ping."""
+    )
+XMPPSettings.add_setting(u"keepalive_max_missed", type = int, default = 2,
+        validator = XMPPSettings.get_int_range_validator(1, 1000),
+        doc = u"""Number of keepalive pings in a row not answered before
+the peer is declared dead and the connection closed."""
+    )
+XMPPSettings.add_setting(u"keepalive_tick", type = float, default = 1,
+        validator = XMPPSettings.validate_positive_float,
+        doc = u"""Resolution (in seconds) of the keepalive timers."""
+    )
+
+# vi: sts=4 et sw=4
@@ -25,6 +25,7 @@ __docformat__ = "restructuredtext en"
 import time
 import logging
 import inspect
+import threading
 
 from .events import EventDispatcher
 from .interfaces import EventHandler, IOHandler, TimeoutHandler, MainLoop, QUIT
@@ -32,11 +33,45 @@ from ..settings import XMPPSettings
 
 logger = logging.getLogger("pyxmpp2.mainloop.base")
 
+_THREAD = threading.local()
+
+def in_loop_iteration():
+    """Check if the current thread is running an iteration of a main loop
+    which flushes the output queued by its I/O handlers before waiting for
+    I/O again (`pyxmpp2.mainloop.poll.PollMainLoop`).
+
+    :Returntype: `bool`
+    """
+    return getattr(_THREAD, "in_loop_iteration", False)
+
+def set_in_loop_iteration(value):
+    """Mark the current thread as running (or not) a main loop iteration
+    (for `in_loop_iteration`).
+
+    :Parameters:
+        - `value`: the new state
+    :Types:
+        - `value`: `bool`
+
+    :Return: the previous state
+    :Returntype: `bool`
+    """
+    previous = getattr(_THREAD, "in_loop_iteration", False)
+    _THREAD.in_loop_iteration = value
+    return previous
+
 class MainLoopBase(MainLoop):
-    """Base class for main loop implementations."""
+    """Base class for main loop implementations.
+
+    :Ivariables:
+        - `io_handlers`: I/O handlers registered in the loop
+    :Types:
+        - `io_handlers`: `list` of `IOHandler`
+    """
     # pylint: disable-msg=W0223
     def __init__(self, settings = None, handlers = None):
         self.settings = settings if settings else XMPPSettings()
+        self.io_handlers = []
         if not handlers:
             handlers = []
         self._timeout_handlers = []
@@ -50,6 +85,7 @@ class MainLoopBase(MainLoop):
     def add_handler(self, handler):
         if isinstance(handler, IOHandler):
             self._add_io_handler(handler)
+            self.io_handlers.append(handler)
         if isinstance(handler, TimeoutHandler):
             self._add_timeout_handler(handler)
         if isinstance(handler, EventHandler):
@@ -58,6 +94,8 @@ class MainLoopBase(MainLoop):
     def remove_handler(self, handler):
         if isinstance(handler, IOHandler):
             self._remove_io_handler(handler)
+            if handler in self.io_handlers:
+                self.io_handlers.remove(handler)
         if isinstance(handler, TimeoutHandler):
             self._remove_timeout_handler(handler)
         if isinstance(handler, EventHandler):
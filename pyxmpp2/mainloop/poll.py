@@ -28,28 +28,102 @@ from __future__ import absolute_import, division
 
 __docformat__ = "restructuredtext en"
 
+import os
+import errno
+import fcntl
 import logging
 import select
+import threading
 
 from .interfaces import HandlerReady, PrepareAgain
-from .base import MainLoopBase
+from .base import MainLoopBase, set_in_loop_iteration
 
 logger = logging.getLogger("pyxmpp2.mainloop.poll")
 
 class PollMainLoop(MainLoopBase):
-    """Main event loop based on the poll() syscall."""
+    """Main event loop based on the poll() syscall.
+
+    I/O handlers providing a ``set_output_notifier`` method (like
+    `pyxmpp2.transport.TCPTransport`) report output queued outside of the
+    I/O callbacks, so only those handlers are registered again for
+    ``POLLOUT`` before the next ``poll()`` call. When that happens in another
+    thread, while the loop waits in ``poll()``, it is woken up with a byte
+    written to a pipe.
+
+    Output produced during a loop iteration (by the I/O, timeout and event
+    handlers) is queued by such handlers, not sent immediately (see
+    `pyxmpp2.mainloop.base.in_loop_iteration`), so everything queued for
+    a connection goes out with a single write when its socket becomes
+    writable.
+
+    :Ivariables:
+        - `_dirty`: handlers which have queued output since the last loop
+          iteration
+        - `_dirty_lock`: lock protecting `_dirty`
+        - `_polling`: `True` while the loop is (about to be) blocked in the
+          ``poll()`` call
+        - `_wakeup_pipe`: read and write end of the wakeup pipe
+    :Types:
+        - `_dirty`: `set`
+        - `_dirty_lock`: :std:`threading.Lock`
+        - `_polling`: `bool`
+        - `_wakeup_pipe`: (`int`, `int`)
+    """
     def __init__(self, settings = None, handlers = None):
         self._handlers = {}
         self._unprepared_handlers = {}
         self.poll = select.poll()
         self._timeout = None
+        self._dirty = set()
+        self._dirty_lock = threading.Lock()
+        self._polling = False
+        self._wakeup_pipe = os.pipe()
+        for fileno in self._wakeup_pipe:
+            flags = fcntl.fcntl(fileno, fcntl.F_GETFL)
+            fcntl.fcntl(fileno, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self.poll.register(self._wakeup_pipe[0], select.POLLIN)
         MainLoopBase.__init__(self, settings, handlers)
 
+    def __del__(self):
+        for fileno in getattr(self, "_wakeup_pipe", ()):
+            try:
+                os.close(fileno)
+            except OSError:
+                pass
+
     def _add_io_handler(self, handler):
         """Add an I/O handler to the loop."""
         self._unprepared_handlers[handler] = None
+        set_notifier = getattr(handler, "set_output_notifier", None)
+        if set_notifier is not None:
+            set_notifier(self._output_queued)
         self._configure_io_handler(handler)
 
+    def _output_queued(self, handler):
+        """Mark a handler to be registered again for ``POLLOUT`` (called by
+        the handler when output has been queued).
+
+        Wake up the loop if it is waiting in ``poll()``.
+        """
+        with self._dirty_lock:
+            self._dirty.add(handler)
+            if not self._polling:
+                return
+        try:
+            os.write(self._wakeup_pipe[1], b"\0")
+        except OSError, err:
+            if err.args[0] != errno.EAGAIN:
+                raise
+
+    def _drain_wakeup_pipe(self):
+        """Read the wakeup bytes from the wakeup pipe."""
+        try:
+            while os.read(self._wakeup_pipe[0], 4096):
+                pass
+        except OSError, err:
+            if err.args[0] != errno.EAGAIN:
+                raise
+
     def _configure_io_handler(self, handler):
         """Register an io-handler at the polling object."""
         if self.check_events():
@@ -109,6 +183,11 @@ class PollMainLoop(MainLoopBase):
 
     def _remove_io_handler(self, handler):
         """Remove an i/o-handler."""
+        set_notifier = getattr(handler, "set_output_notifier", None)
+        if set_notifier is not None:
+            set_notifier(None)
+        with self._dirty_lock:
+            self._dirty.discard(handler)
         if handler in self._unprepared_handlers:
             old_fileno = self._unprepared_handlers[handler]
             del self._unprepared_handlers[handler]
@@ -125,6 +204,14 @@ class PollMainLoop(MainLoopBase):
         """A loop iteration - check any scheduled events
         and I/O available and run the handlers.
         """
+        previous = set_in_loop_iteration(True)
+        try:
+            return self._loop_iteration(timeout)
+        finally:
+            set_in_loop_iteration(previous)
+
+    def _loop_iteration(self, timeout):
+        """Do the work of `loop_iteration`."""
         next_timeout, sources_handled = self._call_timeout_handlers()
         if self._quit:
             return sources_handled
@@ -134,9 +221,24 @@ class PollMainLoop(MainLoopBase):
             timeout = min(next_timeout, timeout)
         for handler in list(self._unprepared_handlers):
             self._configure_io_handler(handler)
-        events = self.poll.poll(timeout * 1000)
+        with self._dirty_lock:
+            dirty = self._dirty
+            self._dirty = set()
+            self._polling = True
+        try:
+            # output queued outside of the I/O callbacks
+            for handler in dirty:
+                if handler not in self._unprepared_handlers:
+                    self._configure_io_handler(handler)
+            events = self.poll.poll(timeout * 1000)
+        finally:
+            with self._dirty_lock:
+                self._polling = False
         self._timeout = None
         for (fileno, event) in events:
+            if fileno == self._wakeup_pipe[0]:
+                self._drain_wakeup_pipe()
+                continue
             if event & select.POLLHUP:
                 self._handlers[fileno].handle_hup()
             if event & select.POLLNVAL:
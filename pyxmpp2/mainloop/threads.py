@@ -354,6 +354,72 @@ class TimeoutThread(object):
             elif not recurring:
                 break
 
+class WorkerPool(object):
+    """A pool of worker threads running submitted functions, e.g. the
+    CPU-intensive steps of TLS handshakes.
+
+    :Ivariables:
+        - `name`: name prefix of the worker threads
+        - `threads`: the worker threads
+        - `_queue`: the task queue
+    :Types:
+        - `name`: `unicode`
+        - `threads`: `list` of :std:`threading.Thread`
+        - `_queue`: :std:`Queue.Queue`
+    """
+    def __init__(self, threads = 4, name = u"worker"):
+        """Initialize the pool and start the threads.
+
+        :Parameters:
+            - `threads`: number of worker threads
+            - `name`: name prefix of the worker threads
+        :Types:
+            - `threads`: `int`
+            - `name`: `unicode`
+        """
+        self.name = name
+        self._queue = Queue.Queue()
+        self.threads = []
+        for i in range(threads):
+            thread = threading.Thread(name = u"{0} {1}".format(name, i),
+                                                        target = self._run)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, function, *args, **kwargs):
+        """Schedule `function` to be called with `args` and `kwargs` in
+        one of the worker threads.
+        """
+        self._queue.put((function, args, kwargs))
+
+    def stop(self, join = False, timeout = None):
+        """Stop the worker threads after the tasks already submitted.
+
+        :Parameters:
+            - `join`: join the threads (wait until they exit)
+            - `timeout`: maximum time (in seconds) to wait when `join` is
+              `True`
+        """
+        for dummy in self.threads:
+            self._queue.put(None)
+        if join:
+            for thread in self.threads:
+                thread.join(timeout)
+
+    def _run(self):
+        """The worker thread function."""
+        while True:
+            task = self._queue.get()
+            if task is None:
+                break
+            function, args, kwargs = task
+            try:
+                function(*args, **kwargs)
+            except Exception: # pylint: disable-msg=W0703
+                logger.exception("Exception in the {0!r} worker thread"
+                                    .format(threading.current_thread().name))
+
 class ThreadPool(MainLoop):
     """Thread pool object, as a replacement for an asychronous event loop."""
     # pylint: disable-msg=R0902
@@ -27,6 +27,7 @@ __docformat__ = "restructuredtext en"
 
 from .etree import ElementTree, ElementClass
 from .stanza import Stanza
+from .utils import intern_name
 
 MESSAGE_TYPES = ("normal", "chat", "headline", "error", "groupchat")
 
@@ -86,12 +87,12 @@ class Message(Stanza):
         if self.element_name != "message":
             raise ValueError("The element is not <message/>")
 
-        self._subject_tag = self._ns_prefix + "subject"
-        self._body_tag = self._ns_prefix + "body"
-        self._thread_tag = self._ns_prefix + "thread"
+        self._subject_tag = intern_name(self._ns_prefix + "subject")
+        self._body_tag = intern_name(self._ns_prefix + "body")
+        self._thread_tag = intern_name(self._ns_prefix + "thread")
 
-        if self._element is not None:
-            self._decode_subelements()
+        # decoded on first use, not to parse a `LazyElement` needlessly
+        self._subelements_decoded = self._element is None
 
         if subject is not None:
             self.subject = subject
@@ -101,7 +102,10 @@ class Message(Stanza):
             self.thread = thread
 
     def _decode_subelements(self):
-        """Decode the stanza subelements."""
+        """Decode the stanza subelements, if not decoded yet."""
+        if self._subelements_decoded:
+            return
+        self._subelements_decoded = True
         for child in self._element:
             if child.tag == self._subject_tag:
                 self._subject = child.text
@@ -118,6 +122,7 @@ class Message(Stanza):
 
         :returntype: :etree:`ElementTree.Element`"""
         result = Stanza.as_xml(self)
+        self._decode_subelements()
         if self._subject:
             child = ElementTree.SubElement(result, self._subject_tag)
             child.text = self._subject
@@ -133,6 +138,7 @@ class Message(Stanza):
         """Create a deep copy of the stanza.
 
         :returntype: `Message`"""
+        self._decode_subelements()
         result = Message(None, self.from_jid, self.to_jid, 
                         self.stanza_type, self.stanza_id, self.error,
                         self._return_path(), self._subject, self._body,
@@ -147,10 +153,12 @@ class Message(Stanza):
 
         :Returntype: `unicode`
         """
+        self._decode_subelements()
         return self._subject
 
     @subject.setter # pylint: disable-msg=E1101
     def subject(self, subject): # pylint: disable-msg=E0202,E0102,C0111
+        self._decode_subelements()
         self._subject = unicode(subject)
         self._dirty = True
 
@@ -160,10 +168,12 @@ class Message(Stanza):
 
         :Returntype: `unicode`
         """
+        self._decode_subelements()
         return self._body
 
     @body.setter # pylint: disable-msg=E1101
     def body(self, body): # pylint: disable-msg=E0202,E0102,C0111
+        self._decode_subelements()
         self._body = unicode(body)
         self._dirty = True
 
@@ -173,10 +183,12 @@ class Message(Stanza):
 
         :Returntype: `unicode`
         """
+        self._decode_subelements()
         return self._thread
 
     @thread.setter # pylint: disable-msg=E1101
     def thread(self, thread): # pylint: disable-msg=E0202,E0102,C0111
+        self._decode_subelements()
         self._thread = unicode(thread)
         self._dirty = True
 
@@ -195,6 +207,7 @@ class Message(Stanza):
             raise ValueError("Errors may not be generated in response"
                                                                 " to errors")
 
+        self._decode_subelements()
         msg = Message(stanza_type = "error", from_jid = self.to_jid, 
                         to_jid = self.from_jid, stanza_id = self.stanza_id,
                         error_cond = cond,
@@ -29,6 +29,7 @@ from .etree import ElementTree, ElementClass
 
 from .exceptions import BadRequestProtocolError
 from .stanza import Stanza
+from .utils import intern_name
 
 PRESENCE_TYPES = ("available", "unavailable", "probe",
                     "subscribe", "unsubscribe", "subscribed", "unsubscribed",
@@ -111,12 +112,12 @@ class Presence(Stanza):
         if self.element_name != "presence":
             raise ValueError("The element is not <presence />")
 
-        self._show_tag = self._ns_prefix + "show"
-        self._status_tag = self._ns_prefix + "status"
-        self._priority_tag = self._ns_prefix + "priority"
+        self._show_tag = intern_name(self._ns_prefix + "show")
+        self._status_tag = intern_name(self._ns_prefix + "status")
+        self._priority_tag = intern_name(self._ns_prefix + "priority")
 
-        if self._element is not None:
-            self._decode_subelements()
+        # decoded on first use, not to parse a `LazyElement` needlessly
+        self._subelements_decoded = self._element is None
 
         if show is not None:
             self.show = show
@@ -126,7 +127,10 @@ class Presence(Stanza):
             self.priority = priority
 
     def _decode_subelements(self):
-        """Decode the stanza subelements."""
+        """Decode the stanza subelements, if not decoded yet."""
+        if self._subelements_decoded:
+            return
+        self._subelements_decoded = True
         for child in self._element:
             if child.tag == self._show_tag:
                 self._show = child.text
@@ -149,6 +153,7 @@ class Presence(Stanza):
 
         :returntype: :etree:`ElementTree.Element`"""
         result = Stanza.as_xml(self)
+        self._decode_subelements()
         if self._show:
             child = ElementTree.SubElement(result, self._show_tag)
             child.text = self._show
@@ -164,6 +169,7 @@ class Presence(Stanza):
         """Create a deep copy of the stanza.
 
         :returntype: `Presence`"""
+        self._decode_subelements()
         result = Presence(None, self.from_jid, self.to_jid, 
                         self.stanza_type, self.stanza_id, self.error,
                         self._return_path(), 
@@ -180,10 +186,12 @@ class Presence(Stanza):
 
         :returntype: `unicode`
         """
+        self._decode_subelements()
         return self._show
 
     @show.setter # pylint: disable-msg=E1101
     def show(self, show): # pylint: disable-msg=E0202,E0102,C0111
+        self._decode_subelements()
         self._show = unicode(show)
         self._dirty = True
 
@@ -193,10 +201,12 @@ class Presence(Stanza):
 
         :returntype: `unicode`
         """
+        self._decode_subelements()
         return self._status
 
     @status.setter # pylint: disable-msg=E1101
     def status(self, status): # pylint: disable-msg=E0202,E0102,C0111
+        self._decode_subelements()
         self._status = unicode(status)
         self._dirty = True
 
@@ -206,6 +216,7 @@ class Presence(Stanza):
 
         :returntype: `unicode`
         """
+        self._decode_subelements()
         return self._priority
 
     @priority.setter # pylint: disable-msg=E1101
@@ -213,6 +224,7 @@ class Presence(Stanza):
         priority = int(priority)
         if priority < -128 or priority > 127:
             raise ValueError("Priority must be in the (-128, 128) range")
+        self._decode_subelements()
         self._priority = priority
         self._dirty = True
 
@@ -264,6 +276,7 @@ class Presence(Stanza):
             raise ValueError("Errors may not be generated in response"
                                                                 " to errors")
 
+        self._decode_subelements()
         stanza = Presence(stanza_type = "error", from_jid = self.from_jid,
                             to_jid = self.to_jid, stanza_id = self.stanza_id,
                             status = self._status, show = self._show,
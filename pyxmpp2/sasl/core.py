@@ -42,7 +42,7 @@ mechanism-dependant, but these are the usually expected properties:
       mechanisms.
     * ``"authzid"`` - authorization id. Optional for most mechanisms.
     * ``"security-layer"`` - security layer if any. ``"TLS"`` when TLS is in
-      use.
+      use, ``"UNIX"`` for a (local) Unix domain socket connection.
     * ``"channel-binding"`` - mapping of 'channel binding type' to 'channel
       binding date' if available on the channel
     * ``"service-type"`` - service type as required by the DIGEST-MD5 protocol
@@ -51,6 +51,8 @@ mechanism-dependant, but these are the usually expected properties:
     * ``"service-hostname"`` - service host name (the 'host' par of diges-uri
       of DIGEST-MD5)
     * ``"remote-ip"`` - remote IP address
+    * ``"peer-credentials"`` - mapping with the 'pid', 'uid' and 'gid' of the
+      peer process of a Unix domain socket connection
     * ``"realm"`` - the realm to use if needed
     * ``"realms"`` - list of acceptable realms
     * ``"available_mechanisms"`` - mechanism list provided by peer
@@ -26,9 +26,19 @@ from __future__ import absolute_import, division
 
 __docformat__ = "restructuredtext en"
 
-from .core import ClientAuthenticator, Response, Success
+import logging
+
+try:
+    import pwd
+except ImportError:
+    pwd = None # pylint: disable=C0103
+
+from .core import ClientAuthenticator, ServerAuthenticator
+from .core import Response, Success, Failure
 from .core import sasl_mechanism
 
+logger = logging.getLogger("pyxmpp2.sasl.external")
+
 @sasl_mechanism("EXTERNAL", False, 20)
 class ExternalClientAuthenticator(ClientAuthenticator):
     """Provides client-side External SASL (TLS-Identify) authentication."""
@@ -62,3 +72,44 @@ class ExternalClientAuthenticator(ClientAuthenticator):
         :return: a success indicator.
         :returntype: `Success`"""
         return Success({"authzid": self.authzid})
+
+@sasl_mechanism("EXTERNAL", False, 20)
+class ExternalServerAuthenticator(ServerAuthenticator):
+    """Provides server-side External SASL authentication of local processes
+    connected via a Unix domain socket.
+
+    The client is authenticated as the system user the peer process runs as.
+
+    Authentication properties used:
+
+        - ``"peer-credentials"`` - credentials of the peer process
+
+    Authentication properties returned:
+
+        - ``"username"`` - name of the system user of the peer process
+        - ``"authzid"`` - authorization id
+    """
+    @classmethod
+    def are_properties_sufficient(cls, properties):
+        return pwd is not None and "peer-credentials" in properties
+
+    def start(self, properties, initial_response):
+        credentials = properties.get("peer-credentials")
+        if not credentials or pwd is None:
+            logger.debug("No peer credentials available")
+            return Failure("not-authorized")
+        try:
+            username = pwd.getpwuid(credentials["uid"]).pw_name
+        except KeyError:
+            logger.debug("Unknown peer uid: {0!r}".format(credentials["uid"]))
+            return Failure("not-authorized")
+        if isinstance(username, bytes):
+            username = username.decode("utf-8")
+        if initial_response and initial_response != b"=":
+            authzid = initial_response.decode("utf-8")
+        else:
+            authzid = None
+        return Success({"username": username, "authzid": authzid})
+
+    def response(self, response):
+        return Failure("not-authorized")
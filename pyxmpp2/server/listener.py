@@ -26,6 +26,9 @@ __docformat__ = "restructuredtext en"
 import threading
 import socket
 import logging
+import stat
+import errno
+import os
 
 try:
     from socket import SOMAXCONN
@@ -37,12 +40,64 @@ from ..exceptions import PyXMPPIOError
 
 logger = logging.getLogger("pyxmpp2.server.listener")
 
-from ..transport import BLOCKING_ERRORS
+from ..transport import BLOCKING_ERRORS, AF_UNIX
 
 
 
+def _remove_stale_socket(path):
+    """Remove a Unix domain socket file left by a previous listener, so
+    the address can be bound again. Files which are not sockets are left
+    alone.
+
+    The socket is considered stale only when connecting to it is refused,
+    a socket another listener still accepts connections on is not removed.
+
+    :Parameters:
+        - `path`: the socket path
+
+    :Raise: :std:`socket.error` with ``EADDRINUSE`` when the socket is in use
+    """
+    try:
+        mode = os.stat(path).st_mode
+    except OSError:
+        return
+    if not stat.S_ISSOCK(mode):
+        return
+    probe = socket.socket(AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            probe.connect(path)
+        except socket.error, err:
+            if err.args[0] == errno.ENOENT:
+                return
+            if err.args[0] != errno.ECONNREFUSED:
+                raise
+            logger.debug("Removing stale socket {0!r}".format(path))
+            os.unlink(path)
+            return
+    finally:
+        probe.close()
+    raise socket.error(errno.EADDRINUSE, "{0}: {1!r}".format(
+                                os.strerror(errno.EADDRINUSE), path))
+
+def _socket_file_id(path):
+    """Return the identity of a socket file (device and inode numbers),
+    `None` if it does not exist.
+
+    :Parameters:
+        - `path`: the socket path
+
+    :Returntype: `tuple`
+    """
+    try:
+        stat_result = os.stat(path)
+    except OSError:
+        return None
+    return (stat_result.st_dev, stat_result.st_ino)
+
 class TCPListener(IOHandler):
-    """Listens on a TCPSocket calling a function on incoming connection.
+    """Listens on a TCPSocket (or a Unix domain socket) calling a function on
+    incoming connection.
 
     :Ivariables:
         - `_lock`: thread synchronisaton lock
@@ -50,19 +105,28 @@ class TCPListener(IOHandler):
         - `_target`: function to be called with accepted connection. It should
           expect two arguments: a connected socket and a socket address (as
           returned by accept)
+        - `_path`: path of the Unix domain socket, removed when the listener
+          is closed
+        - `_file_id`: device and inode numbers of the Unix domain socket
+          file, it is not removed when replaced by another listener
     :Types:
         - `_lock`: :std:`threading.RLock`
         - `_socket`: socket object
         - `_target`: callable
+        - `_path`: `unicode`
+        - `_file_id`: `tuple`
     """
     _socket = None
+    _path = None
+    _file_id = None
     def __init__(self, family, address, target):
         """Initialize the `TCPListener` object and create the socket.
 
         :Parameters:
-            - `family`: address family (:std:`socket.AF_INET` or
-              :std:`socket.AF_INET6`)
-            - `address`: address to listen on (address, port)
+            - `family`: address family (:std:`socket.AF_INET`,
+              :std:`socket.AF_INET6` or :std:`socket.AF_UNIX`)
+            - `address`: address to listen on (address, port) or the
+              socket path for :std:`socket.AF_UNIX`
             - `target`: function to call on an accepted connection
         """
         self._socket = None
@@ -70,23 +134,38 @@ class TCPListener(IOHandler):
         self._target = target
         sock = socket.socket(family, socket.SOCK_STREAM)
         try:
-            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if family == AF_UNIX:
+                _remove_stale_socket(address)
+            else:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             sock.bind(address)
+            if family == AF_UNIX:
+                # listen right away, so the socket is not considered stale
+                # by another listener
+                sock.listen(SOMAXCONN)
         except:
             sock.close()
             raise
         self._socket = sock
+        if family == AF_UNIX:
+            self._path = address
+            self._file_id = _socket_file_id(address)
 
     def __del__(self):
-        if self._socket:
-            self._socket.close()
-            self._socket = None
+        self.close()
 
     def close(self):
         with self._lock:
             if self._socket:
                 self._socket.close()
                 self._socket = None
+            if self._path:
+                if _socket_file_id(self._path) == self._file_id:
+                    try:
+                        os.unlink(self._path)
+                    except OSError:
+                        pass
+                self._path = None
 
     def prepare(self):
         """When connecting start the next connection step and schedule
@@ -275,6 +275,14 @@ class XMPPSettings(MutableMapping):
             raise ValueError("Positive number required")
         return value
 
+    @staticmethod
+    def validate_non_negative_float(value):
+        """Non-negative float validator to be used with `add_setting`."""
+        value = float(value)
+        if value < 0:
+            raise ValueError("Non-negative number required")
+        return value
+
     @staticmethod
     def get_int_range_validator(start, stop):
         """Return an integer range validator to be used with `add_setting`.
@@ -34,6 +34,7 @@ from .jid import JID
 from .stanzapayload import XMLPayload, payload_factory
 from .stanzapayload import payload_class_for_element_name
 from .xmppserializer import serialize
+from .utils import intern_name
 from .constants import STANZA_NAMESPACES, STANZA_CLIENT_NS, XML_LANG_QNAME
 from .error import StanzaErrorElement
 from .interfaces import StanzaPayload
@@ -104,19 +105,21 @@ class Stanza(object):
             if not element.tag.startswith("{"):
                 raise ValueError("Element has no namespace")
             else:
-                self._namespace, self.element_name = element.tag[1:].split("}")
-                if self._namespace not in STANZA_NAMESPACES:
+                namespace, element_name = element.tag[1:].split("}")
+                if namespace not in STANZA_NAMESPACES:
                     raise BadRequestProtocolError("Wrong stanza namespace")
+                self._namespace = intern_name(namespace)
+                self.element_name = intern_name(element_name)
             self._payload = None
         else:
             self._element = None
             self._dirty = True
-            self.element_name = unicode(element)
+            self.element_name = intern_name(unicode(element))
             self._namespace = STANZA_CLIENT_NS
             self._payload = []
 
-        self._ns_prefix = "{{{0}}}".format(self._namespace)
-        self._element_qname = self._ns_prefix + self.element_name
+        self._ns_prefix = intern_name("{{{0}}}".format(self._namespace))
+        self._element_qname = intern_name(self._ns_prefix + self.element_name)
 
         if from_jid is not None:
             self.from_jid = from_jid
@@ -0,0 +1,278 @@
+#
+# (C) Copyright 2003-2011 Jacek Konieczny <jajcus@jajcus.net>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version
+# 2.1 as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+
+"""Limits and filters applied by the stream readers to the stanzas received.
+
+`StanzaLimits` guards against elements too large or too complex, while
+`StanzaFilter` objects allow dropping unwanted stanzas before an element
+tree is built for them. Both are used by all the readers in `xmppparser`
+and `xmppreaders`.
+"""
+
+from __future__ import absolute_import, division
+
+__docformat__ = "restructuredtext en"
+
+import sys
+
+from .exceptions import StanzaLimitExceeded
+from .settings import XMPPSettings
+
+class StanzaLimits(object):
+    """Size and structure limits of the level-1 stream elements (stanzas),
+    checked by the stream readers while an element is parsed.
+
+    The size is the number of characters in the element and attribute names,
+    attribute values and text.
+
+    `StanzaLimitExceeded` is raised when a limit is exceeded.
+
+    :Ivariables:
+        - `max_size`: maximum stanza size
+        - `max_depth`: maximum element nesting depth (1 is a stanza with no
+          child elements)
+        - `max_children`: maximum number of child elements of an element
+        - `max_attributes`: maximum number of attributes of an element
+        - `max_text`: maximum length of a single text node
+        - `size`: size of the current stanza so far
+        - `text`: length of the current text node so far
+        - `_children`: number of children of each open element
+    :Types:
+        - `max_size`: `int`
+        - `max_depth`: `int`
+        - `max_children`: `int`
+        - `max_attributes`: `int`
+        - `max_text`: `int`
+        - `size`: `int`
+        - `text`: `int`
+        - `_children`: `list` of `int`
+    """
+    # pylint: disable-msg=R0902
+    def __init__(self, settings = None):
+        """Initialize the `StanzaLimits` object.
+
+        :Parameters:
+            - `settings`: settings to take the limits from, 0 meaning no
+              limit
+        :Types:
+            - `settings`: `XMPPSettings`
+        """
+        if settings is None:
+            settings = XMPPSettings()
+        self.max_size = settings["max_stanza_size"] or sys.maxint
+        self.max_depth = settings["max_stanza_depth"] or sys.maxint
+        self.max_children = settings["max_element_children"] or sys.maxint
+        self.max_attributes = settings["max_element_attributes"] or sys.maxint
+        self.max_text = settings["max_text_length"] or sys.maxint
+        self.size = 0
+        self.text = 0
+        self._children = []
+
+    def reset(self):
+        """Prepare for a new stanza."""
+        self.size = 0
+        self.text = 0
+        del self._children[:]
+
+    def start(self, tag, attrs):
+        """Account for an element start tag.
+
+        :Parameters:
+            - `tag`: the element name
+            - `attrs`: the element attributes
+        :Types:
+            - `tag`: `unicode`
+            - `attrs`: `dict`
+        """
+        children = self._children
+        if children:
+            children[-1] += 1
+            if children[-1] > self.max_children:
+                raise StanzaLimitExceeded(u"More than {0} child elements"
+                                            .format(self.max_children))
+            if len(children) >= self.max_depth:
+                raise StanzaLimitExceeded(u"Elements nested deeper than {0}"
+                                                .format(self.max_depth))
+        children.append(0)
+        size = len(tag)
+        if attrs:
+            if len(attrs) > self.max_attributes:
+                raise StanzaLimitExceeded(u"More than {0} attributes"
+                                                .format(self.max_attributes))
+            for name, value in attrs.items():
+                size += len(name) + len(value)
+        self.size += size
+        if self.size > self.max_size:
+            raise StanzaLimitExceeded(u"Stanza larger than {0}"
+                                                    .format(self.max_size))
+        self.text = 0
+
+    def end(self):
+        """Account for an element end tag."""
+        self._children.pop()
+        self.text = 0
+
+    def data(self, data):
+        """Account for a piece of text.
+
+        :Parameters:
+            - `data`: the text
+        :Types:
+            - `data`: `unicode`
+        """
+        length = len(data)
+        self.text += length
+        if self.text > self.max_text:
+            raise StanzaLimitExceeded(u"Text node longer than {0}"
+                                                    .format(self.max_text))
+        self.size += length
+        if self.size > self.max_size:
+            raise StanzaLimitExceeded(u"Stanza larger than {0}"
+                                                    .format(self.max_size))
+
+    def pending(self, length):
+        """Check a piece of text which is not complete yet, without
+        accounting for it.
+
+        :Parameters:
+            - `length`: the text length so far
+        :Types:
+            - `length`: `int`
+        """
+        if self.text + length > self.max_text:
+            raise StanzaLimitExceeded(u"Text node longer than {0}"
+                                                    .format(self.max_text))
+        if self.size + length > self.max_size:
+            raise StanzaLimitExceeded(u"Stanza larger than {0}"
+                                                    .format(self.max_size))
+
+class StanzaFilter(object):
+    """Filter applied by the stream readers at the start tag of every
+    stanza (or other element directly under the stream root), so unwanted
+    traffic can be dropped before an element tree is built for it.
+
+    Filters are usually installed with the :r:`stanza_filters setting`.
+    They should not drop the stream negotiation elements.
+
+    :Ivariables:
+        - `function`: the filter function, called with the element name and
+          attributes (in the :etree:`ElementTree` '{namespace}name' form),
+          returning `True` if the element should be dropped
+        - `name`: filter name, for the logs and statistics
+        - `checked`: number of elements checked by the filter
+        - `dropped`: number of elements dropped by the filter
+    :Types:
+        - `function`: callable
+        - `name`: `unicode`
+        - `checked`: `int`
+        - `dropped`: `int`
+    """
+    def __init__(self, function, name = None):
+        """Initialize the `StanzaFilter` object.
+
+        :Parameters:
+            - `function`: the filter function
+            - `name`: filter name, the function name by default
+        :Types:
+            - `function`: callable
+            - `name`: `unicode`
+        """
+        self.function = function
+        if name is None:
+            name = getattr(function, "__name__", None)
+        self.name = name
+        self.checked = 0
+        self.dropped = 0
+
+    def check(self, tag, attrs):
+        """Check if a stanza should be dropped.
+
+        :Parameters:
+            - `tag`: the element name
+            - `attrs`: the element attributes
+        :Types:
+            - `tag`: `unicode`
+            - `attrs`: `dict`
+
+        :Returntype: `bool`
+        """
+        self.checked += 1
+        if self.function(tag, attrs):
+            self.dropped += 1
+            return True
+        return False
+
+    def __repr__(self):
+        return "<StanzaFilter {0!r}: {1}/{2} dropped>".format(self.name,
+                                                self.dropped, self.checked)
+
+def drop_stanza(filters, tag, attrs):
+    """Check if a stanza is dropped by any of the `filters`.
+
+    :Returntype: `bool`
+    """
+    for stanza_filter in filters:
+        if stanza_filter.check(tag, attrs):
+            return True
+    return False
+
+XMPPSettings.add_setting(u"stanza_filters", type = u"list of `StanzaFilter`",
+        default = (),
+        doc = u"""Filters applied to the stanzas received before they are
+parsed into element trees. A stanza is dropped when any of the filters
+matches."""
+    )
+
+XMPPSettings.add_setting(u"max_stanza_size", type = int,
+        default = 1 << 22,
+        validator = XMPPSettings.get_int_range_validator(0, 1 << 30),
+        cmdline_help = u"Maximum size of a stanza received (0: no limit)",
+        doc = u"""Maximum size of a stanza (or other element directly under
+the stream root) received, counted in characters of element names, attribute
+names and values and text. The stream is closed with a 'policy-violation'
+stream error when it is exceeded. 0 means no limit."""
+    )
+
+XMPPSettings.add_setting(u"max_stanza_depth", type = int,
+        default = 64,
+        validator = XMPPSettings.get_int_range_validator(0, 1 << 30),
+        doc = u"""Maximum element nesting depth of a stanza received (1 is
+a stanza with no child elements). 0 means no limit."""
+    )
+
+XMPPSettings.add_setting(u"max_element_children", type = int,
+        default = 1 << 16,
+        validator = XMPPSettings.get_int_range_validator(0, 1 << 30),
+        doc = u"""Maximum number of child elements of any element in
+a stanza received. 0 means no limit."""
+    )
+
+XMPPSettings.add_setting(u"max_element_attributes", type = int,
+        default = 64,
+        validator = XMPPSettings.get_int_range_validator(0, 1 << 30),
+        doc = u"""Maximum number of attributes of any element in a stanza
+received. 0 means no limit."""
+    )
+
+XMPPSettings.add_setting(u"max_text_length", type = int,
+        default = 1 << 20,
+        validator = XMPPSettings.get_int_range_validator(0, 1 << 30),
+        doc = u"""Maximum length of a single piece of text (element text or
+tail) in a stanza received. 0 means no limit."""
+    )
+
+# vi: sts=4 et sw=4
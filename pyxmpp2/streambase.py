@@ -31,6 +31,7 @@ import logging
 import uuid
 import re
 import threading
+import time
 
 from .etree import ElementTree, element_to_unicode
 
@@ -39,6 +40,7 @@ from .error import StreamErrorElement
 from .jid import JID
 from .exceptions import StreamError
 from .exceptions import FatalStreamError, StreamParseError
+from .exceptions import StanzaLimitExceeded
 from .constants import STREAM_QNP, XML_LANG_QNAME, STREAM_ROOT_TAG
 from .settings import XMPPSettings
 from .xmppserializer import serialize
@@ -74,15 +76,21 @@ class StreamBase(XMLStreamHandler):
     :Ivariables:
         - `authenticated`: `True` if local entity has authenticated to peer
         - `features`: stream features as annouced by the receiver.
+        - `handler_time`: seconds spent processing the stream elements
+          received
         - `handlers`: handlers for stream elements
         - `initiator`: `True` if local stream endpoint is the initiating entity.
         - `lock`: RLock object used to synchronize access to Stream object.
         - `me`: local stream endpoint JID.
         - `peer_authenticated`: `True` if the peer has authenticated to us
+        - `peer_certificate`: the verified TLS certificate of the peer,
+          `None` if no certificate has been presented
         - `peer_language`: language of human-readable stream content selected
           by the peer
         - `peer`: remote stream endpoint JID.
         - `settings`: stream settings
+        - `sm_session`: the Stream Management session the stream counts
+          the stanzas for, if enabled
         - `stanza_namespace`: default namespace of the stream
         - `tls_established`: `True` when the stream is protected by TLS
         - `transport`: transport used by this stream
@@ -90,31 +98,41 @@ class StreamBase(XMLStreamHandler):
           legacy (pre-XMPP) Jabber protocol.
         - `_element_handlers`: mapping from stream element names to lists of
           methods handling them
+        - `_held_input`: parser events received while the input is held,
+          `None` when it is not held
         - `_input_state`: `None`, "open" (<stream:stream> has been received)
           "restart" or "closed" (</stream:stream> or EOF has been received)
         - `_output_state`: `None`, "open" (<stream:stream> has been received)
           "restart" or "closed" (</stream:stream> or EOF has been received)
         - `_stanza_namespace_p`: qname prefix of the stanza namespace
+        - `_stanzas_received`: number of stanzas received
+        - `_stanzas_sent`: number of stanzas sent
         - `_stream_feature_handlers`: stream features handlers
     :Types:
         - `authenticated`: `bool`
         - `features`: :etree:`ElementTree.Element`
+        - `handler_time`: `float`
         - `handlers`: `list`
         - `initiator`: `bool`
         - `lock`: :std:`threading.RLock`
         - `me`: `JID`
         - `peer_authenticated`: `bool`
+        - `peer_certificate`: `pyxmpp2.cert.CertificateData`
         - `peer_language`: `unicode`
         - `peer`: `JID`
         - `settings`: XMPPSettings
+        - `sm_session`: `streammanagement.StreamManagementSession`
         - `stanza_namespace`: `unicode`
         - `tls_established`: `bool`
         - `transport`: `transport.XMPPTransport`
         - `version`: (`int`, `int`) tuple
         - `_element_handlers`: `dict`
+        - `_held_input`: `list` of (method, arguments) tuples
         - `_input_state`: `unicode`
         - `_output_state`: `unicode`
         - `_stanza_namespace_p`: `unicode`
+        - `_stanzas_received`: `int`
+        - `_stanzas_sent`: `int`
         - `_stream_feature_handlers`: `list` of `StreamFeatureHandler`
     """
     # pylint: disable-msg=R0902,R0904
@@ -155,14 +173,22 @@ class StreamBase(XMLStreamHandler):
         self.authenticated = False
         self.peer_authenticated = False
         self.tls_established = False
+        self.peer_certificate = None
         self.auth_method_used = None
         self.version = None
         self.language = None
         self.peer_language = None
         self.transport = None
+        self.sm_session = None
         self._input_state = None
         self._output_state = None
         self._element_handlers = {}
+        self._held_input = None
+        self._negotiation_step = 0
+        self._pipelined = None
+        self._stanzas_received = 0
+        self._stanzas_sent = 0
+        self.handler_time = 0.0
 
     def initiate(self, transport, to = None):
         """Initiate an XMPP connection over the `transport`.
@@ -189,6 +215,7 @@ class StreamBase(XMLStreamHandler):
         """
         self._setup_stream_element_handlers()
         self._send_stream_start()
+        self._pipeline_negotiation()
 
     def receive(self, transport, myname):
         """Receive an XMPP connection over the `transport`.
@@ -233,6 +260,8 @@ class StreamBase(XMLStreamHandler):
     def disconnect(self):
         """Gracefully close the connection."""
         with self.lock:
+            if self.sm_session is not None:
+                self.sm_session.close()
             self.transport.disconnect()
             self._output_state = "closed"
 
@@ -262,6 +291,44 @@ class StreamBase(XMLStreamHandler):
         """Forcibly close the connection and clear the stream state."""
         self.transport.close()
 
+    def hold_input(self):
+        """Stop processing the input until `release_input` is called.
+
+        The stream start, elements and end received in the meantime are
+        kept and processed when the input is released. Used by the receiving
+        entity after StartTLS, when the new stream header may arrive before
+        the peer certificate is verified.
+        """
+        with self.lock:
+            if self._held_input is None:
+                self._held_input = []
+
+    def release_input(self):
+        """Process the input held since `hold_input` and stop holding it."""
+        with self.lock:
+            held = self._held_input
+            self._held_input = None
+            if held:
+                for method, args in held:
+                    method(*args)
+
+    def _hold(self, method, *args):
+        """Keep a parser event for later processing if the input is held.
+
+        [called with `lock` acquired]
+
+        :Parameters:
+            - `method`: the method to call when the input is released
+            - `args`: the method arguments
+
+        :Return: `True` if the event has been held
+        """
+        if self._held_input is None:
+            return False
+        logger.debug("Input held: {0!r}".format(method))
+        self._held_input.append((method, args))
+        return True
+
     def stream_start(self, element):
         """Process <stream:stream> (stream start) tag received from peer.
         
@@ -270,6 +337,8 @@ class StreamBase(XMLStreamHandler):
         :Parameters:
             - `element`: root element (empty) created by the parser"""
         with self.lock:
+            if self._hold(self.stream_start, element):
+                return
             logger.debug("input document: " + element_to_unicode(element))
             if not element.tag.startswith(STREAM_QNP):
                 self._send_stream_error("invalid-namespace")
@@ -346,14 +415,32 @@ class StreamBase(XMLStreamHandler):
         """
         logger.debug("Stream ended")
         with self.lock:
-            self._input_state = "closed"
-            self.transport.disconnect()
-            self._output_state = "closed"
+            if self._hold(self.stream_end):
+                return
+            if self.sm_session is not None:
+                self.sm_session.close()
+            self._stream_end()
 
     def stream_eof(self):
         """Process stream EOF.
+
+        Unlike the stream end tag, the EOF does not end the Stream Management
+        session, which may be resumed on a new connection.
+        """
+        logger.debug("Stream EOF")
+        with self.lock:
+            if self._hold(self.stream_eof):
+                return
+            self._stream_end()
+
+    def _stream_end(self):
+        """Close the stream after stream end or EOF.
+
+        [called with `lock` acquired]
         """
-        self.stream_end()
+        self._input_state = "closed"
+        self.transport.disconnect()
+        self._output_state = "closed"
 
     def stream_element(self, element):
         """Process first level child element of the stream).
@@ -364,7 +451,13 @@ class StreamBase(XMLStreamHandler):
             - `element`: :etree:`ElementTree.Element`
         """
         with self.lock:
-            self._process_element(element)
+            if self._hold(self.stream_element, element):
+                return
+            start = time.time()
+            try:
+                self._process_element(element)
+            finally:
+                self.handler_time += time.time() - start
 
     def stream_parse_error(self, descr):
         """Called when an error is encountered in the stream.
@@ -373,8 +466,24 @@ class StreamBase(XMLStreamHandler):
             - `descr`: description of the error
         :Types:
             - `descr`: `unicode`"""
+        if self.transport:
+            self.transport.dump_traffic(u"Parse error: {0}".format(descr),
+                                                                logging.INFO)
         self.send_stream_error("not-well-formed")
         raise StreamParseError(descr)
+
+    def stream_limit_exceeded(self, descr):
+        """Called when an element received exceeds the parser limits.
+
+        :Parameters:
+            - `descr`: description of the limit exceeded
+        :Types:
+            - `descr`: `unicode`"""
+        if self.transport:
+            self.transport.dump_traffic(u"Stanza limit exceeded: {0}"
+                                                .format(descr), logging.INFO)
+        self.send_stream_error("policy-violation")
+        raise StanzaLimitExceeded(descr)
  
     def _send_stream_start(self, stream_id = None, stream_to = None):
         """Send stream start tag."""
@@ -417,6 +526,8 @@ class StreamBase(XMLStreamHandler):
             self._send_stream_start()
         element = StreamErrorElement(condition).as_xml()
         self.transport.send_element(element)
+        self.transport.dump_traffic(u"Stream error sent: {0}"
+                                .format(condition), logging.INFO, once = True)
         self.transport.disconnect()
         self._output_state = "closed"
 
@@ -425,9 +536,59 @@ class StreamBase(XMLStreamHandler):
         self._input_state = "restart"
         self._output_state = "restart"
         self.features = None
+        self._negotiation_step += 1
         self.transport.restart()
         if self.initiator:
             self._send_stream_start(self.stream_id)
+            self._pipeline_negotiation()
+
+    def _negotiation_stage(self):
+        """Identify the current stream negotiation stage, for the
+        :r:`negotiation_cache setting`.
+
+        :Returntype: `tuple`
+        """
+        return (self._negotiation_step, self.tls_established,
+                                                        self.authenticated)
+
+    def _pipeline_negotiation(self):
+        """Send requests for the stream features expected from the peer,
+        without waiting for the <features/> element, when the
+        :r:`pipelining setting` is enabled and the features received on this
+        stage from the same peer before are known.
+
+        Each of the stream feature handlers, up to the one which has
+        handled the cached features, gets a chance to act upon them.
+
+        [initiating entity only, called with `lock` acquired]
+        """
+        self._pipelined = None
+        if not self.settings["pipelining"] or not self.peer:
+            return
+        cache = self.settings["negotiation_cache"]
+        entry = cache.get(self.peer.domain, self._negotiation_stage())
+        if entry is None:
+            return
+        features, handler_class = entry
+        handlers = self._stream_feature_handlers
+        for index, handler in enumerate(handlers):
+            if handler.__class__ is handler_class:
+                handlers = handlers[:index + 1]
+                break
+        else:
+            return
+        logger.debug("Pipelining stream negotiation: {0}"
+                                                .format(serialize(features)))
+        self.features = features
+        try:
+            for handler in handlers:
+                ret = handler.pipeline_stream_features(self, features)
+                if isinstance(ret, StreamFeatureHandled):
+                    logger.debug("  pipelined: {0}".format(ret))
+                    self._pipelined = (features, handler)
+                    break
+        finally:
+            self.features = None
 
     def _make_stream_features(self):
         """Create the <features/> element for the stream.
@@ -478,8 +639,11 @@ class StreamBase(XMLStreamHandler):
     def _send(self, stanza):
         """Same as `send` but assume `lock` is acquired."""
         self.fix_out_stanza(stanza)
-        element = stanza.as_xml()
+        element = stanza.get_xml()
         self._write_element(element)
+        self._stanzas_sent += 1
+        if self.sm_session is not None:
+            self.sm_session.stanza_sent(element)
 
     def _process_element(self, element):
         """Process first level element of the stream.
@@ -495,16 +659,21 @@ class StreamBase(XMLStreamHandler):
         tag = element.tag
         if tag in self._element_handlers:
             handler = self._element_handlers[tag]
-            logger.debug("Passing element {0!r} to method {1!r}"
-                                                .format(element, handler))
+            logger.debug("Passing element %r to method %r", element, handler)
             handled = handler(self, element)
             if handled:
                 return
         if tag.startswith(self._stanza_namespace_p):
+            self._stanzas_received += 1
             stanza = stanza_factory(element, self, self.language)
             self.uplink_receive(stanza)
+            if self.sm_session is not None:
+                self.sm_session.stanza_handled()
         elif tag == ERROR_TAG:
             error = StreamErrorElement(element)
+            self.transport.dump_traffic(u"Stream error received: {0}"
+                                            .format(error.condition_name),
+                                            logging.INFO, once = True)
             self.process_stream_error(error)
         elif tag == FEATURES_TAG:
             logger.debug("Got features element: {0}".format(serialize(element)))
@@ -558,21 +727,43 @@ class StreamBase(XMLStreamHandler):
 
         [initiating entity only]
 
-        The received features node is available in `features`."""
+        The received features node is available in `features`.
+
+        When requests for the expected features have been already sent
+        (pipelined negotiation), the stream feature handlers are not called
+        now - the handler which has sent the request continues the
+        negotiation when the response comes. If the features differ from
+        the predicted ones, they are handled as usual, except that
+        the handler which has sent the request is not called again."""
         self.features = features
         logger.debug("got features, passing to event handlers...")
         handled = self.event(GotFeaturesEvent(self.features))
         logger.debug("  handled: {0}".format(handled))
+        pipelined, self._pipelined = self._pipelined, None
+        if pipelined is not None:
+            predicted, in_flight = pipelined
+            if serialize(predicted) == serialize(features):
+                return
+            logger.debug("  features differ from the predicted ones")
+            self.settings["negotiation_cache"].remove(self.peer.domain,
+                                                    self._negotiation_stage())
+        else:
+            in_flight = None
         if not handled:
             mandatory_handled = []
             mandatory_not_handled = []
             logger.debug("  passing to stream features handlers: {0}"
                                     .format(self._stream_feature_handlers))
             for handler in self._stream_feature_handlers:
+                if handler is in_flight:
+                    logger.debug("  {0!r} request already sent"
+                                                            .format(handler))
+                    break
                 ret = handler.handle_stream_features(self, self.features)
                 if ret is None:
                     continue
                 elif isinstance(ret, StreamFeatureHandled):
+                    self._cache_features(handler)
                     if ret.mandatory:
                         mandatory_handled.append(unicode(ret))
                         break
@@ -590,6 +781,17 @@ class StreamBase(XMLStreamHandler):
                         u"Unsupported mandatory-to-implement features: "
                                         + u" ".join(mandatory_not_handled))
 
+    def _cache_features(self, handler):
+        """Remember the current features and the `handler` which has
+        handled them, for pipelining the negotiation on the next connection.
+
+        [initiating entity only]
+        """
+        if not self.settings["pipelining"] or not self.peer:
+            return
+        self.settings["negotiation_cache"].update(self.peer.domain,
+                self._negotiation_stage(), self.features, handler.__class__)
+
     def is_connected(self):
         """Check if stream is is_connected and stanzas may be sent.
 
@@ -649,6 +851,21 @@ class StreamBase(XMLStreamHandler):
         # pylint: disable-msg=R0201
         return stanza
 
+    @property
+    def metrics(self):
+        """Stream counters: stanzas received ('stanzas_received') and sent
+        ('stanzas_sent') and seconds spent processing the elements received
+        ('handler_time').
+
+        :Returntype: `dict`
+        """
+        with self.lock:
+            return {
+                    "stanzas_received": self._stanzas_received,
+                    "stanzas_sent": self._stanzas_sent,
+                    "handler_time": self.handler_time,
+                    }
+
     @property
     def auth_properties(self):
         """Authentication properties of the stream.
@@ -662,6 +879,68 @@ class StreamBase(XMLStreamHandler):
         props["service-type"] = "xmpp"
         return props
 
+class NegotiationCache(object):
+    """Stream features received from peers, for the pipelined stream
+    negotiation.
+
+    For each peer domain and negotiation stage the last <features/> element
+    received is remembered, together with the class of the stream feature
+    handler which has handled it.
+
+    Default value of the :r:`negotiation_cache setting`, shared by all
+    the streams.
+    """
+    def __init__(self, settings = None):
+        # pylint: disable-msg=W0613
+        self.lock = threading.Lock()
+        self._entries = {}
+
+    def get(self, domain, stage):
+        """Get the features cached.
+
+        :Parameters:
+            - `domain`: the peer domain
+            - `stage`: the negotiation stage
+        :Types:
+            - `domain`: `unicode`
+            - `stage`: `tuple`
+
+        :Return: (features, handler class) tuple or `None`
+        """
+        with self.lock:
+            return self._entries.get((domain, stage))
+
+    def update(self, domain, stage, features, handler_class):
+        """Remember the features received.
+
+        :Parameters:
+            - `domain`: the peer domain
+            - `stage`: the negotiation stage
+            - `features`: the features element
+            - `handler_class`: class of the stream feature handler which
+              handled the features
+        :Types:
+            - `domain`: `unicode`
+            - `stage`: `tuple`
+            - `features`: :etree:`ElementTree.Element`
+            - `handler_class`: `type`
+        """
+        with self.lock:
+            self._entries[(domain, stage)] = (features, handler_class)
+
+    def remove(self, domain, stage):
+        """Forget the features cached, e.g. after a wrong prediction.
+
+        :Parameters:
+            - `domain`: the peer domain
+            - `stage`: the negotiation stage
+        :Types:
+            - `domain`: `unicode`
+            - `stage`: `tuple`
+        """
+        with self.lock:
+            self._entries.pop((domain, stage), None)
+
 def _languages_factory(settings):
     """Make the default value of the :r:`languages setting`."""
     return [settings["language"]]
@@ -687,5 +966,18 @@ XMPPSettings.add_setting(u"extra_ns_prefixes", type = "prefix -> uri mapping",
         doc = u"""Extra namespace prefix declarations to use at the stream root
 element."""
     )
+XMPPSettings.add_setting(u"pipelining", type = bool, default = False,
+        cmdline_help = u"Pipeline the stream negotiation (XEP-0305)",
+        doc = u"""Send the authentication and resource binding requests
+without waiting for the stream features, when the features announced by
+the same server before are known (XEP-0305 quick-start). This saves round
+trips on high-latency links."""
+    )
+XMPPSettings.add_setting(u"negotiation_cache", type = NegotiationCache,
+        factory = NegotiationCache, cache = True,
+        default_d = u"A `NegotiationCache` instance shared by all streams",
+        doc = u"""Stream features received from servers, used for the
+pipelined stream negotiation."""
+    )
 
 # vi: sts=4 et sw=4
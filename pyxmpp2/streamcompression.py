@@ -0,0 +1,378 @@
+#
+# (C) Copyright 2011 Jacek Konieczny <jajcus@jajcus.net>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version
+# 2.1 as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+
+"""Stream compression support for XMPP streams.
+
+The compression is done by the transport (see
+`transport.TCPTransport.set_compression`), between the socket I/O and the
+XML parser and serializer.
+
+Normative reference:
+  - `XEP-0138 <http://xmpp.org/extensions/xep-0138.html>`__
+"""
+
+from __future__ import absolute_import, division
+
+__docformat__ = "restructuredtext en"
+
+import zlib
+import logging
+
+from .etree import ElementTree
+from .constants import COMPRESS_FEATURE_QNP, COMPRESS_QNP
+from .settings import XMPPSettings
+from .streamevents import StreamCompressedEvent
+
+from .interfaces import StreamFeatureHandler
+from .interfaces import StreamFeatureHandled, StreamFeatureNotHandled
+from .interfaces import stream_element_handler
+
+COMPRESSION_TAG = COMPRESS_FEATURE_QNP + u"compression"
+FEATURE_METHOD_TAG = COMPRESS_FEATURE_QNP + u"method"
+COMPRESS_TAG = COMPRESS_QNP + u"compress"
+METHOD_TAG = COMPRESS_QNP + u"method"
+COMPRESSED_TAG = COMPRESS_QNP + u"compressed"
+FAILURE_TAG = COMPRESS_QNP + u"failure"
+UNSUPPORTED_METHOD_TAG = COMPRESS_QNP + u"unsupported-method"
+SETUP_FAILED_TAG = COMPRESS_QNP + u"setup-failed"
+
+logger = logging.getLogger("pyxmpp2.streamcompression")
+
+class ZlibCompressor(object):
+    """The 'zlib' compression method: a pair of :std:`zlib` compression and
+    decompression objects for a single stream.
+
+    Every chunk of data written (a stanza, stream head or tail) is followed
+    by a sync flush, so the peer can process it immediately.
+
+    :Ivariables:
+        - `method`: the method name
+        - `bytes_in`: number of compressed bytes received
+        - `bytes_in_raw`: number of bytes decompressed from `bytes_in`
+        - `bytes_out`: number of compressed bytes sent
+        - `bytes_out_raw`: number of bytes compressed into `bytes_out`
+        - `_deflater`: the compression object
+        - `_inflater`: the decompression object
+    :Types:
+        - `method`: `unicode`
+        - `bytes_in`: `int`
+        - `bytes_in_raw`: `int`
+        - `bytes_out`: `int`
+        - `bytes_out_raw`: `int`
+    """
+    # pylint: disable=R0902
+    method = u"zlib"
+    def __init__(self, settings = None):
+        """Initialize the `ZlibCompressor` object.
+
+        :Parameters:
+            - `settings`: settings, the :r:`compression_level setting`,
+              :r:`compression_window_bits setting` and
+              :r:`compression_mem_level setting` are used.
+        :Types:
+            - `settings`: `XMPPSettings`
+        """
+        if settings is None:
+            settings = XMPPSettings()
+        self._deflater = zlib.compressobj(settings["compression_level"],
+                                zlib.DEFLATED,
+                                settings["compression_window_bits"],
+                                settings["compression_mem_level"])
+        # the window size is chosen by the peer
+        self._inflater = zlib.decompressobj(zlib.MAX_WBITS)
+        self.bytes_in = 0
+        self.bytes_in_raw = 0
+        self.bytes_out = 0
+        self.bytes_out_raw = 0
+
+    def compress(self, data):
+        """Compress a chunk of data to be sent.
+
+        :Parameters:
+            - `data`: the data to compress
+        :Types:
+            - `data`: `bytes`
+
+        :Return: the compressed data, including a sync flush
+        :Returntype: `bytes`
+        """
+        result = self._deflater.compress(data)
+        result += self._deflater.flush(zlib.Z_SYNC_FLUSH)
+        self.bytes_out_raw += len(data)
+        self.bytes_out += len(result)
+        return result
+
+    def decompress(self, data, max_length = 0):
+        """Decompress data received.
+
+        :Parameters:
+            - `data`: the compressed data, may be empty to continue with the
+              input left by the previous call (see `pending`)
+            - `max_length`: maximum size of the result, 0 for no limit
+        :Types:
+            - `data`: `bytes` or a read-only buffer
+            - `max_length`: `int`
+
+        :Return: the decompressed data
+        :Returntype: `bytes`
+
+        :Raise zlib.error: on corrupted input
+        """
+        self.bytes_in += len(data)
+        tail = self._inflater.unconsumed_tail
+        if tail:
+            data = tail + bytes(data)
+        result = self._inflater.decompress(data, max_length)
+        self.bytes_in_raw += len(result)
+        return result
+
+    @property
+    def pending(self):
+        """`True` when some input has not been decompressed yet, because
+        of the `max_length` limit passed to `decompress`."""
+        return bool(self._inflater.unconsumed_tail)
+
+    @property
+    def stats(self):
+        """Compression counters: bytes sent before ('bytes_out_raw') and
+        after ('bytes_out') compression, bytes received before ('bytes_in')
+        and after ('bytes_in_raw') decompression and the compression ratios
+        ('ratio_out' and 'ratio_in', raw size / compressed size).
+
+        :Returntype: `dict`
+        """
+        return {
+                "method": self.method,
+                "bytes_out_raw": self.bytes_out_raw,
+                "bytes_out": self.bytes_out,
+                "bytes_in_raw": self.bytes_in_raw,
+                "bytes_in": self.bytes_in,
+                "ratio_out": _ratio(self.bytes_out_raw, self.bytes_out),
+                "ratio_in": _ratio(self.bytes_in_raw, self.bytes_in),
+                }
+
+def _ratio(raw, compressed):
+    """Compute a compression ratio, 1.0 when nothing has been compressed
+    yet."""
+    if not compressed:
+        return 1.0
+    return raw / compressed
+
+COMPRESSION_METHODS = {
+        u"zlib": ZlibCompressor,
+        }
+
+class StreamCompressionHandler(StreamFeatureHandler):
+    """Stream compression (XEP-0138) handler.
+
+    Compression is negotiated after authentication, as recommended by
+    XEP-0170.
+
+    :Ivariables:
+        - `requested`: the method requested, when waiting for the peer
+          response
+        - `failed`: `True` when the peer refused compression
+    :Types:
+        - `requested`: `unicode`
+        - `failed`: `bool`
+    """
+    def __init__(self, settings = None):
+        """Initialize the compression handler.
+
+        :Parameters:
+          - `settings`: settings for stream compression.
+        :Types:
+          - `settings`: `XMPPSettings`
+        """
+        if settings is None:
+            self.settings = XMPPSettings()
+        else:
+            self.settings = settings
+        self.stream = None
+        self.requested = None
+        self.failed = False
+
+    def _methods(self, stream):
+        """Return the compression methods usable on `stream`."""
+        if not self.settings["compression"]:
+            return []
+        if not hasattr(stream.transport, "set_compression"):
+            return []
+        if stream.transport.compressed:
+            return []
+        return [method for method in self.settings["compression_methods"]
+                                            if method in COMPRESSION_METHODS]
+
+    def make_stream_features(self, stream, features):
+        """Add the compression feature to the <features/> element of the
+        stream.
+
+        [receving entity only]
+
+        :returns: update <features/> element."""
+        if self.stream and stream is not self.stream:
+            raise ValueError("Single StreamCompressionHandler instance can"
+                                                " handle only one stream")
+        self.stream = stream
+        if not stream.peer_authenticated:
+            return features
+        methods = self._methods(stream)
+        if methods:
+            element = ElementTree.SubElement(features, COMPRESSION_TAG)
+            for method in methods:
+                ElementTree.SubElement(element, FEATURE_METHOD_TAG
+                                                                ).text = method
+        return features
+
+    def handle_stream_features(self, stream, features):
+        """Process incoming compression element of <stream:features/>.
+
+        [initiating entity only]
+        """
+        if self.stream and stream is not self.stream:
+            raise ValueError("Single StreamCompressionHandler instance can"
+                                                " handle only one stream")
+        self.stream = stream
+        element = features.find(COMPRESSION_TAG)
+        if element is None:
+            return None
+        if self.failed:
+            return StreamFeatureNotHandled("Compression")
+        offered = [sub.text for sub in element
+                                            if sub.tag == FEATURE_METHOD_TAG]
+        for method in self._methods(stream):
+            if method in offered:
+                break
+        else:
+            logger.debug(" compression: no method supported")
+            return StreamFeatureNotHandled("Compression")
+        logger.debug(" compression: requesting {0!r}".format(method))
+        self.requested = method
+        element = ElementTree.Element(COMPRESS_TAG)
+        ElementTree.SubElement(element, METHOD_TAG).text = method
+        stream.write_element(element)
+        return StreamFeatureHandled("Compression")
+
+    @stream_element_handler(COMPRESSED_TAG, "initiator")
+    def _process_compressed(self, stream, element):
+        """Handle the <compressed/> element.
+
+        [initiating entity only]
+        """
+        # pylint: disable-msg=W0613
+        if not self.requested:
+            logger.debug("Unexpected compression element: {0!r}"
+                                                            .format(element))
+            return False
+        method, self.requested = self.requested, None
+        self._start_compression(stream, method)
+        return True
+
+    @stream_element_handler(FAILURE_TAG, "initiator")
+    def _process_failure(self, stream, element):
+        """Handle the <failure/> element: continue the stream negotiation
+        without compression.
+
+        [initiating entity only]
+        """
+        if not self.requested:
+            logger.debug("Unexpected compression element: {0!r}"
+                                                            .format(element))
+            return False
+        condition = element[0].tag if len(element) else None
+        logger.warning("Stream compression failed: {0}".format(condition))
+        self.requested = None
+        self.failed = True
+        stream._got_features(stream.features) # pylint: disable-msg=W0212
+        return True
+
+    @stream_element_handler(COMPRESS_TAG, "receiver")
+    def _process_compress(self, stream, element):
+        """Handle the <compress/> element.
+
+        [receiving entity only]
+        """
+        if self.stream and stream is not self.stream:
+            raise ValueError("Single StreamCompressionHandler instance can"
+                                                " handle only one stream")
+        self.stream = stream
+        method_element = element.find(METHOD_TAG)
+        method = method_element.text if method_element is not None else None
+        methods = self._methods(stream)
+        if method not in methods:
+            logger.debug("Compression method {0!r} not available"
+                                                            .format(method))
+            failure = ElementTree.Element(FAILURE_TAG)
+            if methods or method not in COMPRESSION_METHODS:
+                ElementTree.SubElement(failure, UNSUPPORTED_METHOD_TAG)
+            else:
+                ElementTree.SubElement(failure, SETUP_FAILED_TAG)
+            stream.write_element(failure)
+            return True
+        stream.write_element(ElementTree.Element(COMPRESSED_TAG))
+        self._start_compression(stream, method)
+        return True
+
+    def _start_compression(self, stream, method):
+        """Enable compression in the transport and restart the stream.
+
+        :Parameters:
+            - `stream`: the stream
+            - `method`: the compression method negotiated
+        :Types:
+            - `method`: `unicode`
+        """
+        logger.debug(" compression: starting {0!r}".format(method))
+        compressor = COMPRESSION_METHODS[method](self.settings)
+        with stream.lock:
+            stream.transport.set_compression(compressor)
+            stream.event(StreamCompressedEvent(method))
+            stream._restart_stream() # pylint: disable-msg=W0212
+
+XMPPSettings.add_setting(u"compression", type = bool, default = False,
+        cmdline_help = u"Enable stream compression (XEP-0138)",
+        doc = u"""Enable stream compression (XEP-0138). Compression
+reduces bandwidth usage, but it may reveal information about an encrypted
+stream content."""
+    )
+XMPPSettings.add_setting(u"compression_methods", type = 'list of ``unicode``',
+        validator = XMPPSettings.validate_string_list,
+        default = [u"zlib"],
+        doc = u"""Stream compression methods to use, in order of
+preference. Only 'zlib' is supported."""
+    )
+XMPPSettings.add_setting(u"compression_level", type = int,
+        default = zlib.Z_DEFAULT_COMPRESSION,
+        validator = XMPPSettings.get_int_range_validator(-1, 10),
+        cmdline_help = u"zlib compression level (0-9)",
+        doc = u"""Compression level of the 'zlib' stream compression:
+0 (no compression), 1 (fastest) to 9 (best), -1 for the zlib default."""
+    )
+XMPPSettings.add_setting(u"compression_window_bits", type = int,
+        default = zlib.MAX_WBITS,
+        validator = XMPPSettings.get_int_range_validator(9, 16),
+        doc = u"""Base two logarithm of the 'zlib' compression window
+size (9 to 15). The peer uses a window of its own choice for the data it
+sends, so the maximum one is always used for decompression."""
+    )
+XMPPSettings.add_setting(u"compression_mem_level", type = int,
+        default = 8,
+        validator = XMPPSettings.get_int_range_validator(1, 10),
+        doc = u"""Memory used for the internal 'zlib' compression state
+(1 to 9). Lower values save memory per stream at the cost of the
+compression ratio."""
+    )
@@ -86,13 +86,15 @@ class ConnectedEvent(StreamEvent):
     XMPP exchange happens.
     
     :Ivariables:
-        - `sockaddr`: remote IP address and port
+        - `sockaddr`: remote IP address and port or a Unix socket path
     :Types:
-        - `sockaddr`: (`str`, `int`)
+        - `sockaddr`: (`str`, `int`) or `str`
     """
     def __init__(self, sockaddr):
         self.sockaddr = sockaddr
     def __unicode__(self):
+        if isinstance(self.sockaddr, basestring):
+            return u"Connected to {0!r}".format(self.sockaddr)
         ipaddr, port = self.sockaddr
         if ":" in ipaddr:
             return u"Connected to [{0}]:{1}".format(ipaddr, port)
@@ -106,13 +108,15 @@ class ConnectingEvent(StreamEvent):
     Probably useful only for connection progres monitoring.
     
     :Ivariables:
-        - `sockaddr`: remote IP address and port
+        - `sockaddr`: remote IP address and port or a Unix socket path
     :Types:
-        - `sockaddr`: (`str`, `int`)
+        - `sockaddr`: (`str`, `int`) or `str`
     """
     def __init__(self, sockaddr):
         self.sockaddr = sockaddr
     def __unicode__(self):
+        if isinstance(self.sockaddr, basestring):
+            return u"Connecting to {0!r}...".format(self.sockaddr)
         ipaddr, port = self.sockaddr
         if ":" in ipaddr:
             return u"Connecting to [{0}]:{1}...".format(ipaddr, port)
@@ -123,13 +127,15 @@ class ConnectionAcceptedEvent(StreamEvent):
     """Emitted when a new TCP connection is accepted.
     
     :Ivariables:
-        - `sockaddr`: remote IP address and port
+        - `sockaddr`: remote IP address and port or a Unix socket path
     :Types:
-        - `sockaddr`: (`str`, `int`)
+        - `sockaddr`: (`str`, `int`) or `str`
     """
     def __init__(self, sockaddr):
         self.sockaddr = sockaddr
     def __unicode__(self):
+        if isinstance(self.sockaddr, basestring):
+            return u"Connection received from {0!r}".format(self.sockaddr)
         ipaddr, port = self.sockaddr
         if ":" in ipaddr:
             return u"Connection received from [{0}]:{1}".format(ipaddr, port)
@@ -171,6 +177,40 @@ class GotFeaturesEvent(StreamEvent):
         return u"Got stream features"
 
 
+class OutputBufferDrainedEvent(StreamEvent):
+    """Emitted when the output buffer of a transport, previously reported
+    full with `OutputBufferFullEvent`, drains down to the low watermark.
+
+    The application may resume sending data over the stream.
+
+    :Ivariables:
+        - `buffered`: number of bytes still waiting in the buffer
+    :Types:
+        - `buffered`: `int`
+    """
+    def __init__(self, buffered):
+        self.buffered = buffered
+    def __unicode__(self):
+        return u"Output buffer drained ({0} bytes left)".format(self.buffered)
+
+class OutputBufferFullEvent(StreamEvent):
+    """Emitted when the amount of data waiting in the output buffer of
+    a transport reaches the high watermark, e.g. because the peer does not
+    read fast enough.
+
+    The data is still accepted, but the application should stop producing
+    output for this stream until `OutputBufferDrainedEvent` is received.
+
+    :Ivariables:
+        - `buffered`: number of bytes waiting in the buffer
+    :Types:
+        - `buffered`: `int`
+    """
+    def __init__(self, buffered):
+        self.buffered = buffered
+    def __unicode__(self):
+        return u"Output buffer full ({0} bytes waiting)".format(self.buffered)
+
 class ResolvingAddressEvent(StreamEvent):
     """Emitted when staring to resolve an address (A or AAAA) DNS record
     for a hostname.
@@ -251,6 +291,73 @@ class TLSConnectedEvent(StreamEvent):
         return u"TLS connected using {0} cipher {1} ({2} bits)".format(
                             self.cipher[0], self.cipher[1], self.cipher[2])
 
+class TLSSessionCacheEvent(StreamEvent):
+    """Emitted after TLS handshake on an outgoing connection, when the
+    TLS session cache is in use.
+
+    :Ivariables:
+        - `key`: the cache key: (host, port, SNI hostname) tuple
+        - `hit`: `True` if a cached session was offered to the peer
+        - `resumed`: `True` if the session has actually been resumed
+        - `hits`: total number of cache hits
+        - `misses`: total number of cache misses
+    :Types:
+        - `key`: `tuple`
+        - `hit`: `bool`
+        - `resumed`: `bool`
+        - `hits`: `int`
+        - `misses`: `int`
+    """
+    # pylint: disable=R0913
+    def __init__(self, key, hit, resumed, hits, misses):
+        self.key = key
+        self.hit = hit
+        self.resumed = resumed
+        self.hits = hits
+        self.misses = misses
+    def __unicode__(self):
+        if self.resumed:
+            result = u"TLS session resumed"
+        elif self.hit:
+            result = u"TLS session cache hit, but session not resumed"
+        else:
+            result = u"TLS session cache miss"
+        return u"{0} ({1} hits, {2} misses)".format(result, self.hits,
+                                                                self.misses)
+
+class StreamCompressedEvent(StreamEvent):
+    """Emitted when stream compression has been negotiated, before the
+    stream is restarted.
+
+    :Ivariables:
+        - `method`: the compression method
+    :Types:
+        - `method`: `unicode`
+    """
+    def __init__(self, method):
+        self.method = method
+    def __unicode__(self):
+        return u"Stream compressed using {0}".format(self.method)
+
+class StreamResumedEvent(StreamEvent):
+    """Emitted when a Stream Management (XEP-0198) session has been resumed
+    on a new stream. The stream is then authorized as `resumed_jid`, without
+    resource binding, so `AuthorizedEvent` is not emitted.
+
+    :Ivariables:
+        - `resumed_jid`: the full JID of the resumed session
+        - `resent`: number of unacknowledged stanzas sent again
+    :Types:
+        - `resumed_jid`: `pyxmpp2.jid.JID`
+        - `resent`: `int`
+    """
+    def __init__(self, resumed_jid, resent):
+        self.resumed_jid = resumed_jid
+        self.resent = resent
+    def __unicode__(self):
+        return u"Session resumed as {0} ({1} stanzas resent)".format(
+                                                self.resumed_jid, self.resent)
+
 class StreamRestartedEvent(StreamEvent):
     """Emitted after stream is restarted (<stream:stream> tag exchange)
     e.g. after SASL.
@@ -0,0 +1,552 @@
+#
+# (C) Copyright 2011 Jacek Konieczny <jajcus@jajcus.net>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version
+# 2.1 as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+
+"""Stream Management support for XMPP client streams.
+
+Stanzas sent are kept until acknowledged by the server and the stanzas
+received are counted, so the session can be resumed on a new connection
+after the previous one has been broken, without resource binding, roster
+retrieval and initial presence.
+
+Only the initiating entity (client) side is implemented.
+
+Normative reference:
+  - `XEP-0198 <http://xmpp.org/extensions/xep-0198.html>`__
+"""
+
+from __future__ import absolute_import, division
+
+__docformat__ = "restructuredtext en"
+
+import time
+import logging
+
+from collections import deque
+
+from .etree import ElementTree
+from .constants import SM_QNP
+from .settings import XMPPSettings
+from .streamevents import AuthorizedEvent, DisconnectedEvent
+from .streamevents import StreamResumedEvent
+
+from .interfaces import StreamFeatureHandler, StreamFeatureHandled
+from .interfaces import stream_element_handler
+from .interfaces import EventHandler, event_handler
+from .interfaces import TimeoutHandler, timeout_handler
+
+logger = logging.getLogger("pyxmpp2.streammanagement")
+
+SM_TAG = SM_QNP + u"sm"
+ENABLE_TAG = SM_QNP + u"enable"
+ENABLED_TAG = SM_QNP + u"enabled"
+RESUME_TAG = SM_QNP + u"resume"
+RESUMED_TAG = SM_QNP + u"resumed"
+FAILED_TAG = SM_QNP + u"failed"
+REQUEST_TAG = SM_QNP + u"r"
+ANSWER_TAG = SM_QNP + u"a"
+
+# the stanza counters wrap around at 2^32
+H_MODULO = 1 << 32
+
+class StreamManagementSession(object):
+    """Stream Management session state. Unlike a stream, it may outlive
+    a connection.
+
+    :Ivariables:
+        - `settings`: the settings used
+        - `stream`: the stream currently used for the session
+        - `enabled`: `True` when the server has enabled Stream Management
+        - `session_id`: the session id for resumption, `None` when the server
+          does not allow resumption
+        - `location`: preferred reconnection address provided by the server
+        - `max_time`: maximum resumption time (in seconds) provided by the
+          server
+        - `resumable`: `False` after the session has been closed gracefully
+        - `jid`: the full JID bound to the session
+        - `handled_in`: number of stanzas received and handled
+        - `acked_out`: number of stanzas sent and acknowledged by the server
+        - `unacked`: stanzas sent, but not acknowledged by the server yet
+        - `disconnected_at`: time when the stream of the session has been
+          disconnected
+        - `_since_request`: number of stanzas sent since the last ack request
+        - `_unrequested_since`: time the first stanza not covered by an ack
+          request was sent
+    :Types:
+        - `settings`: `XMPPSettings`
+        - `stream`: `streambase.StreamBase`
+        - `enabled`: `bool`
+        - `session_id`: `unicode`
+        - `location`: `unicode`
+        - `max_time`: `int`
+        - `resumable`: `bool`
+        - `jid`: `JID`
+        - `handled_in`: `int`
+        - `acked_out`: `int`
+        - `unacked`: :std:`collections.deque` of
+          :etree:`ElementTree.Element`
+        - `disconnected_at`: `float`
+        - `_since_request`: `int`
+        - `_unrequested_since`: `float`
+    """
+    # pylint: disable=R0902
+    def __init__(self, settings = None):
+        if settings is None:
+            settings = XMPPSettings()
+        self.settings = settings
+        self.stream = None
+        self.enabled = False
+        self.session_id = None
+        self.location = None
+        self.max_time = None
+        self.resumable = True
+        self.jid = None
+        self.handled_in = 0
+        self.acked_out = 0
+        self.unacked = deque()
+        self.disconnected_at = None
+        self._since_request = 0
+        self._unrequested_since = None
+
+    def attach(self, stream):
+        """Use the session on the `stream`.
+
+        [called with the `stream` lock acquired]
+
+        :Parameters:
+            - `stream`: the stream
+        :Types:
+            - `stream`: `streambase.StreamBase`
+        """
+        self.stream = stream
+        self.disconnected_at = None
+        stream.sm_session = self
+
+    def detach(self):
+        """Stop using the session on the current stream (e.g. when it has
+        been disconnected)."""
+        if self.stream is not None:
+            if self.stream.sm_session is self:
+                self.stream.sm_session = None
+            self.stream = None
+            self.disconnected_at = time.time()
+        self._since_request = 0
+        self._unrequested_since = None
+
+    def can_resume(self, now = None):
+        """Check if the session may be resumed on a new stream.
+
+        :Parameters:
+            - `now`: current time (default: ``time.time()``)
+        """
+        if not self.enabled or not self.resumable or not self.session_id:
+            return False
+        if self.max_time and self.disconnected_at is not None:
+            if now is None:
+                now = time.time()
+            if now - self.disconnected_at > self.max_time:
+                return False
+        return True
+
+    def close(self):
+        """Mark the session closed gracefully, so it won't be resumed.
+
+        Acknowledge the stanzas received so far, as the server may
+        not have asked for it yet.
+
+        [called with the stream lock acquired]
+        """
+        if self.enabled and self.stream is not None and self.resumable:
+            self.send_ack()
+        self.resumable = False
+
+    def stanza_sent(self, element):
+        """Count a stanza sent and keep it until acknowledged. Request an
+        acknowledgement every :r:`sm_ack_stanzas setting` stanzas.
+
+        [called with the stream lock acquired]
+
+        :Parameters:
+            - `element`: the stanza sent
+        :Types:
+            - `element`: :etree:`ElementTree.Element`
+        """
+        self.unacked.append(element)
+        if not self._since_request:
+            self._unrequested_since = time.time()
+        self._since_request += 1
+        self.check_ack_stanzas()
+
+    def check_ack_stanzas(self):
+        """Request an acknowledgement if :r:`sm_ack_stanzas setting` stanzas
+        have been sent since the last request.
+
+        [called with the stream lock acquired]
+        """
+        ack_stanzas = self.settings["sm_ack_stanzas"]
+        if not self.enabled or not ack_stanzas:
+            return
+        if self._since_request >= ack_stanzas:
+            self.request_ack()
+
+    def stanza_handled(self):
+        """Count a stanza received and handled.
+
+        [called with the stream lock acquired]
+        """
+        if self.enabled:
+            self.handled_in = (self.handled_in + 1) % H_MODULO
+
+    def request_ack(self):
+        """Send the <r/> element.
+
+        [called with the stream lock acquired]
+        """
+        self._since_request = 0
+        self._unrequested_since = None
+        # pylint: disable=W0212
+        self.stream._write_element(ElementTree.Element(REQUEST_TAG))
+
+    def check_ack_interval(self, now = None):
+        """Request an acknowledgement if any stanza has been sent more
+        than :r:`sm_ack_interval setting` seconds ago without requesting one.
+
+        [called with the stream lock acquired]
+
+        :Parameters:
+            - `now`: current time (default: ``time.time()``)
+        """
+        interval = self.settings["sm_ack_interval"]
+        if not interval or not self.enabled or self.stream is None:
+            return
+        if not self._since_request:
+            return
+        if now is None:
+            now = time.time()
+        if now - self._unrequested_since >= interval:
+            self.request_ack()
+
+    def send_ack(self):
+        """Send the <a/> element with the number of stanzas handled.
+
+        [called with the stream lock acquired]
+        """
+        element = ElementTree.Element(ANSWER_TAG)
+        element.set("h", unicode(self.handled_in))
+        self.stream._write_element(element) # pylint: disable=W0212
+
+    def process_ack(self, value):
+        """Drop stanzas acknowledged by the server.
+
+        :Parameters:
+            - `value`: the 'h' value received from the server
+        :Types:
+            - `value`: `unicode`
+
+        :Return: number of the stanzas acknowledged
+        :Returntype: `int`
+        """
+        try:
+            h_value = int(value)
+        except (TypeError, ValueError):
+            logger.warning("Invalid 'h' value: {0!r}".format(value))
+            return 0
+        count = (h_value - self.acked_out) % H_MODULO
+        if count > len(self.unacked):
+            logger.warning("Server acknowledged {0} stanzas, but only {1}"
+                                " were sent".format(count, len(self.unacked)))
+            count = len(self.unacked)
+        for dummy in range(count):
+            self.unacked.popleft()
+        self.acked_out = h_value % H_MODULO
+        return count
+
+    def resend_unacked(self):
+        """Send again all the stanzas not acknowledged, after resumption.
+
+        [called with the stream lock acquired]
+
+        :Return: number of the stanzas sent
+        """
+        elements = list(self.unacked)
+        self.unacked.clear()
+        for element in elements:
+            self.stream._write_element(element) # pylint: disable=W0212
+            self.stanza_sent(element)
+        return len(elements)
+
+class StreamManagementHandler(StreamFeatureHandler, EventHandler,
+                                                            TimeoutHandler):
+    """Stream Management (XEP-0198) handler.
+
+    Stream Management is enabled after resource binding. On a new stream
+    with an unfinished, resumable session, the session is resumed instead of
+    binding a resource.
+
+    Must be used before the `binding.ResourceBindingHandler` on the handler
+    list and added to the main loop, to receive the events.
+
+    :Ivariables:
+        - `settings`: the settings used
+        - `session`: the current Stream Management session
+        - `_resuming`: the stream waiting for the <resumed/> response
+    :Types:
+        - `settings`: `XMPPSettings`
+        - `session`: `StreamManagementSession`
+        - `_resuming`: `streambase.StreamBase`
+    """
+    def __init__(self, settings = None):
+        """Initialize the Stream Management handler.
+
+        :Parameters:
+          - `settings`: settings for Stream Management.
+        :Types:
+          - `settings`: `XMPPSettings`
+        """
+        if settings is None:
+            self.settings = XMPPSettings()
+        else:
+            self.settings = settings
+        self.session = None
+        self._resuming = None
+
+    def make_stream_features(self, stream, features):
+        """Stream Management is not implemented for the receiving entity.
+
+        [receving entity only]
+        """
+        # pylint: disable-msg=W0613,R0201
+        return features
+
+    def handle_stream_features(self, stream, features):
+        """Resume the previous session, if possible, when the server
+        announces Stream Management support.
+
+        [initiating entity only]
+        """
+        if not self.settings["stream_management"] or not stream.authenticated:
+            return None
+        if features.find(SM_TAG) is None:
+            return None
+        session = self.session
+        if session is None:
+            return None
+        if not session.can_resume():
+            self._drop_session()
+            return None
+        logger.debug("Resuming Stream Management session {0!r}"
+                                                .format(session.session_id))
+        element = ElementTree.Element(RESUME_TAG)
+        element.set("previd", session.session_id)
+        element.set("h", unicode(session.handled_in))
+        self._resuming = stream
+        stream.write_element(element)
+        return StreamFeatureHandled("Stream Management resumption",
+                                                            mandatory = True)
+
+    def pipeline_stream_features(self, stream, features):
+        """Resume the previous session, if possible, when the server is
+        expected to announce Stream Management support. A <failed/> response
+        continues the negotiation with the features actually received.
+
+        [initiating entity only]
+        """
+        return self.handle_stream_features(stream, features)
+
+    def _drop_session(self):
+        """Forget the current session."""
+        if self.session.unacked:
+            logger.warning("{0} unacknowledged stanzas may have been lost"
+                                        .format(len(self.session.unacked)))
+        self.session.detach()
+        self.session = None
+
+    @event_handler(AuthorizedEvent)
+    def handle_authorized(self, event):
+        """Enable Stream Management after resource binding.
+        """
+        stream = event.stream
+        if not stream or not stream.initiator:
+            return
+        if not self.settings["stream_management"]:
+            return
+        if stream.features is None or stream.features.find(SM_TAG) is None:
+            return
+        with stream.lock:
+            if self.session is not None:
+                self._drop_session()
+            self.session = StreamManagementSession(self.settings)
+            self.session.jid = stream.me
+            element = ElementTree.Element(ENABLE_TAG)
+            if self.settings["sm_resume"]:
+                element.set("resume", "true")
+                max_time = self.settings["sm_max_resume_time"]
+                if max_time:
+                    element.set("max", unicode(max_time))
+            stream.write_element(element)
+            # the server counts stanzas sent after the <enable/>
+            self.session.attach(stream)
+
+    @stream_element_handler(ENABLED_TAG, "initiator")
+    def _process_enabled(self, stream, element):
+        """Handle the <enabled/> element.
+
+        [initiating entity only]
+        """
+        session = self.session
+        if session is None or session.stream is not stream:
+            logger.debug("Unexpected <enabled/>")
+            return False
+        session.enabled = True
+        if element.get("resume") in ("true", "1"):
+            session.session_id = element.get("id")
+            session.location = element.get("location")
+            max_time = element.get("max")
+            if max_time and max_time.isdigit():
+                session.max_time = int(max_time)
+        logger.debug("Stream Management enabled, resumption id: {0!r}"
+                                                .format(session.session_id))
+        session.check_ack_stanzas()
+        return True
+
+    @stream_element_handler(RESUMED_TAG, "initiator")
+    def _process_resumed(self, stream, element):
+        """Handle the <resumed/> element: send again the stanzas not
+        received by the server.
+
+        [initiating entity only]
+        """
+        session = self.session
+        if session is None or self._resuming is not stream:
+            logger.debug("Unexpected <resumed/>")
+            return False
+        self._resuming = None
+        session.process_ack(element.get("h"))
+        session.attach(stream)
+        session.resumable = True
+        stream.me = session.jid
+        resent = session.resend_unacked()
+        stream.event(StreamResumedEvent(session.jid, resent))
+        return True
+
+    @stream_element_handler(FAILED_TAG, "initiator")
+    def _process_failed(self, stream, element):
+        """Handle the <failed/> element: continue with the stream negotiation
+        (resource binding) when resumption failed.
+
+        [initiating entity only]
+        """
+        session = self.session
+        condition = element[0].tag if len(element) else None
+        if self._resuming is stream:
+            logger.warning("Stream Management resumption failed: {0}"
+                                                        .format(condition))
+            self._resuming = None
+            if session is not None:
+                if element.get("h") is not None:
+                    session.process_ack(element.get("h"))
+                self._drop_session()
+            stream._got_features(stream.features) # pylint: disable-msg=W0212
+            return True
+        if session is not None and session.stream is stream:
+            logger.warning("Stream Management not enabled: {0}"
+                                                        .format(condition))
+            session.unacked.clear()
+            session.detach()
+            self.session = None
+            return True
+        return False
+
+    @stream_element_handler(REQUEST_TAG, "initiator")
+    def _process_request(self, stream, element):
+        """Handle the <r/> element: acknowledge the stanzas received.
+
+        [initiating entity only]
+        """
+        # pylint: disable-msg=W0613
+        session = stream.sm_session
+        if session is None or not session.enabled:
+            return False
+        session.send_ack()
+        return True
+
+    @stream_element_handler(ANSWER_TAG, "initiator")
+    def _process_answer(self, stream, element):
+        """Handle the <a/> element: drop the stanzas acknowledged.
+
+        [initiating entity only]
+        """
+        session = stream.sm_session
+        if session is None:
+            return False
+        session.process_ack(element.get("h"))
+        return True
+
+    @event_handler(DisconnectedEvent)
+    def handle_disconnected(self, event):
+        """Keep the session for resumption when its stream is disconnected.
+        """
+        session = self.session
+        if session is None or session.stream is not event.stream:
+            return
+        with event.stream.lock:
+            session.detach()
+        if not session.can_resume():
+            self._drop_session()
+
+    @timeout_handler(1)
+    def _check_ack_interval(self):
+        """Request acknowledgement of stanzas waiting too long.
+
+        :Return: delay (in seconds) before the next check
+        """
+        session = self.session
+        if session is not None:
+            stream = session.stream
+            if stream is not None:
+                with stream.lock:
+                    session.check_ack_interval()
+        return 1
+
+XMPPSettings.add_setting(u"stream_management", type = bool, default = False,
+        cmdline_help = u"Enable Stream Management (XEP-0198)",
+        doc = u"""Enable Stream Management (XEP-0198), when supported by
+the server."""
+    )
+XMPPSettings.add_setting(u"sm_resume", type = bool, default = True,
+        doc = u"""Request Stream Management session resumption support,
+so the session may be continued on a new connection after a network
+failure."""
+    )
+XMPPSettings.add_setting(u"sm_max_resume_time", type = int, default = None,
+        validator = XMPPSettings.validate_positive_int,
+        doc = u"""Preferred maximum time (in seconds) the server should wait
+for the session to be resumed. The server default is used if not set."""
+    )
+XMPPSettings.add_setting(u"sm_ack_stanzas", type = int, default = 5,
+        validator = XMPPSettings.get_int_range_validator(0, 65536),
+        doc = u"""Request an acknowledgement from the server after that many
+stanzas sent. 0 to request acknowledgements only as set by the
+:r:`sm_ack_interval setting`."""
+    )
+XMPPSettings.add_setting(u"sm_ack_interval", type = float, default = 30,
+        validator = XMPPSettings.validate_non_negative_float,
+        doc = u"""Request an acknowledgement from the server when a stanza
+sent has not been covered by any request for that many seconds. 0 to
+request acknowledgements only as set by the :r:`sm_ack_stanzas setting`."""
+    )
+
+# vi: sts=4 et sw=4
@@ -82,10 +82,13 @@ class StreamSASLHandler(StreamFeatureHandler):
     :Ivariables:
         - `peer_sasl_mechanisms`: SASL mechanisms offered by peer
         - `authenticator`: the authenticator object
+        - `pipelined`: `True` when the authentication has been started
+          before the stream features were received
     :Types:
         - `peer_sasl_mechanisms`: `list` of `unicode`
         - `authenticator`: `sasl.ClientAuthenticator` or
           `sasl.ServerAuthenticator`
+        - `pipelined`: `bool`
     """
     def __init__(self, settings = None):
         """Initialize the SASL handler"""
@@ -94,6 +97,7 @@ class StreamSASLHandler(StreamFeatureHandler):
         self.settings = settings
         self.peer_sasl_mechanisms = None
         self.authenticator = None
+        self.pipelined = False
 
     def make_stream_features(self, stream, features):
         """Add SASL features to the <features/> element of the stream.
@@ -114,14 +118,10 @@ class StreamSASLHandler(StreamFeatureHandler):
 
         [initiating entity only]
         """
-        element = features.find(MECHANISMS_TAG)
-        self.peer_sasl_mechanisms = []
-        if element is None:
+        mechanisms = self._get_mechanisms(features)
+        self.peer_sasl_mechanisms = mechanisms or []
+        if mechanisms is None:
             return None
-        for sub in element:
-            if sub.tag != MECHANISM_TAG:
-                continue
-            self.peer_sasl_mechanisms.append(sub.text)
 
         if stream.authenticated or not self.peer_sasl_mechanisms:
             return StreamFeatureNotHandled("SASL", mandatory = True)
@@ -136,6 +136,36 @@ class StreamSASLHandler(StreamFeatureHandler):
         self._sasl_authenticate(stream, username, self.settings.get("authzid"))
         return StreamFeatureHandled("SASL", mandatory = True)
 
+    def pipeline_stream_features(self, stream, features):
+        """Start the authentication with the mechanisms the peer is
+        expected to offer.
+
+        [initiating entity only]
+        """
+        try:
+            ret = self.handle_stream_features(stream, features)
+        except (SASLNotAvailable, SASLMechanismNotAvailable), err:
+            logger.debug("Cannot pipeline SASL: {0}".format(err))
+            self.authenticator = None
+            return None
+        if not isinstance(ret, StreamFeatureHandled):
+            return None
+        self.pipelined = True
+        return ret
+
+    @staticmethod
+    def _get_mechanisms(features):
+        """Get the SASL mechanisms from a <features/> element.
+
+        :Return: list of the mechanism names or `None` if the <mechanisms/>
+            element is not present
+        :Returntype: `list` of `unicode`
+        """
+        element = features.find(MECHANISMS_TAG)
+        if element is None:
+            return None
+        return [sub.text for sub in element if sub.tag == MECHANISM_TAG]
+
     @stream_element_handler(AUTH_TAG, "receiver")
     def process_sasl_auth(self, stream, element):
         """Process incoming <sasl:auth/> element.
@@ -313,6 +343,7 @@ class StreamSASLHandler(StreamFeatureHandler):
         else:
             data = None
         ret = self.authenticator.finish(data)
+        self.pipelined = False
         if isinstance(ret, sasl.Success):
             logger.debug("SASL authentication succeeded")
             authzid = ret.properties.get("authzid")
@@ -336,13 +367,23 @@ class StreamSASLHandler(StreamFeatureHandler):
 
         [initiating entity only]
         """
-        _unused = stream
         if not self.authenticator:
             logger.debug("Unexpected SASL response")
             return False
 
         logger.debug("SASL authentication failed: {0!r}".format(
                                                 element_to_unicode(element)))
+        if self.pipelined:
+            self.pipelined = False
+            mechanisms = None
+            if stream.features is not None:
+                mechanisms = self._get_mechanisms(stream.features)
+            if mechanisms and stream.auth_method_used not in mechanisms:
+                logger.debug("Pipelined SASL mechanism not offered,"
+                                                    " starting again")
+                self.authenticator = None
+                stream._got_features(stream.features) # pylint: disable=W0212
+                return True
         raise SASLAuthenticationFailed("SASL authentication failed")
 
     @stream_element_handler(ABORT_TAG, "receiver")
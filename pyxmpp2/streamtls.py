@@ -20,6 +20,7 @@
 
 Normative reference:
   - `RFC 6120 <http://xmpp.org/rfcs/rfc6120.html>`__
+  - `XEP-0368 <http://xmpp.org/extensions/xep-0368.html>`__
 """
 
 from __future__ import absolute_import, division
@@ -27,13 +28,13 @@ from __future__ import absolute_import, division
 __docformat__ = "restructuredtext en"
 
 import logging
+import threading
 import ssl
 
 from ssl import SSLError
 
 from .etree import ElementTree
 from .constants import TLS_QNP
-from .streambase import FatalStreamError
 from .exceptions import TLSNegotiationFailed
 from .settings import XMPPSettings
 from .streamevents import TLSConnectedEvent
@@ -50,8 +51,169 @@ FAILURE_TAG = TLS_QNP + u"failure"
         
 logger = logging.getLogger("pyxmpp2.streamtls")
 
+class SSLContextFactory(object):
+    """Builds and keeps :std:`ssl.SSLContext` objects for TLS connections,
+    so the certificates and keys are loaded only once and not on every
+    connection.
+
+    A single instance is created for a settings object (see the
+    :r:`tls_context_factory setting`) and shared by all connections using
+    these settings. Call `reload` after the certificate or key files
+    change; connections already established keep the old context.
+
+    The server-side context selects the certificate by the name requested
+    by the client via SNI, using the :r:`tls_sni_certificates setting`.
+
+    :Ivariables:
+        - `settings`: settings used to build the contexts
+        - `_contexts`: contexts built, by the `server_side` flag
+        - `_lock`: the lock protecting the object
+    :Types:
+        - `settings`: `XMPPSettings`
+        - `_contexts`: `dict`
+        - `_lock`: :std:`threading.RLock`
+    """
+    def __init__(self, settings = None):
+        """Initialize the `SSLContextFactory` object.
+
+        :Parameters:
+            - `settings`: TLS settings
+        :Types:
+            - `settings`: `XMPPSettings`
+        """
+        if settings is None:
+            self.settings = XMPPSettings()
+        else:
+            self.settings = settings
+        self._contexts = {}
+        self._lock = threading.RLock()
+
+    def get_context(self, server_side = False):
+        """Get the context for a connection, building it on first use.
+
+        :Parameters:
+            - `server_side`: `True` for the receiving entity
+        :Types:
+            - `server_side`: `bool`
+
+        :Returntype: :std:`ssl.SSLContext`
+        """
+        with self._lock:
+            context = self._contexts.get(server_side)
+            if context is None:
+                context = self.make_context(server_side)
+                self._contexts[server_side] = context
+            return context
+
+    def reload(self):
+        """Rebuild the contexts built so far, loading the certificate,
+        key and CA files again.
+
+        The new contexts are built before the old ones are replaced, so
+        if loading fails the old contexts stay in use.
+        """
+        with self._lock:
+            contexts = {}
+            for server_side in self._contexts:
+                contexts[server_side] = self.make_context(server_side)
+            self._contexts = contexts
+
+    def make_context(self, server_side):
+        """Build a new context.
+
+        :Parameters:
+            - `server_side`: `True` for the receiving entity
+        :Types:
+            - `server_side`: `bool`
+
+        :Returntype: :std:`ssl.SSLContext`
+        """
+        logger.debug("Building {0} SSL context".format(
+                                    "server" if server_side else "client"))
+        context = self._make_context(server_side,
+                                        self.settings["tls_cert_file"],
+                                        self.settings["tls_key_file"])
+        if server_side:
+            sni_contexts = {}
+            sni_certificates = self.settings["tls_sni_certificates"]
+            for name, (cert_file, key_file) in sni_certificates.items():
+                sni_contexts[name.lower()] = self._make_context(True,
+                                                        cert_file, key_file)
+            if sni_contexts:
+                self._set_sni_callback(context, sni_contexts)
+        return context
+
+    def _make_context(self, server_side, cert_file, key_file):
+        """Build a new context using the given certificate.
+
+        :Parameters:
+            - `server_side`: `True` for the receiving entity
+            - `cert_file`: path to the certificate file
+            - `key_file`: path to the private key file
+        :Types:
+            - `server_side`: `bool`
+            - `cert_file`: `str`
+            - `key_file`: `str`
+
+        :Returntype: :std:`ssl.SSLContext`
+        """
+        context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+        context.options |= ssl.OP_NO_SSLv2 | ssl.OP_NO_SSLv3
+        verify = self.settings["tls_verify_peer"]
+        if not verify:
+            context.verify_mode = ssl.CERT_NONE
+        elif server_side:
+            # client certificates are used only for SASL EXTERNAL
+            context.verify_mode = ssl.CERT_OPTIONAL
+        else:
+            context.verify_mode = ssl.CERT_REQUIRED
+        # the peer name is verified by the 'tls_verify_callback'
+        context.check_hostname = False
+        if cert_file:
+            context.load_cert_chain(cert_file, key_file)
+        ca_file = self.settings["tls_cacert_file"]
+        if ca_file:
+            context.load_verify_locations(ca_file)
+        elif verify:
+            if server_side:
+                context.load_default_certs(ssl.Purpose.CLIENT_AUTH)
+            else:
+                context.load_default_certs()
+        return context
+
+    @staticmethod
+    def _set_sni_callback(context, sni_contexts):
+        """Make `context` switch to one of the `sni_contexts` when the
+        client requests a server name via SNI.
+
+        :Parameters:
+            - `context`: the default server context
+            - `sni_contexts`: server name to context mapping
+        :Types:
+            - `context`: :std:`ssl.SSLContext`
+            - `sni_contexts`: `dict`
+        """
+        def sni_callback(ssl_socket, server_name, initial_context):
+            """Select the context for the server name requested."""
+            # pylint: disable=W0613
+            if server_name:
+                sni_context = sni_contexts.get(server_name.lower())
+                if sni_context is not None:
+                    ssl_socket.context = sni_context
+            return None
+        if hasattr(context, "sni_callback"):
+            context.sni_callback = sni_callback
+        else:
+            context.set_servername_callback(sni_callback)
+
 class StreamTLSHandler(StreamFeatureHandler, EventHandler):
     """Handler for stream TLS support.
+
+    :Ivariables:
+        - `direct`: `True` when TLS is established immediately after
+          connecting (Direct TLS) instead of being negotiated with StartTLS
+    :Types:
+        - `direct`: `bool`
     """
     def __init__(self, settings = None):
         """Initialize the TLS handler.
@@ -67,9 +229,10 @@ class StreamTLSHandler(StreamFeatureHandler, EventHandler):
             self.settings = settings
         self.stream = None
         self.requested = False
+        self.direct = False
         self.tls_socket = None
 
-    def make_stream_tls_features(self, stream, features):
+    def make_stream_features(self, stream, features):
         """Update the <features/> element with StartTLS feature.
 
         [receving entity only]
@@ -106,7 +269,7 @@ class StreamTLSHandler(StreamFeatureHandler, EventHandler):
         element = features.find(STARTTLS_TAG)
         if element is None:
             logger.debug(" tls: no starttls feature found")
-            if self.settings["tls_require"]:
+            if self.settings["tls_require"] and not stream.tls_established:
                 raise TLSNegotiationFailed("StartTLS required,"
                                                 " but not supported by peer")
             return None
@@ -158,48 +321,116 @@ class StreamTLSHandler(StreamFeatureHandler, EventHandler):
     @stream_element_handler(STARTTLS_TAG, "receiver")
     def _process_tls_starttls(self, stream, element):
         """Handle <starttls/> element.
+
+        [receiving entity only]
         """
-        # pylint: disable-msg=R0201
-        _unused, _unused = stream, element
-        raise FatalStreamError("TLS not implemented for the receiving side yet")
+        # pylint: disable-msg=W0613
+        if self.stream and stream is not self.stream:
+            raise ValueError("Single StreamTLSHandler instance can handle"
+                                                            " only one stream")
+        self.stream = stream
+        if not self.settings["starttls"] or stream.tls_established:
+            logger.debug("Unexpected StartTLS request")
+            stream.write_element(ElementTree.Element(FAILURE_TAG))
+            stream.disconnect()
+            return True
+        logger.debug(" tls: <starttls/> received")
+        stream.write_element(ElementTree.Element(PROCEED_TAG))
+        self._make_tls_connection()
+        # The initiator will send the new stream header over TLS, after
+        # the handshake, which may complete before the `TLSConnectedEvent`
+        # is handled. It is processed only after the peer certificate
+        # is verified.
+        with stream.lock:
+            stream.hold_input()
+            stream._restart_stream() # pylint: disable-msg=W0212
+        return True
 
     def _make_tls_connection(self):
         """Initiate TLS connection.
 
-        [initiating entity only]
         """
         logger.debug("Preparing TLS connection")
-        if self.settings["tls_verify_peer"]:
-            cert_reqs = ssl.CERT_REQUIRED
+        self.direct = False
+        if self.stream.initiator:
+            self._starttls(self.stream.transport, False, self.stream.peer)
         else:
-            cert_reqs = ssl.CERT_NONE
-        self.stream.transport.starttls(
-                    keyfile = self.settings["tls_key_file"],
-                    certfile = self.settings["tls_cert_file"],
-                    server_side = not self.stream.initiator,
-                    cert_reqs = cert_reqs,
-                    ssl_version = ssl.PROTOCOL_TLSv1,
-                    ca_certs = self.settings["tls_cacert_file"],
-                    do_handshake_on_connect = False,
-                    )
+            self._starttls(self.stream.transport, True)
+
+    def _starttls(self, transport, server_side, peer = None):
+        """Request TLS handshake on a transport.
+
+        :Parameters:
+            - `transport`: the transport to use
+            - `server_side`: `True` for the receiving entity
+            - `peer`: name of the peer, sent via SNI
+        """
+        factory = self.settings["tls_context_factory"]
+        kwargs = {
+                "ssl_context": factory.get_context(server_side),
+                "server_side": server_side,
+                "do_handshake_on_connect": False,
+                }
+        if peer and ssl.HAS_SNI:
+            kwargs["server_hostname"] = unicode(peer)
+        transport.starttls(**kwargs)
+
+    def make_direct_tls_connection(self, transport, peer = None):
+        """Request Direct TLS (XEP-0368): TLS handshake immediately after
+        the `transport` connects, without StartTLS negotiation.
+
+        Must be called before the transport is connected. The stream is
+        started when the TLS connection is established and the peer
+        certificate verified.
+
+        [initiating entity only]
+
+        :Parameters:
+            - `transport`: the transport not connected yet
+            - `peer`: the peer domain, sent via SNI
+        :Types:
+            - `transport`: `transport.TCPTransport`
+            - `peer`: `JID`
+        """
+        logger.debug("Preparing Direct TLS connection")
+        self.direct = True
+        self._starttls(transport, False, peer)
 
     @event_handler(TLSConnectedEvent)
     def handle_tls_connected_event(self, event):
         """Verify the peer certificate on the `TLSConnectedEvent`.
+
+        The receiving stream has already been restarted, the input received
+        since is processed now.
         """
+        stream = event.stream
+        if stream is None or (self.stream is not None
+                                                and stream is not self.stream):
+            return
+        cert = event.peer_certificate
         if self.settings["tls_verify_peer"]:
-            valid = self.settings["tls_verify_callback"](event.stream,
-                                                        event.peer_certificate)
+            valid = self.settings["tls_verify_callback"](stream, cert)
             if not valid:
                 raise SSLError("Certificate verification failed")
-        event.stream.tls_established = True
-        with event.stream.lock:
-            event.stream._restart_stream() # pylint: disable-msg=W0212
+        if cert and cert.validated:
+            stream.peer_certificate = cert
+        stream.tls_established = True
+        if not stream.initiator:
+            stream.release_input()
+            return
+        if self.direct:
+            stream.transport_connected()
+            return
+        with stream.lock:
+            stream._restart_stream() # pylint: disable-msg=W0212
 
     @staticmethod
     def is_certificate_valid(stream, cert):
         """Default certificate verification callback for TLS connections.
 
+        On the receiving side the client certificate is optional (used only
+        for SASL EXTERNAL), but when presented it must have been validated.
+
         :Parameters:
             - `cert`: certificate information
         :Types:
@@ -209,6 +440,13 @@ class StreamTLSHandler(StreamFeatureHandler, EventHandler):
         """
         try:
             logger.debug("tls_is_certificate_valid(cert = {0!r})".format(cert))
+            if not stream.initiator:
+                if cert and cert.validated:
+                    logger.debug(" tls: client certificate for {0!r}"
+                                                .format(cert.get_jids()))
+                else:
+                    logger.debug(" tls: no client certificate")
+                return True
             if not cert:
                 logger.warning("No TLS certificate information received.")
                 return False
@@ -234,6 +472,14 @@ XMPPSettings.add_setting(u"starttls", type = bool, default = False,
         doc = u"""Enable StartTLS negotiation."""
     )
 
+XMPPSettings.add_setting(u"direct_tls", type = bool, default = False,
+        basic = True,
+        cmdline_help = "Use Direct TLS instead of StartTLS",
+        doc = u"""Establish TLS immediately after connecting (Direct TLS,
+XEP-0368), saving the StartTLS negotiation round trips. The server is
+looked up via the :r:`c2s_direct_tls_service setting` SRV records."""
+    )
+
 XMPPSettings.add_setting(u"tls_require", type = bool, default = False,
         basic = True,
         cmdline_help = "Require TLS stream encryption",
@@ -260,12 +506,40 @@ format). Not needed if the key is included in the file pointed by the
 :r:`tls_cert_file setting`."""
     )
 
+XMPPSettings.add_setting(u"tls_sni_certificates",
+        type = u"server name -> (cert file, key file) mapping",
+        default = {},
+        doc = u"""Certificates to use on the receiving side, selected
+by the server name requested by the client via SNI. The
+:r:`tls_cert_file setting` certificate is used when no name is requested
+or the name is not found in the mapping."""
+    )
+
 XMPPSettings.add_setting(u"tls_cacert_file", type = str, basic = True,
         cmdline_help = "TLS CA certificates file",
         doc = u"""Path to the TLS CA certificates file. The file should contain
 the trusted CA certificates in the PEM format, concatenated."""
     )
 
+def _tls_context_factory_factory(settings):
+    """Factory for the :r:`tls_context_factory setting` default.
+
+    The factory created is stored in the `settings`, so it is shared by all
+    the connections using them.
+    """
+    factory = SSLContextFactory(settings)
+    settings[u"tls_context_factory"] = factory
+    return factory
+
+XMPPSettings.add_setting(u"tls_context_factory", type = SSLContextFactory,
+        factory = _tls_context_factory_factory,
+        default_d = u"A `SSLContextFactory` instance created for the settings"
+                                                                u" object",
+        doc = u"""Source of the :std:`ssl.SSLContext` objects for TLS
+connections. Call its `SSLContextFactory.reload` method to make new
+connections use updated certificate and key files."""
+    )
+
 XMPPSettings.add_setting(u"tls_verify_callback", type = "callable",
         default = StreamTLSHandler.is_certificate_valid,
         doc = u"""A function to verify if a certificate is valid and if the
@@ -27,6 +27,14 @@ socket.setdefaulttimeout(5)
 
 TIMEOUT = 60.0 # seconds
 
+class RecordingLogHandler(logging.Handler):
+    """Logging handler storing the records emitted."""
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+    def emit(self, record):
+        self.records.append(record)
+
 class NetReaderWritter(object):
     """Threaded network reader/writter.
     
@@ -37,6 +45,8 @@ class NetReaderWritter(object):
         - `eof`: EOF flag
         - `error`: error flag
         - `peer`: address of the peer connected
+        - `accept_tls`: keyword arguments to :std:`ssl.wrap_socket` when
+          TLS should be started immediately on the accepted connection
     """
     # pylint: disable=R0902
     def __init__(self, sock, need_accept = False):
@@ -52,6 +62,7 @@ class NetReaderWritter(object):
         self.eof_cond = threading.Condition(self.lock)
         self.extra_on_read = None
         self.peer = None
+        self.accept_tls = None
 
     def start(self):
         """Start the reader and writter threads."""
@@ -105,6 +116,35 @@ class NetReaderWritter(object):
             self.sock = ssl.wrap_socket(*args, **kwargs)
             self.extra_on_read = self._do_tls_handshake
             self.rdata = b""
+            if not kwargs.get("server_side"):
+                # the client starts the handshake, do not wait for input
+                thread = threading.Thread(target = self._client_tls_handshake,
+                                                name = "TLS handshake")
+                thread.daemon = True
+                thread.start()
+
+    def _client_tls_handshake(self):
+        """Do the client-side TLS handshake. The test must keep the main
+        loop running until `tls_handshake_done` returns `True`."""
+        with self.lock:
+            if self.extra_on_read:
+                self._do_tls_handshake()
+
+    def tls_handshake_done(self):
+        """Check if the TLS handshake requested by `starttls` is
+        completed."""
+        return self.extra_on_read is None
+
+    def starttls_on_accept(self, **kwargs):
+        """Request TLS handshake immediately after a connection is accepted
+        (like for Direct TLS).
+
+        :Parameters:
+            - `kwargs`: keyword arguments to :std:`ssl.wrap_socket`
+        """
+        kwargs['do_handshake_on_connect'] = False
+        with self.lock:
+            self.accept_tls = kwargs
 
     def writter_run(self):
         """The writter thread function."""
@@ -144,7 +184,12 @@ class NetReaderWritter(object):
                     if self.extra_on_read:
                         self.extra_on_read()
                     elif self.ready:
-                        data = self.sock.recv(1024)
+                        try:
+                            data = self.sock.recv(1024)
+                        except ssl.SSLError, err:
+                            # e.g. TLS 1.3 session ticket, no application data
+                            logger.debug(u"tst IN: {0}".format(err))
+                            continue
                         if not data:
                             logger.debug(u"tst IN: EOF")
                             self.eof = True
@@ -157,6 +202,12 @@ class NetReaderWritter(object):
                         logger.debug(u"tst ACCEPT: " + repr(self.peer))
                         self.sock.close()
                         self.sock = sock1
+                        if self.accept_tls is not None:
+                            logger.debug("tst: wrapping the socket")
+                            self.sock = ssl.wrap_socket(sock1,
+                                                        **self.accept_tls)
+                            self.extra_on_read = self._do_tls_handshake
+                            self.write_enabled = False
                         self.ready = True
                         self.write_cond.notify()
 
@@ -314,10 +365,13 @@ class InitiatorSelectTestCase(NetworkTestCase):
         - `stream`: The stream tested (to be created by a test method)
         - `transport`: TCPTransport used by the stream
         - `loop`: the main loop
+        - `transport_settings`: settings for the transport
     :Types:
         - `transport`: `TCPTransport`
         - `loop`: `MainLoop`
+        - `transport_settings`: `XMPPSettings`
     """
+    transport_settings = None
     def setUp(self):
         super(InitiatorSelectTestCase, self).setUp()
         self.stream = None
@@ -326,7 +380,7 @@ class InitiatorSelectTestCase(NetworkTestCase):
 
     def start_transport(self, handlers):
         """Initialize a transport and a main loop with the provided handlers"""
-        self.transport = TCPTransport()
+        self.transport = TCPTransport(self.transport_settings)
         self.make_loop(handlers + [self.transport])
 
     def connect_transport(self):
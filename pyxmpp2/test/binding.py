@@ -5,7 +5,7 @@
 import unittest
 import re
 
-from pyxmpp2.streambase import StreamBase
+from pyxmpp2.streambase import StreamBase, NegotiationCache
 from pyxmpp2.streamevents import * # pylint: disable=W0401,W0614
 from pyxmpp2.jid import JID
 from pyxmpp2.binding import ResourceBindingHandler
@@ -129,6 +129,54 @@ class TestBindingInitiator(InitiatorSelectTestCase):
                     ConnectedEvent, StreamConnectedEvent, GotFeaturesEvent,
                     BindingResourceEvent, AuthorizedEvent, DisconnectedEvent])
    
+    def test_bind_pipelined(self):
+        handler = AuthorizedEventHandler()
+        handlers = [ResourceBindingHandler(), handler]
+        processor = StanzaProcessor()
+        processor.setup_stanza_handlers(handlers, "post-auth")
+        settings = XMPPSettings({u"pipelining": True,
+                                    u"negotiation_cache": NegotiationCache()})
+        # first connection: features cached
+        self.stream = StreamBase(u"jabber:client", processor, handlers,
+                                                                    settings)
+        processor.uplink = self.stream
+        self.stream.me = JID("test@127.0.0.1")
+        self.start_transport([handler])
+        self.stream.initiate(self.transport, u"127.0.0.1")
+        self.connect_transport()
+        self.server.write(C2S_SERVER_STREAM_HEAD)
+        self.wait_short(1)
+        self.server.write(BIND_FEATURES)
+        req_id = self.wait(1,
+                    expect = re.compile(br".*<iq[^>]*id=[\"']([^\"']*)[\"']"))
+        self.assertIsNotNone(req_id)
+        self.server.disconnect()
+        self.wait()
+
+        # second connection: <iq/> sent with the stream head
+        handler.events_received = []
+        self.stream = StreamBase(u"jabber:client", processor, handlers,
+                                                                    settings)
+        processor.uplink = self.stream
+        self.stream.me = JID("test@127.0.0.1")
+        self.start_transport([handler])
+        self.stream.initiate(self.transport, u"127.0.0.1")
+        self.connect_transport()
+        req_id = self.wait(1,
+                    expect = re.compile(br".*<iq[^>]*id=[\"']([^\"']*)[\"']"))
+        self.assertIsNotNone(req_id)
+        req_id = req_id.decode("utf-8")
+        self.server.write(C2S_SERVER_STREAM_HEAD)
+        self.server.write(BIND_FEATURES)
+        self.server.write(BIND_GENERATED_RESPONSE.format(req_id)
+                                                            .encode("utf-8"))
+        self.wait()
+        self.assertEqual(self.stream.me, JID("test@127.0.0.1/Generated"))
+        event_classes = [e.__class__ for e in handler.events_received]
+        self.assertEqual(event_classes, [ConnectingEvent,
+                    ConnectedEvent, BindingResourceEvent, StreamConnectedEvent,
+                    GotFeaturesEvent, AuthorizedEvent, DisconnectedEvent])
+
 class TestBindingReceiver(ReceiverSelectTestCase):
     def test_bind_no_resource(self):
         handler = EventRecorder()
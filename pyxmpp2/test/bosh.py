@@ -0,0 +1,321 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+# pylint: disable=C0111
+
+"""Tests for pyxmpp2.bosh"""
+
+import unittest
+import socket
+import threading
+import time
+import logging
+
+from pyxmpp2.etree import ElementTree
+from pyxmpp2.bosh import BOSHTransport
+from pyxmpp2.settings import XMPPSettings
+from pyxmpp2.constants import BOSH_QNP, XBOSH_QNP
+from pyxmpp2.streambase import StreamBase
+from pyxmpp2.streamevents import * # pylint: disable=W0614,W0401
+from pyxmpp2.message import Message
+from pyxmpp2.utils import parse_http_head
+
+from pyxmpp2.test._util import EventRecorder
+from pyxmpp2.test._util import InitiatorSelectTestCase
+
+logger = logging.getLogger("pyxmpp2.test.bosh")
+
+TIMEOUT = 2.0 # seconds
+
+FEATURES = (b'<stream:features'
+            b' xmlns:stream="http://etherx.jabber.org/streams"/>')
+
+class BOSHRequest(object):
+    """Request received by the `BOSHServer`."""
+    def __init__(self, connection, body):
+        self.connection = connection
+        self.body = ElementTree.XML(body)
+        self.rid = int(self.body.get("rid"))
+
+    def respond(self, payload = b"", attrs = u"", status = 200):
+        """Send response to the request."""
+        body = (u"<body xmlns='http://jabber.org/protocol/httpbind'"
+                    u" xmlns:xmpp='urn:xmpp:xbosh'{0}".format(attrs))
+        if payload:
+            body = body.encode("utf-8") + b">" + payload + b"</body>"
+        else:
+            body = (body + u"/>").encode("utf-8")
+        self.connection.sendall(b"HTTP/1.1 " + str(status).encode("utf-8")
+                    + b" Whatever\r\n"
+                    b"Content-Type: text/xml; charset=utf-8\r\n"
+                    b"Content-Length: " + str(len(body)).encode("utf-8")
+                    + b"\r\n\r\n" + body)
+
+class BOSHServer(object):
+    """Minimal threaded HTTP server collecting BOSH requests, to be answered
+    by the test code."""
+    def __init__(self, sock):
+        self.sock = sock
+        self.lock = threading.Lock()
+        self.requests = []
+        self.connections = []
+        self.paths = []
+        thread = threading.Thread(target = self.accept_run)
+        thread.daemon = True
+        thread.start()
+
+    def accept_run(self):
+        while True:
+            try:
+                sock = self.sock.accept()[0]
+            except socket.error:
+                return
+            with self.lock:
+                self.connections.append(sock)
+            thread = threading.Thread(target = self.reader_run,
+                                                            args = (sock,))
+            thread.daemon = True
+            thread.start()
+
+    def reader_run(self, sock):
+        data = b""
+        while True:
+            try:
+                chunk = sock.recv(4096)
+            except socket.error:
+                return
+            if not chunk:
+                return
+            data += chunk
+            while b"\r\n\r\n" in data:
+                head, rest = data.split(b"\r\n\r\n", 1)
+                start_line, headers = parse_http_head(head)
+                length = int(headers[b"content-length"])
+                if len(rest) < length:
+                    break
+                with self.lock:
+                    self.paths.append(start_line)
+                    self.requests.append(BOSHRequest(sock, rest[:length]))
+                data = rest[length:]
+
+    def close(self):
+        self.sock.close()
+        with self.lock:
+            for sock in self.connections:
+                sock.close()
+
+class DeliveryRecorder(object):
+    """Stream stub recording the elements received from a BOSH transport.
+    The first element makes another thread pass the next response to the
+    transport."""
+    # pylint: disable=R0201
+    def __init__(self, transport):
+        self.transport = transport
+        self.received = []
+    def stream_element(self, element):
+        if not self.received:
+            def got_response():
+                with self.transport.lock:
+                    self.transport.got_response(None, 11, 200,
+                            b"<body xmlns='http://jabber.org/protocol/httpbind'>"
+                            b"<message xmlns='jabber:client' id='b'/></body>")
+            thread = threading.Thread(target = got_response)
+            thread.start()
+            thread.join(TIMEOUT)
+        self.received.append(element.get("id"))
+
+class TestDelivery(unittest.TestCase):
+    def test_in_order(self):
+        transport = BOSHTransport(None)
+        stream = DeliveryRecorder(transport)
+        # pylint: disable=W0212
+        transport._stream = stream
+        transport._state = "connected"
+        transport._sid = u"s1"
+        transport._next_rid_in = 10
+        # no connections to send new requests with
+        transport._requests = 0
+        with transport.lock:
+            transport.got_response(None, 10, 200,
+                        b"<body xmlns='http://jabber.org/protocol/httpbind'>"
+                        b"<message xmlns='jabber:client' id='a1'/>"
+                        b"<message xmlns='jabber:client' id='a2'/></body>")
+        self.assertEqual(stream.received, ["a1", "a2", "b"])
+        self.assertEqual(transport._responses, {})
+
+class TestLimits(unittest.TestCase):
+    def test_hold_below_requests(self):
+        settings = XMPPSettings({u"bosh_requests": 2, u"bosh_hold": 5})
+        transport = BOSHTransport(None, settings = settings)
+        # pylint: disable=W0212
+        self.assertEqual(transport._requests, 2)
+        self.assertEqual(transport._hold, 1)
+
+    def test_something_held(self):
+        settings = XMPPSettings({u"bosh_requests": 1, u"bosh_hold": 0})
+        transport = BOSHTransport(None, settings = settings)
+        # pylint: disable=W0212
+        self.assertEqual(transport._requests, 2)
+        self.assertEqual(transport._hold, 1)
+
+    def test_validators(self):
+        for name, value in ((u"bosh_hold", "0"), (u"bosh_requests", "1"),
+                                            (u"bosh_max_retries", "-1")):
+            # pylint: disable=W0212
+            validator = XMPPSettings._defs[name].validator
+            with self.assertRaises(ValueError):
+                validator(value)
+
+class TestBOSHTransport(InitiatorSelectTestCase):
+    def start_transport(self, handlers):
+        self.loop = None
+        self.make_loop(handlers)
+        self.transport = BOSHTransport(self.loop)
+
+    def connect_transport(self):
+        sock = self.make_listening_socket()
+        sock.listen(5)
+        self.bosh_server = BOSHServer(sock)
+        addr, port = sock.getsockname()
+        self.transport.connect_url(u"http://{0}:{1}/http-bind?a=b"
+                                                        .format(addr, port))
+
+    def tearDown(self):
+        if getattr(self, "bosh_server", None):
+            self.bosh_server.close()
+        super(TestBOSHTransport, self).tearDown()
+
+    def wait_requests(self, count, timeout = TIMEOUT):
+        """Run the main loop until at least `count` requests are
+        received by the server."""
+        timeout = time.time() + timeout
+        while time.time() < timeout:
+            self.loop.loop_iteration(0.1)
+            with self.bosh_server.lock:
+                if len(self.bosh_server.requests) >= count:
+                    return list(self.bosh_server.requests)
+        return list(self.bosh_server.requests)
+
+    def run_loop(self, timeout = 0.3):
+        timeout = time.time() + timeout
+        while time.time() < timeout and not self.loop.finished:
+            self.loop.loop_iteration(0.1)
+
+    def start_session(self, handler):
+        self.stream = StreamBase(u"jabber:client", None, [handler])
+        self.start_transport([handler])
+        self.stream.initiate(self.transport, u"127.0.0.1")
+        self.connect_transport()
+        requests = self.wait_requests(1)
+        self.assertEqual(len(requests), 1)
+        requests[0].respond(FEATURES, u" sid='s1' requests='2' hold='1'"
+                                u" wait='60' from='127.0.0.1' authid='abc'"
+                                u" xmpp:version='1.0'")
+        return requests[0]
+
+    def test_session_creation(self):
+        handler = EventRecorder()
+        request = self.start_session(handler)
+        body = request.body
+        self.assertEqual(body.tag, BOSH_QNP + "body")
+        self.assertEqual(body.get("to"), "127.0.0.1")
+        self.assertEqual(body.get("hold"), "1")
+        self.assertEqual(body.get("wait"), "60")
+        self.assertEqual(body.get("ver"), "1.11")
+        self.assertEqual(body.get(XBOSH_QNP + "version"), "1.0")
+        self.assertIsNone(body.get("sid"))
+        self.assertEqual(self.bosh_server.paths[0],
+                                            b"POST /http-bind?a=b HTTP/1.1")
+        # the connection manager may hold a single empty request
+        requests = self.wait_requests(2)
+        self.run_loop()
+        self.assertEqual(len(self.bosh_server.requests), 2)
+        self.assertEqual(self.stream.stream_id, u"abc")
+        poll = requests[1]
+        self.assertEqual(poll.rid, request.rid + 1)
+        self.assertEqual(poll.body.get("sid"), "s1")
+        self.assertEqual(len(poll.body), 0)
+        self.stream.disconnect()
+        requests = self.wait_requests(3)
+        terminate = requests[2]
+        self.assertEqual(terminate.body.get("type"), "terminate")
+        poll.respond()
+        terminate.respond(attrs = u" type='terminate'")
+        self.run_loop(1)
+        event_classes = [e.__class__ for e in handler.events_received]
+        self.assertEqual(event_classes, [ConnectingEvent, ConnectedEvent,
+                    StreamConnectedEvent, GotFeaturesEvent, DisconnectedEvent])
+
+    def test_batching(self):
+        handler = EventRecorder()
+        self.start_session(handler)
+        requests = self.wait_requests(2)
+        poll = requests[1]
+        for i in range(4):
+            self.stream.send(Message(to_jid = u"test@127.0.0.1",
+                                                body = u"test {0}".format(i)))
+        requests = self.wait_requests(3)
+        self.run_loop()
+        # second request slot was free for the first stanza only
+        self.assertEqual(len(self.bosh_server.requests), 3)
+        self.assertEqual(len(requests[2].body), 1)
+        poll.respond()
+        requests = self.wait_requests(4)
+        # the other stanzas come together in the next request
+        self.assertEqual(len(requests), 4)
+        self.assertEqual([r.rid for r in requests],
+                                    range(requests[0].rid, requests[0].rid + 4))
+        bodies = [elem.find("{jabber:client}body").text
+                                        for elem in requests[3].body]
+        self.assertEqual(bodies, [u"test 1", u"test 2", u"test 3"])
+        stats = self.transport.http_stats
+        self.assertEqual(stats["stanzas_sent"], 4)
+        self.assertEqual(stats["max_batch"], 3)
+        self.assertEqual(stats["requests_sent"], 4)
+        self.assertEqual(stats["connections_opened"], 2)
+
+    def test_response_order(self):
+        handler = EventRecorder()
+        self.start_session(handler)
+        requests = self.wait_requests(2)
+        self.stream.send(Message(to_jid = u"test@127.0.0.1", body = u"x"))
+        requests = self.wait_requests(3)
+        # answer the later request first
+        requests[2].respond(b"<message xmlns='jabber:client' id='m2'/>")
+        self.run_loop()
+        received = []
+        self.stream.stream_element = lambda elem: received.append(
+                                                            elem.get("id"))
+        requests[1].respond(b"<message xmlns='jabber:client' id='m1'/>")
+        self.run_loop()
+        self.assertEqual(received, ["m1", "m2"])
+
+    def test_terminated_by_server(self):
+        handler = EventRecorder()
+        self.start_session(handler)
+        requests = self.wait_requests(2)
+        requests[1].respond(attrs = u" type='terminate'"
+                                        u" condition='system-shutdown'")
+        self.run_loop(1)
+        self.assertEqual(len(self.bosh_server.requests), 2)
+        self.assertFalse(self.transport.is_connected())
+        event_classes = [e.__class__ for e in handler.events_received]
+        self.assertEqual(event_classes[-1], DisconnectedEvent)
+
+    def test_http_error(self):
+        handler = EventRecorder()
+        self.start_session(handler)
+        requests = self.wait_requests(2)
+        requests[1].respond(status = 404)
+        self.run_loop(1)
+        self.assertFalse(self.transport.is_connected())
+        event_classes = [e.__class__ for e in handler.events_received]
+        self.assertEqual(event_classes[-1], DisconnectedEvent)
+
+# pylint: disable=W0611
+from pyxmpp2.test._support import load_tests, setup_logging
+
+def setUpModule():
+    setup_logging()
+
+if __name__ == "__main__":
+    unittest.main()
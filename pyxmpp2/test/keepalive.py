@@ -0,0 +1,146 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+# pylint: disable=C0111
+
+"""Tests for pyxmpp2.keepalive"""
+
+import unittest
+import random
+
+from pyxmpp2.keepalive import TimerWheel, KeepaliveManager
+from pyxmpp2.settings import XMPPSettings
+from pyxmpp2.jid import JID
+
+class TestTimerWheel(unittest.TestCase):
+    def test_expiry(self):
+        wheel = TimerWheel(tick = 1, bits = 2, levels = 3, now = 0)
+        # delays from the lowest wheel up to beyond the highest one
+        delays = range(1, 100)
+        random.shuffle(delays)
+        for delay in delays:
+            wheel.add(delay, delay)
+        self.assertEqual(len(wheel), 99)
+        fired = {}
+        for now in range(0, 101):
+            for key in wheel.advance(now):
+                fired[key] = now
+        self.assertEqual(fired, dict((d, d) for d in range(1, 100)))
+        self.assertEqual(len(wheel), 0)
+
+    def test_remove_and_replace(self):
+        wheel = TimerWheel(tick = 0.5, now = 100)
+        wheel.add("a", 2)
+        wheel.add("b", 2)
+        wheel.add("a", 10)
+        wheel.remove("b")
+        wheel.remove("c")
+        self.assertEqual(wheel.advance(105), [])
+        self.assertIn("a", wheel)
+        self.assertNotIn("b", wheel)
+        self.assertEqual(wheel.advance(110), ["a"])
+
+    def test_late_advance(self):
+        wheel = TimerWheel(tick = 1, bits = 2, levels = 2, now = 0)
+        wheel.add("a", 5)
+        wheel.add("b", 50)
+        self.assertEqual(wheel.advance(20), ["a"])
+        wheel.add("c", 1)
+        self.assertEqual(wheel.advance(21), ["c"])
+        self.assertEqual(wheel.advance(60), ["b"])
+
+class DummyTransport(object):
+    # pylint: disable=R0201
+    def __init__(self, now):
+        self.last_read = now
+        self.last_write = now
+        self.keepalives = 0
+        self.closed = False
+    def is_connected(self):
+        return not self.closed
+    def send_keepalive(self):
+        self.keepalives += 1
+        return True
+    def close(self):
+        self.closed = True
+
+class DummyStream(object):
+    def __init__(self, now):
+        self.transport = DummyTransport(now)
+        self.peer = JID(u"example.org")
+        self.authenticated = True
+        self.peer_authenticated = False
+        self.sent = []
+    def send(self, stanza):
+        self.sent.append(stanza)
+
+class TestKeepaliveManager(unittest.TestCase):
+    def make_manager(self, mode):
+        settings = XMPPSettings({u"keepalive": mode,
+                                u"keepalive_interval": 10,
+                                u"keepalive_ping_timeout": 5,
+                                u"keepalive_max_missed": 2})
+        manager = KeepaliveManager(settings)
+        manager.wheel = TimerWheel(tick = 1, now = 0)
+        return manager
+
+    @staticmethod
+    def run_until(manager, start, end):
+        """Process the ticks from `start` to `end`, as the `_tick`
+        timeout handler would do."""
+        # pylint: disable=W0212
+        for now in range(start, end + 1):
+            for stream in manager.wheel.advance(now):
+                manager._check_stream(manager._states[stream], now)
+
+    def test_whitespace(self):
+        manager = self.make_manager("whitespace")
+        stream = DummyStream(0)
+        manager.add_stream(stream)
+        # not idle: data sent at 5
+        stream.transport.last_write = 5
+        self.run_until(manager, 0, 12)
+        self.assertEqual(stream.transport.keepalives, 0)
+        self.run_until(manager, 13, 15)
+        self.assertEqual(stream.transport.keepalives, 1)
+        self.run_until(manager, 16, 25)
+        self.assertEqual(stream.transport.keepalives, 2)
+        self.assertEqual(stream.sent, [])
+
+    def test_ping(self):
+        manager = self.make_manager("ping")
+        stream = DummyStream(0)
+        manager.add_stream(stream)
+        self.run_until(manager, 0, 10)
+        self.assertEqual(len(stream.sent), 1)
+        ping = stream.sent[0]
+        self.assertEqual(ping.stanza_type, "get")
+        self.assertEqual(ping.to_jid, JID(u"example.org"))
+        self.assertEqual(ping.get_xml()[0].tag, "{urn:xmpp:ping}ping")
+        # answered
+        stream.transport.last_read = 12
+        self.run_until(manager, 11, 21)
+        self.assertEqual(len(stream.sent), 1)
+        self.run_until(manager, 22, 22)
+        self.assertEqual(len(stream.sent), 2)
+        # not answered
+        self.run_until(manager, 23, 27)
+        self.assertEqual(len(stream.sent), 3)
+        self.assertFalse(stream.transport.closed)
+        self.run_until(manager, 28, 32)
+        self.assertTrue(stream.transport.closed)
+        self.assertNotIn(stream, manager.wheel)
+
+    def test_disabled(self):
+        manager = self.make_manager(None)
+        stream = DummyStream(0)
+        manager.add_stream(stream)
+        self.assertEqual(len(manager.wheel), 0)
+
+# pylint: disable=W0611
+from pyxmpp2.test._support import load_tests, setup_logging
+
+def setUpModule():
+    setup_logging()
+
+if __name__ == "__main__":
+    unittest.main()
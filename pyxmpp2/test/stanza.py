@@ -100,6 +100,15 @@ class TestStanza(unittest.TestCase):
         self.assertEqual(stanza3.to_jid, JID(u"e@f.g/h"))
         self.assertEqual(stanza3.stanza_type, u"unavailable")
         self.assertEqual(stanza3.stanza_id, u'666')
+    def test_stanza_names_interned(self):
+        stanza1 = Stanza(ElementTree.XML(STANZA3))
+        stanza2 = Stanza(ElementTree.XML(STANZA3))
+        stanza3 = Stanza("presence")
+        # pylint: disable=W0212
+        self.assertIs(stanza1._ns_prefix, stanza2._ns_prefix)
+        self.assertIs(stanza1._element_qname, stanza2._element_qname)
+        self.assertIs(stanza1._element_qname, stanza3._element_qname)
+        self.assertIs(stanza1.element_name, stanza3.element_name)
     def test_stanza_build(self):
         stanza = Stanza("presence", from_jid = JID('a@b.c/d'), 
                             to_jid = JID('e@f.g/h'), stanza_id = '666',
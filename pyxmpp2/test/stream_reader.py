@@ -13,6 +13,10 @@ import unittest
 from xml.etree import ElementTree
 
 from pyxmpp2 import xmppparser
+from pyxmpp2 import utils
+from pyxmpp2.stanzaprocessor import stanza_factory
+from pyxmpp2.settings import XMPPSettings
+from pyxmpp2.exceptions import StreamParseError, StanzaLimitExceeded
 
 from pyxmpp2.utils import xml_elements_equal
 
@@ -66,10 +70,11 @@ def load_whole_stream():
     whole_stream = ElementTree.parse(os.path.join(DATA_DIR, "stream.xml"))
 
 class TestStreamReader(unittest.TestCase):
+    reader_class = xmppparser.StreamReader
     def setUp(self):
         self.expected_events = list(expected_events)
         self.handler = StreamHandler(self)
-        self.reader = xmppparser.StreamReader(self.handler)
+        self.reader = self.reader_class(self.handler)
         self.file = open(os.path.join(DATA_DIR, "stream.xml"))
         self.chunk_start = 0
         self.chunk_end = 0
@@ -138,6 +143,430 @@ class TestStreamReader(unittest.TestCase):
             root = self.whole_stream.getroot()
             root.append(element)
 
+class TestExpatStreamReader(TestStreamReader):
+    reader_class = xmppparser.ExpatStreamReader
+
+@unittest.skipIf("lxml" not in xmppparser.XML_PARSERS, "lxml not available")
+class TestLXMLStreamReader(TestStreamReader):
+    reader_class = xmppparser.LXMLStreamReader
+
+class TestLazyExpatStreamReader(TestStreamReader):
+    reader_class = xmppparser.LazyExpatStreamReader
+    def event(self, event, element):
+        if event == "node":
+            self.assertFalse(element.materialized)
+            # a LazyElement cannot be appended to an ElementTree element
+            element = element.element
+        TestStreamReader.event(self, event, element)
+
+class TestLazyElement(unittest.TestCase):
+    def parse(self, data):
+        handler = ErrorHandler()
+        reader = xmppparser.LazyExpatStreamReader(handler)
+        reader.feed(b"<stream:stream xmlns='jabber:client' xmlns:stream="
+                        b"'http://etherx.jabber.org/streams'>\n")
+        for i in range(0, len(data), 3):
+            reader.feed(data[i:i + 3])
+        self.assertEqual(handler.errors, [])
+        return handler.elements
+
+    def test_raw(self):
+        elements = self.parse(b"<message to='a@b' a='/>'>x<b/>y/></message >"
+                                b" <presence/><iq type='get'></iq>")
+        self.assertEqual([element.raw for element in elements],
+                                [b"<message to='a@b' a='/>'>x<b/>y/></message >",
+                                b"<presence/>", b"<iq type='get'></iq>"])
+        for element in elements:
+            self.assertFalse(element.materialized)
+        self.assertEqual(elements[0].tag, "{jabber:client}message")
+        self.assertEqual(elements[0].get("to"), "a@b")
+        self.assertEqual(elements[2].items(), [("type", "get")])
+        self.assertFalse(elements[0].materialized)
+
+    def test_materialize(self):
+        elements = self.parse(b"<message xml:lang='pl'>x<b:b xmlns:b='urn:b'"
+                        b" b:c='d'>\xc5\xbc</b:b>y<stream:error/></message>")
+        element = elements[0]
+        self.assertEqual(element.text, u"x")
+        self.assertTrue(element.materialized)
+        self.assertEqual(element.get(
+                        "{http://www.w3.org/XML/1998/namespace}lang"), "pl")
+        self.assertEqual(len(element), 2)
+        self.assertEqual(element[0].tag, "{urn:b}b")
+        self.assertEqual(element[0].get("{urn:b}c"), "d")
+        self.assertEqual(element[0].text, u"\u017c")
+        self.assertEqual(element[0].tail, u"y")
+        self.assertEqual(element[1].tag,
+                                    "{http://etherx.jabber.org/streams}error")
+        self.assertIsNone(element.tail)
+
+    def test_stanza(self):
+        elements = self.parse(b"<message from='a@b/c' id='1'>"
+                                b"<body>Hello</body></message>"
+                                b"<iq type='get' id='2'><query xmlns='q'/>"
+                                b"</iq>")
+        message = stanza_factory(elements[0])
+        self.assertEqual(message.stanza_id, u"1")
+        self.assertFalse(elements[0].materialized)
+        self.assertEqual(message.body, u"Hello")
+        self.assertTrue(elements[0].materialized)
+        iq = stanza_factory(elements[1])
+        self.assertEqual(iq.stanza_type, u"get")
+        self.assertFalse(elements[1].materialized)
+        payload = iq.get_all_payload()
+        self.assertEqual(payload[0].element.tag, "{q}query")
+        self.assertTrue(elements[1].materialized)
+
+class ErrorHandler(xmppparser.XMLStreamHandler):
+    def __init__(self):
+        xmppparser.XMLStreamHandler.__init__(self)
+        self.elements = []
+        self.errors = []
+    def stream_start(self, element):
+        pass
+    def stream_element(self, element):
+        self.elements.append(element)
+    def stream_parse_error(self, descr):
+        self.errors.append(descr)
+
+class TestParseError(unittest.TestCase):
+    reader_class = xmppparser.StreamReader
+    def test_mismatched_tag(self):
+        handler = ErrorHandler()
+        reader = self.reader_class(handler)
+        reader.feed(b"<stream:stream xmlns='jabber:client' xmlns:stream="
+                        b"'http://etherx.jabber.org/streams'><message>"
+                        b"<body>a</body>b</message>")
+        self.assertEqual(len(handler.elements), 1)
+        self.assertEqual(handler.elements[0].tag, "{jabber:client}message")
+        self.assertEqual(handler.elements[0][0].text, "a")
+        self.assertEqual(handler.elements[0][0].tail, "b")
+        self.assertEqual(reader.stanzas_parsed, 1)
+        self.assertEqual(handler.errors, [])
+        reader.feed(b"<iq></message>")
+        self.assertEqual(len(handler.errors), 1)
+
+    def test_handler_exception(self):
+        handler = ErrorHandler()
+        reader = self.reader_class(handler)
+        reader.feed(b"<stream:stream xmlns='jabber:client' xmlns:stream="
+                        b"'http://etherx.jabber.org/streams'>")
+        handler.stream_element = None
+        with self.assertRaises(TypeError):
+            reader.feed(b"<message/>")
+        reader.feed(b"<message/>")
+        reader.feed(b"")
+        self.assertEqual(handler.errors, [])
+
+class TestExpatParseError(TestParseError):
+    reader_class = xmppparser.ExpatStreamReader
+
+class TestLazyExpatParseError(TestParseError):
+    reader_class = xmppparser.LazyExpatStreamReader
+
+@unittest.skipIf("lxml" not in xmppparser.XML_PARSERS, "lxml not available")
+class TestLXMLParseError(TestParseError):
+    reader_class = xmppparser.LXMLStreamReader
+
+class LimitHandler(ErrorHandler):
+    def __init__(self):
+        ErrorHandler.__init__(self)
+        self.exceeded = []
+    def stream_limit_exceeded(self, descr):
+        self.exceeded.append(descr)
+
+class TestLimits(unittest.TestCase):
+    reader_class = xmppparser.StreamReader
+    settings = XMPPSettings({u"max_stanza_size": 1000,
+                            u"max_stanza_depth": 3,
+                            u"max_element_children": 5,
+                            u"max_element_attributes": 3,
+                            u"max_text_length": 50})
+    def parse(self, stanza):
+        handler = LimitHandler()
+        reader = self.reader_class(handler, self.settings)
+        data = (b"<stream:stream xmlns='jabber:client' xmlns:stream="
+                        b"'http://etherx.jabber.org/streams'><message/>"
+                        + stanza + b"<message/>")
+        for i in range(0, len(data), 10):
+            reader.feed(data[i:i + 10])
+        reader.feed(b"")
+        self.assertEqual(len(handler.elements), 1)
+        self.assertEqual(handler.errors, [])
+        return handler.exceeded
+
+    def test_within_limits(self):
+        handler = LimitHandler()
+        reader = self.reader_class(handler, self.settings)
+        reader.feed(b"<stream:stream xmlns='jabber:client' xmlns:stream="
+                        b"'http://etherx.jabber.org/streams'>"
+                        b"<message a='1' b='2' c='3'><b>" + b"x" * 50
+                        + b"</b><c/><c/><c/><c><d/></c></message>")
+        self.assertEqual(len(handler.elements), 1)
+        self.assertEqual(handler.exceeded, [])
+
+    def test_depth(self):
+        exceeded = self.parse(b"<message><a><b><c/></b></a></message>")
+        self.assertEqual(exceeded, [u"Elements nested deeper than 3"])
+
+    def test_children(self):
+        exceeded = self.parse(b"<message>" + b"<a/>" * 6 + b"</message>")
+        self.assertEqual(exceeded, [u"More than 5 child elements"])
+
+    def test_attributes(self):
+        exceeded = self.parse(b"<message><a a='1' b='2' c='3' d='4'/>"
+                                                            b"</message>")
+        self.assertEqual(exceeded, [u"More than 3 attributes"])
+
+    def test_text(self):
+        exceeded = self.parse(b"<message><a>" + b"x" * 30 + b"<b/>"
+                                    + b"x" * 30 + b"</a>" + b"x" * 51
+                                    + b"</message>")
+        self.assertEqual(exceeded, [u"Text node longer than 50"])
+
+    def test_unclosed_text(self):
+        handler = LimitHandler()
+        reader = self.reader_class(handler, self.settings)
+        reader.feed(b"<stream:stream xmlns='jabber:client' xmlns:stream="
+                        b"'http://etherx.jabber.org/streams'><message><body>")
+        # libxml2 buffers a few hundred bytes of text
+        for dummy in range(100):
+            reader.feed(b"x" * 10)
+            if handler.exceeded:
+                break
+        self.assertEqual(handler.exceeded, [u"Text node longer than 50"])
+
+    def test_size(self):
+        value = b"'" + b"x" * 400 + b"'"
+        exceeded = self.parse(b"<message><a a=" + value + b" b=" + value
+                                        + b" c=" + value + b"/></message>")
+        self.assertEqual(exceeded, [u"Stanza larger than 1000"])
+
+class TestExpatLimits(TestLimits):
+    reader_class = xmppparser.ExpatStreamReader
+
+class TestLazyExpatLimits(TestLimits):
+    reader_class = xmppparser.LazyExpatStreamReader
+
+@unittest.skipIf("lxml" not in xmppparser.XML_PARSERS, "lxml not available")
+class TestLXMLLimits(TestLimits):
+    reader_class = xmppparser.LXMLStreamReader
+
+def drop_groupchat(tag, attrs):
+    return (tag == "{jabber:client}message"
+                                and attrs.get("type") == "groupchat")
+
+class TestFilters(unittest.TestCase):
+    reader_class = xmppparser.StreamReader
+    def test_drop(self):
+        stanza_filter = xmppparser.StanzaFilter(drop_groupchat)
+        settings = XMPPSettings({u"stanza_filters": [stanza_filter]})
+        handler = ErrorHandler()
+        reader = self.reader_class(handler, settings)
+        data = (b"<stream:stream xmlns='jabber:client' xmlns:stream="
+                    b"'http://etherx.jabber.org/streams'>"
+                    b"<message type='groupchat'><body>a<b>c</b></body>"
+                    b"</message><message type='chat'><body>b</body></message>"
+                    b"<message type='groupchat'/><presence/>")
+        for i in range(0, len(data), 7):
+            reader.feed(data[i:i + 7])
+        self.assertEqual(handler.errors, [])
+        self.assertEqual([e.tag for e in handler.elements],
+                        ["{jabber:client}message", "{jabber:client}presence"])
+        self.assertEqual(handler.elements[0].get("type"), "chat")
+        self.assertEqual(handler.elements[0][0].text, "b")
+        self.assertEqual(stanza_filter.checked, 4)
+        self.assertEqual(stanza_filter.dropped, 2)
+        self.assertEqual(reader.stanzas_dropped, 2)
+        self.assertEqual(stanza_filter.name, "drop_groupchat")
+
+class TestExpatFilters(TestFilters):
+    reader_class = xmppparser.ExpatStreamReader
+
+class TestLazyExpatFilters(TestFilters):
+    reader_class = xmppparser.LazyExpatStreamReader
+
+@unittest.skipIf("lxml" not in xmppparser.XML_PARSERS, "lxml not available")
+class TestLXMLFilters(TestFilters):
+    reader_class = xmppparser.LXMLStreamReader
+
+class TestInterning(unittest.TestCase):
+    reader_class = xmppparser.StreamReader
+    def parse(self):
+        handler = ErrorHandler()
+        reader = self.reader_class(handler)
+        reader.feed(b"<stream:stream xmlns='jabber:client' xmlns:stream="
+                    b"'http://etherx.jabber.org/streams'>"
+                    b"<message type='chat'><body>a</body></message>")
+        self.assertEqual(len(handler.elements), 1)
+        return handler.elements[0]
+
+    @unittest.skipIf(xmppparser.ElementTree.__name__ == "lxml.etree",
+                            "lxml elements do not keep the name objects")
+    def test_shared_names(self):
+        stanza1 = self.parse()
+        stanza2 = self.parse()
+        self.assertIs(stanza1.tag, stanza2.tag)
+        self.assertIs(stanza1.keys()[0], stanza2.keys()[0])
+        self.assertIs(stanza1[0].tag, stanza2[0].tag)
+
+class TestExpatInterning(TestInterning):
+    reader_class = xmppparser.ExpatStreamReader
+
+class TestLazyExpatInterning(TestInterning):
+    reader_class = xmppparser.LazyExpatStreamReader
+    def test_shared_names(self):
+        stanza1 = self.parse()
+        stanza2 = self.parse()
+        self.assertIs(stanza1.tag, stanza2.tag)
+        self.assertIs(stanza1.keys()[0], stanza2.keys()[0])
+
+class TestInternName(unittest.TestCase):
+    def test_known_names(self):
+        name = u"".join([u"{jabber:client}", u"message"])
+        self.assertIsNot(utils.intern_name(name), name)
+        self.assertIs(utils.intern_name(name),
+                                    utils.intern_name(u"{jabber:client}message"))
+        self.assertIsInstance(utils.intern_name(name), unicode)
+
+    def test_peer_names_not_interned(self):
+        saved_names = dict(utils._INTERNED_NAMES)
+        for reader_class in xmppparser.XML_PARSERS.values():
+            handler = ErrorHandler()
+            reader = reader_class(handler)
+            reader.feed(b"<stream:stream xmlns='jabber:client' xmlns:stream="
+                        b"'http://etherx.jabber.org/streams'>"
+                        + b"".join(b"<x{0} a{0}='1'/>".format(i)
+                                                        for i in range(100)))
+            self.assertEqual(len(handler.elements), 100)
+        self.assertEqual(utils._INTERNED_NAMES, saved_names)
+        name = u"".join([u"{urn:test}", u"a"])
+        self.assertIs(utils.intern_name(name), name)
+
+    def test_name_cache(self):
+        cache = utils.NameCache(2)
+        name1 = u"".join([u"{urn:test}", u"a"])
+        self.assertIs(cache.get(name1), name1)
+        self.assertIs(cache.get(u"".join([u"{urn:test}", u"a"])), name1)
+        cache.get(u"{urn:test}b")
+        name3 = u"".join([u"{urn:test}", u"c"])
+        self.assertIs(cache.get(name3), name3)
+        self.assertIsNot(cache.get(u"".join([u"{urn:test}", u"c"])), name3)
+        self.assertEqual(len(cache), 2)
+        self.assertIs(cache.get(u"".join([u"{jabber:client}", u"message"])),
+                            utils.intern_name(u"{jabber:client}message"))
+        self.assertEqual(len(cache), 2)
+
+CONFORMANCE_STREAM = (
+    b"<?xml version='1.0' encoding='UTF-8'?>"
+    b"<stream:stream xmlns='jabber:client'"
+    b" xmlns:stream='http://etherx.jabber.org/streams' xml:lang='pl'"
+    b" version='1.0'>\n  "
+    b"<message to='a@b.c/\xc5\xbc\xc3\xb3\xc5\x82w' type='chat'>"
+    b"<body>Za&amp;\xc5\xbc\xc3\xb3\xc5\x82&#x107; &lt;g\xc4\x99\xc5\x9bl\xc4\x85&gt;"
+    b"<![CDATA[ <jasn\xc4\x85> ]]></body>\n"
+    b"<x:data xmlns:x='urn:example:x' x:attr='1' attr='2'>a<b/>c<d>e</d>"
+    b"f</x:data><html xmlns='http://jabber.org/protocol/xhtml-im'>"
+    b"<body xmlns='http://www.w3.org/1999/xhtml'><p>one <b>two</b>"
+    b" three</p></body></html></message>  \n"
+    b"<iq type='get' id='1'><query xmlns='jabber:iq:roster'/></iq>"
+    b"<presence xml:lang='en'><status>away</status><!-- comment -->"
+    b"<?pi data?><priority>5</priority></presence>"
+    b"</stream:stream>")
+
+def canonical(element):
+    """Convert an element to a tuple, comparable between the ElementTree
+    implementations."""
+    if element is None:
+        return None
+    def text(value):
+        return unicode(value) if value else u""
+    children = [child for child in element if isinstance(child.tag,
+                                                            basestring)]
+    return (unicode(element.tag), sorted((unicode(k), unicode(v))
+                                            for k, v in element.items()),
+                text(element.text), text(element.tail),
+                [canonical(child) for child in children])
+
+class TestParseDocument(unittest.TestCase):
+    def test_parse(self):
+        stanza_filter = xmppparser.StanzaFilter(drop_groupchat)
+        for name in xmppparser.XML_PARSERS:
+            settings = XMPPSettings({u"xml_parser": name,
+                                        u"stanza_filters": [stanza_filter]})
+            root, elements = xmppparser.parse_document(
+                    b"<body xmlns='http://jabber.org/protocol/httpbind'"
+                    b" sid='a'><message xmlns='jabber:client'><body>b</body>"
+                    b"</message><message xmlns='jabber:client'"
+                    b" type='groupchat'/></body>", settings)
+            self.assertEqual(root.tag,
+                                "{http://jabber.org/protocol/httpbind}body")
+            self.assertEqual(root.get("sid"), "a")
+            self.assertEqual(len(root), 0)
+            self.assertEqual([e.tag for e in elements],
+                                            ["{jabber:client}message"], name)
+            self.assertEqual(elements[0][0].text, "b")
+
+    def test_errors(self):
+        for name in xmppparser.XML_PARSERS:
+            settings = XMPPSettings({u"xml_parser": name,
+                                        u"max_stanza_depth": 2})
+            with self.assertRaises(StreamParseError):
+                xmppparser.parse_document(b"<body><message>", settings)
+            with self.assertRaises(StreamParseError):
+                xmppparser.parse_document(b"<body></message>", settings)
+            with self.assertRaises(StanzaLimitExceeded):
+                xmppparser.parse_document(b"<body><message><a><b/></a>"
+                                        b"</message></body>", settings)
+
+class RecordingStreamHandler(xmppparser.XMLStreamHandler):
+    def __init__(self):
+        xmppparser.XMLStreamHandler.__init__(self)
+        self.events = []
+    def stream_start(self, element):
+        self.events.append(("start", unicode(element.tag),
+                                    sorted(element.items())))
+    def stream_end(self):
+        self.events.append(("end",))
+    def stream_element(self, element):
+        self.events.append(("element", canonical(element)))
+
+class TestConformance(unittest.TestCase):
+    """Check that all the stream reader backends produce the same
+    results."""
+    @staticmethod
+    def parse(reader_class, data, chunk_size):
+        handler = RecordingStreamHandler()
+        reader = reader_class(handler)
+        for i in range(0, len(data), chunk_size):
+            reader.feed(data[i:i + chunk_size])
+        reader.feed(b"")
+        return handler.events
+
+    def check_corpus(self, data):
+        expected = self.parse(xmppparser.StreamReader, data, len(data))
+        for name, reader_class in xmppparser.XML_PARSERS.items():
+            for chunk_size in (1, 7, 100, len(data)):
+                events = self.parse(reader_class, data, chunk_size)
+                self.assertEqual(events, expected, "{0} backend, {1}-byte"
+                                    " chunks".format(name, chunk_size))
+        return expected
+
+    def test_stream_xml(self):
+        with open(os.path.join(DATA_DIR, "stream.xml"), "rb") as stream:
+            events = self.check_corpus(stream.read())
+        self.assertEqual(len(events), 6)
+
+    def test_corpus(self):
+        events = self.check_corpus(CONFORMANCE_STREAM)
+        self.assertEqual(len(events), 5)
+        self.assertIn(("{http://www.w3.org/XML/1998/namespace}lang", "pl"),
+                                                                events[0][2])
+        body = events[1][1][4][0]
+        self.assertEqual(body[2],
+                        u"Za&\u017c\xf3\u0142\u0107 <g\u0119\u015bl\u0105>"
+                        u" <jasn\u0105> ")
+
 # pylint: disable=W0611
 from pyxmpp2.test._support import load_tests, setup_logging
 
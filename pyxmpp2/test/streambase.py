@@ -17,15 +17,16 @@ except ImportError:
 
 from pyxmpp2.streambase import StreamBase
 from pyxmpp2.streamevents import * # pylint: disable=W0401,W0614
-from pyxmpp2.exceptions import StreamParseError
+from pyxmpp2.exceptions import StreamParseError, StanzaLimitExceeded
 from pyxmpp2.jid import JID
 from pyxmpp2.message import Message
 from pyxmpp2.settings import XMPPSettings
+from pyxmpp2.traffic import TRAFFIC_LOGGER
 
 from pyxmpp2.interfaces import event_handler
 from pyxmpp2.interfaces import StanzaRoute
 
-from pyxmpp2.test._util import EventRecorder
+from pyxmpp2.test._util import EventRecorder, RecordingLogHandler
 from pyxmpp2.test._util import InitiatorSelectTestCase
 from pyxmpp2.test._util import InitiatorPollTestMixIn
 from pyxmpp2.test._util import InitiatorThreadedTestMixIn
@@ -48,6 +49,10 @@ PARSE_ERROR_RESPONSE = (b'<stream:error><not-well-formed'
                     b'  xmlns="urn:ietf:params:xml:ns:xmpp-streams"/>'
                                         b'</stream:error></stream:stream>')
 
+POLICY_VIOLATION_RESPONSE = (b'<stream:error><policy-violation'
+                    b'  xmlns="urn:ietf:params:xml:ns:xmpp-streams"/>'
+                                        b'</stream:error></stream:stream>')
+
 logger = logging.getLogger("pyxmpp2.test.streambase")
 
 class RecordingRoute(StanzaRoute):
@@ -118,16 +123,27 @@ class TestInitiatorSelect(InitiatorSelectTestCase):
     def test_parse_error(self):
         handler = IgnoreEventHandler()
         self.stream = StreamBase(u"jabber:client", None, [])
+        self.transport_settings = XMPPSettings({u"traffic_buffer_size": 16384})
         self.start_transport([handler])
         self.stream.initiate(self.transport)
         self.connect_transport()
         self.server.write(C2S_SERVER_STREAM_HEAD)
         self.wait_short()
-        self.server.write(b"</stream:test>")
-        with self.assertRaises(StreamParseError):
-            logger.debug("-- WAIT start")
-            self.wait()
-            logger.debug("-- WAIT end")
+        log_handler = RecordingLogHandler()
+        level = TRAFFIC_LOGGER.level
+        TRAFFIC_LOGGER.addHandler(log_handler)
+        TRAFFIC_LOGGER.setLevel(logging.INFO)
+        try:
+            self.server.write(b"</stream:test>")
+            with self.assertRaises(StreamParseError):
+                logger.debug("-- WAIT start")
+                self.wait()
+                logger.debug("-- WAIT end")
+        finally:
+            TRAFFIC_LOGGER.removeHandler(log_handler)
+            TRAFFIC_LOGGER.setLevel(level)
+        self.assertEqual(len(log_handler.records), 1)
+        self.assertIn(u"</stream:test>", log_handler.records[0].getMessage())
         self.assertFalse(self.stream.is_connected())
         self.wait_short()
         self.server.wait(1)
@@ -159,6 +175,8 @@ class TestInitiatorSelect(InitiatorSelectTestCase):
         element = XML(xml)
         stanza = Message(element)
         self.assertEqual(stanza.body, u"Test")
+        self.assertEqual(self.stream.metrics["stanzas_sent"], 1)
+        self.assertEqual(self.stream.metrics["stanzas_received"], 0)
         self.stream.disconnect()
         self.server.write(STREAM_TAIL)
         self.server.disconnect()
@@ -193,6 +211,10 @@ class TestInitiatorSelect(InitiatorSelectTestCase):
         stanza = route.received[0]
         self.assertIsInstance(stanza, Message)
         self.assertEqual(stanza.body, u"Test")
+        metrics = self.stream.metrics
+        self.assertEqual(metrics["stanzas_received"], 1)
+        self.assertEqual(metrics["stanzas_sent"], 0)
+        self.assertGreater(metrics["handler_time"], 0)
         event_classes = [e.__class__ for e in handler.events_received]
         self.assertEqual(event_classes, [ConnectingEvent, ConnectedEvent,
                                     StreamConnectedEvent, DisconnectedEvent])
@@ -252,6 +274,49 @@ class TestReceiverSelect(ReceiverSelectTestCase):
         self.assertEqual(event_classes, [StreamConnectedEvent,
                                                         DisconnectedEvent])
 
+    def test_limit_exceeded(self):
+        handler = IgnoreEventHandler()
+        self.start_transport([handler])
+        self.transport.settings["max_stanza_depth"] = 2
+        self.stream = StreamBase(u"jabber:client", None, [])
+        self.stream.receive(self.transport, self.addr[0])
+        self.client.write(C2S_CLIENT_STREAM_HEAD)
+        self.wait_short(0.25)
+        self.client.write(b"<message><a><b/></a></message>")
+        with self.assertRaises(StanzaLimitExceeded):
+            self.wait()
+        self.assertFalse(self.stream.is_connected())
+        self.wait_short(0.1)
+        self.client.wait(1)
+        self.assertTrue(self.client.eof)
+        self.assertTrue(self.client.rdata.endswith(POLICY_VIOLATION_RESPONSE))
+        self.client.disconnect()
+        self.wait()
+
+    def test_hold_input(self):
+        handler = JustStreamConnectEventHandler()
+        self.start_transport([handler])
+        route = RecordingRoute()
+        self.stream = StreamBase(u"jabber:client", route, [])
+        self.stream.receive(self.transport, self.addr[0])
+        self.stream.hold_input()
+        self.client.write(C2S_CLIENT_STREAM_HEAD)
+        self.client.write(b"<message><body>Test</body></message>")
+        self.wait_short(0.25)
+        self.wait_short(0.25)
+        self.assertEqual(self.client.rdata, b"")
+        self.assertEqual(route.received, [])
+        self.assertEqual(handler.events_received, [])
+        self.stream.release_input()
+        self.wait_short(0.25)
+        self.assertTrue(self.client.rdata.startswith(b"<stream:stream"))
+        self.assertEqual(len(route.received), 1)
+        self.client.write(STREAM_TAIL)
+        self.wait()
+        event_classes = [e.__class__ for e in handler.events_received]
+        self.assertEqual(event_classes, [StreamConnectedEvent,
+                                                            DisconnectedEvent])
+
 @unittest.skipIf(not hasattr(select, "poll"), "No poll() support")
 class TestReceiverPoll(ReceiverPollTestMixIn, TestReceiverSelect):
     pass
@@ -0,0 +1,263 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+# pylint: disable=C0111
+
+import unittest
+import re
+import zlib
+import time
+
+from pyxmpp2.etree import ElementTree
+
+from pyxmpp2.streambase import StreamBase
+from pyxmpp2.streamcompression import StreamCompressionHandler
+from pyxmpp2.streamcompression import ZlibCompressor
+from pyxmpp2.streamevents import * # pylint: disable=W0614,W0401
+from pyxmpp2.exceptions import FatalStreamError
+from pyxmpp2.settings import XMPPSettings
+
+from pyxmpp2.test._util import EventRecorder
+from pyxmpp2.test._util import InitiatorSelectTestCase
+from pyxmpp2.test._util import ReceiverSelectTestCase
+
+C2S_SERVER_STREAM_HEAD = (b'<stream:stream version="1.0" from="127.0.0.1"'
+                            b' xmlns:stream="http://etherx.jabber.org/streams"'
+                            b' xmlns="jabber:client">')
+C2S_CLIENT_STREAM_HEAD = (b'<stream:stream version="1.0" to="127.0.0.1"'
+                            b' xmlns:stream="http://etherx.jabber.org/streams"'
+                            b' xmlns="jabber:client">')
+
+COMPRESSION_FEATURES = b"""<stream:features>
+     <compression xmlns='http://jabber.org/features/compress'>
+        <method>zlib</method>
+     </compression>
+</stream:features>"""
+
+EMPTY_FEATURES = b"""<stream:features/>"""
+
+COMPRESS = (b"<compress xmlns='http://jabber.org/protocol/compress'>"
+                                            b"<method>zlib</method></compress>")
+COMPRESS_LZW = (b"<compress xmlns='http://jabber.org/protocol/compress'>"
+                                            b"<method>lzw</method></compress>")
+COMPRESSED = b"<compressed xmlns='http://jabber.org/protocol/compress'/>"
+FAILURE = (b"<failure xmlns='http://jabber.org/protocol/compress'>"
+                                        b"<setup-failed/></failure>")
+
+STREAM_TAIL = b'</stream:stream>'
+
+TIMEOUT = 1.0 # seconds
+
+def deflate(compressor, data):
+    """Compress `data` with a sync flush."""
+    return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+class TestZlibCompressor(unittest.TestCase):
+    def test_round_trip(self):
+        settings = XMPPSettings({"compression_level": 9,
+                                    "compression_window_bits": 10,
+                                    "compression_mem_level": 2})
+        sender = ZlibCompressor(settings)
+        receiver = ZlibCompressor()
+        stanza = b"<presence from='user@example.org/res'><show>away</show>" \
+                                                                b"</presence>"
+        for dummy in range(100):
+            data = sender.compress(stanza)
+            self.assertEqual(receiver.decompress(data), stanza)
+        stats = sender.stats
+        self.assertEqual(stats["bytes_out_raw"], len(stanza) * 100)
+        self.assertTrue(stats["ratio_out"] > 5)
+        stats = receiver.stats
+        self.assertEqual(stats["bytes_in_raw"], len(stanza) * 100)
+        self.assertTrue(stats["ratio_in"] > 5)
+
+    def test_max_length(self):
+        sender = ZlibCompressor()
+        receiver = ZlibCompressor()
+        data = sender.compress(b"x" * 100000)
+        self.assertTrue(len(data) < 1000)
+        result = receiver.decompress(buffer(data), 4096)
+        self.assertEqual(len(result), 4096)
+        self.assertTrue(receiver.pending)
+        while receiver.pending:
+            chunk = receiver.decompress(b"", 4096)
+            self.assertTrue(len(chunk) <= 4096)
+            result += chunk
+        self.assertEqual(result, b"x" * 100000)
+
+class _CompressionTestMixIn(object):
+    # pylint: disable=E1101
+    def setUp(self):
+        super(_CompressionTestMixIn, self).setUp()
+        self.inflater = zlib.decompressobj()
+        self.deflater = zlib.compressobj()
+        self.decompressed_pos = 0
+        self.decompressed = b""
+
+    def wait_decompressed(self, peer, expect, timeout = TIMEOUT):
+        """Run the main loop until decompressed data received by the test
+        `peer` matches `expect`."""
+        timeout = time.time() + timeout
+        while time.time() < timeout:
+            self.wait_short()
+            data = peer.rdata[self.decompressed_pos:]
+            self.decompressed_pos += len(data)
+            self.decompressed += self.inflater.decompress(data)
+            match = expect.match(self.decompressed)
+            if match:
+                return match.group(1)
+        return None
+
+class TestInitiator(_CompressionTestMixIn, InitiatorSelectTestCase):
+    def test_compression(self):
+        handler = EventRecorder()
+        settings = XMPPSettings({u"compression": True})
+        self.stream = StreamBase(u"jabber:client", None,
+                        [StreamCompressionHandler(settings), handler], settings)
+        self.start_transport([handler])
+        self.stream.initiate(self.transport)
+        self.connect_transport()
+        self.server.write(C2S_SERVER_STREAM_HEAD)
+        self.server.write(COMPRESSION_FEATURES)
+        xml = self.wait(expect = re.compile(br".*(<compress.*</compress>)"))
+        self.assertIsNotNone(xml)
+        element = ElementTree.XML(xml)
+        self.assertEqual(element.tag,
+                                "{http://jabber.org/protocol/compress}compress")
+        self.assertEqual(element[0].text, "zlib")
+        self.server.rdata = b""
+        self.server.write(COMPRESSED)
+        stream_start = self.wait_decompressed(self.server,
+                                        re.compile(br"(<stream:stream[^>]*>)"))
+        self.assertIsNotNone(stream_start)
+        self.assertTrue(self.transport.compressed)
+        self.server.write(deflate(self.deflater, C2S_SERVER_STREAM_HEAD))
+        self.server.write(deflate(self.deflater, EMPTY_FEATURES))
+        self.wait_short()
+        self.wait_short()
+        self.stream.disconnect()
+        self.server.write(deflate(self.deflater, STREAM_TAIL))
+        self.wait()
+        stats = self.transport.compression_stats
+        self.assertTrue(stats["bytes_in"] > 0)
+        self.assertEqual(stats["bytes_in_raw"], len(C2S_SERVER_STREAM_HEAD)
+                                    + len(EMPTY_FEATURES) + len(STREAM_TAIL))
+        event_classes = [e.__class__ for e in handler.events_received]
+        self.assertEqual(event_classes, [ConnectingEvent,
+                    ConnectedEvent, StreamConnectedEvent, GotFeaturesEvent,
+                    StreamCompressedEvent, StreamRestartedEvent,
+                    GotFeaturesEvent, DisconnectedEvent])
+
+    def test_failure(self):
+        handler = EventRecorder()
+        settings = XMPPSettings({u"compression": True})
+        self.stream = StreamBase(u"jabber:client", None,
+                        [StreamCompressionHandler(settings), handler], settings)
+        self.start_transport([handler])
+        self.stream.initiate(self.transport)
+        self.connect_transport()
+        self.server.write(C2S_SERVER_STREAM_HEAD)
+        self.server.write(COMPRESSION_FEATURES)
+        xml = self.wait(expect = re.compile(br".*(<compress.*</compress>)"))
+        self.assertIsNotNone(xml)
+        self.server.write(FAILURE)
+        self.wait_short()
+        self.wait_short()
+        self.assertFalse(self.transport.compressed)
+        self.stream.disconnect()
+        self.server.write(STREAM_TAIL)
+        self.wait()
+        event_classes = [e.__class__ for e in handler.events_received]
+        self.assertEqual(event_classes, [ConnectingEvent,
+                    ConnectedEvent, StreamConnectedEvent, GotFeaturesEvent,
+                    GotFeaturesEvent, DisconnectedEvent])
+
+    def test_disabled(self):
+        handler = EventRecorder()
+        self.stream = StreamBase(u"jabber:client", None,
+                        [StreamCompressionHandler(), handler], XMPPSettings())
+        self.start_transport([handler])
+        self.stream.initiate(self.transport)
+        self.connect_transport()
+        self.server.write(C2S_SERVER_STREAM_HEAD)
+        self.server.write(COMPRESSION_FEATURES)
+        self.wait_short()
+        self.wait_short()
+        self.assertFalse(b"<compress" in self.server.rdata)
+        self.stream.disconnect()
+        self.server.write(STREAM_TAIL)
+        self.wait()
+
+class TestReceiver(_CompressionTestMixIn, ReceiverSelectTestCase):
+    def _start_stream(self, handler):
+        settings = XMPPSettings({u"compression": True})
+        self.stream = StreamBase(u"jabber:client", None,
+                        [StreamCompressionHandler(settings), handler], settings)
+        self.stream.receive(self.transport, self.addr[0])
+        self.stream.peer_authenticated = True
+        self.client.write(C2S_CLIENT_STREAM_HEAD)
+        xml = self.wait(expect = re.compile(
+                                br".*<stream:features>(.*)</stream:features>"))
+        self.assertIsNotNone(xml)
+        element = ElementTree.XML(xml)
+        self.assertEqual(element.tag,
+                            "{http://jabber.org/features/compress}compression")
+        self.assertEqual(element[0].text, "zlib")
+
+    def test_compression(self):
+        handler = EventRecorder()
+        self.start_transport([handler])
+        self._start_stream(handler)
+        self.client.write(COMPRESS)
+        xml = self.wait(expect = re.compile(br".*(<compressed[^>]*/>)"))
+        self.assertIsNotNone(xml)
+        self.client.rdata = b""
+        self.client.write(deflate(self.deflater, C2S_CLIENT_STREAM_HEAD))
+        features = self.wait_decompressed(self.client, re.compile(
+                                    br".*<stream:stream[^>]*>(<stream:features"
+                                    br"(?:/>|>.*</stream:features>))"))
+        self.assertIsNotNone(features)
+        self.assertFalse(b"compression" in features)
+        self.client.write(deflate(self.deflater, STREAM_TAIL))
+        self.client.disconnect()
+        self.wait()
+        event_classes = [e.__class__ for e in handler.events_received]
+        self.assertEqual(event_classes, [StreamConnectedEvent,
+                            StreamCompressedEvent, StreamRestartedEvent,
+                            DisconnectedEvent])
+
+    def test_unsupported_method(self):
+        handler = EventRecorder()
+        self.start_transport([handler])
+        self._start_stream(handler)
+        self.client.write(COMPRESS_LZW)
+        xml = self.wait(expect = re.compile(br".*(<failure.*</failure>)"))
+        self.assertIsNotNone(xml)
+        element = ElementTree.XML(xml)
+        self.assertEqual(element[0].tag,
+                        "{http://jabber.org/protocol/compress}unsupported-method")
+        self.assertFalse(self.transport.compressed)
+
+    def test_corrupted_input(self):
+        handler = EventRecorder()
+        self.start_transport([handler])
+        self._start_stream(handler)
+        self.client.write(COMPRESS)
+        xml = self.wait(expect = re.compile(br".*(<compressed[^>]*/>)"))
+        self.assertIsNotNone(xml)
+        self.client.rdata = b""
+        self.client.write(b"\xff" * 100)
+        with self.assertRaises(FatalStreamError):
+            self.wait()
+        error = self.wait_decompressed(self.client,
+                            re.compile(br".*(<stream:error>.*</stream:error>)"))
+        self.assertIsNotNone(error)
+        self.assertTrue(b"undefined-condition" in error)
+
+# pylint: disable=W0611
+from pyxmpp2.test._support import load_tests, setup_logging
+
+def setUpModule():
+    setup_logging()
+
+if __name__ == "__main__":
+    unittest.main()
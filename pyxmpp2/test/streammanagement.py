@@ -0,0 +1,233 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+# pylint: disable=C0111
+
+"""Tests for pyxmpp2.streammanagement"""
+
+import unittest
+import re
+import time
+
+from pyxmpp2.etree import ElementTree
+from pyxmpp2.streambase import StreamBase
+from pyxmpp2.streammanagement import StreamManagementHandler
+from pyxmpp2.streammanagement import StreamManagementSession
+from pyxmpp2.streamevents import * # pylint: disable=W0614,W0401
+from pyxmpp2.message import Message
+from pyxmpp2.settings import XMPPSettings
+from pyxmpp2.jid import JID
+
+from pyxmpp2.test._util import EventRecorder
+from pyxmpp2.test._util import InitiatorSelectTestCase
+
+C2S_SERVER_STREAM_HEAD = (b'<stream:stream version="1.0" from="127.0.0.1"'
+                            b' xmlns:stream="http://etherx.jabber.org/streams"'
+                            b' xmlns="jabber:client">')
+
+SM_FEATURES = b"""<stream:features>
+     <bind xmlns='urn:ietf:params:xml:ns:xmpp-bind'/>
+     <sm xmlns='urn:xmpp:sm:3'/>
+</stream:features>"""
+
+class SMTestStream(StreamBase):
+    """Stream with authentication already done and recording the stanzas
+    received."""
+    def __init__(self, handlers, settings):
+        StreamBase.__init__(self, u"jabber:client", None, handlers, settings)
+        self.authenticated = True
+        self.me = JID(u"test@127.0.0.1")
+        self.received = []
+
+    def uplink_receive(self, stanza):
+        self.received.append(stanza.stanza_id)
+
+class TestStreamManagement(InitiatorSelectTestCase):
+    def setUp(self):
+        super(TestStreamManagement, self).setUp()
+        self.settings = XMPPSettings({u"stream_management": True,
+                                                u"sm_ack_stanzas": 2})
+        self.sm_handler = StreamManagementHandler(self.settings)
+        self.recorder = EventRecorder()
+
+    def start_stream(self):
+        """Connect a new stream using the same `StreamManagementHandler`."""
+        if self.transport:
+            self.transport.close()
+        if self.server:
+            self.server.close()
+        self.stream = SMTestStream([self.sm_handler, self.recorder],
+                                                                self.settings)
+        self.start_transport([self.sm_handler, self.recorder])
+        self.stream.initiate(self.transport)
+        self.connect_transport()
+        self.server.write(C2S_SERVER_STREAM_HEAD)
+        self.server.write(SM_FEATURES)
+
+    def expect(self, pattern):
+        """Wait for server input matching `pattern` and return the matched
+        element, clearing the input buffer."""
+        xml = self.wait(1, expect = re.compile(br".*(" + pattern + br")",
+                                                                re.DOTALL))
+        self.assertIsNotNone(xml, "{0!r} not received".format(pattern))
+        self.server.read()
+        return ElementTree.XML(xml)
+
+    def wait_features(self):
+        """Run the main loop until stream features are received."""
+        timeout = time.time() + 1
+        while self.stream.features is None and time.time() < timeout:
+            self.wait_short()
+        self.assertIsNotNone(self.stream.features)
+
+    def send_message(self, stanza_id):
+        self.stream.send(Message(to_jid = JID(u"peer@127.0.0.1"),
+                                    stanza_id = stanza_id, body = u"test"))
+
+    def enable(self):
+        """Start the stream, bind and enable Stream Management."""
+        self.start_stream()
+        self.wait_features()
+        self.stream.me = JID(u"test@127.0.0.1/res")
+        self.stream.event(AuthorizedEvent(self.stream.me))
+        element = self.expect(br"<enable[^>]*>")
+        self.assertEqual(element.get("resume"), "true")
+        # sent before <enabled/>, no ack requested yet
+        self.send_message(u"m1")
+        self.wait_short()
+        self.server.write(b"<enabled xmlns='urn:xmpp:sm:3' id='sm-1'"
+                                                b" resume='true' max='60'/>")
+        self.wait_short()
+        session = self.sm_handler.session
+        self.assertTrue(session.enabled)
+        self.assertEqual(session.session_id, u"sm-1")
+        self.assertEqual(session.max_time, 60)
+        return session
+
+    def test_disabled_by_default(self):
+        self.settings = XMPPSettings()
+        self.sm_handler = StreamManagementHandler(self.settings)
+        self.start_stream()
+        self.wait_features()
+        self.stream.me = JID(u"test@127.0.0.1/res")
+        self.stream.event(AuthorizedEvent(self.stream.me))
+        self.send_message(u"m1")
+        self.wait_short()
+        self.wait_short()
+        self.assertNotIn(b"<enable", self.server.rdata)
+        self.assertIsNone(self.sm_handler.session)
+
+    def test_acks(self):
+        session = self.enable()
+        self.send_message(u"m2")
+        self.expect(br"<r[^>]*/>")
+        self.assertEqual(len(session.unacked), 2)
+        self.server.write(b"<a xmlns='urn:xmpp:sm:3' h='1'/>")
+        self.wait_short()
+        self.assertEqual(len(session.unacked), 1)
+        self.assertEqual(session.unacked[0].get("id"), u"m2")
+        self.server.write(b"<message xmlns='jabber:client' id='in1'/>"
+                            b"<message xmlns='jabber:client' id='in2'/>"
+                            b"<r xmlns='urn:xmpp:sm:3'/>")
+        element = self.expect(br"<a[^>]*/>")
+        self.assertEqual(element.get("h"), "2")
+        self.assertEqual(self.stream.received, [u"in1", u"in2"])
+
+    def test_resume(self):
+        session = self.enable()
+        self.send_message(u"m2")
+        self.send_message(u"m3")
+        self.wait_short()
+        self.server.write(b"<message xmlns='jabber:client' id='in1'/>")
+        self.wait_short()
+        # connection broken
+        self.server.disconnect()
+        self.wait(1)
+        self.assertIsNone(session.stream)
+        self.assertIs(self.sm_handler.session, session)
+        self.assertTrue(session.can_resume())
+
+        self.start_stream()
+        element = self.expect(br"<resume[^>]*/>")
+        self.assertEqual(element.get("previd"), "sm-1")
+        self.assertEqual(element.get("h"), "1")
+        self.server.write(b"<resumed xmlns='urn:xmpp:sm:3' previd='sm-1'"
+                                                            b" h='1'/>")
+        self.wait_short()
+        self.wait_short()
+        data = self.server.rdata
+        self.assertNotIn(b"m1", data)
+        self.assertIn(b"m2", data)
+        self.assertIn(b"m3", data)
+        self.assertIs(self.stream.sm_session, session)
+        self.assertEqual(self.stream.me, JID(u"test@127.0.0.1/res"))
+        event_classes = [e.__class__ for e in self.recorder.events_received]
+        self.assertIn(StreamResumedEvent, event_classes)
+        self.assertEqual(event_classes.count(AuthorizedEvent), 1)
+        self.assertNotIn(b"<bind", data)
+
+    def test_resume_failed(self):
+        session = self.enable()
+        self.server.disconnect()
+        self.wait(1)
+        self.start_stream()
+        self.expect(br"<resume[^>]*/>")
+        self.server.write(b"<failed xmlns='urn:xmpp:sm:3'>"
+                b"<item-not-found xmlns='urn:ietf:params:xml:ns:xmpp-stanzas'/>"
+                b"</failed>")
+        self.wait_short()
+        self.assertIsNone(self.sm_handler.session)
+        self.assertIsNone(session.stream)
+
+    def test_graceful_close(self):
+        session = self.enable()
+        self.server.write(b"<message xmlns='jabber:client' id='in1'/>")
+        self.wait_short()
+        self.stream.disconnect()
+        element = self.expect(br"<a[^>]*/>")
+        self.assertEqual(element.get("h"), "1")
+        self.assertFalse(session.can_resume())
+        self.server.write(b"</stream:stream>")
+        self.server.disconnect()
+        self.wait(1)
+        self.assertIsNone(self.sm_handler.session)
+
+class TestSession(unittest.TestCase):
+    def test_ack_interval(self):
+        settings = XMPPSettings({u"sm_ack_stanzas": 0,
+                                                u"sm_ack_interval": 10})
+        session = StreamManagementSession(settings)
+        written = []
+        class Stream(object):
+            sm_session = None
+            # pylint: disable=R0201
+            def _write_element(self, element):
+                written.append(element.tag)
+        session.attach(Stream())
+        session.enabled = True
+        for i in range(10):
+            session.stanza_sent(ElementTree.Element(u"{jabber:client}message"))
+        self.assertEqual(written, [])
+        session.check_ack_interval(time.time() + 5)
+        self.assertEqual(written, [])
+        session.check_ack_interval(time.time() + 11)
+        self.assertEqual(written, [u"{urn:xmpp:sm:3}r"])
+        session.check_ack_interval(time.time() + 22)
+        self.assertEqual(len(written), 1)
+
+    def test_counter_wrap(self):
+        session = StreamManagementSession()
+        session.acked_out = (1 << 32) - 1
+        for i in range(3):
+            session.unacked.append(i)
+        self.assertEqual(session.process_ack(u"1"), 2)
+        self.assertEqual(list(session.unacked), [2])
+        self.assertEqual(session.acked_out, 1)
+
+# pylint: disable=W0611
+from pyxmpp2.test._support import load_tests, setup_logging
+
+def setUpModule():
+    setup_logging()
+
+if __name__ == "__main__":
+    unittest.main()
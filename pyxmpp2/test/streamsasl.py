@@ -20,10 +20,11 @@ if "PYXMPP2_ETREE" not in os.environ:
 
 from pyxmpp2.etree import ElementTree
 
-from pyxmpp2.streambase import StreamBase
+from pyxmpp2.streambase import StreamBase, NegotiationCache
 from pyxmpp2.streamsasl import StreamSASLHandler
+from pyxmpp2.streamtls import StreamTLSHandler
 from pyxmpp2.streamevents import * # pylint: disable=W0614,W0401
-from pyxmpp2.exceptions import SASLAuthenticationFailed
+from pyxmpp2.exceptions import SASLAuthenticationFailed, FatalStreamError
 from pyxmpp2.settings import XMPPSettings
 
 from pyxmpp2.test._util import EventRecorder
@@ -43,6 +44,12 @@ AUTH_FEATURES = b"""<stream:features>
      </mechanisms>
 </stream:features>"""
 
+DIGEST_FEATURES = b"""<stream:features>
+     <mechanisms xmlns='urn:ietf:params:xml:ns:xmpp-sasl'>
+        <mechanism>DIGEST-MD5</mechanism>
+     </mechanisms>
+</stream:features>"""
+
 BIND_FEATURES = b"""<stream:features>
      <bind xmlns='urn:ietf:params:xml:ns:xmpp-bind'/>
 </stream:features>"""
@@ -130,6 +137,127 @@ class TestInitiator(InitiatorSelectTestCase):
         self.assertEqual(event_classes, [ConnectingEvent, ConnectedEvent,
                     StreamConnectedEvent, GotFeaturesEvent, DisconnectedEvent])
  
+    def start_pipelined(self, settings):
+        handler = EventRecorder()
+        self.stream = StreamBase(u"jabber:client", None,
+                            [StreamSASLHandler(settings), handler], settings)
+        self.start_transport([handler])
+        self.stream.initiate(self.transport, u"127.0.0.1")
+        self.connect_transport()
+        return handler
+
+    def test_auth_pipelined(self):
+        settings = XMPPSettings({
+                                u"username": u"user",
+                                u"password": u"secret",
+                                u"pipelining": True,
+                                u"negotiation_cache": NegotiationCache(),
+                                })
+        # first connection: features cached
+        self.start_pipelined(settings)
+        self.server.write(C2S_SERVER_STREAM_HEAD)
+        self.wait_short(0.5)
+        self.assertNotIn(b"<auth", self.server.rdata)
+        self.server.write(AUTH_FEATURES)
+        xml = self.wait(expect = re.compile(br".*(<auth.*</auth>)"))
+        self.assertIsNotNone(xml)
+        self.server.disconnect()
+        self.wait()
+
+        # second connection: <auth/> sent with the stream head
+        handler = self.start_pipelined(settings)
+        xml = self.wait(expect = re.compile(br".*(<auth.*</auth>)"))
+        self.assertIsNotNone(xml)
+        element = ElementTree.XML(xml)
+        self.assertEqual(element.get("mechanism"), "PLAIN")
+        data = binascii.a2b_base64(element.text.encode("utf-8"))
+        self.assertEqual(data, b"\000user\000secret")
+        self.server.rdata = b""
+        self.server.write(C2S_SERVER_STREAM_HEAD)
+        self.server.write(AUTH_FEATURES)
+        self.server.write(
+                        b"<success xmlns='urn:ietf:params:xml:ns:xmpp-sasl'/>")
+        stream_start = self.wait(expect = re.compile(
+                                                br"(<stream:stream[^>]*>)"))
+        self.assertIsNotNone(stream_start)
+        self.assertTrue(self.stream.authenticated)
+        self.assertNotIn(b"<auth", self.server.rdata)
+        self.server.write(C2S_SERVER_STREAM_HEAD)
+        self.server.write(BIND_FEATURES)
+        self.server.write(b"</stream:stream>")
+        self.server.disconnect()
+        self.wait()
+        event_classes = [e.__class__ for e in handler.events_received]
+        self.assertEqual(event_classes, [ConnectingEvent, ConnectedEvent,
+                    StreamConnectedEvent, GotFeaturesEvent,
+                    AuthenticatedEvent, StreamRestartedEvent, GotFeaturesEvent,
+                    DisconnectedEvent])
+
+    def test_auth_pipelined_fallback(self):
+        cache = NegotiationCache()
+        cache.update(u"127.0.0.1", (0, False, False),
+                                ElementTree.XML(DIGEST_FEATURES.replace(
+                                    b"<stream:features>",
+                                    b"<stream:features xmlns:stream="
+                                    b"'http://etherx.jabber.org/streams'>")),
+                                StreamSASLHandler)
+        settings = XMPPSettings({
+                                u"username": u"user",
+                                u"password": u"secret",
+                                u"pipelining": True,
+                                u"negotiation_cache": cache,
+                                })
+        self.start_pipelined(settings)
+        xml = self.wait(expect = re.compile(br".*(<auth[^>]*/>)"))
+        self.assertIsNotNone(xml)
+        element = ElementTree.XML(xml)
+        self.assertEqual(element.get("mechanism"), "DIGEST-MD5")
+        self.server.rdata = b""
+        self.server.write(C2S_SERVER_STREAM_HEAD)
+        self.server.write(AUTH_FEATURES)
+        self.server.write(b"<failure xmlns='urn:ietf:params:xml:ns:xmpp-sasl'>"
+                                            b"<invalid-mechanism/></failure>")
+        xml = self.wait(expect = re.compile(br".*(<auth.*</auth>)"))
+        self.assertIsNotNone(xml)
+        element = ElementTree.XML(xml)
+        self.assertEqual(element.get("mechanism"), "PLAIN")
+        # the actual features are cached now
+        features = cache.get(u"127.0.0.1", (0, False, False))[0]
+        self.assertEqual(features.find(".//{urn:ietf:params:xml:ns:xmpp-sasl}"
+                                                    "mechanism").text, "PLAIN")
+
+    def test_auth_pipelined_mismatch(self):
+        cache = NegotiationCache()
+        cache.update(u"127.0.0.1", (0, False, False),
+                                ElementTree.XML(AUTH_FEATURES.replace(
+                                    b"<stream:features>",
+                                    b"<stream:features xmlns:stream="
+                                    b"'http://etherx.jabber.org/streams'>")),
+                                StreamSASLHandler)
+        settings = XMPPSettings({
+                                u"username": u"user",
+                                u"password": u"secret",
+                                u"pipelining": True,
+                                u"negotiation_cache": cache,
+                                })
+        handler = EventRecorder()
+        self.stream = StreamBase(u"jabber:client", None,
+                            [StreamTLSHandler(settings),
+                                StreamSASLHandler(settings), handler], settings)
+        self.start_transport([handler])
+        self.stream.initiate(self.transport, u"127.0.0.1")
+        self.connect_transport()
+        xml = self.wait(expect = re.compile(br".*(<auth.*</auth>)"))
+        self.assertIsNotNone(xml)
+        self.server.write(C2S_SERVER_STREAM_HEAD)
+        self.server.write(AUTH_FEATURES.replace(b"<stream:features>",
+                    b"<stream:features><starttls xmlns="
+                    b"'urn:ietf:params:xml:ns:xmpp-tls'><required/></starttls>"))
+        with self.assertRaises(FatalStreamError):
+            self.wait()
+        self.assertIn(b"<unsupported-feature", self.server.rdata)
+        self.assertIsNone(cache.get(u"127.0.0.1", (0, False, False)))
+
 class TestReceiver(ReceiverSelectTestCase):
     def test_auth(self):
         handler = EventRecorder()
@@ -5,18 +5,25 @@
 import unittest
 import re
 import os
+import ssl
+import socket
+import threading
+import time
 
 from pyxmpp2.test._support import DATA_DIR
 
 from xml.etree.ElementTree import XML
 
 from pyxmpp2.streambase import StreamBase
-from pyxmpp2.streamtls import StreamTLSHandler
+from pyxmpp2.streamtls import StreamTLSHandler, SSLContextFactory
 from pyxmpp2.streamevents import *  # pylint: disable=W0614,W0401
 from pyxmpp2.exceptions import TLSNegotiationFailed
 from pyxmpp2.settings import XMPPSettings
 
+from pyxmpp2.mainloop.threads import WorkerPool
+
 from pyxmpp2.test._util import EventRecorder, InitiatorSelectTestCase
+from pyxmpp2.test._util import ReceiverSelectTestCase, TIMEOUT
 
 C2S_SERVER_STREAM_HEAD = (b'<stream:stream version="1.0"'
                             b' from="server.example.org"'
@@ -40,6 +47,7 @@ TLS_REQUIRED_FEATURES = b"""<stream:features>
 EMPTY_FEATURES = b"""<stream:features/>"""
 
 PROCEED = b"<proceed xmlns='urn:ietf:params:xml:ns:xmpp-tls' />"
+STARTTLS = b"<starttls xmlns='urn:ietf:params:xml:ns:xmpp-tls'/>"
 
 STREAM_TAIL = b'</stream:stream>'
         
@@ -179,6 +187,203 @@ class TestInitiator(InitiatorSelectTestCase):
                     ConnectedEvent, StreamConnectedEvent, GotFeaturesEvent,
                     DisconnectedEvent])
 
+    def test_direct(self):
+        """Test Direct TLS, with TLS required in settings."""
+        settings = XMPPSettings({
+                        u"direct_tls": True,
+                        u"tls_require": True,
+                        u"tls_cacert_file": os.path.join(DATA_DIR, "ca.pem"),
+                                })
+        handler = EventRecorder()
+        tls_handler = StreamTLSHandler(settings)
+        handlers = [tls_handler, handler]
+        self.stream = StreamBase(u"jabber:client", None, handlers, settings)
+        self.start_transport(handlers)
+        self.stream.initiate(self.transport, to = "server.example.org")
+        tls_handler.make_direct_tls_connection(self.transport)
+        addr, port = self.start_server()
+        self.server.starttls_on_accept(
+                            keyfile = os.path.join(DATA_DIR, "server-key.pem"),
+                            certfile = os.path.join(DATA_DIR, "server.pem"),
+                            server_side = True,
+                            ca_certs = os.path.join(DATA_DIR, "ca.pem"),
+                                )
+        self.transport.connect(addr, port)
+        stream_start = self.wait(expect = re.compile(
+                                                    br"(<stream:stream[^>]*>)"))
+        self.assertIsNotNone(stream_start)
+        self.assertTrue(self.stream.tls_established)
+        self.server.write(C2S_SERVER_STREAM_HEAD)
+        self.server.write(EMPTY_FEATURES)
+        self.stream.disconnect()
+        self.server.write(b"</stream:stream>")
+        self.wait()
+        event_classes = [e.__class__ for e in handler.events_received]
+        self.assertEqual(event_classes, [ConnectingEvent,
+                    ConnectedEvent, TLSConnectingEvent, TLSConnectedEvent,
+                    StreamConnectedEvent, GotFeaturesEvent,
+                    DisconnectedEvent])
+
+class TestReceiver(ReceiverSelectTestCase):
+    def setUp(self):
+        super(TestReceiver, self).setUp()
+        self.pool = None
+
+    def tearDown(self):
+        if self.pool:
+            self.pool.stop(True, 2)
+        super(TestReceiver, self).tearDown()
+
+    @staticmethod
+    def _make_tls_handler():
+        settings = XMPPSettings({
+                        u"starttls": True,
+                        u"tls_verify_peer": False,
+                        u"tls_cert_file": os.path.join(DATA_DIR, "server.pem"),
+                        u"tls_key_file": os.path.join(DATA_DIR,
+                                                        "server-key.pem"),
+                                })
+        return StreamTLSHandler(settings)
+
+    def _test_starttls(self, tls_handler, handler):
+        self.stream = StreamBase(u"jabber:client", None,
+                            [tls_handler, handler], tls_handler.settings)
+        self.stream.receive(self.transport, u"server.example.org")
+        self.client.write(C2S_CLIENT_STREAM_HEAD)
+        xml = self.wait(expect = re.compile(
+                                br".*<stream:features>(.*)</stream:features>"))
+        self.assertIsNotNone(xml)
+        element = XML(xml)
+        self.assertEqual(element.tag,
+                                "{urn:ietf:params:xml:ns:xmpp-tls}starttls")
+        self.client.write(STARTTLS)
+        xml = self.wait(expect = re.compile(br".*(<proceed[^>]*>)"))
+        self.assertIsNotNone(xml)
+        self.client.starttls(self.client.sock,
+                            ca_certs = os.path.join(DATA_DIR, "ca.pem"),
+                            cert_reqs = ssl.CERT_REQUIRED)
+        timeout = time.time() + TIMEOUT
+        while not self.client.tls_handshake_done() and time.time() < timeout:
+            self.wait_short()
+        self.assertTrue(self.client.tls_handshake_done())
+        self.client.write(C2S_CLIENT_STREAM_HEAD)
+        xml = self.wait(expect = re.compile(br".*(<stream:features/>)"))
+        self.assertIsNotNone(xml)
+        self.assertTrue(self.stream.tls_established)
+        self.assertEqual(self.transport.auth_properties["security-layer"],
+                                                                        "TLS")
+        self.client.write(STREAM_TAIL)
+        xml = self.wait(expect = re.compile(br".*(</stream:stream>)"))
+        self.assertIsNotNone(xml)
+        event_classes = [e.__class__ for e in handler.events_received]
+        # the restarted stream is processed after the TLS handshake
+        self.assertEqual(event_classes[:4], [StreamConnectedEvent,
+                            TLSConnectingEvent, TLSConnectedEvent,
+                            StreamRestartedEvent])
+
+    def test_starttls(self):
+        """Test StartTLS on the receiving side."""
+        handler = EventRecorder()
+        tls_handler = self._make_tls_handler()
+        self.start_transport([tls_handler, handler])
+        self._test_starttls(tls_handler, handler)
+
+    def test_starttls_offloaded(self):
+        """Test StartTLS on the receiving side, with the handshake run in
+        a worker thread."""
+        handler = EventRecorder()
+        tls_handler = self._make_tls_handler()
+        self.start_transport([tls_handler, handler])
+        self.pool = WorkerPool(2)
+        self.transport.settings["tls_handshake_executor"] = self.pool
+        self._test_starttls(tls_handler, handler)
+
+class TestSSLContextFactory(unittest.TestCase):
+    def test_shared(self):
+        settings = XMPPSettings({
+                        u"tls_cacert_file": os.path.join(DATA_DIR, "ca.pem"),
+                                })
+        factory = settings["tls_context_factory"]
+        self.assertIsInstance(factory, SSLContextFactory)
+        self.assertIs(settings["tls_context_factory"], factory)
+        context = factory.get_context()
+        self.assertIs(factory.get_context(), context)
+        self.assertEqual(context.verify_mode, ssl.CERT_REQUIRED)
+        self.assertIsNot(factory.get_context(True), context)
+        other_factory = XMPPSettings()["tls_context_factory"]
+        self.assertIsNot(other_factory, factory)
+
+    def test_reload(self):
+        settings = XMPPSettings({
+                        u"tls_verify_peer": False,
+                                })
+        factory = SSLContextFactory(settings)
+        context = factory.get_context()
+        self.assertEqual(context.verify_mode, ssl.CERT_NONE)
+        factory.reload()
+        new_context = factory.get_context()
+        self.assertIsNot(new_context, context)
+        self.assertEqual(new_context.verify_mode, ssl.CERT_NONE)
+
+    def test_reload_failed(self):
+        settings = XMPPSettings({
+                        u"tls_cacert_file": os.path.join(DATA_DIR, "ca.pem"),
+                                })
+        factory = SSLContextFactory(settings)
+        context = factory.get_context()
+        settings[u"tls_cacert_file"] = os.path.join(DATA_DIR, "missing.pem")
+        with self.assertRaises(IOError):
+            factory.reload()
+        self.assertIs(factory.get_context(), context)
+
+    @unittest.skipIf(not ssl.HAS_SNI, "No SNI support")
+    def test_sni_certificates(self):
+        settings = XMPPSettings({
+                        u"tls_verify_peer": False,
+                        u"tls_cert_file": os.path.join(DATA_DIR, "server.pem"),
+                        u"tls_key_file": os.path.join(DATA_DIR,
+                                                        "server-key.pem"),
+                        u"tls_sni_certificates": {
+                            u"DNS1.example.org": (
+                                    os.path.join(DATA_DIR, "server1.pem"),
+                                    os.path.join(DATA_DIR, "server1-key.pem")),
+                                },
+                                })
+        context = SSLContextFactory(settings).get_context(True)
+        cert = self._handshake(context, u"dns1.example.org")
+        self.assertEqual(cert[u"subject"][-1][0][1],
+                                                    u"common-name.example.org")
+        cert = self._handshake(context, u"other.example.org")
+        self.assertEqual(cert[u"subject"][-1][0][1], u"server.example.org")
+        cert = self._handshake(context, None)
+        self.assertEqual(cert[u"subject"][-1][0][1], u"server.example.org")
+
+    @staticmethod
+    def _handshake(server_context, server_hostname):
+        """Do a TLS handshake over a socket pair and return the server
+        certificate seen by the client."""
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(1)
+        client_sock = socket.create_connection(listener.getsockname())
+        server_sock = listener.accept()[0]
+        listener.close()
+        server = server_context.wrap_socket(server_sock, server_side = True,
+                                            do_handshake_on_connect = False)
+        thread = threading.Thread(target = server.do_handshake)
+        thread.daemon = True
+        thread.start()
+        client_context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+        client_context.load_verify_locations(os.path.join(DATA_DIR, "ca.pem"))
+        client_context.verify_mode = ssl.CERT_REQUIRED
+        try:
+            client = client_context.wrap_socket(client_sock,
+                                        server_hostname = server_hostname)
+            thread.join(5)
+            return client.getpeercert()
+        finally:
+            client_sock.close()
+            server.close()
 
 # pylint: disable=W0611
 from pyxmpp2.test._support import load_tests, setup_logging
@@ -0,0 +1,83 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+# pylint: disable=C0111
+
+"""Tests for pyxmpp2.tlssession"""
+
+import unittest
+import time
+
+from pyxmpp2.tlssession import TLSSessionCache
+from pyxmpp2.settings import XMPPSettings
+
+class FakeSession(object):
+    """Object with :std:`ssl.SSLSession` lifetime attributes."""
+    def __init__(self, name, start = None, timeout = 300):
+        self.name = name
+        if start is None:
+            start = int(time.time())
+        self.time = start
+        self.timeout = timeout
+
+KEY1 = (u"xmpp1.example.org", 5222, u"example.org")
+KEY2 = (u"xmpp2.example.org", 5222, u"example.org")
+KEY3 = (u"xmpp3.example.org", 5222, u"example.org")
+
+class TestTLSSessionCache(unittest.TestCase):
+    def test_get_put(self):
+        cache = TLSSessionCache()
+        self.assertIsNone(cache.get(KEY1))
+        session = FakeSession("s1")
+        cache.put(KEY1, session)
+        self.assertIs(cache.get(KEY1), session)
+        self.assertIsNone(cache.get(KEY2))
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 2)
+
+    def test_lru(self):
+        cache = TLSSessionCache(XMPPSettings({"tls_session_cache_size": 2}))
+        session1 = FakeSession("s1")
+        session2 = FakeSession("s2")
+        session3 = FakeSession("s3")
+        cache.put(KEY1, session1)
+        cache.put(KEY2, session2)
+        self.assertIs(cache.get(KEY1), session1)
+        cache.put(KEY3, session3)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get(KEY2))
+        self.assertIs(cache.get(KEY1), session1)
+        self.assertIs(cache.get(KEY3), session3)
+
+    def test_expired(self):
+        cache = TLSSessionCache()
+        cache.put(KEY1, FakeSession("s1", time.time() - 600, 300))
+        self.assertIsNone(cache.get(KEY1))
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.misses, 1)
+
+    def test_remove(self):
+        cache = TLSSessionCache()
+        cache.put(KEY1, FakeSession("s1"))
+        cache.put(KEY2, FakeSession("s2"))
+        cache.remove(KEY1)
+        cache.remove(KEY3)
+        self.assertIsNone(cache.get(KEY1))
+        self.assertIsNotNone(cache.get(KEY2))
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+    def test_shared_default(self):
+        cache1 = XMPPSettings()["tls_session_cache"]
+        cache2 = XMPPSettings()["tls_session_cache"]
+        self.assertIs(cache1, cache2)
+        self.assertIsNone(XMPPSettings({"tls_session_cache": None})
+                                                    ["tls_session_cache"])
+
+# pylint: disable=W0611
+from pyxmpp2.test._support import load_tests, setup_logging
+
+def setUpModule():
+    setup_logging()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+# pylint: disable=C0111
+
+"""Tests for pyxmpp2.traffic"""
+
+import unittest
+import logging
+
+from pyxmpp2.traffic import TrafficBuffer, TRAFFIC_LOGGER
+from pyxmpp2.test._util import RecordingLogHandler
+
+class TestTrafficBuffer(unittest.TestCase):
+    def test_bounded(self):
+        buf = TrafficBuffer(10)
+        buf.record("OUT", b"abcd")
+        buf.record("IN", b"efgh")
+        self.assertEqual(buf.size, 8)
+        buf.record("OUT", b"ijkl")
+        self.assertEqual(buf.size, 8)
+        self.assertEqual([r[1:] for r in buf.records],
+                                    [("IN", b"efgh"), ("OUT", b"ijkl")])
+        buf.record("IN", b"0123456789abc")
+        self.assertEqual([r[1:] for r in buf.records],
+                                    [("IN", b"3456789abc")])
+        self.assertEqual(buf.size, 10)
+        buf.clear()
+        self.assertEqual(buf.size, 0)
+        self.assertEqual(len(buf.records), 0)
+
+    def test_buffer(self):
+        buf = TrafficBuffer(4)
+        data = bytearray(b"0123456789")
+        buf.record("IN", memoryview(data)[2:8])
+        buf.record("IN", buffer(data, 1, 3))
+        self.assertEqual([r[1:] for r in buf.records], [("IN", b"123")])
+        buf.record("IN", memoryview(data)[:6])
+        self.assertEqual([r[1:] for r in buf.records], [("IN", b"2345")])
+        self.assertEqual(type(buf.records[0][2]), bytes)
+
+    def test_dump(self):
+        buf = TrafficBuffer(100)
+        buf.record("OUT", b"<message/>")
+        buf.record("IN", b"<iq type='result'/>")
+        handler = RecordingLogHandler()
+        level = TRAFFIC_LOGGER.level
+        TRAFFIC_LOGGER.addHandler(handler)
+        TRAFFIC_LOGGER.setLevel(logging.INFO)
+        try:
+            buf.dump(u"Test", logging.DEBUG)
+            self.assertEqual(handler.records, [])
+            buf.dump(u"Test", logging.INFO)
+        finally:
+            TRAFFIC_LOGGER.removeHandler(handler)
+            TRAFFIC_LOGGER.setLevel(level)
+        self.assertEqual(len(handler.records), 1)
+        lines = handler.records[0].getMessage().split(u"\n")
+        self.assertEqual(lines[0], u"Test, last 29 bytes of traffic:")
+        self.assertTrue(lines[1].endswith(u"OUT '<message/>'"))
+        self.assertTrue(lines[2].endswith(u"IN  \"<iq type='result'/>\""))
+
+# pylint: disable=W0611
+from pyxmpp2.test._support import load_tests, setup_logging
+
+def setUpModule():
+    setup_logging()
+
+if __name__ == "__main__":
+    unittest.main()
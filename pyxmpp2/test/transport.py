@@ -0,0 +1,937 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+# pylint: disable=C0111
+
+"""Tests for pyxmpp2.transport"""
+
+import unittest
+import socket
+import ssl
+import logging
+import time
+import threading
+import os
+import errno
+import shutil
+import tempfile
+import Queue
+
+try:
+    import pwd
+except ImportError:
+    # pylint: disable=C0103
+    pwd = None
+
+from xml.etree.ElementTree import Element, SubElement
+
+from pyxmpp2 import transporttls
+from pyxmpp2.transport import TCPTransport
+from pyxmpp2.transportmetrics import collect_metrics
+from pyxmpp2.interfaces import Resolver
+from pyxmpp2.mainloop.select import SelectMainLoop
+from pyxmpp2.mainloop.poll import PollMainLoop
+from pyxmpp2.server.listener import TCPListener
+from pyxmpp2.sasl import server_authenticator_factory, Success
+# pylint: disable=W0611
+from pyxmpp2 import streambase
+from pyxmpp2.xmppparser import XMLStreamHandler
+from pyxmpp2.settings import XMPPSettings
+from pyxmpp2.traffic import TRAFFIC_LOGGER
+from pyxmpp2.streamevents import OutputBufferFullEvent
+from pyxmpp2.streamevents import OutputBufferDrainedEvent
+from pyxmpp2.streamevents import TLSSessionCacheEvent
+from pyxmpp2.tlssession import TLSSessionCache
+from pyxmpp2.test.tlssession import FakeSession
+from pyxmpp2.test._util import RecordingLogHandler
+
+logger = logging.getLogger("pyxmpp2.test.transport")
+
+def make_stanza(size):
+    """Make a <message/> element with a `size` characters long body."""
+    element = Element("{jabber:client}message")
+    body = SubElement(element, "{jabber:client}body")
+    body.text = u"x" * size
+    return element
+
+def read_all(sock):
+    """Read everything available from a non-blocking socket."""
+    data = b""
+    while True:
+        try:
+            chunk = sock.recv(65536)
+        except socket.error:
+            break
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+STREAM_HEAD = (b"<stream:stream xmlns='jabber:client'"
+                    b" xmlns:stream='http://etherx.jabber.org/streams'>")
+
+class EchoHandler(XMLStreamHandler):
+    """Stream handler sending back every element received."""
+    def __init__(self):
+        XMLStreamHandler.__init__(self)
+        self.transport = None
+        self.received = []
+    def stream_start(self, element):
+        pass
+    def stream_element(self, element):
+        self.received.append(element)
+        if self.transport.settings.get("echo", True):
+            self.transport.send_element(element)
+
+@unittest.skipIf(not hasattr(socket, "socketpair"), "No socketpair()")
+class _TransportTestCase(unittest.TestCase):
+    """Base class for tests of a `TCPTransport` connected to a local
+    socket pair."""
+    settings = {}
+    handler_class = EchoHandler
+    def setUp(self):
+        self.event_queue = Queue.Queue()
+        settings = XMPPSettings(self.settings)
+        settings["event_queue"] = self.event_queue
+        sock, self.peer = socket.socketpair()
+        self.peer.setblocking(False)
+        self.transport = TCPTransport(settings, sock = sock)
+        self.handler = self.handler_class()
+        self.handler.transport = self.transport
+        self.transport.set_target(self.handler)
+        self.transport.send_stream_head(u"jabber:client", None, u"test")
+
+    def tearDown(self):
+        self.transport.close()
+        self.peer.close()
+
+    def get_events(self, event_class = None):
+        """Get events of `event_class` from the event queue."""
+        events = []
+        while True:
+            try:
+                event = self.event_queue.get_nowait()
+            except Queue.Empty:
+                break
+            if event_class is None or isinstance(event, event_class):
+                events.append(event)
+        return events
+
+class TestOutputBuffer(_TransportTestCase):
+    settings = {
+            "output_buffer_high_watermark": 256 * 1024,
+            "output_buffer_low_watermark": 16 * 1024,
+            }
+    def test_small_write_immediate(self):
+        self.transport.send_element(make_stanza(10))
+        self.assertEqual(self.transport.output_buffered, 0)
+        self.assertFalse(self.transport.is_writable())
+        data = read_all(self.peer)
+        self.assertTrue(data.endswith(b"<body>xxxxxxxxxx</body></message>"))
+
+    def test_buffer_full_and_drained(self):
+        stanza = make_stanza(16 * 1024)
+        for dummy in range(64):
+            self.transport.send_element(stanza)
+        self.assertTrue(self.transport.output_buffered > 0)
+        self.assertTrue(self.transport.is_writable())
+        self.assertTrue(self.transport.output_buffer_full)
+        events = self.get_events(OutputBufferFullEvent)
+        self.assertEqual(len(events), 1)
+        self.assertTrue(events[0].buffered >= 256 * 1024)
+
+        received = b""
+        for dummy in range(1000):
+            received += read_all(self.peer)
+            if not self.transport.is_writable():
+                break
+            self.transport.handle_write()
+        received += read_all(self.peer)
+        self.assertEqual(self.transport.output_buffered, 0)
+        self.assertFalse(self.transport.output_buffer_full)
+        self.assertEqual(len(self.get_events(OutputBufferDrainedEvent)), 1)
+        self.assertEqual(received.count(b"<message>"), 64)
+
+    def test_tail_after_buffered_data(self):
+        stanza = make_stanza(16 * 1024)
+        for dummy in range(64):
+            self.transport.send_element(stanza)
+        self.transport.send_stream_tail()
+        self.assertTrue(self.transport.is_writable())
+        received = b""
+        for dummy in range(1000):
+            received += read_all(self.peer)
+            if not self.transport.is_writable():
+                break
+            self.transport.handle_write()
+        received += read_all(self.peer)
+        self.assertTrue(received.endswith(b"</stream:stream>"))
+        self.assertEqual(received.count(b"<message>"), 64)
+
+class TestOutputBufferWatermarks(_TransportTestCase):
+    settings = {
+            "output_buffer_high_watermark": 64 * 1024,
+            "output_buffer_low_watermark": 256 * 1024,
+            }
+    def test_low_watermark_clamped(self):
+        # pylint: disable=W0212
+        self.assertEqual(self.transport._low_watermark, 32 * 1024)
+        stanza = make_stanza(16 * 1024)
+        for dummy in range(64):
+            self.transport.send_element(stanza)
+        self.assertTrue(self.transport.output_buffer_full)
+        self.assertEqual(len(self.get_events(OutputBufferFullEvent)), 1)
+        self.assertEqual(self.get_events(OutputBufferDrainedEvent), [])
+
+class TestOutputCork(_TransportTestCase):
+    settings = {"output_cork": True}
+    def test_responses_coalesced(self):
+        read_all(self.peer)
+        stats = self.transport.output_stats
+        self.peer.sendall(STREAM_HEAD
+                        + b"<message><body>test</body></message>" * 10)
+        self.transport.handle_read()
+        data = read_all(self.peer)
+        self.assertEqual(data.count(b"<message><body>test</body></message>"),
+                                                                        10)
+        new_stats = self.transport.output_stats
+        self.assertEqual(new_stats["send_calls"] - stats["send_calls"], 1)
+        self.assertEqual(new_stats["flushes"] - stats["flushes"], 1)
+        self.assertEqual(new_stats["buffers_flushed"]
+                                        - stats["buffers_flushed"], 10)
+        self.assertEqual(new_stats["bytes_sent"] - stats["bytes_sent"],
+                                                                    len(data))
+
+class TestOutputNoCork(_TransportTestCase):
+    def test_responses_not_coalesced(self):
+        read_all(self.peer)
+        stats = self.transport.output_stats
+        self.peer.sendall(STREAM_HEAD
+                        + b"<message><body>test</body></message>" * 10)
+        self.transport.handle_read()
+        data = read_all(self.peer)
+        self.assertEqual(data.count(b"<message><body>test</body></message>"),
+                                                                        10)
+        new_stats = self.transport.output_stats
+        self.assertEqual(new_stats["send_calls"] - stats["send_calls"], 10)
+
+class TestKeepalive(_TransportTestCase):
+    def test_activity(self):
+        read_all(self.peer)
+        last_read = self.transport.last_read
+        last_write = self.transport.last_write
+        self.assertIsNotNone(last_read)
+        time.sleep(0.01)
+        self.assertTrue(self.transport.send_keepalive())
+        self.assertEqual(read_all(self.peer), b" ")
+        self.assertGreater(self.transport.last_write, last_write)
+        self.assertEqual(self.transport.last_read, last_read)
+        self.peer.sendall(STREAM_HEAD)
+        self.transport.handle_read()
+        self.assertGreater(self.transport.last_read, last_read)
+        self.transport.send_stream_tail()
+        self.assertFalse(self.transport.send_keepalive())
+
+class TimedEchoHandler(EchoHandler):
+    """Echo handler taking some time for every element and accounting it
+    as `streambase.StreamBase` does."""
+    def __init__(self):
+        EchoHandler.__init__(self)
+        self.handler_time = 0.0
+    def stream_element(self, element):
+        start = time.time()
+        time.sleep(0.01)
+        EchoHandler.stream_element(self, element)
+        self.handler_time += time.time() - start
+    @property
+    def metrics(self):
+        return {"handler_time": self.handler_time}
+
+class TestMetrics(_TransportTestCase):
+    handler_class = TimedEchoHandler
+    def test_metrics(self):
+        read_all(self.peer)
+        metrics = self.transport.metrics
+        self.assertEqual(metrics["stanzas_sent"], 0)
+        self.assertEqual(metrics["stanzas_received"], 0)
+        self.assertGreaterEqual(metrics["age"], 0)
+        self.peer.sendall(STREAM_HEAD
+                        + b"<message><body>test</body></message>" * 5)
+        self.transport.handle_read()
+        data = read_all(self.peer)
+        metrics = self.transport.metrics
+        self.assertEqual(metrics["stanzas_received"], 5)
+        self.assertEqual(metrics["stanzas_sent"], 5)
+        self.assertEqual(metrics["bytes_received"], len(STREAM_HEAD)
+                        + len(b"<message><body>test</body></message>") * 5)
+        self.assertGreater(metrics["bytes_sent"], len(data))
+        self.assertGreaterEqual(metrics["recv_calls"], 1)
+        self.assertGreaterEqual(metrics["send_calls"], 6)
+        self.assertEqual(metrics["write_queue_length"], 0)
+        self.assertGreaterEqual(metrics["handler_time"], 0.05)
+        self.assertLess(metrics["parse_time"], metrics["handler_time"])
+        self.assertGreaterEqual(metrics["parse_time"], 0)
+
+    def test_collect(self):
+        main_loop = SelectMainLoop(self.transport.settings, [self.transport])
+        self.peer.sendall(STREAM_HEAD + b"<message/>" * 2)
+        self.transport.handle_read()
+        collected = collect_metrics(main_loop)
+        self.assertEqual(len(collected["connections"]), 1)
+        connection = collected["connections"][0]
+        self.assertEqual(connection["stanzas_received"], 2)
+        self.assertEqual(connection["stream"]["handler_time"],
+                                                    self.handler.handler_time)
+        self.assertEqual(collected["total"]["stanzas_received"], 2)
+        self.assertEqual(collected["total"]["stanzas_sent"], 2)
+        main_loop.remove_handler(self.transport)
+        self.assertEqual(collect_metrics(main_loop)["connections"], [])
+
+class TestPollOutputNotifier(_TransportTestCase):
+    def fill(self, count):
+        stanza = make_stanza(64 * 1024)
+        for dummy in range(count):
+            self.transport.send_element(stanza)
+
+    def test_dirty(self):
+        # pylint: disable=W0212
+        loop = PollMainLoop(None, [self.transport])
+        read_all(self.peer)
+        loop.loop_iteration(0)
+        self.assertEqual(loop._dirty, set())
+        self.fill(16)
+        self.assertTrue(self.transport.is_writable())
+        self.assertEqual(loop._dirty, set([self.transport]))
+        received = b""
+        for dummy in range(1000):
+            received += read_all(self.peer)
+            if not self.transport.is_writable():
+                break
+            loop.loop_iteration(0.1)
+        received += read_all(self.peer)
+        self.assertFalse(self.transport.is_writable())
+        self.assertEqual(received.count(b"</message>"), 16)
+        loop.remove_handler(self.transport)
+        self.fill(1)
+        self.assertEqual(loop._dirty, set())
+
+    def test_loop_output_coalesced(self):
+        loop = PollMainLoop(None, [self.transport])
+        loop.loop_iteration(0)
+        read_all(self.peer)
+        stats = self.transport.output_stats
+        self.peer.sendall(STREAM_HEAD
+                        + b"<message><body>test</body></message>" * 10)
+        loop.loop_iteration(1)
+        loop.loop_iteration(1)
+        data = read_all(self.peer)
+        self.assertEqual(data.count(b"<message><body>test</body></message>"),
+                                                                        10)
+        new_stats = self.transport.output_stats
+        self.assertEqual(new_stats["send_calls"] - stats["send_calls"], 1)
+        self.assertEqual(new_stats["buffers_flushed"]
+                                        - stats["buffers_flushed"], 10)
+        # outside of the loop
+        self.transport.send_element(make_stanza(10))
+        self.assertFalse(self.transport.is_writable())
+        loop.remove_handler(self.transport)
+
+    def test_wakeup(self):
+        loop = PollMainLoop(None, [self.transport])
+        loop.loop_iteration(0)
+        self.fill(16)
+        # now waiting for the socket writability
+        loop.loop_iteration(0.1)
+        thread = threading.Timer(0.2, self.fill, [1])
+        thread.start()
+        start = time.time()
+        loop.loop_iteration(10)
+        thread.join()
+        self.assertTrue(time.time() - start < 5)
+        loop.remove_handler(self.transport)
+
+class TestTraffic(_TransportTestCase):
+    settings = {"traffic_buffer_size": 1024}
+    def test_traffic(self):
+        read_all(self.peer)
+        self.peer.sendall(STREAM_HEAD + b"<message><body>test</body></message>")
+        self.transport.handle_read()
+        traffic = [(d, data) for (t, d, data) in self.transport.traffic]
+        self.assertEqual(traffic[0][0], "OUT")
+        self.assertTrue(traffic[0][1].startswith(b"<stream:stream"))
+        self.assertEqual(traffic[1], ("IN", STREAM_HEAD
+                                + b"<message><body>test</body></message>"))
+        self.assertEqual(traffic[2], ("OUT",
+                                    b"<message><body>test</body></message>"))
+
+    def test_dump_on_close(self):
+        handler = RecordingLogHandler()
+        level = TRAFFIC_LOGGER.level
+        TRAFFIC_LOGGER.addHandler(handler)
+        TRAFFIC_LOGGER.setLevel(logging.DEBUG)
+        try:
+            self.peer.sendall(STREAM_HEAD + b"<message/>")
+            self.transport.handle_read()
+            self.transport.close()
+            self.transport.dump_traffic(u"Again", once = True)
+        finally:
+            TRAFFIC_LOGGER.removeHandler(handler)
+            TRAFFIC_LOGGER.setLevel(level)
+        self.assertEqual(len(handler.records), 1)
+        message = handler.records[0].getMessage()
+        self.assertTrue(message.startswith(u"Disconnected, last"))
+        self.assertIn(u"<message/>", message)
+
+class TestTrafficDisabled(_TransportTestCase):
+    settings = {"traffic_buffer_size": 0}
+    def test_disabled(self):
+        self.transport.send_element(make_stanza(10))
+        self.assertIsNone(self.transport.traffic)
+
+class TestReadBuffer(_TransportTestCase):
+    settings = {
+            "echo": False,
+            "read_buffer_size": 1024,
+            "read_buffer_max_size": 16384,
+            }
+    def test_grow_and_shrink(self):
+        # pylint: disable=W0212
+        self.assertEqual(len(self.transport._read_buf), 1024)
+        body = u"x" * 1000
+        stanza = b"<message><body>" + body.encode("utf-8") + b"</body></message>"
+        self.peer.sendall(STREAM_HEAD + stanza * 50)
+        self.transport.handle_read()
+        self.assertEqual(len(self.handler.received), 50)
+        for element in self.handler.received:
+            self.assertEqual(element[0].text, body)
+        self.assertTrue(len(self.transport._read_buf) > 1024)
+        self.assertTrue(len(self.transport._read_buf) <= 16384)
+        for dummy in range(10):
+            self.peer.sendall(b"<message/>")
+            self.transport.handle_read()
+        self.assertEqual(len(self.handler.received), 60)
+        self.assertEqual(len(self.transport._read_buf), 1024)
+
+class TestReadBufferExpat(TestReadBuffer):
+    settings = dict(TestReadBuffer.settings, xml_parser = "expat")
+
+class TestReadBudgetBytes(_TransportTestCase):
+    settings = {
+            "echo": False,
+            "read_buffer_size": 1024,
+            "read_buffer_max_size": 1024,
+            "read_budget_bytes": 4096,
+            }
+    def test_budget(self):
+        stanza = b"<message><body>" + b"x" * 1000 + b"</body></message>"
+        self.peer.sendall(STREAM_HEAD + stanza * 20)
+        self.transport.handle_read()
+        stats = self.transport.input_stats
+        self.assertEqual(stats["bytes_received"], 4096)
+        self.assertEqual(stats["read_budget_exhausted"], 1)
+        self.assertTrue(self.transport.is_readable())
+        for dummy in range(20):
+            if len(self.handler.received) == 20:
+                break
+            self.transport.handle_read()
+        self.assertEqual(len(self.handler.received), 20)
+        stats = self.transport.input_stats
+        self.assertEqual(stats["stanzas_received"], 20)
+        self.assertTrue(stats["read_budget_exhausted"] > 1)
+
+    def test_validators(self):
+        for name in ("read_budget_bytes", "read_budget_stanzas"):
+            # pylint: disable=W0212
+            validator = XMPPSettings._defs[name].validator
+            self.assertEqual(validator("0"), 0)
+            with self.assertRaises(ValueError):
+                validator("-1")
+
+class TestReadBudgetStanzas(_TransportTestCase):
+    settings = {
+            "echo": False,
+            "read_buffer_size": 64,
+            "read_buffer_max_size": 64,
+            "read_budget_stanzas": 5,
+            }
+    def test_budget(self):
+        self.peer.sendall(STREAM_HEAD + b"<message><body>test</body></message>"
+                                                                        * 20)
+        self.transport.handle_read()
+        received = len(self.handler.received)
+        self.assertTrue(5 <= received < 20)
+        self.assertEqual(self.transport.input_stats["read_budget_exhausted"],
+                                                                            1)
+        for dummy in range(20):
+            if len(self.handler.received) == 20:
+                break
+            self.transport.handle_read()
+        self.assertEqual(len(self.handler.received), 20)
+
+class BlackHoleListener(object):
+    """Listening socket with a full accept backlog, so further connection
+    attempts get no response at all, like when the endpoint is unreachable.
+    """
+    def __init__(self, family = socket.AF_INET, host = "127.0.0.1"):
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.bind((host, 0))
+        self.sock.listen(0)
+        self.address = self.sock.getsockname()[:2]
+        self.fillers = []
+        for dummy in range(4):
+            filler = socket.socket(family, socket.SOCK_STREAM)
+            filler.setblocking(False)
+            try:
+                filler.connect(self.address)
+            except socket.error:
+                pass
+            self.fillers.append(filler)
+    def close(self):
+        for filler in self.fillers:
+            filler.close()
+        self.sock.close()
+
+class DeadEndpoint(object):
+    """Address with nothing listening, so connections are refused."""
+    def __init__(self, family = socket.AF_INET, host = "127.0.0.1"):
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.bind((host, 0))
+        self.address = sock.getsockname()[:2]
+        sock.close()
+    def close(self):
+        pass
+
+class GoodListener(object):
+    """Listening socket accepting connections."""
+    def __init__(self, family = socket.AF_INET, host = "127.0.0.1"):
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.bind((host, 0))
+        self.sock.listen(5)
+        self.address = self.sock.getsockname()[:2]
+    def close(self):
+        self.sock.close()
+
+class FakeResolver(Resolver):
+    """Resolver returning predefined results immediately."""
+    def __init__(self, srv, addresses):
+        self.srv = srv
+        self.addresses = addresses
+    def resolve_srv(self, domain, service, protocol, callback):
+        callback(self.srv.get((domain, service), []))
+    def resolve_address(self, hostname, callback, allow_cname = True):
+        callback(self.addresses.get(hostname, []))
+
+class ConnectTarget(EchoHandler):
+    """Stream handler recording `transport_connected` calls."""
+    def __init__(self):
+        EchoHandler.__init__(self)
+        self.connected = False
+    def transport_connected(self):
+        self.connected = True
+
+def _endpoint(endpoint_class, family):
+    if family == socket.AF_INET6:
+        return endpoint_class(family, "::1")
+    else:
+        return endpoint_class(family, "127.0.0.1")
+
+class _TestHappyEyeballs(unittest.TestCase):
+    """Tests for connection racing against local slow and dead endpoints."""
+    def setUp(self):
+        self.endpoints = []
+        self.transport = None
+
+    def tearDown(self):
+        if self.transport:
+            self.transport.close()
+        for endpoint in self.endpoints:
+            endpoint.close()
+
+    def endpoint(self, endpoint_class, family = socket.AF_INET):
+        endpoint = _endpoint(endpoint_class, family)
+        self.endpoints.append(endpoint)
+        return endpoint
+
+    def make_loop(self, settings, handlers):
+        raise NotImplementedError
+
+    def run_connect(self, srv, addresses, timeout = 5):
+        """Connect to 'example.org' via 'xmpp-client' SRV records.
+
+        :Return: (transport, time to connect)
+        """
+        resolver = FakeResolver(srv, addresses)
+        settings = XMPPSettings({
+                        "dns_resolver": resolver,
+                        "event_queue": Queue.Queue(),
+                        "connect_attempt_delay": 0.1,
+                        })
+        self.transport = TCPTransport(settings)
+        target = ConnectTarget()
+        target.transport = self.transport
+        self.transport.set_target(target)
+        loop = self.make_loop(settings, [self.transport])
+        start = time.time()
+        self.transport.connect(u"example.org", None, u"xmpp-client")
+        while not target.connected and time.time() - start < timeout:
+            loop.loop_iteration(0.1)
+        return target.connected, time.time() - start
+
+    def test_black_hole_srv_target(self):
+        # pylint: disable=W0212
+        slow = self.endpoint(BlackHoleListener)
+        good = self.endpoint(GoodListener)
+        srv = {("example.org", "xmpp-client"): [
+                                    ("slow.example.org", slow.address[1]),
+                                    ("good.example.org", good.address[1])]}
+        addresses = {
+                "slow.example.org": [(socket.AF_INET, slow.address[0])],
+                "good.example.org": [(socket.AF_INET, good.address[0])],
+                }
+        connected, duration = self.run_connect(srv, addresses)
+        self.assertTrue(connected)
+        self.assertTrue(duration < 2)
+        self.assertEqual(self.transport._dst_addr, good.address)
+        self.assertEqual(self.transport.auth_properties["service-hostname"],
+                                                        "good.example.org")
+
+    @unittest.skipIf(not socket.has_ipv6, "No IPv6 support")
+    def test_black_hole_family(self):
+        try:
+            slow = self.endpoint(BlackHoleListener, socket.AF_INET6)
+        except socket.error:
+            self.skipTest("IPv6 loopback not available")
+        # pylint: disable=W0212
+        good = self.endpoint(GoodListener, socket.AF_INET)
+        srv = {("example.org", "xmpp-client"): [
+                                    ("slow.example.org", slow.address[1]),
+                                    ("good.example.org", good.address[1])]}
+        addresses = {
+                "slow.example.org": [(socket.AF_INET6, slow.address[0])],
+                "good.example.org": [(socket.AF_INET, good.address[0])],
+                }
+        connected, duration = self.run_connect(srv, addresses)
+        self.assertTrue(connected)
+        self.assertTrue(duration < 2)
+        self.assertEqual(self.transport._dst_addr, good.address)
+
+    def test_dead_endpoints(self):
+        # pylint: disable=W0212
+        dead1 = self.endpoint(DeadEndpoint)
+        dead2 = self.endpoint(DeadEndpoint)
+        dead3 = self.endpoint(DeadEndpoint)
+        good = self.endpoint(GoodListener)
+        srv = {("example.org", "xmpp-client"): [
+                                    ("dead1.example.org", dead1.address[1]),
+                                    ("dead2.example.org", dead2.address[1]),
+                                    ("dead3.example.org", dead3.address[1]),
+                                    ("good.example.org", good.address[1])]}
+        addresses = {
+                "dead1.example.org": [(socket.AF_INET, dead1.address[0])],
+                "dead2.example.org": [(socket.AF_INET, dead2.address[0])],
+                "dead3.example.org": [(socket.AF_INET, dead3.address[0])],
+                "good.example.org": [(socket.AF_INET, good.address[0])],
+                }
+        connected, duration = self.run_connect(srv, addresses)
+        self.assertTrue(connected)
+        self.assertTrue(duration < 2)
+        self.assertEqual(self.transport._dst_addr, good.address)
+
+    def test_all_dead(self):
+        # pylint: disable=W0212
+        dead1 = self.endpoint(DeadEndpoint)
+        dead2 = self.endpoint(DeadEndpoint)
+        srv = {("example.org", "xmpp-client"): [
+                                    ("dead1.example.org", dead1.address[1]),
+                                    ("dead2.example.org", dead2.address[1])]}
+        addresses = {
+                "dead1.example.org": [(socket.AF_INET, dead1.address[0])],
+                "dead2.example.org": [(socket.AF_INET, dead2.address[0])],
+                }
+        with self.assertRaises(socket.error):
+            self.run_connect(srv, addresses)
+        self.assertEqual(self.transport._state, "aborted")
+        self.assertEqual(self.transport._connect_attempts, [])
+
+UNROUTABLE_ADDRESS = ("255.255.255.255", 5222)
+
+def _connect_fails_immediately(address):
+    """Check if a non-blocking connect to `address` fails synchronously."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setblocking(False)
+    try:
+        sock.connect(address)
+    except socket.error, err:
+        return err.args[0] not in (errno.EINPROGRESS, errno.EWOULDBLOCK)
+    finally:
+        sock.close()
+    return False
+
+class TestConnectAttempts(unittest.TestCase):
+    def setUp(self):
+        self.slow = BlackHoleListener()
+        self.good = GoodListener()
+        settings = XMPPSettings({
+                        "event_queue": Queue.Queue(),
+                        "connect_attempt_delay": 60,
+                        })
+        self.transport = TCPTransport(settings)
+        target = ConnectTarget()
+        target.transport = self.transport
+        self.transport.set_target(target)
+
+    def tearDown(self):
+        self.transport.close()
+        self.slow.close()
+        self.good.close()
+
+    def test_unroutable(self):
+        # an attempt failing synchronously should not delay the next one
+        # pylint: disable=W0212
+        if not _connect_fails_immediately(UNROUTABLE_ADDRESS):
+            self.skipTest("Connect to {0} does not fail immediately"
+                                                .format(UNROUTABLE_ADDRESS))
+        transport = self.transport
+        with transport.lock:
+            transport._dst_addrs = [
+                            (socket.AF_INET, self.slow.address, None),
+                            (socket.AF_INET, UNROUTABLE_ADDRESS, None),
+                            (socket.AF_INET, self.good.address, None)]
+            transport._set_state("connect")
+            transport._race_connect()
+            self.assertEqual(len(transport._connect_attempts), 1)
+            # the connection attempt delay has passed
+            transport._next_attempt_time = 0
+            transport._race_connect()
+            self.assertEqual(transport._dst_addrs, [])
+            self.assertTrue(transport._state == "connected" or
+                            transport._connect_attempts[-1][2]
+                                                    == self.good.address)
+
+class FakeSSLSocket(object):
+    """Stub :std:`ssl.SSLSocket` with the session resumption interface
+    (not available in the :std:`ssl` module of Python 2.7)."""
+    def __init__(self, reused = False, reject = False):
+        self._session = None
+        self.session_reused = reused
+        self.reject = reject
+        self.handshake_error = None
+    @property
+    def session(self):
+        return self._session
+    @session.setter
+    def session(self, session):
+        if self.reject:
+            raise ValueError("Session refers to a different SSLContext")
+        self._session = session
+    def do_handshake(self):
+        if self.handshake_error:
+            raise self.handshake_error # pylint: disable=E0702
+    @staticmethod
+    def cipher():
+        return ("AES128-SHA", "TLSv1.2", 128)
+    @staticmethod
+    def getpeercert(binary_form = False):
+        # pylint: disable=W0613
+        return None
+    @staticmethod
+    def get_channel_binding(cb_type = "tls-unique"):
+        # pylint: disable=W0613
+        return b"tls-unique-data"
+
+SESSION_KEY = (u"xmpp.example.org", 5222, u"example.org")
+
+class TestTLSSessionHooks(unittest.TestCase):
+    # pylint: disable=W0212
+    def setUp(self):
+        self.supported = transporttls.SESSION_RESUMPTION_SUPPORTED
+        transporttls.SESSION_RESUMPTION_SUPPORTED = True
+        self.event_queue = Queue.Queue()
+        self.cache = TLSSessionCache()
+        settings = XMPPSettings({
+                        "event_queue": self.event_queue,
+                        "tls_session_cache": self.cache,
+                        })
+        self.transport = TCPTransport(settings)
+        self.transport._dst_hostname = u"xmpp.example.org"
+        self.transport._dst_addr = ("192.0.2.1", 5222)
+
+    def tearDown(self):
+        transporttls.SESSION_RESUMPTION_SUPPORTED = self.supported
+        self.transport._socket = None
+        self.transport.close()
+
+    def handshake(self, sock):
+        """Run the session cache hooks of a client TLS handshake
+        over `sock`."""
+        transport = self.transport
+        with transport.lock:
+            transport._socket = sock
+            transport._offer_tls_session(u"example.org")
+            transport._tls_state = "tls-handshake"
+            transport._continue_tls_handshake()
+
+    def get_cache_events(self):
+        events = []
+        while not self.event_queue.empty():
+            event = self.event_queue.get_nowait()
+            if isinstance(event, TLSSessionCacheEvent):
+                events.append(event)
+        return events
+
+    def test_miss(self):
+        sock = FakeSSLSocket()
+        sock._session = FakeSession("s1")
+        self.handshake(sock)
+        self.assertEqual(self.transport._tls_session_key, SESSION_KEY)
+        self.assertIs(self.cache.get(SESSION_KEY), sock._session)
+        event, = self.get_cache_events()
+        self.assertEqual(event.key, SESSION_KEY)
+        self.assertFalse(event.hit)
+        self.assertFalse(event.resumed)
+        self.assertEqual(event.misses, 1)
+
+    def test_resumed(self):
+        session = FakeSession("s1")
+        self.cache.put(SESSION_KEY, session)
+        sock = FakeSSLSocket(reused = True)
+        self.handshake(sock)
+        self.assertIs(sock.session, session)
+        event, = self.get_cache_events()
+        self.assertTrue(event.hit)
+        self.assertTrue(event.resumed)
+        self.assertEqual(event.hits, 1)
+
+    def test_rejected(self):
+        self.cache.put(SESSION_KEY, FakeSession("s1"))
+        sock = FakeSSLSocket(reject = True)
+        with self.transport.lock:
+            self.transport._socket = sock
+            self.transport._offer_tls_session(u"example.org")
+        self.assertFalse(self.transport._tls_session_hit)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_failed_handshake(self):
+        self.cache.put(SESSION_KEY, FakeSession("s1"))
+        sock = FakeSSLSocket()
+        sock.handshake_error = ssl.SSLError(ssl.SSL_ERROR_SSL, "failed")
+        with self.assertRaises(ssl.SSLError):
+            self.handshake(sock)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_not_supported(self):
+        transporttls.SESSION_RESUMPTION_SUPPORTED = False
+        self.cache.put(SESSION_KEY, FakeSession("s1"))
+        sock = FakeSSLSocket()
+        self.handshake(sock)
+        self.assertIsNone(self.transport._tls_session_key)
+        self.assertIsNone(sock.session)
+        self.assertEqual(self.get_cache_events(), [])
+
+class TestHappyEyeballsSelect(_TestHappyEyeballs):
+    def make_loop(self, settings, handlers):
+        return SelectMainLoop(settings, handlers)
+
+class TestHappyEyeballsPoll(_TestHappyEyeballs):
+    def make_loop(self, settings, handlers):
+        return PollMainLoop(settings, handlers)
+
+class FailingResolver(Resolver):
+    """Resolver failing the test when used."""
+    def resolve_srv(self, domain, service, protocol, callback):
+        raise AssertionError("SRV look-up requested")
+    def resolve_address(self, hostname, callback, allow_cname = True):
+        raise AssertionError("Address look-up requested")
+
+@unittest.skipIf(not hasattr(socket, "AF_UNIX"), "No Unix domain sockets")
+class TestUnixSocket(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "xmpp.sock")
+        self.accepted = []
+        self.listener = None
+        self.transport = None
+
+    def tearDown(self):
+        if self.transport:
+            self.transport.close()
+        if self.listener:
+            self.listener.close()
+        for sock, _unused in self.accepted:
+            sock.close()
+        shutil.rmtree(self.tmpdir)
+
+    def accept(self, sock, address):
+        self.accepted.append((sock, address))
+
+    def test_socket_in_use(self):
+        self.listener = TCPListener(socket.AF_UNIX, self.path, self.accept)
+        with self.assertRaises(socket.error) as context:
+            TCPListener(socket.AF_UNIX, self.path, self.accept)
+        self.assertEqual(context.exception.args[0], errno.EADDRINUSE)
+        self.assertTrue(os.path.exists(self.path))
+
+    def test_close_replaced(self):
+        self.listener = TCPListener(socket.AF_UNIX, self.path, self.accept)
+        os.unlink(self.path)
+        other = TCPListener(socket.AF_UNIX, self.path, self.accept)
+        try:
+            self.listener.close()
+            self.assertTrue(os.path.exists(self.path))
+        finally:
+            other.close()
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_connect(self):
+        settings = XMPPSettings({
+                        "dns_resolver": FailingResolver(),
+                        "event_queue": Queue.Queue(),
+                        })
+        # a stale socket file does not prevent binding
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(self.path)
+        stale.close()
+        self.listener = TCPListener(socket.AF_UNIX, self.path, self.accept)
+        self.transport = TCPTransport(settings)
+        target = ConnectTarget()
+        target.transport = self.transport
+        self.transport.set_target(target)
+        loop = SelectMainLoop(settings, [self.listener, self.transport])
+        self.transport.connect_unix(self.path)
+        timeout = time.time() + 5
+        while not (target.connected and self.accepted) \
+                                                and time.time() < timeout:
+            loop.loop_iteration(0.1)
+        self.assertTrue(target.connected)
+        self.assertEqual(len(self.accepted), 1)
+        props = self.transport.auth_properties
+        self.assertEqual(props["security-layer"], "UNIX")
+        self.assertNotIn("remote-ip", props)
+        if "peer-credentials" in props:
+            # the same process at both ends
+            self.assertEqual(props["peer-credentials"]["pid"], os.getpid())
+            self.assertEqual(props["peer-credentials"]["uid"], os.getuid())
+
+        server = TCPTransport(settings, sock = self.accepted[0][0])
+        props = server.auth_properties
+        self.assertEqual(props["security-layer"], "UNIX")
+        if "peer-credentials" not in props:
+            self.skipTest("Peer credentials not available")
+        self.assertEqual(props["peer-credentials"]["gid"], os.getgid())
+        authenticator = server_authenticator_factory("EXTERNAL", None)
+        result = authenticator.start(props, b"")
+        self.assertIsInstance(result, Success)
+        self.assertEqual(result.properties["username"],
+                                        pwd.getpwuid(os.getuid()).pw_name)
+        self.assertIsNone(result.properties["authzid"])
+        server.close()
+        self.listener.close()
+        self.assertFalse(os.path.exists(self.path))
+
+# pylint: disable=W0611
+from pyxmpp2.test._support import load_tests, setup_logging
+
+def setUpModule():
+    setup_logging()
+
+if __name__ == "__main__":
+    unittest.main()
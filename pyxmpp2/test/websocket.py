@@ -0,0 +1,356 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+# pylint: disable=C0111
+
+"""Tests for pyxmpp2.websocket"""
+
+import unittest
+import socket
+import struct
+import re
+import time
+import Queue
+
+from xml.etree.ElementTree import Element, SubElement
+
+from pyxmpp2.etree import ElementTree
+from pyxmpp2.websocket import WebSocketTransport, make_frame, apply_mask
+from pyxmpp2.websocket import websocket_accept_key
+from pyxmpp2.websocket import OP_TEXT, OP_CLOSE, OP_PING, OP_PONG, OP_BINARY
+from pyxmpp2.websocket import OP_CONTINUATION
+from pyxmpp2.constants import STREAM_ROOT_TAG
+from pyxmpp2.streambase import StreamBase
+from pyxmpp2.streamevents import * # pylint: disable=W0614,W0401
+from pyxmpp2.exceptions import PyXMPPIOError
+from pyxmpp2.xmppparser import XMLStreamHandler
+from pyxmpp2.settings import XMPPSettings
+
+from pyxmpp2.test._util import EventRecorder
+from pyxmpp2.test._util import InitiatorSelectTestCase
+
+HANDSHAKE_REQUEST = (b"GET /xmpp-websocket HTTP/1.1\r\n"
+                        b"Host: example.org\r\n"
+                        b"Upgrade: websocket\r\n"
+                        b"Connection: Upgrade\r\n"
+                        b"Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\n"
+                        b"Sec-WebSocket-Version: 13\r\n"
+                        b"Sec-WebSocket-Protocol: xmpp\r\n"
+                        b"\r\n")
+
+OPEN = (b'<open xmlns="urn:ietf:params:xml:ns:xmpp-framing"'
+                                    b' to="example.org" version="1.0"/>')
+SERVER_OPEN = (b'<open xmlns="urn:ietf:params:xml:ns:xmpp-framing"'
+                        b' from="127.0.0.1" id="abc" version="1.0"/>')
+CLOSE = b'<close xmlns="urn:ietf:params:xml:ns:xmpp-framing"/>'
+FEATURES = (b'<stream:features'
+            b' xmlns:stream="http://etherx.jabber.org/streams"/>')
+MESSAGE = b'<message xmlns="jabber:client"><body>test</body></message>'
+
+TIMEOUT = 1.0 # seconds
+
+def parse_frames(data):
+    """Decode WebSocket frames.
+
+    :Return: list of (fin, opcode, masked, payload) tuples and the rest of
+        the data"""
+    frames = []
+    while len(data) >= 2:
+        byte1, byte2 = struct.unpack("!BB", data[:2])
+        length = byte2 & 0x7f
+        pos = 2
+        if length == 126:
+            length = struct.unpack("!H", data[2:4])[0]
+            pos = 4
+        elif length == 127:
+            length = struct.unpack("!Q", data[2:10])[0]
+            pos = 10
+        masked = bool(byte2 & 0x80)
+        if masked:
+            key = data[pos:pos + 4]
+            pos += 4
+        if len(data) < pos + length:
+            break
+        payload = data[pos:pos + length]
+        if masked:
+            payload = apply_mask(payload, key)
+        frames.append((bool(byte1 & 0x80), byte1 & 0x0f, masked, payload))
+        data = data[pos + length:]
+    return frames, data
+
+def read_all(sock):
+    """Read everything available from a non-blocking socket."""
+    data = b""
+    while True:
+        try:
+            chunk = sock.recv(65536)
+        except socket.error:
+            break
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+class TestFraming(unittest.TestCase):
+    def test_mask(self):
+        key = b"\x01\x02\xff\x00"
+        for size in (0, 1, 3, 4, 5, 1000):
+            data = b"\x00x\xff" * size
+            masked = apply_mask(data, key)
+            self.assertEqual(len(masked), len(data))
+            if data:
+                self.assertNotEqual(masked, data)
+            self.assertEqual(apply_mask(masked, key), data)
+
+    def test_frame_lengths(self):
+        for size in (0, 125, 126, 65535, 65536):
+            payload = b"x" * size
+            for mask in (False, True):
+                frame = make_frame(OP_TEXT, payload, mask)
+                frames, rest = parse_frames(frame)
+                self.assertEqual(rest, b"")
+                self.assertEqual(frames, [(True, OP_TEXT, mask, payload)])
+
+    def test_accept_key(self):
+        # the example from RFC 6455
+        self.assertEqual(websocket_accept_key(b"dGhlIHNhbXBsZSBub25jZQ=="),
+                                        b"s3pPLMBiTxaQ9kYGzzhZRbK+xOo=")
+
+class RecordingHandler(XMLStreamHandler):
+    """Stream handler recording the content received."""
+    def __init__(self):
+        XMLStreamHandler.__init__(self)
+        self.root = None
+        self.received = []
+        self.ended = False
+        self.errors = []
+        self.exceeded = []
+    def stream_start(self, element):
+        self.root = element
+    def stream_element(self, element):
+        self.received.append(element)
+    def stream_end(self):
+        self.ended = True
+    def stream_parse_error(self, descr):
+        self.errors.append(descr)
+    def stream_limit_exceeded(self, descr):
+        self.exceeded.append(descr)
+
+@unittest.skipIf(not hasattr(socket, "socketpair"), "No socketpair()")
+class TestServerSide(unittest.TestCase):
+    """Tests of the `WebSocketTransport` on the server side of a local
+    socket pair."""
+    def setUp(self):
+        self.event_queue = Queue.Queue()
+        settings = XMPPSettings({"websocket_max_message_size": 4096})
+        settings["event_queue"] = self.event_queue
+        sock, self.peer = socket.socketpair()
+        self.peer.setblocking(False)
+        self.transport = WebSocketTransport(settings, sock = sock)
+        self.handler = RecordingHandler()
+        self.transport.set_target(self.handler)
+
+    def tearDown(self):
+        self.transport.close()
+        self.peer.close()
+
+    def handshake(self):
+        self.peer.sendall(HANDSHAKE_REQUEST)
+        self.transport.handle_read()
+        response = read_all(self.peer)
+        self.assertTrue(response.startswith(b"HTTP/1.1 101 "))
+        self.assertTrue(b"\r\nSec-WebSocket-Accept: "
+                            b"s3pPLMBiTxaQ9kYGzzhZRbK+xOo=\r\n" in response)
+        self.assertTrue(b"\r\nSec-WebSocket-Protocol: xmpp\r\n" in response)
+        self.assertTrue(response.endswith(b"\r\n\r\n"))
+
+    def test_handshake_rejected(self):
+        self.peer.sendall(HANDSHAKE_REQUEST.replace(b"xmpp", b"mqtt"))
+        with self.assertRaises(PyXMPPIOError):
+            self.transport.handle_read()
+        response = read_all(self.peer)
+        self.assertTrue(response.startswith(b"HTTP/1.1 400 "))
+
+    def test_receive(self):
+        self.handshake()
+        data = make_frame(OP_TEXT, OPEN, True)
+        data += make_frame(OP_PING, b"ping", True)
+        # a fragmented message
+        data += struct.pack("!BB", OP_TEXT, 0x80 | 10) + b"\x00" * 4
+        data += MESSAGE[:10]
+        data += struct.pack("!BB", 0x80 | OP_CONTINUATION,
+                                    0x80 | (len(MESSAGE) - 10)) + b"\x00" * 4
+        data += MESSAGE[10:]
+        data += make_frame(OP_TEXT, MESSAGE, True)
+        # split in the middle of a frame header
+        self.peer.sendall(data[:3])
+        self.transport.handle_read()
+        self.assertIsNone(self.handler.root)
+        self.peer.sendall(data[3:])
+        self.transport.handle_read()
+        self.assertEqual(self.handler.root.tag, STREAM_ROOT_TAG)
+        self.assertEqual(self.handler.root.get("to"), "example.org")
+        self.assertEqual(self.handler.root.get("version"), "1.0")
+        self.assertEqual(len(self.handler.received), 2)
+        for element in self.handler.received:
+            self.assertEqual(element.tag, "{jabber:client}message")
+            self.assertEqual(element[0].text, "test")
+        self.assertEqual(self.transport.input_stats["stanzas_received"], 2)
+        frames = parse_frames(read_all(self.peer))[0]
+        self.assertEqual(frames, [(True, OP_PONG, False, b"ping")])
+
+        self.peer.sendall(make_frame(OP_TEXT, CLOSE, True))
+        self.transport.handle_read()
+        self.assertTrue(self.handler.ended)
+
+    def test_send(self):
+        self.handshake()
+        self.transport.send_stream_head(u"jabber:client", u"example.org",
+                                    None, u"abc", language = u"en")
+        element = Element("{jabber:client}message")
+        SubElement(element, "{jabber:client}body").text = u"test"
+        self.transport.send_element(element)
+        features = Element("{http://etherx.jabber.org/streams}features")
+        self.transport.send_element(features)
+        self.transport.send_stream_tail()
+        frames = parse_frames(read_all(self.peer))[0]
+        self.assertEqual([frame[:3] for frame in frames],
+                                    [(True, OP_TEXT, False)] * 4
+                                                + [(True, OP_CLOSE, False)])
+        element = ElementTree.XML(frames[0][3])
+        self.assertEqual(element.tag,
+                                "{urn:ietf:params:xml:ns:xmpp-framing}open")
+        self.assertEqual(element.get("from"), "example.org")
+        self.assertEqual(element.get("id"), "abc")
+        self.assertEqual(element.get("version"), "1.0")
+        self.assertEqual(element.get(
+                    "{http://www.w3.org/XML/1998/namespace}lang"), "en")
+        for frame, expected in zip(frames[1:4], [MESSAGE, FEATURES, CLOSE]):
+            self.assertEqual(ElementTree.tostring(ElementTree.XML(frame[3])),
+                            ElementTree.tostring(ElementTree.XML(expected)))
+        self.assertTrue(frames[2][3].startswith(b"<stream:features "))
+        self.assertEqual(frames[4][3], struct.pack("!H", 1000))
+
+    def test_unmasked_frame(self):
+        self.handshake()
+        self.peer.sendall(make_frame(OP_TEXT, OPEN, False))
+        with self.assertRaises(PyXMPPIOError):
+            self.transport.handle_read()
+        frames = parse_frames(read_all(self.peer))[0]
+        self.assertEqual(frames, [(True, OP_CLOSE, False,
+                                                    struct.pack("!H", 1002))])
+
+    def test_binary_frame(self):
+        self.handshake()
+        self.peer.sendall(make_frame(OP_BINARY, OPEN, True))
+        with self.assertRaises(PyXMPPIOError):
+            self.transport.handle_read()
+
+    def test_message_too_big(self):
+        self.handshake()
+        self.peer.sendall(make_frame(OP_TEXT, b" " * 5000, True))
+        with self.assertRaises(PyXMPPIOError):
+            self.transport.handle_read()
+        frames = parse_frames(read_all(self.peer))[0]
+        self.assertEqual(frames, [(True, OP_CLOSE, False,
+                                                    struct.pack("!H", 1009))])
+
+    def test_parse_error(self):
+        self.handshake()
+        self.peer.sendall(make_frame(OP_TEXT, b"<open", True))
+        self.transport.handle_read()
+        self.assertEqual(len(self.handler.errors), 1)
+
+    def test_two_elements(self):
+        self.handshake()
+        self.peer.sendall(make_frame(OP_TEXT, MESSAGE + MESSAGE, True))
+        self.transport.handle_read()
+        self.assertEqual(len(self.handler.errors), 1)
+        self.assertEqual(self.handler.received, [])
+
+    def test_limit_exceeded(self):
+        self.handshake()
+        self.transport.settings["max_stanza_depth"] = 1
+        self.peer.sendall(make_frame(OP_TEXT, MESSAGE, True))
+        self.transport.handle_read()
+        self.assertEqual(self.handler.exceeded,
+                                        [u"Elements nested deeper than 1"])
+        self.assertEqual(self.handler.received, [])
+
+class TestInitiator(InitiatorSelectTestCase):
+    def start_transport(self, handlers):
+        self.transport = WebSocketTransport()
+        self.make_loop(handlers + [self.transport])
+
+    def connect_transport(self):
+        addr, port = self.start_server()
+        self.transport.connect_url(u"ws://{0}:{1}/ws/xmpp".format(addr, port))
+
+    def wait_frames(self, count, timeout = TIMEOUT):
+        """Run the main loop until `count` frames are received by the
+        server."""
+        timeout = time.time() + timeout
+        while time.time() < timeout:
+            self.wait_short()
+            frames = parse_frames(self.server.rdata)[0]
+            if len(frames) >= count:
+                return frames
+        return None
+
+    def test_connect(self):
+        handler = EventRecorder()
+        self.stream = StreamBase(u"jabber:client", None, [handler])
+        self.start_transport([handler])
+        self.stream.initiate(self.transport, u"127.0.0.1")
+        self.connect_transport()
+        request = self.wait(expect = re.compile(br"(.*\r\n\r\n)", re.DOTALL))
+        self.assertIsNotNone(request)
+        self.assertTrue(request.startswith(b"GET /ws/xmpp HTTP/1.1\r\n"))
+        self.assertTrue(b"\r\nSec-WebSocket-Protocol: xmpp\r\n" in request)
+        key = re.search(br"\r\nSec-WebSocket-Key: ([^\r]*)\r\n",
+                                                            request).group(1)
+        # nothing else until the handshake is completed
+        self.wait_short()
+        self.assertEqual(self.server.rdata, request)
+        self.server.rdata = b""
+        self.server.write(b"HTTP/1.1 101 Switching Protocols\r\n"
+                        b"Upgrade: websocket\r\n"
+                        b"Connection: Upgrade\r\n"
+                        b"Sec-WebSocket-Accept: "
+                            + websocket_accept_key(key) + b"\r\n"
+                        b"Sec-WebSocket-Protocol: xmpp\r\n"
+                        b"\r\n" + make_frame(OP_TEXT, SERVER_OPEN))
+        frames = self.wait_frames(1)
+        self.assertIsNotNone(frames)
+        fin, opcode, masked, payload = frames[0]
+        self.assertTrue(fin and masked)
+        self.assertEqual(opcode, OP_TEXT)
+        element = ElementTree.XML(payload)
+        self.assertEqual(element.tag,
+                                "{urn:ietf:params:xml:ns:xmpp-framing}open")
+        self.assertEqual(element.get("to"), "127.0.0.1")
+        self.server.write(make_frame(OP_TEXT, FEATURES))
+        self.wait_short()
+        self.wait_short()
+        self.assertEqual(self.stream.stream_id, "abc")
+        self.stream.disconnect()
+        frames = self.wait_frames(3)
+        self.assertIsNotNone(frames)
+        self.assertEqual(ElementTree.XML(frames[1][3]).tag,
+                                "{urn:ietf:params:xml:ns:xmpp-framing}close")
+        self.assertEqual(frames[2][1], OP_CLOSE)
+        self.server.write(make_frame(OP_TEXT, CLOSE)
+                                        + make_frame(OP_CLOSE, frames[2][3]))
+        self.server.disconnect()
+        self.wait()
+        event_classes = [e.__class__ for e in handler.events_received]
+        self.assertEqual(event_classes, [ConnectingEvent, ConnectedEvent,
+                    StreamConnectedEvent, GotFeaturesEvent, DisconnectedEvent])
+
+# pylint: disable=W0611
+from pyxmpp2.test._support import load_tests, setup_logging
+
+def setUpModule():
+    setup_logging()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,9 +3,11 @@
 # pylint: disable=C0111
 
 import unittest
+from io import BytesIO
 from xml.etree import ElementTree
 
 from pyxmpp2.xmppserializer import XMPPSerializer
+from pyxmpp2.xmppparser import LazyElement
 
 from pyxmpp2.utils import xml_elements_equal
 
@@ -69,6 +71,90 @@ class TestXMPPSerializer(unittest.TestCase):
         # prefix for other namespace child
         self.assertTrue("<sub2" in output)
 
+    def test_emit_lazy_stanza(self):
+        serializer = XMPPSerializer("jabber:client")
+        serializer.emit_head("from", "to")
+        raw = b"<message  to='a@b'><body>\xc5\xbc</body></message >"
+        stanza = LazyElement("{jabber:client}message", {"to": "a@b"}, raw,
+                    ((None, "jabber:server"),
+                    ("stream", "http://etherx.jabber.org/streams")))
+        output = serializer.emit_stanza(stanza)
+        self.assertEqual(output, raw.decode("utf-8"))
+        self.assertFalse(stanza.materialized)
+
+    def test_emit_lazy_stanza_other_prefix(self):
+        serializer = XMPPSerializer("jabber:client")
+        serializer.emit_head("from", "to")
+        raw = b"<message><s:x/></message>"
+        stanza = LazyElement("{jabber:client}message", {}, raw,
+                    ((None, "jabber:client"),
+                    ("s", "http://etherx.jabber.org/streams")))
+        output = serializer.emit_stanza(stanza)
+        self.assertTrue(stanza.materialized)
+        self.assertEqual(output, u"<message><stream:x/></message>")
+
+    def test_write_stanza(self):
+        def make_serializer():
+            serializer = XMPPSerializer("jabber:client",
+                                        {"http://example.org/ns3": "ex"})
+            serializer.emit_head("from", "to")
+            return serializer
+        for data in WRITE_STANZAS:
+            stanza = ElementTree.XML(data)
+            expected = make_serializer().emit_stanza(stanza).encode("utf-8")
+            output = bytearray(b"x")
+            make_serializer().write_stanza(stanza, output)
+            self.assertEqual(bytes(output), b"x" + expected)
+            output = BytesIO()
+            make_serializer().write_stanza(stanza, output)
+            self.assertEqual(output.getvalue(), expected)
+
+    def test_write_control_characters(self):
+        serializer = XMPPSerializer("jabber:client")
+        serializer.emit_head("from", "to")
+        stanza = ElementTree.Element("{jabber:client}message",
+                                            {"to": u"a\x01\t\"'b"})
+        body = ElementTree.SubElement(stanza, "{jabber:client}body")
+        body.text = u"\x00<\u017c>\x1f&\n"
+        expected = serializer.emit_stanza(stanza).encode("utf-8")
+        output = bytearray()
+        serializer.write_stanza(stanza, output)
+        self.assertEqual(bytes(output), expected)
+        self.assertEqual(bytes(output),
+                    u"<message to=\"a\ufffd&#9;&quot;'b\"><body>"
+                    u"\ufffd&lt;\u017c&gt;\ufffd&amp;\n</body></message>"
+                                                        .encode("utf-8"))
+
+    def test_write_lazy_stanza(self):
+        serializer = XMPPSerializer("jabber:client")
+        serializer.emit_head("from", "to")
+        raw = b"<message  to='a@b'><body>\xc5\xbc</body></message >"
+        stanza = LazyElement("{jabber:client}message", {"to": "a@b"}, raw,
+                    ((None, "jabber:client"),
+                    ("stream", "http://etherx.jabber.org/streams")))
+        output = bytearray()
+        serializer.write_stanza(stanza, output)
+        self.assertEqual(bytes(output), raw)
+        self.assertFalse(stanza.materialized)
+
+WRITE_STANZAS = [
+    b"<message xmlns='jabber:client'/>",
+    b"<message xmlns='jabber:server' to='a@b' type='chat'>"
+            b"<body>Body &amp; &lt;more&gt; \xc5\xbc\xc3\xb3\xc5\x82w</body>"
+            b"<sub xmlns='http://example.org/ns'>text<sub1 />tail"
+                b"<sub2 xmlns='http://example.org/ns2' a='&quot;' b=\"'\""
+                    b" c='&quot;&apos;&#10;&#13;&#9;&lt;'/>"
+            b"</sub>"
+        b"</message>",
+    b"<iq xmlns='jabber:client' xmlns:a='http://example.org/a' id='1'"
+                            b" a:attr='x' xml:lang='pl'>"
+            b"<ex:x xmlns:ex='http://example.org/ns3'><ex:y/></ex:x>"
+            b"<x xmlns='jabber:iq:roster' a:y='1' xmlns:b='urn:b' b:z='2'>"
+                b"<item>\n  </item> \n"
+            b"</x>"
+        b"</iq>",
+    ]
+
 # pylint: disable=W0611
 from pyxmpp2.test._support import load_tests, setup_logging
 
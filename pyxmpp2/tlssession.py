@@ -0,0 +1,166 @@
+#
+# (C) Copyright 2011 Jacek Konieczny <jajcus@jajcus.net>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version
+# 2.1 as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+
+"""TLS session cache for TLS session resumption on reconnects.
+
+Session resumption requires :std:`ssl.SSLSession` support in the Python
+standard library (Python 3.6 or newer). When it is not available the
+cache stays empty and every handshake is a full one.
+"""
+
+from __future__ import absolute_import, division
+
+__docformat__ = "restructuredtext en"
+
+import ssl
+import time
+import threading
+import logging
+
+from collections import OrderedDict
+
+from .settings import XMPPSettings
+
+logger = logging.getLogger("pyxmpp2.tlssession")
+
+SESSION_RESUMPTION_SUPPORTED = hasattr(ssl, "SSLSession")
+
+class TLSSessionCache(object):
+    """Bounded cache of TLS sessions of outgoing connections, keyed by
+    (service host, port, SNI hostname) tuples.
+
+    Least recently used sessions are dropped when the cache is full.
+    Expired sessions are dropped when looked up.
+
+    :Ivariables:
+        - `max_size`: maximum number of sessions stored
+        - `hits`: number of successful lookups
+        - `misses`: number of lookups which found no usable session
+        - `_sessions`: the sessions stored
+        - `_lock`: the lock protecting the object
+    :Types:
+        - `max_size`: `int`
+        - `hits`: `int`
+        - `misses`: `int`
+        - `_sessions`: :std:`collections.OrderedDict`
+        - `_lock`: :std:`threading.RLock`
+    """
+    def __init__(self, settings = None):
+        """Initialize the `TLSSessionCache` object.
+
+        :Parameters:
+            - `settings`: settings, only the :r:`tls_session_cache_size
+              setting` is used.
+        :Types:
+            - `settings`: `XMPPSettings`
+        """
+        if settings is None:
+            settings = XMPPSettings()
+        self.max_size = settings["tls_session_cache_size"]
+        self.hits = 0
+        self.misses = 0
+        self._sessions = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def get(self, key):
+        """Get a session for reuse.
+
+        :Parameters:
+            - `key`: (host, port, SNI hostname) tuple
+        :Types:
+            - `key`: `tuple`
+
+        :Return: the session stored or `None`
+        """
+        with self._lock:
+            session = self._sessions.pop(key, None)
+            if session is not None and self._expired(session):
+                logger.debug("TLS session for {0!r} expired".format(key))
+                session = None
+            if session is None:
+                self.misses += 1
+                return None
+            self._sessions[key] = session
+            self.hits += 1
+            return session
+
+    def put(self, key, session):
+        """Store a session.
+
+        :Parameters:
+            - `key`: (host, port, SNI hostname) tuple
+            - `session`: the session to store
+        :Types:
+            - `key`: `tuple`
+            - `session`: :std:`ssl.SSLSession`
+        """
+        if session is None:
+            return
+        with self._lock:
+            self._sessions.pop(key, None)
+            self._sessions[key] = session
+            while len(self._sessions) > self.max_size:
+                self._sessions.popitem(last = False)
+
+    def remove(self, key):
+        """Remove a session, e.g. when it was rejected by the peer.
+
+        :Parameters:
+            - `key`: (host, port, SNI hostname) tuple
+        :Types:
+            - `key`: `tuple`
+        """
+        with self._lock:
+            self._sessions.pop(key, None)
+
+    def clear(self):
+        """Remove all the sessions stored."""
+        with self._lock:
+            self._sessions.clear()
+
+    @staticmethod
+    def _expired(session):
+        """Check if a session lifetime hint has passed.
+
+        :Parameters:
+            - `session`: the session to check
+        :Types:
+            - `session`: :std:`ssl.SSLSession`
+        """
+        timeout = getattr(session, "timeout", None)
+        start = getattr(session, "time", None)
+        if not timeout or not start:
+            return False
+        return start + timeout < time.time()
+
+XMPPSettings.add_setting(u"tls_session_cache", type = TLSSessionCache,
+        factory = TLSSessionCache, cache = True,
+        default_d = u"A `TLSSessionCache` instance shared by all connections",
+        doc = u"""Cache of TLS sessions used to resume sessions when
+reconnecting to the same server. Set to `None` to disable TLS session
+resumption."""
+    )
+XMPPSettings.add_setting(u"tls_session_cache_size", type = int,
+        default = 1024,
+        validator = XMPPSettings.validate_positive_int,
+        doc = u"""Maximum number of TLS sessions stored in the
+:r:`tls_session_cache setting` cache."""
+    )
@@ -0,0 +1,146 @@
+#
+# (C) Copyright 2011 Jacek Konieczny <jajcus@jajcus.net>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version
+# 2.1 as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+
+"""Recent traffic of a connection, for debugging.
+
+Unlike the "pyxmpp2.IN" and "pyxmpp2.OUT" debug loggers, which format
+every piece of data sent and received, `TrafficBuffer` only keeps the last
+few kilobytes of raw data. The data is formatted only when the buffer is
+dumped to the "pyxmpp2.TRAFFIC" logger, which the transport does on a
+stream error, a parse error or a disconnect.
+
+Keeping the data still costs a copy of every piece of data received (which
+is read into a reusable buffer) and up to :r:`traffic_buffer_size setting`
+bytes per connection, so the buffer is disabled by default.
+
+The dumps include everything sent and received (e.g. the SASL exchange),
+so the "pyxmpp2.TRAFFIC" logger should be enabled with care.
+"""
+
+from __future__ import absolute_import, division
+
+__docformat__ = "restructuredtext en"
+
+import time
+import logging
+
+from collections import deque
+
+from .settings import XMPPSettings
+
+TRAFFIC_LOGGER = logging.getLogger("pyxmpp2.TRAFFIC")
+
+class TrafficBuffer(object):
+    """Bounded buffer of the most recent data sent and received over
+    a connection.
+
+    The data is stored as is, oldest records are dropped when the total
+    size exceeds `max_size`.
+
+    Not thread-safe, the owner (transport) is responsible for locking.
+
+    :Ivariables:
+        - `max_size`: maximum number of bytes kept
+        - `size`: number of bytes currently kept
+        - `records`: (timestamp, direction, data) tuples, direction is
+          "IN" or "OUT"
+        - `dumped`: `True` when the buffer has been dumped after an error
+          or disconnect
+    :Types:
+        - `max_size`: `int`
+        - `size`: `int`
+        - `records`: :std:`collections.deque`
+        - `dumped`: `bool`
+    """
+    def __init__(self, max_size):
+        """Initialize the `TrafficBuffer` object.
+
+        :Parameters:
+            - `max_size`: maximum number of bytes kept
+        :Types:
+            - `max_size`: `int`
+        """
+        self.max_size = max_size
+        self.size = 0
+        self.records = deque()
+        self.dumped = False
+
+    def record(self, direction, data):
+        """Store a piece of data sent or received.
+
+        Only the last `max_size` bytes of `data` are copied.
+
+        :Parameters:
+            - `direction`: "IN" or "OUT"
+            - `data`: the raw data
+        :Types:
+            - `direction`: `str`
+            - `data`: `bytes` or a read-only buffer
+        """
+        if len(data) > self.max_size:
+            data = data[-self.max_size:]
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        elif not isinstance(data, bytes):
+            data = bytes(data)
+        self.records.append((time.time(), direction, data))
+        self.size += len(data)
+        while self.size > self.max_size:
+            self.size -= len(self.records.popleft()[2])
+
+    def clear(self):
+        """Drop all the data stored."""
+        self.records.clear()
+        self.size = 0
+
+    def format(self):
+        """Format the data stored for logging, one record per line.
+
+        :Returntype: `unicode`
+        """
+        lines = []
+        for timestamp, direction, data in self.records:
+            stamp = time.strftime("%H:%M:%S", time.localtime(timestamp))
+            lines.append(u"{0}.{1:03d} {2:3s} {3!r}".format(stamp,
+                            int(timestamp * 1000) % 1000, direction, data))
+        return u"\n".join(lines)
+
+    def dump(self, reason, level = logging.DEBUG):
+        """Log the data stored to the "pyxmpp2.TRAFFIC" logger.
+
+        :Parameters:
+            - `reason`: why the buffer is dumped
+            - `level`: logging level to use
+        :Types:
+            - `reason`: `unicode`
+            - `level`: `int`
+        """
+        if not TRAFFIC_LOGGER.isEnabledFor(level):
+            return
+        TRAFFIC_LOGGER.log(level, u"%s, last %i bytes of traffic:\n%s",
+                                            reason, self.size, self.format())
+
+XMPPSettings.add_setting(u"traffic_buffer_size", type = int,
+        default = 0,
+        validator = XMPPSettings.get_int_range_validator(0, 1 << 30),
+        doc = u"""Number of bytes of the most recent traffic kept by each
+connection, to be logged to the "pyxmpp2.TRAFFIC" logger on a stream error,
+parse error or disconnect. 0 (the default) disables the buffer, 16384 is
+a reasonable value for debugging."""
+    )
+
+# vi: sts=4 et sw=4
@@ -30,102 +30,111 @@ import socket
 import threading
 import errno
 import logging
+import time
+import sys
 import ssl
-
-try:
-    # pylint: disable=E0611
-    from ssl import CHANNEL_BINDING_TYPES
-except ImportError:
-    CHANNEL_BINDING_TYPES = []
-
-from functools import partial
-from collections import deque
+import zlib
+import struct
 
 from .etree import element_to_unicode
 from .mainloop.interfaces import IOHandler, HandlerReady, PrepareAgain
 from .settings import XMPPSettings
-from .exceptions import DNSError, PyXMPPIOError
-from .streamevents import ResolvingSRVEvent, ResolvingAddressEvent
-from .streamevents import ConnectedEvent, ConnectingEvent, DisconnectedEvent
-from .streamevents import TLSConnectingEvent, TLSConnectedEvent
+from .exceptions import PyXMPPIOError, FatalStreamError
+from .streamevents import ConnectedEvent, DisconnectedEvent
+from .streamevents import TLSConnectingEvent
 from .xmppserializer import XMPPSerializer
-from .xmppparser import StreamReader
-from .mainloop.wait import wait_for_write
+from .xmppparser import XML_PARSERS
 from .interfaces import XMPPTransport
-from .cert import get_certificate_from_ssl_socket
-
-# pylint: disable=W0611
-from . import resolver  
+from .connector import TCPConnector, BLOCKING_ERRORS, AF_UNIX
+from .transportoutput import TransportOutput, WriteData, ShutdownWrite
+from .transportoutput import ContinueConnect, StartTLS, TLSHandshake
+from .transporttls import TransportTLS
+from .transportmetrics import TransportMetrics
 
 logger = logging.getLogger("pyxmpp2.transport")
 
 IN_LOGGER = logging.getLogger("pyxmpp2.IN")
-OUT_LOGGER = logging.getLogger("pyxmpp2.OUT")
-
-BLOCKING_ERRORS = set()
-for __name in ['EAGAIN', 'EWOULDBLOCK', 'WSAEWOULDBLOCK', 'EINPROGRESS']:
-    if hasattr(errno, __name):
-        BLOCKING_ERRORS.add(getattr(errno, __name))
 
-class WriteJob(object):
-    """Base class for objects put to the `TCPTransport` write queue."""
-    # pylint: disable-msg=R0903
-    def __repr__(self):
-        return "<WriteJob: {0}>".format(self.__class__.__name__)
+try:
+    # pylint: disable=C0103
+    _input_view = buffer
+except NameError:
+    def _input_view(data, offset, size):
+        """Return a read-only view of `size` bytes of `data`, starting at
+        `offset`, without copying."""
+        return memoryview(data)[offset:offset + size]
+
+if hasattr(socket, "SO_PEERCRED"):
+    SO_PEERCRED = socket.SO_PEERCRED
+elif sys.platform.startswith("linux"):
+    # missing from the Python 2 socket module
+    SO_PEERCRED = 17
+else:
+    SO_PEERCRED = None
+
+def get_peer_credentials(sock):
+    """Get credentials of the process connected to the other end of a Unix
+    domain socket.
+
+    :Parameters:
+        - `sock`: a connected :std:`socket.AF_UNIX` socket
+    :Types:
+        - `sock`: :std:`socket.socket`
 
-class ContinueConnect(WriteJob):
-    """Object to signal (via the write queue) a pending connect request.
-    """
-    # pylint: disable-msg=R0903
-    pass
-
-class StartTLS(WriteJob):
-    """StartTLS request for the `TCPTransport` write queue."""
-    # pylint: disable-msg=R0903
-    def __init__(self, **kwargs):
-        WriteJob.__init__(self)
-        self.kwargs = kwargs
-    def __repr__(self):
-        args = [ "{0}={1!r}".format(k, v) for (k, v) in self.kwargs.items() ]
-        return "<WriteJob: StartTLS: {0}>".format(" ".join(args))
-
-class TLSHandshake(WriteJob):
-    """Object to signal (via the write queue) a pending TLS handshake.
+    :Return: mapping with the 'pid', 'uid' and 'gid' keys or `None` if
+        the credentials are not available on this platform
+    :Returntype: `dict`
     """
-    # pylint: disable-msg=R0903
-    pass
+    if SO_PEERCRED is None:
+        return None
+    size = struct.calcsize("3i")
+    try:
+        data = sock.getsockopt(socket.SOL_SOCKET, SO_PEERCRED, size)
+    except socket.error, err:
+        logger.debug("Cannot get peer credentials: {0}".format(err))
+        return None
+    pid, uid, gid = struct.unpack("3i", data)
+    return {"pid": pid, "uid": uid, "gid": gid}
 
-class WriteData(WriteJob):
-    """Data queued for write.
-    """
-    # pylint: disable-msg=R0903
-    def __init__(self, data):
-        WriteJob.__init__(self)
-        self.data = data
-    def __repr__(self):
-        return "<WriteJob: WriteData: {0!r}>".format(self.data)
+def _is_tls_eof(err):
+    """Check if an :std:`ssl.SSLError` means the peer closed the
+    connection without the TLS close_notify alert, which OpenSSL 3 reports
+    as an error instead of EOF.
 
-class TCPTransport(XMPPTransport, IOHandler):
-    """XMPP over TCP with optional TLS.
+    :Parameters:
+        - `err`: the exception raised by a read
+    :Types:
+        - `err`: :std:`ssl.SSLError`
+    """
+    if err.args[0] == ssl.SSL_ERROR_EOF:
+        return True
+    return "unexpected eof" in str(err).lower()
+class TCPTransport(TCPConnector, TransportOutput, TransportTLS,
+                        TransportMetrics, XMPPTransport, IOHandler):
+    """XMPP over TCP (or a Unix domain socket) with optional TLS.
+
+    Parts of the implementation are provided by the base classes:
+    resolving the peer address and connecting by `TCPConnector`, the write
+    queue by `TransportOutput`, the TLS handshake by `TransportTLS` and the
+    counters by `TransportMetrics`.
 
     :Ivariables:
         - `lock`: the lock protecting this object
         - `settings`: settings for this object
           socket is currently open)
+        - `last_read`: time when data has been last received
+        - `last_write`: time when data has been last sent
+        - `connected_at`: time when the connection has been established
+        - `_compressor`: the stream compression layer, when enabled
         - `_dst_addr`: socket address currently in use
-        - `_dst_addrs`: list of (family, sockaddr) candidates to connect to
-        - `_dst_family`: address family of the socket
-        - `_dst_hostname`: hostname the transport is connecting to or connected
-          to
-        - `_dst_name`: requested domain name of the remote service
-        - `_dst_nameports`: list of (hostname, port) candidates to connect to
-        - `_dst_port`: requested port of the remote service
-        - `_dst_service`: requested service name (e.g. 'xmpp-client')
+        - `_family`: address family of the socket
         - `_eof`: `True` when reading side of the socket is closed
         - `_event_queue`: queue to send connection events to
         - `_hup`: `True` when the writing side of the socket is closed
+        - `_read_buf`: buffer for the data received
         - `_reader`: parser for the data received from the socket
         - `_serializer`: XML serializer for data sent over the socket
+        - `_output_buf`: buffer the stanzas sent are serialized into
         - `_socket`: socket currently used by the transport (`None` if no
         - `_state_cond`: condition object to synchronize threads over state
           change
@@ -133,28 +142,27 @@ class TCPTransport(XMPPTransport, IOHandler):
           "resolve-hostname", "connect", "connected", "tls-handshake",
           "closing", "closed", "aborted")
         - `_stream`: the stream associated with this transport
-        - `_tls_state`: state of TLS handshake
     :Types:
         - `lock`: :std:`threading.RLock`
         - `settings`: `XMPPSettings`
+        - `last_read`: `float`
+        - `last_write`: `float`
+        - `connected_at`: `float`
+        - `_compressor`: `streamcompression.ZlibCompressor`
         - `_dst_addr`: tuple
-        - `_dst_addrs`: list of tuples
-        - `_dst_family`: `int`
-        - `_dst_hostname`: `unicode`
-        - `_dst_name`: `unicode`
-        - `_dst_nameports`: list of tuples
-        - `_dst_port`: `int`
-        - `_dst_service`: `unicode`
+        - `_family`: `int`
         - `_eof`: `bool`
         - `_event_queue`: :std:`Queue.Queue`
         - `_hup`: `bool`
-        - `_reader`: `StreamReader`
+        - `_read_buf`: `bytearray`
+        - `_reader`: `xmppparser.StreamReader` or
+          `xmppreaders.ExpatStreamReader`
         - `_serializer`: `XMPPSerializer`
+        - `_output_buf`: `bytearray`
         - `_socket`: :std:`socket.socket`
         - `_state_cond`: :std:`threading.Condition`
         - `_state`: `unicode`
         - `_stream`: `streambase.StreamBase`
-        - `_tls_state`: `unicode`
     """
     # pylint: disable=R0902
     def __init__(self, settings = None, sock = None):
@@ -164,25 +172,31 @@ class TCPTransport(XMPPTransport, IOHandler):
             - `settings`: XMPP settings to use
             - `sock`: existing socket, e.g. for accepted incoming connection.
         """
+        TCPConnector.__init__(self)
         if settings:
             self.settings = settings
         else:
             self.settings = XMPPSettings()
+        TransportMetrics.__init__(self, self.settings)
         self.lock = threading.RLock()
-        self._write_queue = deque()
-        self._write_queue_cond = threading.Condition(self.lock)
+        TransportOutput.__init__(self, self.settings)
+        TransportTLS.__init__(self)
+        self._read_buf_min = self.settings["read_buffer_size"]
+        self._read_buf_max = max(self._read_buf_min,
+                                        self.settings["read_buffer_max_size"])
+        self._read_buf = bytearray(self._read_buf_min)
+        self._read_budget_bytes = self.settings["read_budget_bytes"]
+        self._read_budget_stanzas = self.settings["read_budget_stanzas"]
         self._eof = False
         self._hup = False
+        self.last_read = None
+        self.last_write = None
+        self.connected_at = None
         self._stream = None
         self._serializer = None
+        self._output_buf = bytearray()
         self._reader = None
-        self._dst_name = None
-        self._dst_port = None
-        self._dst_service = None
-        self._dst_nameports = None
-        self._dst_hostname = None
-        self._dst_addrs = None
-        self._tls_state = None
+        self._compressor = None
         self._state_cond = threading.Condition(self.lock)
         if sock is None:
             self._socket = None
@@ -195,8 +209,12 @@ class TCPTransport(XMPPTransport, IOHandler):
             self._dst_addr = sock.getpeername()
             self._state = "connected"
             self._socket.setblocking(False)
+            self.connected_at = time.time()
+            self.last_read = self.last_write = self.connected_at
         self._event_queue = self.settings["event_queue"]
         self._auth_properties = {}
+        if sock is not None and self._family == AF_UNIX:
+            self._set_unix_auth_properties()
 
     def _set_state(self, state):
         """Set `_state` and notify any threads waiting for the change.
@@ -205,239 +223,80 @@ class TCPTransport(XMPPTransport, IOHandler):
         self._state = state
         self._state_cond.notify()
 
-    def connect(self, addr, port = None, service = None):
-        """Start establishing TCP connection with given address.
-
-        One of: `port` or `service` must be provided and `addr` must be 
-        a domain name and not an IP address if `port` is not given.
-
-        When `service` is given try an SRV lookup for that service
-        at domain `addr`. If `service` is not given or `addr` is an IP address, 
-        or the SRV lookup fails, connect to `port` at host `addr` directly.
-
-        [initiating entity only]
-
-        :Parameters:
-            - `addr`: peer name or IP address
-            - `port`: port number to connect to
-            - `service`: service name (to be resolved using SRV DNS records)
-        """
-        with self.lock:
-            self._connect(addr, port, service)
-
-    def _connect(self, addr, port, service):
-        """Same as `connect`, but assumes `lock` acquired.
-        """
-        self._dst_name = addr
-        self._dst_port = port
-        family = None
-        try:
-            res = socket.getaddrinfo(addr, port, socket.AF_UNSPEC,
-                                socket.SOCK_STREAM, 0, socket.AI_NUMERICHOST)
-            family = res[0][0]
-            sockaddr = res[0][4]
-        except socket.gaierror:
-            family = None
-            sockaddr = None
-
-        if family is not None:
-            if not port:
-                raise ValueError("No port number given with literal IP address")
-            self._dst_service = None
-            self._family = family
-            self._dst_addrs = [(family, sockaddr)]
-            self._set_state("connect")
-        elif service is not None:
-            self._dst_service = service
-            self._set_state("resolve-srv")
-            self._dst_name = addr
-        elif port:
-            self._dst_nameports = [(self._dst_name, self._dst_port)]
-            self._dst_service = None
-            self._set_state("resolve-hostname")
-        else:
-            raise ValueError("No port number and no SRV service name given")
-
-    def _resolve_srv(self):
-        """Start resolving the SRV record.
-        """
-        resolver = self.settings["dns_resolver"] # pylint: disable=W0621
-        self._set_state("resolving-srv")
-        self.event(ResolvingSRVEvent(self._dst_name, self._dst_service))
-        resolver.resolve_srv(self._dst_name, self._dst_service, "tcp",
-                                                    callback = self._got_srv)
-
-    def _got_srv(self, addrs):
-        """Handle SRV lookup result.
-        
-        :Parameters:
-            - `addrs`: properly sorted list of (hostname, port) tuples
-        """
-        with self.lock:
-            if not addrs:
-                self._dst_service = None
-                if self._dst_port:
-                    self._dst_nameports = [(self._dst_name, self._dst_port)]
-                else:
-                    self._dst_nameports = []
-                    self._set_state("aborted")
-                    raise DNSError("Could not resolve SRV for service {0!r}"
-                            " on host {1!r} and fallback port number not given"
-                                    .format(self._dst_service, self._dst_name))
-            elif addrs == [(".", 0)]:
-                self._dst_nameports = []
-                self._set_state("aborted")
-                raise DNSError("Service {0!r} not available on host {1!r}"
-                                    .format(self._dst_service, self._dst_name))
-            else:
-                self._dst_nameports = addrs
-            self._set_state("resolve-hostname")
-
-    def _resolve_hostname(self):
-        """Start hostname resolution for the next name to try.
+    def _wait_for_connect(self):
+        """Make sure `_continue_connect` is called when a connection
+        attempt in progress may have finished.
 
         [called with `lock` acquired]
         """
-        self._set_state("resolving-hostname")
-        resolver = self.settings["dns_resolver"] # pylint: disable=W0621
-        logger.debug("_dst_nameports: {0!r}".format(self._dst_nameports))
-        name, port = self._dst_nameports.pop(0)
-        self._dst_hostname = name
-        resolver.resolve_address(name, callback = partial(
-                                self._got_addresses, name, port),
-                                allow_cname = self._dst_service is None)
-        self.event(ResolvingAddressEvent(name))
-
-    def _got_addresses(self, name, port, addrs):
-        """Handler DNS address record lookup result.
-        
-        :Parameters:
-            - `name`: the name requested
-            - `port`: port number to connect to
-            - `addrs`: list of (family, address) tuples
-        """
-        with self.lock:
-            if not addrs:
-                if self._dst_nameports:
-                    self._set_state("resolve-hostname")
-                    return
-                else:
-                    self._dst_addrs = []
-                    self._set_state("aborted")
-                    raise DNSError("Could not resolve address record for {0!r}"
-                                                                .format(name))
-            self._dst_addrs = [ (family, (addr, port)) for (family, addr)
-                                                                    in addrs ]
-            self._set_state("connect")
+        if not any(isinstance(job, ContinueConnect)
+                                        for job in self._write_queue):
+            self._write_queue.append(ContinueConnect())
+            self._write_queue_changed()
 
-    def _start_connect(self):
-        """Start connecting to the next address on the `_dst_addrs` list.
+    def _connected(self):
+        """Handle connection success.
 
-        [ called with `lock` acquired ] 
-        
+        [called with `lock` acquired]
         """
-        family, addr = self._dst_addrs.pop(0)
-        self._socket = socket.socket(family, socket.SOCK_STREAM)
-        self._socket.setblocking(False)
-        self._dst_addr = addr
-        self._family  = family
-        try:
-            self._socket.connect(addr)
-        except socket.error, err:
-            logger.debug("Connect error: {0}".format(err))
-            if err.args[0] in BLOCKING_ERRORS:
-                self._set_state("connecting")
-                self._write_queue.append(ContinueConnect())
-                self._write_queue_cond.notify()
-                self.event(ConnectingEvent(addr))
-                return
-            elif self._dst_addrs:
-                self._set_state("connect")
-                return
-            elif self._dst_nameports:
-                self._set_state("resolve-hostname")
-                return
-            else:
-                self._socket.close()
-                self._socket = None
-                self._set_state("aborted")
-                self._write_queue.clear()
-                self._write_queue_cond.notify()
-                raise
-        self._connected()
-
-    def _connected(self):
-        """Handle connection success."""
-        self._auth_properties['remote-ip'] = self._dst_addr[0]
-        if self._dst_service:
-            self._auth_properties['service-domain'] = self._dst_name
-        if self._dst_hostname is not None:
-            self._auth_properties['service-hostname'] = self._dst_hostname
+        for job in list(self._write_queue):
+            if isinstance(job, ContinueConnect):
+                self._write_queue.remove(job)
+        if self._family == AF_UNIX:
+            self._set_unix_auth_properties()
         else:
-            self._auth_properties['service-hostname'] = self._dst_addr[0]
-        self._auth_properties['security-layer'] = None
+            self._auth_properties['remote-ip'] = self._dst_addr[0]
+            if self._dst_service:
+                self._auth_properties['service-domain'] = self._dst_name
+            if self._dst_hostname is not None:
+                self._auth_properties['service-hostname'] = \
+                                                        self._dst_hostname
+            else:
+                self._auth_properties['service-hostname'] = self._dst_addr[0]
+            self._auth_properties['security-layer'] = None
+        self.connected_at = time.time()
+        self.last_read = self.last_write = self.connected_at
         self.event(ConnectedEvent(self._dst_addr))
+        if self._direct_tls is not None:
+            kwargs = self._direct_tls
+            self._direct_tls = None
+            self.event(TLSConnectingEvent())
+            self._initiate_starttls(**kwargs)
+            return
         self._set_state("connected")
         self._stream.transport_connected()
 
-    def _continue_connect(self):
-        """Continue connecting.
+    def _set_unix_auth_properties(self):
+        """Set the authentication properties of a Unix domain socket
+        connection. The channel is local, so it is reported as the "UNIX"
+        security layer, and the peer process credentials are provided as
+        the "peer-credentials" property (for SASL EXTERNAL).
 
         [called with `lock` acquired]
-
-        :Return: `True` when just connected
         """
-        try:
-            self._socket.connect(self._dst_addr)
-        except socket.error, err:
-            logger.debug("Connect error: {0}".format(err))
-            if err.args[0] == errno.EISCONN:
-                pass
-            elif err.args[0] in BLOCKING_ERRORS:
-                return None
-            elif self._dst_addrs:
-                self._set_state("connect")
-                return None
-            elif self._dst_nameports:
-                self._set_state("resolve-hostname")
-                return None
-            else:
-                self._socket.close()
-                self._socket = None
-                self._set_state("aborted")
-                raise
-        self._connected()
+        self._auth_properties['security-layer'] = "UNIX"
+        credentials = get_peer_credentials(self._socket)
+        if credentials is not None:
+            self._auth_properties['peer-credentials'] = credentials
 
-    def _write(self, data):
-        """Write raw data to the socket.
+    @property
+    def compressed(self):
+        """`True` when stream compression is enabled."""
+        return self._compressor is not None
+
+    def set_compression(self, compressor):
+        """Compress all data sent and decompress all data received from now
+        on, e.g. after XEP-0138 negotiation.
 
         :Parameters:
-            - `data`: data to send
+            - `compressor`: the compression layer
         :Types:
-            - `data`: `bytes`
+            - `compressor`: `streamcompression.ZlibCompressor`
         """
-        OUT_LOGGER.debug("OUT: %r", data)
-        if self._hup or not self._socket:
-            raise PyXMPPIOError(u"Connection closed.")
-        try:
-            while data:
-                try:
-                    sent = self._socket.send(data)
-                except ssl.SSLError, err:
-                    if err.args[0] == ssl.SSL_ERROR_WANT_WRITE:
-                        continue
-                    else:
-                        raise
-                except socket.error, err:
-                    if err.args[0] == errno.EINTR:
-                        continue
-                    if err.args[0] in BLOCKING_ERRORS:
-                        wait_for_write(self._socket)
-                        continue
-                    raise
-                data = data[sent:]
-        except (IOError, OSError, socket.error), err:
-            raise PyXMPPIOError(u"IO Error: {0}".format(err))
+        with self.lock:
+            if self._compressor is not None:
+                raise RuntimeError("Compression already enabled")
+            self._compressor = compressor
 
     def set_target(self, stream):
         """Make the `stream` the target for this transport instance.
@@ -455,7 +314,8 @@ class TCPTransport(XMPPTransport, IOHandler):
             if self._stream:
                 raise ValueError("Target stream already set")
             self._stream = stream
-            self._reader = StreamReader(stream)
+            self._reader = XML_PARSERS[self.settings["xml_parser"]](stream,
+                                                                self.settings)
 
     def send_stream_head(self, stanza_namespace, stream_from, stream_to, 
                         stream_id = None, version = u'1.0', language = None):
@@ -486,7 +346,8 @@ class TCPTransport(XMPPTransport, IOHandler):
 
     def restart(self):
         """Restart the stream after SASL or StartTLS handshake."""
-        self._reader = StreamReader(self._stream)
+        self._reader = XML_PARSERS[self.settings["xml_parser"]](self._stream,
+                                                                self.settings)
         self._serializer = None
 
     def send_stream_tail(self):
@@ -505,14 +366,12 @@ class TCPTransport(XMPPTransport, IOHandler):
                                                                 .format(err))
             self._serializer = None
             self._hup = True
-            if self._tls_state is None:
-                try:
-                    self._socket.shutdown(socket.SHUT_WR)
-                except socket.error:
-                    pass
             self._set_state("closing")
-            self._write_queue.clear()
-            self._write_queue_cond.notify()
+            if self._write_queue:
+                self._write_queue.append(ShutdownWrite())
+                self._write_queue_changed()
+            else:
+                self._shutdown_write()
 
     def send_element(self, element):
         """
@@ -523,33 +382,55 @@ class TCPTransport(XMPPTransport, IOHandler):
                 logger.debug("Dropping element: {0}".format(
                                                 element_to_unicode(element)))
                 return
-            data = self._serializer.emit_stanza(element)
-            self._write(data.encode("utf-8"))
+            buf = self._output_buf
+            del buf[:]
+            self._serializer.write_stanza(element, buf)
+            # this is the only copy of the serialized stanza: the write
+            # path (compressor, write queue joins, traffic log) needs an
+            # immutable `bytes` object on Python 2, which a `bytearray`
+            # is not, while `buf` itself is reused for the next stanza
+            self._write(bytes(buf))
+            self._stanzas_sent += 1
+
+    def send_keepalive(self):
+        """Send a whitespace keepalive, when the stream is open.
+
+        :Return: `True` if the keepalive has been sent
+        :Returntype: `bool`
+        """
+        with self.lock:
+            if self._eof or self._hup or self._socket is None:
+                return False
+            if self._state != "connected" or not self._serializer:
+                return False
+            self._write(b" ")
+            return True
 
     def prepare(self):
         """When connecting start the next connection step and schedule
         next `prepare` call, when connected return `HandlerReady()`
         """
         result = HandlerReady()
-        logger.debug("TCPTransport.prepare(): state: {0!r}".format(self._state))
+        logger.debug("TCPTransport.prepare(): state: %r", self._state)
         with self.lock:
             if self._state in ("connected", "closing", "closed", "aborted"):
                 # no need to call prepare() .fileno() is stable
                 pass
-            elif self._state == "connect":
-                self._start_connect()
-                result = PrepareAgain(None)
+            elif self._state in ("connect", "connecting"):
+                result = PrepareAgain(self._race_connect())
             elif self._state == "resolve-hostname":
                 self._resolve_hostname()
                 result = PrepareAgain(0)
             elif self._state == "resolve-srv":
                 self._resolve_srv()
                 result = PrepareAgain(0)
+            elif self._tls_offloaded:
+                # check soon, the main loop is not woken up when done
+                result = PrepareAgain(0.01)
             else:
                 # wait for i/o, but keep calling prepare()
                 result = PrepareAgain(None)
-        logger.debug("TCPTransport.prepare(): new state: {0!r}"
-                                                        .format(self._state))
+        logger.debug("TCPTransport.prepare(): new state: %r", self._state)
         return result
 
     def fileno(self):
@@ -563,7 +444,8 @@ class TCPTransport(XMPPTransport, IOHandler):
         """
         :Return: `True` when the I/O channel can be read
         """
-        return self._socket is not None and not self._eof and (
+        return self._socket is not None and not self._eof \
+                and not self._tls_pending and (
                     self._state in ("connected", "closing")
                         or self._state == "tls-handshake" 
                                         and self._tls_state == "want_read")
@@ -578,19 +460,32 @@ class TCPTransport(XMPPTransport, IOHandler):
             while True:
                 if self._socket is None or self._eof:
                     return False
-                if self._state in ("connected", "closing"):
-                    return True
-                if self._state == "tls-handshake" and \
+                if not self._tls_pending:
+                    if self._state in ("connected", "closing"):
+                        return True
+                    if self._state == "tls-handshake" and \
                                             self._tls_state == "want_read":
-                    return True
+                        return True
                 self._state_cond.wait()
 
+    def _can_write(self):
+        """Check if there is anything in the write queue that may be
+        processed now.
+
+        [called with `lock` acquired]
+        """
+        if not self._socket or not self._write_queue:
+            return False
+        if self._state == "tls-handshake" and self._tls_state == "want_read":
+            return False
+        return True
+
     def is_writable(self):
         """
-        :Return: `False` as currently the data is always written synchronously
+        :Return: `True` when there is data or other job in the write queue
         """
         with self.lock:
-            return self._socket and bool(self._write_queue)
+            return self._can_write()
 
     def wait_for_writability(self):
         """
@@ -600,10 +495,12 @@ class TCPTransport(XMPPTransport, IOHandler):
         """
         with self.lock:
             while True:
-                if self._state in ("closing", "closed", "aborted"):
+                if self._state in ("closed", "aborted"):
                     return False
-                if self._socket and bool(self._write_queue):
+                if self._can_write():
                     return True
+                if self._state == "closing" and not self._write_queue:
+                    return False
                 self._write_queue_cond.wait()
         return False
 
@@ -613,13 +510,15 @@ class TCPTransport(XMPPTransport, IOHandler):
         socket.
         """
         with self.lock:
-            logger.debug("handle_write: queue: {0!r}".format(self._write_queue))
-            try:
-                job = self._write_queue.popleft()
-            except IndexError:
+            logger.debug("handle_write: queue: %r", self._write_queue)
+            if not self._can_write():
                 return
-            if isinstance(job, WriteData):
-                self._do_write(job.data) # pylint: disable=E1101
+            while isinstance(self._write_queue[0], WriteData):
+                if not self._do_write() or not self._write_queue:
+                    return
+            job = self._write_queue.popleft()
+            if isinstance(job, ShutdownWrite):
+                self._shutdown_write()
             elif isinstance(job, ContinueConnect):
                 self._continue_connect()
             elif isinstance(job, StartTLS):
@@ -630,132 +529,173 @@ class TCPTransport(XMPPTransport, IOHandler):
                 raise ValueError("Unrecognized job in the write queue: "
                                         "{0!r}".format(job))
 
-    def starttls(self, **kwargs):
-        """Request a TLS handshake on the socket ans switch
-        to encrypted output.
-        The handshake will start after any currently buffered data is sent.
-        
-        :Parameters:
-            - `kwargs`: arguments for :std:`ssl.wrap_socket`
-        """
-        with self.lock:
-            self.event(TLSConnectingEvent())
-            self._write_queue.append(StartTLS(**kwargs))
-            self._write_queue_cond.notify()
-
-    def getpeercert(self):
-        """Return the peer certificate. 
-        
-        :ReturnType: `pyxmpp2.cert.Certificate`
-        """
-        with self.lock:
-            if not self._socket or self._tls_state != "connected":
-                raise ValueError("Not TLS-connected")
-            return get_certificate_from_ssl_socket(self._socket)
-
-    def _initiate_starttls(self, **kwargs):
-        """Initiate starttls handshake over the socket.
-        """
-        if self._tls_state == "connected":
-            raise RuntimeError("Already TLS-connected")
-        kwargs["do_handshake_on_connect"] = False
-        logger.debug("Wrapping the socket into ssl")
-        self._socket = ssl.wrap_socket(self._socket, **kwargs)
-        self._set_state("tls-handshake")
-        self._continue_tls_handshake()
-
-    def _continue_tls_handshake(self):
-        """Continue a TLS handshake."""
-        try:
-            logger.debug(" do_handshake()")
-            self._socket.do_handshake()
-        except ssl.SSLError, err:
-            if err.args[0] == ssl.SSL_ERROR_WANT_READ:
-                self._tls_state = "want_read"
-                logger.debug("   want_read")
-                self._state_cond.notify()
-                return
-            elif err.args[0] == ssl.SSL_ERROR_WANT_WRITE:
-                self._tls_state = "want_write"
-                logger.debug("   want_write")
-                self._write_queue.appendleft(TLSHandshake)
-                return
-            else:
-                raise
-        self._tls_state = "connected"
-        self._set_state("connected")
-        self._auth_properties['security-layer'] = "TLS"
-        if "tls-unique" in CHANNEL_BINDING_TYPES:
-            try:
-                # pylint: disable=E1103
-                tls_unique = self._socket.get_channel_binding("tls-unique")
-            except ValueError:
-                pass
-            else:
-                self._auth_properties['channel-binding'] = {
-                                                    "tls-unique": tls_unique}
-        try:
-            cipher = self._socket.cipher()
-        except AttributeError:
-            # SSLSocket.cipher doesn't work on PyPy
-            cipher = "unknown"
-        cert = get_certificate_from_ssl_socket(self._socket)
-        self.event(TLSConnectedEvent(cipher, cert))
-
     def handle_read(self):
         """
         Handle the 'channel readable' state. E.g. read from a socket.
+
+        When the :r:`output_cork setting` is enabled, any output produced
+        while the input is processed is sent only after all the data available
+        has been read and parsed.
         """
         with self.lock:
             logger.debug("handle_read()")
             if self._eof or self._socket is None:
                 return
-            if self._state == "tls-handshake":
-                while True:
-                    logger.debug("tls handshake read...")
-                    self._continue_tls_handshake()
-                    logger.debug("  state: {0}".format(self._tls_state))
-                    if self._tls_state != "want_read":
+            self._corked = self._cork
+            try:
+                self._do_read()
+            finally:
+                if self._corked:
+                    self._corked = False
+                    if self._socket is not None:
+                        self._flush_write_queue()
+
+    def _do_read(self):
+        """Read all the data available from the socket and feed it to the
+        reader.
+
+        [called with `lock` acquired]
+        """
+        if self._state == "tls-handshake":
+            if not self._tls_offloaded:
+                logger.debug("tls handshake read...")
+                self._step_tls_handshake()
+                logger.debug("  state: {0}".format(self._tls_state))
+        else:
+            bytes_start = self._bytes_received
+            stanzas_start = self._stanzas_received
+            while self._socket and not self._eof:
+                logger.debug("socket read...")
+                try:
+                    size = self._socket.recv_into(self._read_buf)
+                except ssl.SSLError, err:
+                    if err.args[0] == ssl.SSL_ERROR_WANT_READ:
                         break
-            elif self._tls_state == "connected":
-                while self._socket and not self._eof:
-                    logger.debug("tls socket read...")
-                    try:
-                        data = self._socket.read(4096)
-                    except ssl.SSLError, err:
-                        if err.args[0] == ssl.SSL_ERROR_WANT_READ:
-                            break
-                        elif err.args[0] == ssl.SSL_ERROR_WANT_WRITE:
-                            break
-                        else:
-                            raise
-                    except socket.error, err:
-                        if err.args[0] == errno.EINTR:
-                            continue
-                        elif err.args[0] in BLOCKING_ERRORS:
-                            break
-                        elif err.args[0] == errno.ECONNRESET:
-                            logger.warning("Connection reset by peer")
-                            data = None
-                        else:
-                            raise
-                    self._feed_reader(data)
-            else:
-                while self._socket and not self._eof:
-                    logger.debug("raw socket read...")
-                    try:
-                        data = self._socket.recv(4096)
-                    except socket.error, err:
-                        if err.args[0] == errno.EINTR:
-                            continue
-                        elif err.args[0] in BLOCKING_ERRORS:
-                            break
-                        elif err.args[0] == errno.ECONNRESET:
-                            logger.warning("Connection reset by peer")
-                            data = None
-                        else:
-                            raise
+                    elif err.args[0] == ssl.SSL_ERROR_WANT_WRITE:
+                        break
+                    elif _is_tls_eof(err):
+                        logger.warning("TLS connection closed by peer"
+                                                " without close_notify")
+                        size = 0
+                    else:
+                        raise
+                except socket.error, err:
+                    if err.args[0] == errno.EINTR:
+                        continue
+                    elif err.args[0] in BLOCKING_ERRORS:
+                        break
+                    elif err.args[0] == errno.ECONNRESET:
+                        logger.warning("Connection reset by peer")
+                        size = 0
+                    else:
+                        raise
+                self._recv_calls += 1
+                if not size:
+                    self._feed_reader(None)
+                    break
+                self._bytes_received += size
+                self.last_read = time.time()
+                data = _input_view(self._read_buf, 0, size)
+                if self._compressor is None:
                     self._feed_reader(data)
+                else:
+                    self._feed_decompressed(data)
+                self._adapt_read_buffer(size)
+                if self._tls_pending:
+                    # the rest is TLS handshake data
+                    break
+                if self._read_budget_used(bytes_start, stanzas_start):
+                    break
+
+    def _feed_decompressed(self, data):
+        """Decompress data received and feed the stream reader with it.
+
+        The data is decompressed in chunks no bigger than the maximum read
+        buffer size, so a small piece of input cannot produce a huge string
+        in memory.
+
+        [called with `lock` acquired]
+
+        :Parameters:
+            - `data`: compressed data received from the socket
+        :Types:
+            - `data`: `bytes` or a read-only buffer
+        """
+        compressor = self._compressor
+        while True:
+            try:
+                chunk = compressor.decompress(data, self._read_buf_max)
+            except zlib.error, err:
+                logger.warning("Decompression failed: {0}".format(err))
+                self.lock.release() # not to deadlock with the stream
+                try:
+                    self._stream.send_stream_error("undefined-condition")
+                finally:
+                    self.lock.acquire()
+                raise FatalStreamError(u"Decompression failed: {0}"
+                                                                .format(err))
+            if chunk:
+                self._feed_reader(chunk)
+            if not compressor.pending or self._reader is None:
+                break
+            data = b""
+
+    def _read_budget_used(self, bytes_start, stanzas_start):
+        """Check if the input processed in the current `handle_read` call
+        exceeds the per-wakeup read budget.
+
+        The rest of the input stays in the socket buffer, so the transport
+        is still reported readable and the main loop will call `handle_read`
+        again, after serving other handlers. Decrypted data already buffered
+        in the TLS layer is not held back, as the main loop would not notice
+        it.
+
+        [called with `lock` acquired]
+
+        :Parameters:
+            - `bytes_start`: `_bytes_received` value at the start of the call
+            - `stanzas_start`: `_stanzas_received` value at the start of
+              the call
+
+        :Return: `True` if reading should stop
+        """
+        if (self._read_budget_bytes and self._bytes_received - bytes_start
+                                                >= self._read_budget_bytes):
+            pass
+        elif (self._read_budget_stanzas and self._stanzas_received
+                            - stanzas_start >= self._read_budget_stanzas):
+            pass
+        else:
+            return False
+        if self._socket is None:
+            return True
+        if self._tls_state == "connected" and self._socket.pending():
+            return False
+        self._read_budget_exhausted += 1
+        return True
+
+    def _adapt_read_buffer(self, size):
+        """Adjust the size of the read buffer after a read.
+
+        The buffer grows (up to the :r:`read_buffer_max_size setting`) when
+        a read fills it completely and shrinks (down to the
+        :r:`read_buffer_size setting`) when reads return much less data than
+        it could hold.
+
+        [called with `lock` acquired]
+
+        :Parameters:
+            - `size`: number of bytes just read
+        :Types:
+            - `size`: `int`
+        """
+        buf_size = len(self._read_buf)
+        if size == buf_size:
+            if buf_size < self._read_buf_max:
+                self._read_buf = bytearray(min(buf_size * 2,
+                                                        self._read_buf_max))
+        elif size < buf_size // 4 and buf_size > self._read_buf_min:
+            self._read_buf = bytearray(max(buf_size // 2, self._read_buf_min))
 
     def handle_hup(self):
         """
@@ -769,11 +709,14 @@ class TCPTransport(XMPPTransport, IOHandler):
         Handle an error reported.
         """
         with self.lock:
+            if self._state == "connecting":
+                # failed connection attempt, try the other ones
+                self._continue_connect()
+                return
             self._socket.close()
             self._socket = None
             self._set_state("aborted")
-            self._write_queue.clear()
-            self._write_queue_cond.notify()
+            self._clear_write_queue()
         raise PyXMPPIOError("Unhandled error on socket")
 
     def handle_nval(self):
@@ -799,10 +742,8 @@ class TCPTransport(XMPPTransport, IOHandler):
         """Disconnect the stream gracefully."""
         logger.debug("TCPTransport.disconnect()")
         with self.lock:
-            if self._socket is None:
-                if self._state != "closed":
-                    self.event(DisconnectedEvent(self._dst_addr))
-                    self._set_state("closed")
+            if self._socket is None or self._state == "connecting":
+                self._close()
                 return
             if self._hup or not self._serializer:
                 self._close()
@@ -818,18 +759,22 @@ class TCPTransport(XMPPTransport, IOHandler):
         """Same as `_close` but expects `lock` acquired.
         """
         if self._state != "closed":
+            self.dump_traffic(u"Disconnected", once = True)
             self.event(DisconnectedEvent(self._dst_addr))
             self._set_state("closed")
+        self._abort_connect_attempts()
         if self._socket is None:
             return
+        self._flush_write_queue()
+        # session tickets (TLS 1.3) may have been received after handshake
+        self._store_tls_session()
         try:
             self._socket.shutdown(socket.SHUT_RDWR)
         except socket.error:
             pass
         self._socket.close()
         self._socket = None
-        self._write_queue.clear()
-        self._write_queue_cond.notify()
+        self._clear_write_queue()
 
     def _feed_reader(self, data):
         """Feed the stream reader with data received.
@@ -841,18 +786,35 @@ class TCPTransport(XMPPTransport, IOHandler):
 
         `lock` is acquired during the operation.
 
+        The data may be a view of the transport read buffer, valid only
+        until this method returns.
+
         :Parameters:
             - `data`: data received from the stream socket.
         :Types:
-            - `data`: `unicode`
+            - `data`: `bytes` or a read-only buffer
         """
-        IN_LOGGER.debug("IN: %r", data)
+        if IN_LOGGER.isEnabledFor(logging.DEBUG):
+            IN_LOGGER.debug("IN: %r", bytes(data) if data else data)
         if data:
+            if self._traffic is not None:
+                self._traffic.record("IN", data)
+            reader = self._reader
+            stream = self._stream
+            stanzas = reader.stanzas_parsed
+            handler_time = getattr(stream, "handler_time", 0.0)
+            start = time.time()
             self.lock.release() # not to deadlock with the stream
             try:
-                self._reader.feed(data)
+                reader.feed(data)
             finally:
                 self.lock.acquire()
+                elapsed = time.time() - start
+                handler_time = getattr(stream, "handler_time", 0.0) \
+                                                                - handler_time
+                self._handler_time += handler_time
+                self._parse_time += elapsed - handler_time
+                self._stanzas_received += reader.stanzas_parsed - stanzas
         else:
             self._eof = True
             self.lock.release() # not to deadlock with the stream
@@ -862,6 +824,7 @@ class TCPTransport(XMPPTransport, IOHandler):
                 self.lock.acquire()
             if not self._serializer:
                 if self._state != "closed":
+                    self.dump_traffic(u"Disconnected", once = True)
                     self.event(DisconnectedEvent(self._dst_addr))
                     self._set_state("closed")
 
@@ -876,3 +839,28 @@ class TCPTransport(XMPPTransport, IOHandler):
     def auth_properties(self):
         return self._auth_properties
 
+XMPPSettings.add_setting(u"read_buffer_size", type = int, default = 4096,
+        validator = XMPPSettings.validate_positive_int,
+        doc = u"""Initial (and minimum) size of the per-connection buffer
+for the data received."""
+    )
+XMPPSettings.add_setting(u"read_buffer_max_size", type = int, default = 65536,
+        validator = XMPPSettings.validate_positive_int,
+        doc = u"""Maximum size of the per-connection buffer for the data
+received. The buffer grows up to this size when data comes faster than
+it is read and shrinks back when the connection gets quiet."""
+    )
+XMPPSettings.add_setting(u"read_budget_bytes", type = int, default = 65536,
+        validator = XMPPSettings.get_int_range_validator(0, 1 << 30),
+        doc = u"""Maximum number of bytes a transport reads from its socket
+when the main loop reports it readable. When the limit is reached the
+transport yields to other handlers and continues on the next loop iteration,
+so a single connection flooding data cannot starve the others. 0 means
+no limit."""
+    )
+XMPPSettings.add_setting(u"read_budget_stanzas", type = int, default = 0,
+        validator = XMPPSettings.get_int_range_validator(0, 1 << 30),
+        doc = u"""Maximum number of stanzas a transport parses when the main
+loop reports it readable (checked after each chunk of data read). 0 means
+no limit."""
+    )
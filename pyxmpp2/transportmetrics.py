@@ -0,0 +1,266 @@
+#
+# (C) Copyright 2011 Jacek Konieczny <jajcus@jajcus.net>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version
+# 2.1 as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+
+"""Counters and diagnostics of the XMPP transports.
+
+`TransportMetrics` is a base class of `transport.TCPTransport`, providing the
+per-connection metrics and the traffic buffer. `collect_metrics` gathers
+the metrics of all the transports handled by a main loop.
+"""
+
+from __future__ import absolute_import, division
+
+__docformat__ = "restructuredtext en"
+
+import logging
+import time
+
+from .traffic import TrafficBuffer
+
+class TransportMetrics(object):
+    """Counters of a transport and the most recent traffic.
+
+    The counters are updated directly by the subclass, which provides also
+    the `lock`, `settings`, `connected_at`, `_write_queue`,
+    `_output_buffered` and `_compressor` attributes.
+
+    :Ivariables:
+        - `_send_calls`: number of send calls made
+        - `_bytes_sent`: number of bytes sent
+        - `_stanzas_sent`: number of top-level elements sent
+        - `_flushes`: number of write queue flushes
+        - `_buffers_flushed`: number of buffers sent by the flushes
+        - `_write_queue_peak`: maximum length of the write queue seen
+        - `_recv_calls`: number of receive calls made
+        - `_bytes_received`: number of bytes received
+        - `_stanzas_received`: number of top-level elements parsed
+        - `_read_budget_exhausted`: number of reads stopped by the read
+          budget
+        - `_parse_time`: seconds spent in the stream reader, not counting
+          the stream element handlers
+        - `_handler_time`: seconds spent in the stream element handlers
+          called for the data received
+        - `_traffic`: the most recent data sent and received (`None` when
+          disabled by the :r:`traffic_buffer_size setting`)
+    :Types:
+        - `_send_calls`: `int`
+        - `_bytes_sent`: `int`
+        - `_stanzas_sent`: `int`
+        - `_flushes`: `int`
+        - `_buffers_flushed`: `int`
+        - `_write_queue_peak`: `int`
+        - `_recv_calls`: `int`
+        - `_bytes_received`: `int`
+        - `_stanzas_received`: `int`
+        - `_read_budget_exhausted`: `int`
+        - `_parse_time`: `float`
+        - `_handler_time`: `float`
+        - `_traffic`: `traffic.TrafficBuffer`
+    """
+    # pylint: disable=E1101,R0902
+    def __init__(self, settings):
+        """Initialize the `TransportMetrics` part of a transport.
+
+        :Parameters:
+            - `settings`: the transport settings
+        :Types:
+            - `settings`: `XMPPSettings`
+        """
+        self._send_calls = 0
+        self._bytes_sent = 0
+        self._stanzas_sent = 0
+        self._flushes = 0
+        self._buffers_flushed = 0
+        self._write_queue_peak = 0
+        self._recv_calls = 0
+        self._bytes_received = 0
+        self._stanzas_received = 0
+        self._read_budget_exhausted = 0
+        self._parse_time = 0.0
+        self._handler_time = 0.0
+        traffic_buffer_size = settings["traffic_buffer_size"]
+        if traffic_buffer_size:
+            self._traffic = TrafficBuffer(traffic_buffer_size)
+        else:
+            self._traffic = None
+
+    @property
+    def output_stats(self):
+        """Output counters of the transport: number of send calls made
+        ('send_calls'), bytes sent ('bytes_sent'), number of write queue
+        flushes ('flushes') and buffers (usually stanzas) sent by those
+        flushes ('buffers_flushed').
+
+        'bytes_sent' / 'send_calls' is the average amount of data written per
+        system call and 'buffers_flushed' / 'flushes' is the average number
+        of stanzas coalesced into a single write.
+
+        :Returntype: `dict`
+        """
+        with self.lock:
+            return {
+                    "send_calls": self._send_calls,
+                    "bytes_sent": self._bytes_sent,
+                    "flushes": self._flushes,
+                    "buffers_flushed": self._buffers_flushed,
+                    }
+
+    @property
+    def input_stats(self):
+        """Input counters of the transport: number of receive calls made
+        ('recv_calls'), bytes received ('bytes_received'), stanzas parsed
+        ('stanzas_received') and number of `handle_read` calls stopped
+        because the read budget was used up ('read_budget_exhausted').
+
+        :Returntype: `dict`
+        """
+        with self.lock:
+            return {
+                    "recv_calls": self._recv_calls,
+                    "bytes_received": self._bytes_received,
+                    "stanzas_received": self._stanzas_received,
+                    "read_budget_exhausted": self._read_budget_exhausted,
+                    }
+
+    @property
+    def metrics(self):
+        """Per-connection metrics of the transport.
+
+        Contains the `input_stats` and `output_stats` counters and:
+
+            - 'stanzas_sent': top-level elements sent
+            - 'write_queue_length': current length of the write queue
+            - 'write_queue_peak': maximum length of the write queue seen
+            - 'output_buffered': bytes waiting in the write queue
+            - 'parse_time': seconds spent parsing the input
+            - 'handler_time': seconds spent in the stream handlers of the
+              elements received
+            - 'age': seconds since the connection has been established
+              (`None` if it has not been established yet)
+
+        The counters are updated unconditionally and cheaply, the dictionary
+        is built only when this property is read.
+
+        :Returntype: `dict`
+        """
+        with self.lock:
+            if self.connected_at is None:
+                age = None
+            else:
+                age = time.time() - self.connected_at
+            return {
+                    "send_calls": self._send_calls,
+                    "bytes_sent": self._bytes_sent,
+                    "stanzas_sent": self._stanzas_sent,
+                    "flushes": self._flushes,
+                    "buffers_flushed": self._buffers_flushed,
+                    "recv_calls": self._recv_calls,
+                    "bytes_received": self._bytes_received,
+                    "stanzas_received": self._stanzas_received,
+                    "read_budget_exhausted": self._read_budget_exhausted,
+                    "write_queue_length": len(self._write_queue),
+                    "write_queue_peak": self._write_queue_peak,
+                    "output_buffered": self._output_buffered,
+                    "parse_time": self._parse_time,
+                    "handler_time": self._handler_time,
+                    "age": age,
+                    }
+
+    @property
+    def traffic(self):
+        """The most recent data sent and received, as a list of
+        (timestamp, direction, data) tuples, where direction is "IN" or "OUT".
+        The data is uncompressed, but includes the stream-level
+        elements (TLS and SASL negotiation).
+
+        `None` when disabled by the :r:`traffic_buffer_size setting`.
+
+        :Returntype: `list`
+        """
+        with self.lock:
+            if self._traffic is None:
+                return None
+            return list(self._traffic.records)
+
+    def dump_traffic(self, reason, level = logging.DEBUG, once = False):
+        """Log the most recent data sent and received to the
+        "pyxmpp2.TRAFFIC" logger.
+
+        :Parameters:
+            - `reason`: why the traffic is dumped
+            - `level`: logging level to use
+            - `once`: do nothing if the traffic has already been dumped
+        :Types:
+            - `reason`: `unicode`
+            - `level`: `int`
+            - `once`: `bool`
+        """
+        with self.lock:
+            if self._traffic is None or once and self._traffic.dumped:
+                return
+            self._traffic.dumped = True
+            self._traffic.dump(reason, level)
+
+    @property
+    def compression_stats(self):
+        """Stream compression counters (see
+        `streamcompression.ZlibCompressor.stats`) or `None` when the
+        stream is not compressed.
+
+        :Returntype: `dict`
+        """
+        with self.lock:
+            if self._compressor is None:
+                return None
+            return self._compressor.stats
+
+_SUMMED_METRICS = ("send_calls", "bytes_sent", "stanzas_sent", "flushes",
+                    "buffers_flushed", "recv_calls", "bytes_received",
+                    "stanzas_received", "read_budget_exhausted",
+                    "write_queue_length", "output_buffered", "parse_time",
+                    "handler_time")
+
+def collect_metrics(main_loop):
+    """Collect the metrics of all transports registered in a main loop.
+
+    :Parameters:
+        - `main_loop`: the main loop
+    :Types:
+        - `main_loop`: `mainloop.base.MainLoopBase` or
+          `mainloop.threads.ThreadPool`
+
+    :Return: dictionary with a list of `TransportMetrics.metrics` of every
+        connection ('connections'), each with the
+        `streambase.StreamBase.metrics` of its stream ('stream') added, and
+        the counters summed over all the connections ('total').
+    :Returntype: `dict`
+    """
+    connections = []
+    total = dict.fromkeys(_SUMMED_METRICS, 0)
+    for handler in list(main_loop.io_handlers):
+        if not isinstance(handler, TransportMetrics):
+            continue
+        metrics = handler.metrics
+        for key in _SUMMED_METRICS:
+            total[key] += metrics[key]
+        stream = handler._stream # pylint: disable=W0212
+        if stream is not None and hasattr(stream, "metrics"):
+            metrics["stream"] = stream.metrics
+        connections.append(metrics)
+    return {"connections": connections, "total": total}
+
+# vi: sts=4 et sw=4
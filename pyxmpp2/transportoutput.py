@@ -0,0 +1,402 @@
+#
+# (C) Copyright 2011 Jacek Konieczny <jajcus@jajcus.net>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version
+# 2.1 as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+
+"""Output side of the XMPP TCP transport.
+
+`TransportOutput` is a base class of `transport.TCPTransport`, managing the
+write queue: data and other jobs (like a TLS handshake request) waiting for
+the socket, coalescing of the queued data into few system calls and the
+output buffer watermarks.
+"""
+
+from __future__ import absolute_import, division
+
+__docformat__ = "restructuredtext en"
+
+import socket
+import threading
+import errno
+import logging
+import time
+import ssl
+
+from collections import deque
+
+from .mainloop.base import in_loop_iteration
+from .settings import XMPPSettings
+from .exceptions import PyXMPPIOError
+from .streamevents import OutputBufferFullEvent, OutputBufferDrainedEvent
+from .connector import BLOCKING_ERRORS
+
+logger = logging.getLogger("pyxmpp2.transportoutput")
+
+OUT_LOGGER = logging.getLogger("pyxmpp2.OUT")
+
+# maximum number of buffers passed to a single `socket.sendmsg()` call
+MAX_IOV = 1024
+
+class WriteJob(object):
+    """Base class for objects put to the `TCPTransport` write queue."""
+    # pylint: disable-msg=R0903
+    def __repr__(self):
+        return "<WriteJob: {0}>".format(self.__class__.__name__)
+
+class ContinueConnect(WriteJob):
+    """Object to signal (via the write queue) a pending connect request.
+    """
+    # pylint: disable-msg=R0903
+    pass
+
+class StartTLS(WriteJob):
+    """StartTLS request for the `TCPTransport` write queue."""
+    # pylint: disable-msg=R0903
+    def __init__(self, **kwargs):
+        WriteJob.__init__(self)
+        self.kwargs = kwargs
+    def __repr__(self):
+        args = [ "{0}={1!r}".format(k, v) for (k, v) in self.kwargs.items() ]
+        return "<WriteJob: StartTLS: {0}>".format(" ".join(args))
+
+class TLSHandshake(WriteJob):
+    """Object to signal (via the write queue) a pending TLS handshake.
+    """
+    # pylint: disable-msg=R0903
+    pass
+
+class WriteData(WriteJob):
+    """Data queued for write.
+    """
+    # pylint: disable-msg=R0903
+    def __init__(self, data):
+        WriteJob.__init__(self)
+        self.data = data
+    def __repr__(self):
+        return "<WriteJob: WriteData: {0!r}>".format(self.data)
+
+class ShutdownWrite(WriteJob):
+    """Object to signal (via the write queue) that the writing side of the
+    socket should be shut down, after all the data queued before is sent.
+    """
+    # pylint: disable-msg=R0903
+    pass
+
+class TransportOutput(object):
+    """The write queue of a transport.
+
+    The subclass provides the `lock`, `last_write`, `_socket`, `_state`,
+    `_hup`, `_tls_state`, `_compressor` and `_traffic` attributes and the
+    `event` method.
+
+    :Ivariables:
+        - `_write_queue`: the data and jobs waiting for the socket
+        - `_write_queue_cond`: condition object to wait for the write queue
+          changes
+        - `_output_buffered`: number of bytes waiting in the write queue
+        - `_output_full`: `True` when the output buffer has reached the
+          high watermark and has not been drained below the low watermark yet
+        - `_high_watermark`: the :r:`output_buffer_high_watermark setting`
+        - `_low_watermark`: the :r:`output_buffer_low_watermark setting`,
+          lowered below `_high_watermark` if needed
+        - `_cork`: `True` when output produced while handling input should be
+          held until all the input available is processed
+        - `_corked`: `True` while output is being held
+        - `_output_notifier`: function to call when the write queue changes,
+          set by the main loop
+    :Types:
+        - `_write_queue`: :std:`collections.deque` of `WriteJob`
+        - `_write_queue_cond`: :std:`threading.Condition`
+        - `_output_buffered`: `int`
+        - `_output_full`: `bool`
+        - `_high_watermark`: `int`
+        - `_low_watermark`: `int`
+        - `_cork`: `bool`
+        - `_corked`: `bool`
+        - `_output_notifier`: callable
+    """
+    # pylint: disable=E1101
+    def __init__(self, settings):
+        """Initialize the `TransportOutput` part of a transport.
+
+        [called with `lock` created]
+
+        :Parameters:
+            - `settings`: the transport settings
+        :Types:
+            - `settings`: `XMPPSettings`
+        """
+        self._write_queue = deque()
+        self._write_queue_cond = threading.Condition(self.lock)
+        self._output_buffered = 0
+        self._output_full = False
+        self._high_watermark = settings["output_buffer_high_watermark"]
+        self._low_watermark = settings["output_buffer_low_watermark"]
+        if self._low_watermark >= self._high_watermark:
+            # the buffer would be reported drained as soon as it is full
+            logger.warning("output_buffer_low_watermark ({0}) not lower than"
+                        " output_buffer_high_watermark ({1}), using {2}"
+                        .format(self._low_watermark, self._high_watermark,
+                                                self._high_watermark // 2))
+            self._low_watermark = self._high_watermark // 2
+        self._cork = settings["output_cork"]
+        self._corked = False
+        self._output_notifier = None
+
+    def _write(self, data):
+        """Queue raw data to be written to the socket.
+
+        When nothing else is waiting in the write queue, as much of the data
+        as the socket accepts without blocking is sent immediately. The rest
+        is put into the write queue and sent by `handle_write` when the socket
+        becomes writable.
+
+        When called during an iteration of a main loop which will flush the
+        queue (the transport has an output notifier set and
+        `pyxmpp2.mainloop.base.in_loop_iteration` is `True`), the data is
+        always queued, so all the output produced in the iteration is sent
+        with a single write.
+
+        [called with `lock` acquired]
+
+        :Parameters:
+            - `data`: data to send
+        :Types:
+            - `data`: `bytes`
+        """
+        OUT_LOGGER.debug("OUT: %r", data)
+        if self._hup or not self._socket:
+            raise PyXMPPIOError(u"Connection closed.")
+        self.last_write = time.time()
+        if self._traffic is not None:
+            self._traffic.record("OUT", data)
+        if self._compressor is not None:
+            data = self._compressor.compress(data)
+        if (not self._write_queue and not self._corked
+                                            and self._state == "connected"
+                                            and (self._output_notifier is None
+                                                or not in_loop_iteration())):
+            sent = self._send(data)
+            self._send_calls += 1
+            self._bytes_sent += sent
+            data = data[sent:]
+            if not data:
+                return
+        self._write_queue.append(WriteData(data))
+        self._output_buffered += len(data)
+        if len(self._write_queue) > self._write_queue_peak:
+            self._write_queue_peak = len(self._write_queue)
+        self._write_queue_changed()
+        self._check_watermarks()
+
+    def _send(self, data):
+        """Send as much of `data` as the socket accepts without blocking.
+
+        [called with `lock` acquired]
+
+        :Parameters:
+            - `data`: data to send, a list of buffers is passed to
+              :std:`socket.sendmsg`
+        :Types:
+            - `data`: `bytes` or `list` of `bytes`
+
+        :Return: number of bytes sent
+        :Returntype: `int`
+        """
+        try:
+            while True:
+                try:
+                    if isinstance(data, list):
+                        return self._socket.sendmsg(data)
+                    return self._socket.send(data)
+                except ssl.SSLError, err:
+                    if err.args[0] in (ssl.SSL_ERROR_WANT_WRITE,
+                                                    ssl.SSL_ERROR_WANT_READ):
+                        return 0
+                    raise
+                except socket.error, err:
+                    if err.args[0] == errno.EINTR:
+                        continue
+                    if err.args[0] in BLOCKING_ERRORS:
+                        return 0
+                    raise
+        except (IOError, OSError, socket.error), err:
+            raise PyXMPPIOError(u"IO Error: {0}".format(err))
+
+    def _do_write(self):
+        """Send the data waiting at the front of the write queue.
+
+        Consecutive `WriteData` jobs are sent together: with a single
+        :std:`socket.sendmsg` call when available (plain TCP on Python 3) or
+        joined into a single buffer otherwise. Whatever the socket would not
+        accept without blocking is put back at the front of the queue.
+
+        [called with `lock` acquired]
+
+        :Return: `True` if all the data gathered has been sent
+        """
+        queue = self._write_queue
+        buffers = []
+        while (queue and isinstance(queue[0], WriteData)
+                                                and len(buffers) < MAX_IOV):
+            buffers.append(queue.popleft().data)
+        if not buffers:
+            return True
+        self._flushes += 1
+        self._buffers_flushed += len(buffers)
+        if len(buffers) == 1:
+            data = buffers[0]
+        elif self._tls_state is None and hasattr(self._socket, "sendmsg"):
+            data = buffers
+        else:
+            data = b"".join(buffers)
+            buffers = [data]
+        try:
+            sent = self._send(data)
+        except PyXMPPIOError:
+            self._hup = True
+            self._clear_write_queue()
+            raise
+        self._send_calls += 1
+        self._bytes_sent += sent
+        self._output_buffered -= sent
+        for i, buf in enumerate(buffers):
+            if sent < len(buf):
+                rest = [buf[sent:]] + buffers[i + 1:]
+                queue.extendleft(WriteData(chunk) for chunk in reversed(rest))
+                result = False
+                break
+            sent -= len(buf)
+        else:
+            result = True
+        self._check_watermarks()
+        return result
+
+    def _flush_write_queue(self):
+        """Send as much of the queued data as possible without blocking,
+        e.g. the stream tail before the socket is closed.
+
+        [called with `lock` acquired]
+        """
+        while self._write_queue and isinstance(self._write_queue[0],
+                                                                WriteData):
+            try:
+                if not self._do_write():
+                    break
+            except PyXMPPIOError, err:
+                logger.debug(u"Flushing the write queue failed: {0}"
+                                                                .format(err))
+                break
+
+    def _shutdown_write(self):
+        """Shut down the writing side of a plain TCP socket.
+
+        [called with `lock` acquired]
+        """
+        if self._socket is None or self._tls_state is not None:
+            return
+        try:
+            self._socket.shutdown(socket.SHUT_WR)
+        except socket.error:
+            pass
+
+    def _write_queue_changed(self):
+        """Wake up the threads waiting for the write queue and let the main
+        loop know it may have to wait for the socket writability.
+
+        [called with `lock` acquired]
+        """
+        self._write_queue_cond.notify()
+        if self._output_notifier is not None:
+            self._output_notifier(self)
+
+    def set_output_notifier(self, notifier):
+        """Set the function to be called (with the transport as the argument)
+        whenever something is put into the write queue.
+
+        Used by `pyxmpp2.mainloop.poll.PollMainLoop`, so it does not have to
+        check all its handlers for writability on every iteration.
+
+        :Parameters:
+            - `notifier`: the function or `None`
+        :Types:
+            - `notifier`: callable
+        """
+        with self.lock:
+            self._output_notifier = notifier
+
+    def _clear_write_queue(self):
+        """Drop everything queued for writing.
+
+        [called with `lock` acquired]
+        """
+        self._write_queue.clear()
+        self._output_buffered = 0
+        self._output_full = False
+        self._write_queue_changed()
+
+    def _check_watermarks(self):
+        """Emit `OutputBufferFullEvent` or `OutputBufferDrainedEvent` when
+        the amount of buffered output data crosses the configured watermarks.
+
+        [called with `lock` acquired]
+        """
+        if self._output_full:
+            if self._output_buffered <= self._low_watermark:
+                self._output_full = False
+                self.event(OutputBufferDrainedEvent(self._output_buffered))
+        elif self._output_buffered >= self._high_watermark:
+            self._output_full = True
+            self.event(OutputBufferFullEvent(self._output_buffered))
+
+    @property
+    def output_buffered(self):
+        """Number of bytes waiting in the output buffer."""
+        return self._output_buffered
+
+    @property
+    def output_buffer_full(self):
+        """`True` when the output buffer has reached the high watermark
+        and has not been drained to the low watermark yet."""
+        return self._output_full
+
+XMPPSettings.add_setting(u"output_buffer_high_watermark", type = int,
+        default = 262144,
+        validator = XMPPSettings.validate_positive_int,
+        doc = u"""Number of bytes waiting in the output buffer of a transport
+at which `OutputBufferFullEvent` is emitted. Sending more data is still
+possible, but an application should stop producing output for the connection
+until `OutputBufferDrainedEvent` is received."""
+    )
+XMPPSettings.add_setting(u"output_buffer_low_watermark", type = int,
+        default = 65536,
+        validator = XMPPSettings.validate_positive_int,
+        doc = u"""Number of bytes waiting in the output buffer of a transport
+at which, after the buffer was reported full, `OutputBufferDrainedEvent` is
+emitted. Must be lower than the :r:`output_buffer_high_watermark setting`,
+half of that is used otherwise."""
+    )
+XMPPSettings.add_setting(u"output_cork", type = bool, default = False,
+        cmdline_help = u"Coalesce output produced while handling input",
+        doc = u"""When enabled, output produced while a chunk of input is
+being processed is held and sent together, with as few system calls as
+possible, after the input is processed. E.g. all the responses to a burst of
+stanzas received go out in a single TCP segment. Transports handled by
+`pyxmpp2.mainloop.poll.PollMainLoop` (the default main loop) always queue
+the output produced during a loop iteration and send it with one write per
+connection, whether this is enabled or not."""
+    )
+
+# vi: sts=4 et sw=4
@@ -0,0 +1,296 @@
+#
+# (C) Copyright 2011 Jacek Konieczny <jajcus@jajcus.net>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version
+# 2.1 as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+
+"""TLS layer of the XMPP TCP transport.
+
+`TransportTLS` is a base class of `transport.TCPTransport`, implementing
+StartTLS and Direct TLS handshakes (optionally offloaded to an executor) and
+TLS session resumption with the :r:`tls_session_cache setting` cache.
+"""
+
+from __future__ import absolute_import, division
+
+__docformat__ = "restructuredtext en"
+
+import socket
+import select
+import logging
+import ssl
+
+try:
+    # pylint: disable=E0611
+    from ssl import CHANNEL_BINDING_TYPES
+except ImportError:
+    CHANNEL_BINDING_TYPES = []
+
+from .settings import XMPPSettings
+from .streamevents import TLSConnectingEvent, TLSConnectedEvent
+from .streamevents import TLSSessionCacheEvent
+from .cert import get_certificate_from_ssl_socket
+from .tlssession import SESSION_RESUMPTION_SUPPORTED
+from .transportoutput import StartTLS, TLSHandshake
+
+logger = logging.getLogger("pyxmpp2.transporttls")
+
+class TransportTLS(object):
+    """TLS support of a transport.
+
+    The subclass provides the `lock`, `settings`, `_socket`, `_state`,
+    `_state_cond`, `_dst_addr`, `_dst_hostname` and `_auth_properties`
+    attributes, the write queue (see `transportoutput.TransportOutput`) and
+    the `_set_state`, `_close` and `event` methods.
+
+    :Ivariables:
+        - `_tls_state`: state of TLS handshake
+        - `_tls_pending`: `True` when StartTLS has been requested, so no
+          more data should be read before the handshake
+        - `_tls_offloaded`: `True` while a handshake step runs in the
+          :r:`tls_handshake_executor setting` executor
+        - `_tls_session_key`: TLS session cache key for the connection
+        - `_tls_session_hit`: `True` when a cached TLS session has been
+          offered for the current handshake
+        - `_direct_tls`: arguments for :std:`ssl.wrap_socket` when TLS
+          handshake is to be done immediately after connecting
+    :Types:
+        - `_tls_state`: `unicode`
+        - `_tls_pending`: `bool`
+        - `_tls_offloaded`: `bool`
+        - `_tls_session_key`: `tuple`
+        - `_tls_session_hit`: `bool`
+        - `_direct_tls`: `dict`
+    """
+    # pylint: disable=E1101
+    def __init__(self):
+        """Initialize the `TransportTLS` part of a transport."""
+        self._tls_state = None
+        self._tls_pending = False
+        self._tls_offloaded = False
+        self._tls_session_key = None
+        self._tls_session_hit = False
+        self._direct_tls = None
+
+    def starttls(self, **kwargs):
+        """Request a TLS handshake on the socket ans switch
+        to encrypted output.
+        The handshake will start after any currently buffered data is sent.
+
+        When called before the connection is established, the handshake
+        is done right after connecting, before anything is sent
+        (Direct TLS, XEP-0368). The target stream is not notified with
+        `StreamBase.transport_connected` then, as it is the
+        `TLSConnectedEvent` handler which should start the stream after the
+        peer certificate is verified.
+        
+        :Parameters:
+            - `kwargs`: arguments for :std:`ssl.wrap_socket` or, when
+              `ssl_context` is given, the `ssl_context` and arguments for
+              its :std:`ssl.SSLContext.wrap_socket` method
+        """
+        with self.lock:
+            if self._state in (None, "resolve-srv", "resolving-srv",
+                                "resolve-hostname", "resolving-hostname",
+                                                    "connect", "connecting"):
+                self._direct_tls = kwargs
+                return
+            self.event(TLSConnectingEvent())
+            self._tls_pending = True
+            self._write_queue.append(StartTLS(**kwargs))
+            self._write_queue_changed()
+
+    def getpeercert(self):
+        """Return the peer certificate. 
+        
+        :ReturnType: `pyxmpp2.cert.Certificate`
+        """
+        with self.lock:
+            if not self._socket or self._tls_state != "connected":
+                raise ValueError("Not TLS-connected")
+            return get_certificate_from_ssl_socket(self._socket)
+
+    def _initiate_starttls(self, **kwargs):
+        """Initiate starttls handshake over the socket.
+        """
+        if self._tls_state == "connected":
+            raise RuntimeError("Already TLS-connected")
+        self._tls_pending = False
+        kwargs["do_handshake_on_connect"] = False
+        context = kwargs.pop("ssl_context", None)
+        logger.debug("Wrapping the socket into ssl")
+        if context is not None:
+            self._socket = context.wrap_socket(self._socket, **kwargs)
+        else:
+            self._socket = ssl.wrap_socket(self._socket, **kwargs)
+        if not kwargs.get("server_side"):
+            self._offer_tls_session(kwargs.get("server_hostname"))
+        self._set_state("tls-handshake")
+        self._step_tls_handshake()
+
+    def _offer_tls_session(self, sni_hostname):
+        """Offer a TLS session from the :r:`tls_session_cache setting`
+        cache for resumption in the handshake about to start.
+
+        [called with `lock` acquired]
+
+        :Parameters:
+            - `sni_hostname`: the SNI hostname used for the handshake
+        """
+        cache = self.settings["tls_session_cache"]
+        if cache is None or not SESSION_RESUMPTION_SUPPORTED:
+            self._tls_session_key = None
+            return
+        if self._dst_hostname is not None:
+            host = self._dst_hostname
+        else:
+            host = self._dst_addr[0]
+        self._tls_session_key = (host, self._dst_addr[1], sni_hostname)
+        session = cache.get(self._tls_session_key)
+        self._tls_session_hit = session is not None
+        if session is not None:
+            try:
+                self._socket.session = session
+            except (ValueError, ssl.SSLError), err:
+                logger.debug("Cached TLS session rejected: {0}".format(err))
+                cache.remove(self._tls_session_key)
+                self._tls_session_hit = False
+
+    def _store_tls_session(self):
+        """Store the current TLS session in the :r:`tls_session_cache
+        setting` cache.
+
+        [called with `lock` acquired]
+        """
+        if self._tls_session_key is None or self._tls_state != "connected":
+            return
+        cache = self.settings["tls_session_cache"]
+        try:
+            session = self._socket.session
+        except (AttributeError, ValueError):
+            return
+        cache.put(self._tls_session_key, session)
+
+    def _step_tls_handshake(self):
+        """Continue a TLS handshake, in the :r:`tls_handshake_executor
+        setting` executor if one is configured, or in the current thread
+        otherwise.
+
+        [called with `lock` acquired]
+        """
+        executor = self.settings["tls_handshake_executor"]
+        if executor is None:
+            self._continue_tls_handshake()
+            return
+        self._tls_offloaded = True
+        self._tls_state = "offloaded"
+        executor.submit(self._offloaded_tls_handshake, self._socket)
+
+    def _offloaded_tls_handshake(self, sock):
+        """Run TLS handshake steps in an executor thread, until the peer
+        data is needed to continue.
+
+        The `lock` is not held during the handshake, so the main loop is not
+        blocked; nothing else uses the socket then. A failed handshake
+        closes the transport, as there is no one to pass the exception to.
+
+        :Parameters:
+            - `sock`: the SSL socket
+        """
+        error = None
+        while True:
+            try:
+                sock.do_handshake()
+            except ssl.SSLError, err:
+                if err.args[0] == ssl.SSL_ERROR_WANT_READ:
+                    break
+                elif err.args[0] == ssl.SSL_ERROR_WANT_WRITE:
+                    select.select([], [sock], [], 1)
+                    continue
+                error = err
+            except socket.error, err:
+                error = err
+            break
+        with self.lock:
+            self._tls_offloaded = False
+            if self._socket is not sock:
+                return
+            if error is not None:
+                logger.warning("TLS handshake failed: {0}".format(error))
+                self._set_state("aborted")
+                self._close()
+                return
+            self._continue_tls_handshake()
+
+    def _continue_tls_handshake(self):
+        """Continue a TLS handshake."""
+        try:
+            logger.debug(" do_handshake()")
+            self._socket.do_handshake()
+        except ssl.SSLError, err:
+            if err.args[0] == ssl.SSL_ERROR_WANT_READ:
+                self._tls_state = "want_read"
+                logger.debug("   want_read")
+                self._state_cond.notify()
+                return
+            elif err.args[0] == ssl.SSL_ERROR_WANT_WRITE:
+                self._tls_state = "want_write"
+                logger.debug("   want_write")
+                self._write_queue.appendleft(TLSHandshake())
+                return
+            else:
+                if self._tls_session_hit:
+                    self.settings["tls_session_cache"].remove(
+                                                        self._tls_session_key)
+                raise
+        self._tls_state = "connected"
+        self._set_state("connected")
+        self._write_queue_changed()
+        self._auth_properties['security-layer'] = "TLS"
+        if "tls-unique" in CHANNEL_BINDING_TYPES:
+            try:
+                # pylint: disable=E1103
+                tls_unique = self._socket.get_channel_binding("tls-unique")
+            except ValueError:
+                pass
+            else:
+                self._auth_properties['channel-binding'] = {
+                                                    "tls-unique": tls_unique}
+        try:
+            cipher = self._socket.cipher()
+        except AttributeError:
+            # SSLSocket.cipher doesn't work on PyPy
+            cipher = "unknown"
+        cert = get_certificate_from_ssl_socket(self._socket)
+        self.event(TLSConnectedEvent(cipher, cert))
+        if self._tls_session_key is not None:
+            self._store_tls_session()
+            cache = self.settings["tls_session_cache"]
+            self.event(TLSSessionCacheEvent(self._tls_session_key,
+                                self._tls_session_hit,
+                                self._socket.session_reused,
+                                cache.hits, cache.misses))
+
+XMPPSettings.add_setting(u"tls_handshake_executor",
+        type = u"object with a ``submit(function, *args)`` method",
+        default = None,
+        doc = u"""Executor running the TLS handshake steps, e.g.
+a `pyxmpp2.mainloop.threads.WorkerPool` or a
+:std:`concurrent.futures.ThreadPoolExecutor`. The :std:`ssl` module releases
+the GIL during the cryptographic operations, so a burst of handshakes does
+not stall the main loop. By default handshakes run in the main loop
+thread."""
+    )
+
+# vi: sts=4 et sw=4
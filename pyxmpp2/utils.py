@@ -63,6 +63,172 @@ def xml_elements_equal(element1, element2, ignore_level1_cdata = False):
             return False
     return True
 
+def parse_http_head(data):
+    """Parse the head of an HTTP request or response (without the final
+    empty line).
+
+    :Parameters:
+        - `data`: the request or response head
+    :Types:
+        - `data`: `bytes`
+
+    :Return: the start line and a dictionary of headers (with lower-case
+        names)
+    :Returntype: (`bytes`, `dict`)
+    """
+    lines = data.split(b"\r\n")
+    headers = {}
+    for line in lines[1:]:
+        if b":" not in line:
+            continue
+        name, value = line.split(b":", 1)
+        headers[name.strip().lower()] = value.strip()
+    return lines[0], headers
+
+def http_header_tokens(headers, name):
+    """Return the comma-separated, lower-case tokens of an HTTP header
+    value.
+
+    :Parameters:
+        - `headers`: headers returned by `parse_http_head`
+        - `name`: lower-case header name
+    :Types:
+        - `headers`: `dict`
+        - `name`: `bytes`
+
+    :Returntype: `list` of `bytes`
+    """
+    value = headers.get(name, b"")
+    return [token.strip().lower() for token in value.split(b",")]
+
+from . import constants
+
+MAX_INTERNED_NAMES = 4096
+_INTERNED_NAMES = {}
+
+def register_names(names):
+    """Add names to the table of shared names used by `intern_name`.
+
+    Only names known in advance (defined by the code) should be registered,
+    never the names received from a peer, as the table is never purged.
+
+    :Parameters:
+        - `names`: element names, namespace URIs or attribute names
+    :Types:
+        - `names`: iterable of `unicode`
+    """
+    for name in names:
+        name = unicode(name)
+        _INTERNED_NAMES.setdefault(name, name)
+
+def intern_name(name):
+    """Return a shared copy of a well-known element name, namespace URI or
+    attribute name.
+
+    Names like '{jabber:client}message' are repeated in every stanza
+    received, interning them lets all the parsed elements and stanza
+    objects refer to a single string object.
+
+    Only the names added with `register_names` are shared, other names are
+    returned unchanged (the stream readers keep them in a per-reader
+    `NameCache`), so a peer sending random names cannot fill the table.
+
+    :Parameters:
+        - `name`: the name
+    :Types:
+        - `name`: `unicode`
+
+    :Returntype: `unicode`
+    """
+    return _INTERNED_NAMES.get(name, name)
+
+class NameCache(object):
+    """Shared copies of the names parsed by a single stream reader.
+
+    Well-known names are taken from the `intern_name` table, other names
+    are cached here, up to `MAX_INTERNED_NAMES` of them. The cache is
+    dropped together with the reader, so a peer sending random names can
+    only fill the cache of its own connection.
+
+    :Ivariables:
+        - `_names`: the names cached
+        - `_max_names`: maximum number of names cached
+    :Types:
+        - `_names`: `dict`
+        - `_max_names`: `int`
+    """
+    __slots__ = ("_names", "_max_names")
+    def __init__(self, max_names = None):
+        """Initialize the `NameCache` object.
+
+        :Parameters:
+            - `max_names`: maximum number of names cached,
+              `MAX_INTERNED_NAMES` by default
+        :Types:
+            - `max_names`: `int`
+        """
+        if max_names is None:
+            max_names = MAX_INTERNED_NAMES
+        self._names = {}
+        self._max_names = max_names
+
+    def get(self, name):
+        """Return a shared copy of `name`.
+
+        :Parameters:
+            - `name`: the name
+        :Types:
+            - `name`: `unicode`
+
+        :Returntype: `unicode`
+        """
+        shared = _INTERNED_NAMES.get(name)
+        if shared is None:
+            shared = self._names.get(name)
+            if shared is None:
+                shared = name
+                if len(self._names) < self._max_names:
+                    self._names[name] = name
+        return shared
+
+    def __len__(self):
+        return len(self._names)
+
+def _register_known_names():
+    """Register the stream, stanza and stream negotiation names."""
+    names = [constants.XML_LANG_QNAME, u"to", u"from", u"id", u"type",
+                u"version", u"xmlns", u"mechanism", u"h", u"resume",
+                u"previd", u"max", u"location", u"stamp",
+                u"message", u"presence", u"iq"]
+    qualified = [
+        (constants.STREAM_QNP, (u"stream", u"features", u"error")),
+        (constants.TLS_QNP, (u"starttls", u"required", u"proceed",
+                                                            u"failure")),
+        (constants.SASL_QNP, (u"mechanisms", u"mechanism", u"auth",
+                            u"challenge", u"response", u"success",
+                            u"failure", u"abort")),
+        (constants.BIND_QNP, (u"bind", u"resource", u"jid")),
+        (constants.SESSION_QNP, (u"session",)),
+        (constants.SM_QNP, (u"sm", u"enable", u"enabled", u"r", u"a",
+                            u"resume", u"resumed", u"failed")),
+        (constants.FRAMING_QNP, (u"open", u"close")),
+        (constants.BOSH_QNP, (u"body",)),
+        (constants.STANZA_ERROR_QNP, (u"text",)),
+        (constants.STREAM_ERROR_QNP, (u"text",)),
+        ]
+    for prefix in (constants.STANZA_CLIENT_QNP, constants.STANZA_SERVER_QNP):
+        names.append(prefix)
+        qualified.append((prefix, (u"message", u"presence", u"iq",
+                            u"body", u"subject", u"thread", u"show",
+                            u"status", u"priority", u"error")))
+    for prefix, locals_ in qualified:
+        names += [prefix + local for local in locals_]
+    names += [value for key, value in vars(constants).items()
+                                                if key.endswith("_NS")]
+    register_names(names)
+
+_register_known_names()
+
 import time
 import datetime
 
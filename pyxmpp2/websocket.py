@@ -0,0 +1,717 @@
+#
+# (C) Copyright 2011 Jacek Konieczny <jajcus@jajcus.net>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version
+# 2.1 as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+
+"""XMPP over WebSocket.
+
+The WebSocket transport uses its own framing: every stanza or other top-level
+element is sent as a separate, self-contained XML document in a single
+WebSocket text message and the stream root is replaced with the ``<open/>``
+and ``<close/>`` elements.
+
+Normative reference:
+  - :RFC:`7395`
+  - :RFC:`6455`
+"""
+
+from __future__ import absolute_import, division
+
+__docformat__ = "restructuredtext en"
+
+import os
+import struct
+import base64
+import hashlib
+import binascii
+import logging
+
+try:
+    # pylint: disable=E0611,F0401
+    from urllib.parse import urlsplit
+except ImportError:
+    from urlparse import urlsplit
+
+from .etree import ElementTree
+from .constants import FRAMING_QNP, STREAM_NS, STREAM_ROOT_TAG, XML_LANG_QNAME
+from .settings import XMPPSettings
+from .exceptions import PyXMPPIOError
+from .exceptions import StreamParseError, StanzaLimitExceeded
+from .xmppserializer import XMPPSerializer
+from .xmppparser import parse_document
+from .utils import parse_http_head, http_header_tokens
+from .transport import TCPTransport
+from .transportoutput import ShutdownWrite
+
+logger = logging.getLogger("pyxmpp2.websocket")
+
+OPEN_TAG = FRAMING_QNP + u"open"
+CLOSE_TAG = FRAMING_QNP + u"close"
+
+# :RFC:`6455` constants
+WEBSOCKET_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+WEBSOCKET_PROTOCOL = b"xmpp"
+
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xa
+
+CLOSE_NORMAL = 1000
+CLOSE_PROTOCOL_ERROR = 1002
+CLOSE_UNSUPPORTED_DATA = 1003
+CLOSE_TOO_BIG = 1009
+
+# maximum size of the HTTP handshake request or response
+MAX_HANDSHAKE_SIZE = 16384
+
+# each message is parsed as a child of this element
+MESSAGE_WRAPPER_START = b"<message-wrapper>"
+MESSAGE_WRAPPER_END = b"</message-wrapper>"
+
+def websocket_accept_key(key):
+    """Compute the 'Sec-WebSocket-Accept' value for a 'Sec-WebSocket-Key'.
+
+    :Parameters:
+        - `key`: the 'Sec-WebSocket-Key' header value
+    :Types:
+        - `key`: `bytes`
+
+    :Returntype: `bytes`
+    """
+    return base64.b64encode(hashlib.sha1(key + WEBSOCKET_GUID).digest())
+
+def apply_mask(data, key):
+    """Mask or unmask WebSocket frame payload.
+
+    :Parameters:
+        - `data`: the payload
+        - `key`: the 4-byte masking key
+    :Types:
+        - `data`: `bytes`
+        - `key`: `bytes`
+
+    :Returntype: `bytes`
+    """
+    length = len(data)
+    if not length:
+        return b""
+    key = (key * (length // 4 + 1))[:length]
+    # XOR as big integers, not byte by byte in Python
+    value = int(binascii.hexlify(data), 16) ^ int(binascii.hexlify(key), 16)
+    return binascii.unhexlify("{0:0{1}x}".format(value, length * 2))
+
+def make_frame(opcode, payload, mask = False):
+    """Build a single (final) WebSocket frame.
+
+    :Parameters:
+        - `opcode`: the frame opcode
+        - `payload`: the frame payload
+        - `mask`: `True` to mask the payload (required for frames sent
+          by the client)
+    :Types:
+        - `opcode`: `int`
+        - `payload`: `bytes`
+        - `mask`: `bool`
+
+    :Returntype: `bytes`
+    """
+    length = len(payload)
+    mask_bit = 0x80 if mask else 0
+    if length < 126:
+        header = struct.pack("!BB", 0x80 | opcode, mask_bit | length)
+    elif length < 65536:
+        header = struct.pack("!BBH", 0x80 | opcode, mask_bit | 126, length)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, mask_bit | 127, length)
+    if mask:
+        key = os.urandom(4)
+        return header + key + apply_mask(payload, key)
+    return header + payload
+
+class WebSocketTransport(TCPTransport):
+    """XMPP over WebSocket (:RFC:`7395`).
+
+    The connection is established the same way as for `TCPTransport` (with
+    optional Direct TLS for 'wss:' URLs), then the WebSocket opening
+    handshake is done and XMPP content goes in WebSocket text messages.
+
+    Every message received is parsed separately, so there is no incremental
+    parser to restart after StartTLS or SASL.
+
+    An instance created with a socket (accepted connection) acts as the
+    WebSocket server.
+
+    :Ivariables:
+        - `_ws_host`: value of the 'Host' header sent in the handshake
+        - `_ws_path`: request path (resource name) of the WebSocket endpoint
+        - `_ws_key`: the 'Sec-WebSocket-Key' sent in the handshake
+        - `_ws_server`: `True` for the WebSocket server side
+        - `_ws_state`: WebSocket connection state: `None`, "handshake",
+          "open", "closing" (close frame sent) or "closed"
+        - `_ws_input`: data received and not processed yet
+        - `_ws_message`: fragments of the message being received
+        - `_ws_pending`: frames waiting for the handshake to complete
+        - `_ws_max_message`: maximum size of a message received
+    :Types:
+        - `_ws_host`: `unicode`
+        - `_ws_path`: `unicode`
+        - `_ws_key`: `bytes`
+        - `_ws_server`: `bool`
+        - `_ws_state`: `unicode`
+        - `_ws_input`: `bytearray`
+        - `_ws_message`: `list` of `bytes`
+        - `_ws_pending`: `list` of `bytes`
+        - `_ws_max_message`: `int`
+    """
+    # pylint: disable=R0902
+    def __init__(self, settings = None, sock = None):
+        """Initialize the `WebSocketTransport` object.
+
+        :Parameters:
+            - `settings`: XMPP settings to use
+            - `sock`: existing socket, e.g. for accepted incoming connection.
+        """
+        TCPTransport.__init__(self, settings, sock)
+        self._ws_server = sock is not None
+        self._ws_host = None
+        self._ws_path = self.settings["websocket_path"]
+        self._ws_key = None
+        self._ws_input = bytearray()
+        self._ws_message = None
+        self._ws_pending = []
+        self._ws_max_message = self.settings["websocket_max_message_size"]
+        if self._ws_server:
+            self._ws_state = "handshake"
+        else:
+            self._ws_state = None
+
+    def connect_url(self, url):
+        """Start connecting to a WebSocket endpoint.
+
+        For a 'wss:' URL TLS must have been requested already, usually with
+        `streamtls.StreamTLSHandler.make_direct_tls_connection`.
+
+        [initiating entity only]
+
+        :Parameters:
+            - `url`: the 'ws:' or 'wss:' URL of the XMPP WebSocket endpoint
+        :Types:
+            - `url`: `unicode`
+        """
+        parts = urlsplit(url)
+        if parts.scheme == "ws":
+            port = 80
+        elif parts.scheme == "wss":
+            if self._direct_tls is None:
+                raise ValueError("TLS must be requested before connecting"
+                                                        " to a 'wss:' URL")
+            port = 443
+        else:
+            raise ValueError("Not a WebSocket URL: {0!r}".format(url))
+        if parts.port:
+            port = parts.port
+        self._ws_host = parts.netloc.rsplit("@", 1)[-1]
+        self._ws_path = parts.path or u"/"
+        if parts.query:
+            self._ws_path += u"?" + parts.query
+        self.connect(parts.hostname, port)
+
+    def _connect(self, addr, port, service):
+        """Same as `connect`, but assumes `lock` acquired.
+        """
+        if self._ws_host is None:
+            if port:
+                self._ws_host = u"{0}:{1}".format(addr, port)
+            else:
+                self._ws_host = addr
+        TCPTransport._connect(self, addr, port, service)
+
+    def set_target(self, stream):
+        """Make the `stream` the target for this transport instance.
+
+        :Parameters:
+            - `stream`: the stream handler to receive stream content
+              from the transport
+        :Types:
+            - `stream`: `StreamBase`
+        """
+        with self.lock:
+            if self._stream:
+                raise ValueError("Target stream already set")
+            self._stream = stream
+
+    def _connected(self):
+        """Handle connection success: send the WebSocket handshake request,
+        unless TLS is to be established first."""
+        TCPTransport._connected(self)
+        if self._state == "connected":
+            self._send_handshake_request()
+
+    def _continue_tls_handshake(self):
+        """Continue a TLS handshake and send the WebSocket handshake request
+        when it is completed."""
+        TCPTransport._continue_tls_handshake(self)
+        if self._tls_state == "connected" and self._ws_state is None:
+            self._send_handshake_request()
+
+    def _send_handshake_request(self):
+        """Send the WebSocket opening handshake request.
+
+        [called with `lock` acquired]
+        """
+        self._ws_state = "handshake"
+        self._ws_key = base64.b64encode(os.urandom(16))
+        request = (u"GET {0} HTTP/1.1\r\n"
+                    u"Host: {1}\r\n"
+                    u"Upgrade: websocket\r\n"
+                    u"Connection: Upgrade\r\n"
+                    u"Sec-WebSocket-Key: {2}\r\n"
+                    u"Sec-WebSocket-Version: 13\r\n"
+                    u"Sec-WebSocket-Protocol: xmpp\r\n"
+                    u"\r\n").format(self._ws_path, self._ws_host,
+                                                self._ws_key.decode("ascii"))
+        self._write(request.encode("utf-8"))
+
+    def _process_handshake_response(self, head):
+        """Verify the server handshake response.
+
+        [called with `lock` acquired]
+
+        :Parameters:
+            - `head`: the response head
+        :Types:
+            - `head`: `bytes`
+        """
+        status, headers = parse_http_head(head)
+        status = status.split(None, 2)
+        if len(status) < 2 or status[1] != b"101":
+            raise PyXMPPIOError(u"WebSocket handshake rejected: {0!r}"
+                                                    .format(b" ".join(status)))
+        if (b"websocket" not in http_header_tokens(headers, b"upgrade")
+                or headers.get(b"sec-websocket-accept")
+                                    != websocket_accept_key(self._ws_key)):
+            raise PyXMPPIOError(u"Bad WebSocket handshake response")
+        if headers.get(b"sec-websocket-protocol") != WEBSOCKET_PROTOCOL:
+            raise PyXMPPIOError(u"WebSocket 'xmpp' protocol not accepted")
+        self._handshake_done()
+
+    def _process_handshake_request(self, head):
+        """Verify the client handshake request and send the response.
+
+        [called with `lock` acquired]
+
+        :Parameters:
+            - `head`: the request head
+        :Types:
+            - `head`: `bytes`
+        """
+        request, headers = parse_http_head(head)
+        request = request.split()
+        key = headers.get(b"sec-websocket-key")
+        if (len(request) != 3 or request[0] != b"GET"
+                or b"websocket" not in http_header_tokens(headers, b"upgrade")
+                or headers.get(b"sec-websocket-version") != b"13"
+                or not key):
+            self._reject_handshake(b"400 Bad Request")
+            raise PyXMPPIOError(u"Bad WebSocket handshake request")
+        if WEBSOCKET_PROTOCOL not in http_header_tokens(headers,
+                                                    b"sec-websocket-protocol"):
+            self._reject_handshake(b"400 Bad Request")
+            raise PyXMPPIOError(u"WebSocket 'xmpp' protocol not requested")
+        self._ws_path = request[1].decode("utf-8")
+        self._ws_host = headers.get(b"host", b"").decode("utf-8")
+        self._write(b"HTTP/1.1 101 Switching Protocols\r\n"
+                    b"Upgrade: websocket\r\n"
+                    b"Connection: Upgrade\r\n"
+                    b"Sec-WebSocket-Accept: " + websocket_accept_key(key)
+                    + b"\r\n"
+                    b"Sec-WebSocket-Protocol: xmpp\r\n"
+                    b"\r\n")
+        self._handshake_done()
+
+    def _reject_handshake(self, status):
+        """Send an HTTP error response to a bad handshake request.
+
+        [called with `lock` acquired]
+        """
+        self._write(b"HTTP/1.1 " + status + b"\r\n"
+                    b"Connection: close\r\n"
+                    b"Content-Length: 0\r\n"
+                    b"\r\n")
+        self._ws_state = "closed"
+        self._hup = True
+        self._write_queue.append(ShutdownWrite())
+        self._write_queue_cond.notify()
+
+    def _handshake_done(self):
+        """Switch to the WebSocket protocol after the opening handshake and
+        send the frames waiting for that.
+
+        [called with `lock` acquired]
+        """
+        logger.debug("WebSocket connection established")
+        self._ws_state = "open"
+        self._auth_properties['websocket-path'] = self._ws_path
+        pending = self._ws_pending
+        self._ws_pending = []
+        for frame in pending:
+            self._write(frame)
+
+    def _send_message(self, opcode, payload):
+        """Send a WebSocket message as a single frame, or keep it until the
+        opening handshake is completed.
+
+        [called with `lock` acquired]
+
+        :Parameters:
+            - `opcode`: the frame opcode
+            - `payload`: the frame payload
+        :Types:
+            - `opcode`: `int`
+            - `payload`: `bytes`
+        """
+        frame = make_frame(opcode, payload, mask = not self._ws_server)
+        if self._ws_state == "open":
+            self._write(frame)
+        elif self._ws_state in (None, "handshake"):
+            self._ws_pending.append(frame)
+        else:
+            logger.debug("WebSocket closing, dropping a frame")
+
+    def _send_close(self, code, reason = u""):
+        """Send a WebSocket close frame.
+
+        [called with `lock` acquired]
+
+        :Parameters:
+            - `code`: the status code
+            - `reason`: the close reason
+        :Types:
+            - `code`: `int`
+            - `reason`: `unicode`
+        """
+        if self._ws_state not in ("open", None, "handshake"):
+            return
+        payload = struct.pack("!H", code) + reason.encode("utf-8")
+        self._send_message(OP_CLOSE, payload)
+        self._ws_state = "closing"
+
+    def send_stream_head(self, stanza_namespace, stream_from, stream_to,
+                        stream_id = None, version = u'1.0', language = None):
+        """
+        Send the ``<open/>`` element via the transport.
+
+        :Parameters:
+            - `stanza_namespace`: namespace of stream stanzas (e.g.
+              'jabber:client')
+            - `stream_from`: the 'from' attribute of the stream. May be `None`.
+            - `stream_to`: the 'to' attribute of the stream. May be `None`.
+            - `version`: the 'version' of the stream.
+            - `language`: the 'xml:lang' of the stream
+        :Types:
+            - `stanza_namespace`: `unicode`
+            - `stream_from`: `unicode`
+            - `stream_to`: `unicode`
+            - `version`: `unicode`
+            - `language`: `unicode`
+        """
+        # pylint: disable=R0913
+        with self.lock:
+            prefixes = {STREAM_NS: u"stream"}
+            prefixes.update(self.settings["extra_ns_prefixes"])
+            self._serializer = XMPPSerializer(stanza_namespace, prefixes)
+            element = ElementTree.Element(OPEN_TAG)
+            if stream_from:
+                element.set(u"from", stream_from)
+            if stream_to:
+                element.set(u"to", stream_to)
+            if stream_id is not None:
+                element.set(u"id", stream_id)
+            element.set(u"version", version)
+            if language is not None:
+                element.set(XML_LANG_QNAME, language)
+            data = self._serializer.emit_standalone(element)
+            self._send_message(OP_TEXT, data.encode("utf-8"))
+
+    def restart(self):
+        """Restart the stream after SASL authentication.
+
+        Nothing to do for the parser, as every message is parsed
+        separately."""
+        with self.lock:
+            self._serializer = None
+
+    def send_stream_tail(self):
+        """
+        Send the ``<close/>`` element and close the WebSocket connection.
+        """
+        with self.lock:
+            if not self._socket or self._hup:
+                logger.debug(u"Cannot send stream closing tag: already closed")
+                return
+            element = ElementTree.Element(CLOSE_TAG)
+            data = self._serializer.emit_standalone(element)
+            try:
+                self._send_message(OP_TEXT, data.encode("utf-8"))
+                self._send_close(CLOSE_NORMAL)
+            except (IOError, SystemError, PyXMPPIOError), err:
+                logger.debug(u"Sending stream closing tag failed: {0}"
+                                                                .format(err))
+            self._serializer = None
+            self._hup = True
+            self._set_state("closing")
+            if not self._ws_server:
+                # the server closes the TCP connection first
+                return
+            if self._write_queue:
+                self._write_queue.append(ShutdownWrite())
+                self._write_queue_cond.notify()
+            else:
+                self._shutdown_write()
+
+    def send_element(self, element):
+        """
+        Send an element via the transport, in a separate WebSocket message.
+        """
+        with self.lock:
+            if self._eof or self._socket is None or not self._serializer:
+                logger.debug("Dropping element: {0!r}".format(element))
+                return
+            data = self._serializer.emit_standalone(element)
+            self._send_message(OP_TEXT, data.encode("utf-8"))
+
+    def _feed_reader(self, data):
+        """Process WebSocket data received.
+
+        [ called with `lock` acquired ]
+
+        If `data` is None or empty, then stream end (peer disconnected) is
+        assumed and the stream is closed.
+
+        :Parameters:
+            - `data`: data received from the stream socket.
+        :Types:
+            - `data`: `bytes` or a read-only buffer
+        """
+        if not data:
+            TCPTransport._feed_reader(self, data)
+            return
+        self._ws_input += data
+        try:
+            if self._ws_state in (None, "handshake"):
+                self._read_handshake()
+            if self._ws_state in ("open", "closing"):
+                self._read_frames()
+        except PyXMPPIOError:
+            self._ws_input = bytearray()
+            raise
+
+    def _read_handshake(self):
+        """Process the opening handshake request or response received.
+
+        [called with `lock` acquired]
+        """
+        end = self._ws_input.find(b"\r\n\r\n")
+        if end < 0:
+            if len(self._ws_input) > MAX_HANDSHAKE_SIZE:
+                raise PyXMPPIOError(u"WebSocket handshake too long")
+            return
+        head = bytes(self._ws_input[:end])
+        del self._ws_input[:end + 4]
+        if self._ws_server:
+            self._process_handshake_request(head)
+        else:
+            self._process_handshake_response(head)
+
+    def _read_frames(self):
+        """Decode the complete frames received and process them.
+
+        [called with `lock` acquired]
+        """
+        buf = self._ws_input
+        pos = 0
+        try:
+            while (self._stream and self._ws_state != "closed"
+                                                and len(buf) - pos >= 2):
+                byte1, byte2 = buf[pos], buf[pos + 1]
+                fin = byte1 & 0x80
+                opcode = byte1 & 0x0f
+                masked = byte2 & 0x80
+                length = byte2 & 0x7f
+                header_len = 2
+                if length == 126:
+                    if len(buf) - pos < 4:
+                        break
+                    length = struct.unpack("!H", bytes(buf[pos + 2:pos + 4]))[0]
+                    header_len = 4
+                elif length == 127:
+                    if len(buf) - pos < 10:
+                        break
+                    length = struct.unpack("!Q",
+                                            bytes(buf[pos + 2:pos + 10]))[0]
+                    header_len = 10
+                if masked:
+                    header_len += 4
+                if masked != (0x80 if self._ws_server else 0):
+                    self._protocol_error(CLOSE_PROTOCOL_ERROR,
+                                            u"Bad WebSocket frame masking")
+                if length > self._ws_max_message:
+                    self._protocol_error(CLOSE_TOO_BIG,
+                                            u"WebSocket message too big")
+                if len(buf) - pos < header_len + length:
+                    break
+                payload = bytes(buf[pos + header_len:pos + header_len + length])
+                if masked:
+                    mask = bytes(buf[pos + header_len - 4:pos + header_len])
+                    payload = apply_mask(payload, mask)
+                pos += header_len + length
+                self._process_frame(fin, opcode, payload)
+        finally:
+            del buf[:pos]
+
+    def _process_frame(self, fin, opcode, payload):
+        """Process a single WebSocket frame.
+
+        [called with `lock` acquired]
+
+        :Parameters:
+            - `fin`: the FIN bit
+            - `opcode`: the frame opcode
+            - `payload`: the frame payload (unmasked)
+        """
+        if opcode == OP_PING:
+            self._send_message(OP_PONG, payload)
+        elif opcode == OP_PONG:
+            pass
+        elif opcode == OP_CLOSE:
+            logger.debug("WebSocket close frame received: {0!r}"
+                                                            .format(payload))
+            if self._ws_state == "open":
+                self._send_message(OP_CLOSE, payload[:2])
+            self._ws_state = "closed"
+            self._ws_input = bytearray()
+            TCPTransport._feed_reader(self, None)
+        elif opcode == OP_CONTINUATION:
+            if self._ws_message is None:
+                self._protocol_error(CLOSE_PROTOCOL_ERROR,
+                                        u"Unexpected WebSocket continuation")
+            self._ws_message.append(payload)
+            if sum(len(fragment) for fragment in self._ws_message) \
+                                                    > self._ws_max_message:
+                self._protocol_error(CLOSE_TOO_BIG,
+                                            u"WebSocket message too big")
+            if fin:
+                message = b"".join(self._ws_message)
+                self._ws_message = None
+                self._process_message(message)
+        elif opcode == OP_TEXT:
+            if self._ws_message is not None:
+                self._protocol_error(CLOSE_PROTOCOL_ERROR,
+                                        u"Unfinished WebSocket message")
+            if fin:
+                self._process_message(payload)
+            else:
+                self._ws_message = [payload]
+        elif opcode == OP_BINARY:
+            self._protocol_error(CLOSE_UNSUPPORTED_DATA,
+                                    u"Binary WebSocket message received")
+        else:
+            self._protocol_error(CLOSE_PROTOCOL_ERROR,
+                            u"Unknown WebSocket opcode: {0}".format(opcode))
+
+    def _protocol_error(self, code, description):
+        """Fail the WebSocket connection on a framing error.
+
+        [called with `lock` acquired]
+        """
+        logger.warning(description)
+        self._send_close(code)
+        self._flush_write_queue()
+        self._close()
+        raise PyXMPPIOError(description)
+
+    def _process_message(self, message):
+        """Parse a WebSocket message received and pass its content
+        to the stream.
+
+        The message is parsed as the only child of a wrapper element, with
+        the stream reader selected by the :r:`xml_parser setting`, so the
+        stanza limits and filters apply.
+
+        [called with `lock` acquired]
+
+        :Parameters:
+            - `message`: a complete message received
+        :Types:
+            - `message`: `bytes`
+        """
+        if self._traffic is not None:
+            self._traffic.record("IN", message)
+        stream = self._stream
+        element = None
+        error = None
+        limit_exceeded = False
+        try:
+            elements = parse_document(b"".join((MESSAGE_WRAPPER_START,
+                            message, MESSAGE_WRAPPER_END)), self.settings)[1]
+        except StanzaLimitExceeded, err:
+            error = unicode(err)
+            limit_exceeded = True
+        except StreamParseError, err:
+            error = unicode(err)
+        else:
+            if len(elements) > 1:
+                error = u"More than one element in a WebSocket message"
+            elif elements:
+                element = elements[0]
+                if element.tag not in (OPEN_TAG, CLOSE_TAG):
+                    self._stanzas_received += 1
+        self.lock.release() # not to deadlock with the stream
+        try:
+            if limit_exceeded:
+                stream.stream_limit_exceeded(error)
+            elif error is not None:
+                stream.stream_parse_error(error)
+            elif element is None:
+                # dropped by a stanza filter
+                pass
+            elif element.tag == OPEN_TAG:
+                root = ElementTree.Element(STREAM_ROOT_TAG,
+                                                    dict(element.items()))
+                stream.stream_start(root)
+            elif element.tag == CLOSE_TAG:
+                stream.stream_end()
+            else:
+                stream.stream_element(element)
+        finally:
+            self.lock.acquire()
+
+XMPPSettings.add_setting(u"websocket_path", type = unicode,
+        default = u"/xmpp-websocket",
+        doc = u"""Resource name (path) of the XMPP WebSocket endpoint,
+used when the `websocket.WebSocketTransport` is connected with a host name
+and port instead of an URL."""
+    )
+XMPPSettings.add_setting(u"websocket_max_message_size", type = int,
+        default = 1048576,
+        validator = XMPPSettings.validate_positive_int,
+        doc = u"""Maximum size of a WebSocket message received. The
+connection is closed when the peer sends a bigger one."""
+    )
+
+# vi: sts=4 et sw=4
@@ -15,7 +15,14 @@
 # Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
 #
 
-"""ElementTree-based XMPP stream parserg"""
+"""XMPP stream parsers.
+
+`StreamReader` uses the :etree:`ElementTree.XMLParser` of the selected
+ElementTree implementation. The readers driving the XML parsers directly
+are in the `xmppreaders` module, the stanza limits and filters applied by
+all of them in `stanzalimits`. The one used by the transports is selected
+by the :r:`xml_parser setting`, from the `XML_PARSERS` registry.
+"""
 
 from __future__ import absolute_import, division
 
@@ -26,7 +33,17 @@ import logging
 
 from .etree import ElementTree
 
-from .exceptions import StreamParseError
+from .exceptions import StreamParseError, StanzaLimitExceeded
+from .settings import XMPPSettings
+from .utils import NameCache
+from .stanzalimits import StanzaLimits, drop_stanza
+from .xmppreaders import ExpatStreamReader, LazyExpatStreamReader
+from .xmppreaders import LXMLStreamReader, lxml_etree
+
+# pylint: disable=W0611
+from .stanzalimits import StanzaFilter
+# pylint: disable=W0611
+from .xmppreaders import LazyElement
 
 COMMON_NS = "http://pyxmpp.jajcus.net/xmlns/common"
 
@@ -72,6 +89,17 @@ class XMLStreamHandler(object):
             - `descr`: `unicode`"""
         raise StreamParseError(descr)
 
+    def stream_limit_exceeded(self, descr):
+        """Called when an element received exceeds the parser limits.
+        The partial element has already been dropped and no more input will
+        be parsed.
+
+        :Parameters:
+            - `descr`: description of the limit exceeded
+        :Types:
+            - `descr`: `unicode`"""
+        raise StanzaLimitExceeded(descr)
+
     def stream_eof(self):
         """Called when stream input ends (EOF, socket closed by peer) 
         which could happen before actual stream end tag was received, 
@@ -83,22 +111,66 @@ class XMLStreamHandler(object):
         pass
 
 
+class _NullTreeBuilder(object):
+    """Tree builder replacement for a dropped stanza."""
+    # pylint: disable-msg=R0201,W0613
+    def start(self, tag, attrs):
+        """Ignore a start tag."""
+        pass
+    def data(self, data):
+        """Ignore text."""
+        pass
+    def end(self, tag):
+        """Ignore an end tag."""
+        return None
+
+_NULL_TREE_BUILDER = _NullTreeBuilder()
+
 class ParserTarget(object):
-    """Element tree parser events handler for the XMPP stream parser."""
-    def __init__(self, handler):
+    """Element tree parser events handler for the XMPP stream parser.
+
+    :Ivariables:
+        - `stanzas`: number of complete stanzas (direct children of the root
+          element) parsed
+        - `stanzas_dropped`: number of stanzas dropped by the `filters`
+        - `filters`: the stanza filters
+        - `limits`: the stanza limits
+        - `_exceeded`: `True` after a limit has been exceeded, then the
+          events from the parser (which may still come, e.g. from the C
+          ElementTree implementation) are ignored
+        - `_names`: shared copies of the element and attribute names
+    :Types:
+        - `stanzas`: `int`
+        - `stanzas_dropped`: `int`
+        - `filters`: `list` of `StanzaFilter`
+        - `limits`: `StanzaLimits`
+        - `_exceeded`: `bool`
+        - `_names`: `NameCache`
+    """
+    def __init__(self, handler, settings = None):
         """Initialize the SAX handler.
 
         :Parameters:
             - `handler`: Object to handle stream start, end and stanzas.
+            - `settings`: settings with the stanza limits and filters
         :Types:
             - `handler`: `XMLStreamHandler`
+            - `settings`: `XMPPSettings`
         """
+        if settings is None:
+            settings = XMPPSettings()
         self._handler = handler
+        self.filters = list(settings["stanza_filters"])
+        self.limits = StanzaLimits(settings)
+        self._exceeded = False
+        self._names = NameCache()
         self._head = ""
         self._tail = ""
         self._builder = None
         self._level = 0
         self._root = None
+        self.stanzas = 0
+        self.stanzas_dropped = 0
 
     def data(self, data):
         """Handle XML text data.
@@ -106,7 +178,12 @@ class ParserTarget(object):
         Ignore the data outside the root element and directly under the root,
         pass all other text to the tree builder, so it will be included in the
         stanzas."""
-        if self._level > 1:
+        if self._level > 1 and not self._exceeded:
+            try:
+                self.limits.data(data)
+            except StanzaLimitExceeded:
+                self.release()
+                raise
             return self._builder.data(data)
 
     def start(self, tag, attrs):
@@ -116,13 +193,31 @@ class ParserTarget(object):
         an empty root element if it is top level.
         
         For lower level tags use :etree:`ElementTree.TreeBuilder` to collect
-        them.
+        them, unless the stanza is dropped by the `filters`.
         """
+        if self._exceeded:
+            return
+        names = self._names
+        tag = names.get(tag)
+        if attrs:
+            attrs = dict((names.get(key), value)
+                                            for key, value in attrs.items())
         if self._level == 0:
             self._root = ElementTree.Element(tag, attrs)
             self._handler.stream_start(self._root)
-        if self._level < 2:
             self._builder = ElementTree.TreeBuilder()
+        elif self._level == 1:
+            self.limits.reset()
+            if self.filters and drop_stanza(self.filters, tag, attrs):
+                self._builder = _NULL_TREE_BUILDER
+            else:
+                self._builder = ElementTree.TreeBuilder()
+        if self._level:
+            try:
+                self.limits.start(tag, attrs)
+            except StanzaLimitExceeded:
+                self.release()
+                raise
         self._level += 1
         return self._builder.start(tag, attrs)
 
@@ -130,6 +225,11 @@ class ParserTarget(object):
         """Handle the stream end."""
         pass
 
+    def release(self):
+        """Drop the partial stanza tree and ignore any further input."""
+        self._exceeded = True
+        self._builder = None
+
     def end(self, tag):
         """Handle an end tag.
         
@@ -141,6 +241,8 @@ class ParserTarget(object):
         
         Any tag below will be just added to the tree builder.
         """
+        if self._exceeded:
+            return
         self._level -= 1
         if self._level < 0:
             self._handler.stream_parse_error(u"Unexpected end tag for: {0!r}"
@@ -153,8 +255,13 @@ class ParserTarget(object):
                 return
             self._handler.stream_end()
             return
+        self.limits.end()
         element = self._builder.end(tag)
         if self._level == 1:
+            if element is None:
+                self.stanzas_dropped += 1
+                return
+            self.stanzas += 1
             self._handler.stream_element(element)
 
 class StreamReader(object):
@@ -166,40 +273,72 @@ class StreamReader(object):
         - `lock`: lock to protect the object
         - `in_use`: re-entrancy protection
         - `_started`: flag set after the first byte is pushed to the parser
+        - `_failed`: `True` when a handler has raised an exception, which
+          leaves the parser in an undefined state
+        - `_buffer_input`: `True` when the parser accepts read-only buffers
+          (memory views) as input, so no copy of the data is needed
     :Types:
         - `handler`: `XMLStreamHandler`
         - `parser`: :etree:`ElementTree.XMLParser`
         - `lock`: :std:`threading.RLock`
         - `in_use`: `bool`
         - `_started`: `bool`
+        - `_failed`: `bool`
+        - `_buffer_input`: `bool`
     """
     # pylint: disable-msg=R0903
-    def __init__(self, handler):
+    def __init__(self, handler, settings = None):
         """Initialize the reader.
 
         :Parameters:
             - `handler`: Object to handle stream start, end and stanzas.
+            - `settings`: settings with the stanza limits and filters
         :Types:
             - `handler`: `XMLStreamHandler`
+            - `settings`: `XMPPSettings`
         """
         self.handler = handler
-        self.parser = ElementTree.XMLParser(target = ParserTarget(handler))
+        self._target = ParserTarget(handler, settings)
+        self.parser = ElementTree.XMLParser(target = self._target)
         self.lock = threading.RLock()
         self.in_use = False
         self._started = False
+        self._failed = False
+        self._buffer_input = not hasattr(ElementTree, "LXML_VERSION")
+
+    @property
+    def stanzas_parsed(self):
+        """Number of complete stanzas parsed so far."""
+        return self._target.stanzas
+
+    @property
+    def stanzas_dropped(self):
+        """Number of stanzas dropped by the `filters` so far."""
+        return self._target.stanzas_dropped
+
+    @property
+    def filters(self):
+        """The stanza filters (`StanzaFilter` list), may be modified."""
+        return self._target.filters
 
     def feed(self, data):
         """Feed the parser with a chunk of data. Apropriate methods
         of `handler` will be called whenever something interesting is
         found.
 
+        Input is ignored after a handler has raised an exception.
+
         :Parameters:
             - `data`: the chunk of data to parse.
         :Types:
-            - `data`: `str`"""
+            - `data`: `str` or a read-only buffer"""
+        if not self._buffer_input and not isinstance(data, bytes):
+            data = bytes(data)
         with self.lock:
             if self.in_use:
                 raise StreamParseError("StreamReader.feed() is not reentrant!")
+            if self._failed:
+                return
             self.in_use = True
             try:
                 if not self._started:
@@ -212,9 +351,107 @@ class StreamReader(object):
                     self.parser.feed(data)
                 else:
                     self.parser.close()
+            except StanzaLimitExceeded, err:
+                self._failed = True
+                self.parser = None
+                self.handler.stream_limit_exceeded(unicode(err))
             except ElementTree.ParseError, err:
+                self._failed = True
                 self.handler.stream_parse_error(unicode(err))
+            except:
+                self._failed = True
+                raise
             finally:
                 self.in_use = False
+XML_PARSERS = {
+        "etree": StreamReader,
+        "expat": ExpatStreamReader,
+        "expat-lazy": LazyExpatStreamReader,
+        }
+
+if lxml_etree is not None:
+    XML_PARSERS["lxml"] = LXMLStreamReader
+
+class _DocumentHandler(XMLStreamHandler):
+    """Stream handler collecting the root and its children, for
+    `parse_document`.
+
+    :Ivariables:
+        - `root`: the root element, without children
+        - `elements`: the children of the root
+        - `complete`: `True` when the root end tag has been parsed
+    :Types:
+        - `root`: :etree:`ElementTree.Element`
+        - `elements`: `list` of :etree:`ElementTree.Element`
+        - `complete`: `bool`
+    """
+    def __init__(self):
+        XMLStreamHandler.__init__(self)
+        self.root = None
+        self.elements = []
+        self.complete = False
+
+    def stream_start(self, element):
+        self.root = element
+
+    def stream_element(self, element):
+        self.elements.append(element)
+
+    def stream_end(self):
+        self.complete = True
+
+def parse_document(data, settings = None):
+    """Parse a complete XML document with the stream reader selected by the
+    :r:`xml_parser setting`, so the stanza limits and filters apply to
+    the children of its root element, as they do to stanzas received in
+    a stream.
+
+    Used by transports receiving the stream in separate documents (HTTP
+    bodies or WebSocket messages).
+
+    :Parameters:
+        - `data`: the document
+        - `settings`: settings with the parser selection, stanza limits
+          and filters
+    :Types:
+        - `data`: `bytes`
+        - `settings`: `XMPPSettings`
+
+    :Return: the root element (without children) and the list of its
+        children not dropped by the filters
+    :Returntype: (:etree:`ElementTree.Element`, `list`) tuple
+
+    :Raise: `StreamParseError` when the document is not well-formed,
+        `StanzaLimitExceeded` when a child exceeds the limits
+    """
+    if settings is None:
+        settings = XMPPSettings()
+    handler = _DocumentHandler()
+    reader = XML_PARSERS[settings["xml_parser"]](handler, settings)
+    reader.feed(data)
+    reader.feed(b"")
+    if not handler.complete:
+        raise StreamParseError(u"Incomplete document")
+    return handler.root, handler.elements
+
+def _validate_xml_parser(value):
+    """Validator for the :r:`xml_parser setting`."""
+    if value not in XML_PARSERS:
+        raise ValueError("Unknown XML parser: {0!r}".format(value))
+    return value
+
+XMPPSettings.add_setting(u"xml_parser", type = unicode, default = u"etree",
+        validator = _validate_xml_parser,
+        cmdline_help = u"XML stream parser: 'etree', 'expat', 'expat-lazy'"
+                                                            u" or 'lxml'",
+        doc = u"""XML parser used to read the stream: "etree" (the
+:etree:`ElementTree.XMLParser` of the selected ElementTree implementation),
+"expat" (:std:`pyexpat` used directly, usually faster), "expat-lazy" (as
+"expat", but stanza content is parsed only when accessed and unmodified
+stanzas are forwarded as received) or "lxml" (the lxml pull parser, only
+when lxml is installed and should be used with lxml selected as the
+ElementTree implementation). The BOSH response bodies and WebSocket messages
+are parsed with it too, so the stanza limits and filters apply to them."""
+    )
 
 # vi: sts=4 et sw=4
@@ -0,0 +1,730 @@
+#
+# (C) Copyright 2003-2011 Jacek Konieczny <jajcus@jajcus.net>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version
+# 2.1 as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+
+"""XMPP stream readers driving the XML parsers directly.
+
+`ExpatStreamReader` drives :std:`pyexpat` directly (so does
+`LazyExpatStreamReader`, which leaves building the stanza content to the
+`LazyElement` objects it returns) and `LXMLStreamReader` uses the `lxml
+<http://lxml.de/>`__ pull parser (when lxml is installed). They are
+alternatives to the `xmppparser.StreamReader` and are registered in
+`xmppparser.XML_PARSERS`, to be selected with the :r:`xml_parser setting`.
+"""
+
+from __future__ import absolute_import, division
+
+__docformat__ = "restructuredtext en"
+
+import threading
+
+from copy import deepcopy
+from xml.parsers import expat
+from xml.sax.saxutils import quoteattr
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None # pylint: disable=C0103
+
+from .etree import ElementTree
+
+from .exceptions import StreamParseError, StanzaLimitExceeded
+from .settings import XMPPSettings
+from .utils import intern_name, NameCache
+from .stanzalimits import StanzaLimits, drop_stanza
+
+class ExpatStreamReader(object):
+    """XML stream reader using the :std:`pyexpat` parser directly, without
+    the :etree:`ElementTree.XMLParser` and :etree:`ElementTree.TreeBuilder`
+    layers.
+
+    Stanza elements are built with :etree:`ElementTree.SubElement` right in
+    the parser callbacks. Expanded tag and attribute names are cached, so
+    the same string object is used for every occurrence of a name.
+
+    :Ivariables:
+        - `handler`: object to receive parsed stream elements
+        - `parser`: the xml parser
+        - `lock`: lock to protect the object
+        - `in_use`: re-entrancy protection
+        - `stanzas_parsed`: number of complete stanzas parsed so far
+        - `stanzas_dropped`: number of stanzas dropped by the `filters`
+        - `filters`: the stanza filters
+        - `limits`: the stanza limits
+        - `_failed`: `True` when a handler has raised an exception, which
+          stops the expat parser
+        - `_skipping`: `True` while a dropped stanza is being skipped
+        - `_level`: current element nesting level
+        - `_root`: the stream root element
+        - `_stack`: elements of the stanza being built, which have not been
+          closed yet
+        - `_last`: the element most recently started or closed
+        - `_tail`: `True` if `_last` has been closed, so text goes to its
+          tail
+        - `_names`: shared copies of the element and attribute names
+    :Types:
+        - `handler`: `xmppparser.XMLStreamHandler`
+        - `parser`: :std:`xml.parsers.expat.xmlparser`
+        - `lock`: :std:`threading.RLock`
+        - `in_use`: `bool`
+        - `stanzas_parsed`: `int`
+        - `stanzas_dropped`: `int`
+        - `filters`: `list` of `StanzaFilter`
+        - `limits`: `StanzaLimits`
+        - `_failed`: `bool`
+        - `_skipping`: `bool`
+        - `_level`: `int`
+        - `_root`: :etree:`ElementTree.Element`
+        - `_stack`: `list`
+        - `_last`: :etree:`ElementTree.Element`
+        - `_tail`: `bool`
+        - `_names`: `NameCache`
+    """
+    # pylint: disable-msg=R0902
+    def __init__(self, handler, settings = None):
+        """Initialize the reader.
+
+        :Parameters:
+            - `handler`: Object to handle stream start, end and stanzas.
+            - `settings`: settings with the stanza limits and filters
+        :Types:
+            - `handler`: `xmppparser.XMLStreamHandler`
+            - `settings`: `XMPPSettings`
+        """
+        if settings is None:
+            settings = XMPPSettings()
+        self.handler = handler
+        self.filters = list(settings["stanza_filters"])
+        self.limits = StanzaLimits(settings)
+        self.parser = expat.ParserCreate(None, "}")
+        self.parser.buffer_text = True
+        self.parser.StartElementHandler = self._start
+        self.parser.EndElementHandler = self._end
+        self.parser.CharacterDataHandler = self._data
+        self.lock = threading.RLock()
+        self.in_use = False
+        self.stanzas_parsed = 0
+        self.stanzas_dropped = 0
+        self._failed = False
+        self._skipping = False
+        self._level = 0
+        self._root = None
+        self._stack = []
+        self._last = None
+        self._tail = False
+        self._names = NameCache()
+
+    def _name(self, name):
+        """Convert an expat name ('namespace}local') to the ElementTree
+        form ('{namespace}local') and return its shared copy from the
+        names cache.
+
+        :Returntype: `unicode`
+        """
+        if u"}" in name:
+            name = u"{" + name
+        return self._names.get(name)
+
+    def _start(self, name, attrs):
+        """Handle the start tag."""
+        tag = self._name(name)
+        if attrs:
+            attrs = dict((self._name(key), value)
+                                            for key, value in attrs.items())
+        if self._level > 1:
+            self.limits.start(tag, attrs)
+            element = ElementTree.SubElement(self._stack[-1], tag, attrs)
+            self._stack.append(element)
+        else:
+            if self._level and self.filters and drop_stanza(self.filters,
+                                                                tag, attrs):
+                self._skip_stanza()
+                return
+            element = ElementTree.Element(tag, attrs)
+            if self._level:
+                self.limits.reset()
+                self.limits.start(tag, attrs)
+                self._stack = [element]
+            else:
+                self._root = element
+                self._level = 1
+                self.handler.stream_start(element)
+                return
+        self._last = element
+        self._tail = False
+        self._level += 1
+
+    def _end(self, name):
+        """Handle an end tag."""
+        # pylint: disable=W0613
+        self._level -= 1
+        if self._level > 1:
+            self.limits.end()
+            self._last = self._stack.pop()
+            self._tail = True
+        elif self._level == 1:
+            self.stanzas_parsed += 1
+            self.handler.stream_element(self._stack.pop())
+        else:
+            self.handler.stream_end()
+
+    def _data(self, data):
+        """Handle XML text data.
+
+        Ignore the data outside the root element and directly under the
+        root."""
+        if self._level < 2:
+            return
+        self.limits.data(data)
+        last = self._last
+        if self._tail:
+            last.tail = last.tail + data if last.tail else data
+        else:
+            last.text = last.text + data if last.text else data
+
+    def _skip_stanza(self):
+        """Start skipping a stanza dropped by the `filters`.
+
+        The parser handlers are replaced with the ones only tracking the
+        nesting level until the end of the stanza."""
+        parser = self.parser
+        parser.StartElementHandler = self._skip_start
+        parser.EndElementHandler = self._skip_end
+        parser.CharacterDataHandler = None
+        self._skipping = True
+        self._level = 2
+
+    def _skip_start(self, name, attrs):
+        """Handle the start tag in a dropped stanza."""
+        # pylint: disable=W0613
+        self._level += 1
+
+    def _skip_end(self, name):
+        """Handle an end tag in a dropped stanza."""
+        # pylint: disable=W0613
+        self._level -= 1
+        if self._level == 1:
+            parser = self.parser
+            parser.StartElementHandler = self._start
+            parser.EndElementHandler = self._end
+            parser.CharacterDataHandler = self._data
+            self._skipping = False
+            self.stanzas_dropped += 1
+
+    def _parse(self, data):
+        """Pass a chunk of data to the expat parser.
+
+        [called with `lock` acquired]"""
+        if data:
+            self.parser.Parse(data, False)
+        else:
+            self.parser.Parse(b"", True)
+
+    def _release(self):
+        """Drop the partial stanza, after a limit has been exceeded.
+
+        [called with `lock` acquired]"""
+        self._stack = []
+        self._last = None
+
+    def feed(self, data):
+        """Feed the parser with a chunk of data. Apropriate methods
+        of `handler` will be called whenever something interesting is
+        found.
+
+        Input is ignored after a handler has raised an exception, as
+        the `StreamReader` does.
+
+        :Parameters:
+            - `data`: the chunk of data to parse, empty at the end of input
+        :Types:
+            - `data`: `str` or a read-only buffer"""
+        with self.lock:
+            if self.in_use:
+                raise StreamParseError("StreamReader.feed() is not reentrant!")
+            if self._failed:
+                return
+            self.in_use = True
+            try:
+                self._parse(data)
+            except StanzaLimitExceeded, err:
+                self._failed = True
+                self._release()
+                self.handler.stream_limit_exceeded(unicode(err))
+            except expat.ExpatError, err:
+                self._failed = True
+                self.handler.stream_parse_error(unicode(err))
+            except:
+                self._failed = True
+                raise
+            finally:
+                self.in_use = False
+
+class LazyElement(object):
+    """Stream element (stanza) which keeps the raw XML of its content and
+    builds the child elements only when they are needed.
+
+    The element name and attributes are available immediately, everything
+    else (iteration over the children, `text`, `find()`...) is delegated to
+    an :etree:`ElementTree.Element` parsed from `raw` on first use.
+
+    Unless the element is modified (which, as for any stanza element
+    received, should not be done) `raw` is a valid representation of it
+    and may be sent as is by the `pyxmpp2.xmppserializer.XMPPSerializer`.
+
+    This is not a real :etree:`ElementTree.Element` and cannot be added to
+    another element, the `element` attribute should be used for that.
+
+    :Ivariables:
+        - `tag`: the element name
+        - `raw`: the element, as received (UTF-8 encoded)
+        - `namespaces`: (prefix, namespace) pairs declared on the stream root,
+          prefix is `None` for the default namespace
+        - `_attrib`: the element attributes
+        - `_element`: the parsed element or `None`
+    :Types:
+        - `tag`: `unicode`
+        - `raw`: `bytes`
+        - `namespaces`: `tuple`
+        - `_attrib`: `dict`
+        - `_element`: :etree:`ElementTree.Element`
+    """
+    __slots__ = ("tag", "raw", "namespaces", "_attrib", "_element")
+    def __init__(self, tag, attrib, raw, namespaces):
+        """Initialize the `LazyElement` object.
+
+        :Parameters:
+            - `tag`: the element name
+            - `attrib`: the element attributes
+            - `raw`: the element, as received (UTF-8 encoded)
+            - `namespaces`: (prefix, namespace) pairs declared on the stream
+              root, needed to parse `raw`
+        :Types:
+            - `tag`: `unicode`
+            - `attrib`: `dict`
+            - `raw`: `bytes`
+            - `namespaces`: `tuple`
+        """
+        self.tag = tag
+        self.raw = raw
+        self.namespaces = namespaces
+        self._attrib = attrib
+        self._element = None
+
+    @property
+    def materialized(self):
+        """`True` when the element content has been parsed."""
+        return self._element is not None
+
+    @property
+    def element(self):
+        """The :etree:`ElementTree.Element`, parsed from `raw` on first
+        access."""
+        if self._element is None:
+            declarations = []
+            for prefix, namespace in self.namespaces:
+                if prefix:
+                    declarations.append(u" xmlns:{0}={1}".format(prefix,
+                                                        quoteattr(namespace)))
+                else:
+                    declarations.append(u" xmlns={0}".format(
+                                                        quoteattr(namespace)))
+            head = u"<root{0}>".format(u"".join(declarations)).encode("utf-8")
+            root = ElementTree.XML(head + self.raw + b"</root>")
+            element = root[0]
+            element.tail = None
+            self._element = element
+        return self._element
+
+    @property
+    def attrib(self):
+        """The element attributes."""
+        if self._element is not None:
+            return self._element.attrib
+        return self._attrib
+
+    @property
+    def text(self): # pylint: disable-msg=E0202
+        """The element text."""
+        return self.element.text
+
+    @text.setter # pylint: disable-msg=E1101
+    def text(self, value): # pylint: disable-msg=E0202,E0102,C0111
+        self.element.text = value
+
+    @property
+    def tail(self): # pylint: disable-msg=E0202
+        """The element tail, always empty for a stanza."""
+        return self.element.tail
+
+    @tail.setter # pylint: disable-msg=E1101
+    def tail(self, value): # pylint: disable-msg=E0202,E0102,C0111
+        self.element.tail = value
+
+    def get(self, key, default = None):
+        """Get an attribute value."""
+        return self.attrib.get(key, default)
+
+    def keys(self):
+        """Get the attribute names."""
+        return self.attrib.keys()
+
+    def items(self):
+        """Get the attributes as (name, value) pairs."""
+        return self.attrib.items()
+
+    def __getattr__(self, name):
+        return getattr(self.element, name)
+
+
+    def __iter__(self):
+        return iter(self.element)
+
+    def __len__(self):
+        return len(self.element)
+
+    def __getitem__(self, index):
+        return self.element[index]
+
+    def __deepcopy__(self, memo):
+        return deepcopy(self.element, memo)
+
+    def __repr__(self):
+        return "<LazyElement {0!r} at 0x{1:x}>".format(self.tag, id(self))
+
+class LazyExpatStreamReader(ExpatStreamReader):
+    """`ExpatStreamReader` variant passing `LazyElement` objects to the
+    handler.
+
+    Only the level-1 element start tags are processed, the rest of
+    a stanza is just checked by expat for well-formedness and kept as raw
+    bytes, so a stanza which is only routed (or dropped) is never turned
+    into an element tree.
+
+    :Ivariables:
+        - `_buffer`: the input not yet assigned to a complete stanza
+        - `_offset`: input position of the start of `_buffer`
+        - `_namespaces`: namespaces declared on the stream root
+        - `_stanza_tag`: name of the stanza being parsed
+        - `_stanza_attrib`: attributes of the stanza being parsed
+        - `_empty`: `True` while the stanza being parsed has no content
+    :Types:
+        - `_buffer`: `bytearray`
+        - `_offset`: `int`
+        - `_namespaces`: `tuple`
+        - `_stanza_tag`: `unicode`
+        - `_stanza_attrib`: `dict`
+        - `_empty`: `bool`
+    """
+    # pylint: disable-msg=R0902
+    def __init__(self, handler, settings = None):
+        """Initialize the reader.
+
+        :Parameters:
+            - `handler`: Object to handle stream start, end and stanzas.
+            - `settings`: settings with the stanza limits and filters
+        :Types:
+            - `handler`: `xmppparser.XMLStreamHandler`
+            - `settings`: `XMPPSettings`
+        """
+        ExpatStreamReader.__init__(self, handler, settings)
+        self.parser.StartNamespaceDeclHandler = self._namespace_decl
+        self._buffer = bytearray()
+        self._offset = 0
+        self._namespaces = ()
+        self._stanza_tag = None
+        self._stanza_attrib = None
+        self._empty = False
+
+    def _namespace_decl(self, prefix, namespace):
+        """Handle a namespace declaration, remember the ones on the stream
+        root."""
+        if not self._level:
+            self._namespaces += ((prefix, intern_name(namespace)),)
+
+    def _start(self, name, attrs):
+        """Handle the start tag."""
+        level = self._level
+        if level > 1:
+            self.limits.start(name, attrs)
+            self._empty = False
+            self._level += 1
+            return
+        elif not level:
+            ExpatStreamReader._start(self, name, attrs)
+            return
+        index = self.parser.CurrentByteIndex
+        del self._buffer[:index - self._offset]
+        self._offset = index
+        self._stanza_tag = self._name(name)
+        if attrs:
+            attrs = dict((self._name(key), value)
+                                            for key, value in attrs.items())
+        if self.filters and drop_stanza(self.filters, self._stanza_tag,
+                                                                    attrs):
+            self._skip_stanza()
+            return
+        self.limits.reset()
+        self.limits.start(self._stanza_tag, attrs)
+        self._stanza_attrib = attrs
+        self._empty = True
+        self._level = 2
+
+    def _end(self, name):
+        """Handle an end tag."""
+        # pylint: disable=W0613
+        self._level -= 1
+        if self._level > 1:
+            self.limits.end()
+            return
+        elif not self._level:
+            self.handler.stream_end()
+            return
+        buf = self._buffer
+        # start of the end tag or, for an empty element tag, end of it
+        end = self.parser.CurrentByteIndex - self._offset
+        if not self._empty or buf[end - 2:end] != b"/>":
+            end = buf.index(b">", end) + 1
+        raw = bytes(buf[:end])
+        del buf[:end]
+        self._offset += end
+        element = LazyElement(self._stanza_tag, self._stanza_attrib, raw,
+                                                            self._namespaces)
+        self.stanzas_parsed += 1
+        self.handler.stream_element(element)
+
+    def _data(self, data):
+        """Handle XML text data."""
+        if self._level > 1:
+            self.limits.data(data)
+            self._empty = False
+
+    def _parse(self, data):
+        """Pass a chunk of data to the expat parser.
+
+        [called with `lock` acquired]"""
+        if data:
+            self._buffer += data
+            self.parser.Parse(data, False)
+            if self._skipping:
+                # nothing to keep from a dropped stanza
+                self._offset += len(self._buffer)
+                del self._buffer[:]
+        else:
+            self.parser.Parse(b"", True)
+
+    def _release(self):
+        """Drop the partial stanza, after a limit has been exceeded.
+
+        [called with `lock` acquired]"""
+        self._buffer = bytearray()
+        self._stanza_attrib = None
+
+class LXMLStreamReader(object):
+    """XML stream reader using the ``lxml.etree.XMLPullParser``.
+
+    The elements passed to the handler are lxml elements, so this reader
+    should be used with lxml selected as the ElementTree implementation
+    (see `pyxmpp2.etree`).
+
+    The events are read after a whole chunk of data is parsed, when the
+    parser may already be building the following elements, so the handler
+    gets copies of the stream root and stanza elements. The stanzas
+    preceding the one completed are then removed from the document, so the
+    tree built by the parser does not grow. The last one is not removed
+    yet, as its tail text may still be in use by the parser.
+
+    For the same reason the stanza limits are checked only after each chunk
+    of data has been parsed. Each text node is accounted for as soon as
+    it is complete and the one still being parsed is checked after every
+    chunk, so a stanza never closed cannot grow past the limits (by more
+    than the few hundred bytes of text libxml2 buffers).
+
+    :Ivariables:
+        - `handler`: object to receive parsed stream elements
+        - `parser`: the xml parser
+        - `lock`: lock to protect the object
+        - `in_use`: re-entrancy protection
+        - `stanzas_parsed`: number of complete stanzas parsed so far
+        - `stanzas_dropped`: number of stanzas dropped by the `filters`
+        - `filters`: the stanza filters
+        - `limits`: the stanza limits
+        - `_level`: current element nesting level
+        - `_root`: the stream root element
+        - `_open`: the stanza elements not complete yet, outermost first
+        - `_started`: flag set after the first byte is pushed to the parser
+        - `_failed`: `True` when a handler has raised an exception
+        - `_skipping`: `True` while the current stanza is one dropped
+    :Types:
+        - `handler`: `xmppparser.XMLStreamHandler`
+        - `parser`: ``lxml.etree.XMLPullParser``
+        - `lock`: :std:`threading.RLock`
+        - `in_use`: `bool`
+        - `stanzas_parsed`: `int`
+        - `stanzas_dropped`: `int`
+        - `filters`: `list` of `StanzaFilter`
+        - `limits`: `StanzaLimits`
+        - `_level`: `int`
+        - `_root`: ``lxml.etree._Element``
+        - `_open`: `list` of ``lxml.etree._Element``
+        - `_started`: `bool`
+        - `_failed`: `bool`
+        - `_skipping`: `bool`
+    """
+    # pylint: disable-msg=R0902
+    def __init__(self, handler, settings = None):
+        """Initialize the reader.
+
+        :Parameters:
+            - `handler`: Object to handle stream start, end and stanzas.
+            - `settings`: settings with the stanza limits and filters
+        :Types:
+            - `handler`: `xmppparser.XMLStreamHandler`
+            - `settings`: `XMPPSettings`
+        """
+        if lxml_etree is None:
+            raise ImportError("lxml is not available")
+        if settings is None:
+            settings = XMPPSettings()
+        self.handler = handler
+        self.filters = list(settings["stanza_filters"])
+        self.limits = StanzaLimits(settings)
+        self.parser = lxml_etree.XMLPullParser(events = ("start", "end"),
+                            resolve_entities = False, no_network = True)
+        self.lock = threading.RLock()
+        self.in_use = False
+        self.stanzas_parsed = 0
+        self.stanzas_dropped = 0
+        self._level = 0
+        self._root = None
+        self._open = []
+        self._started = False
+        self._failed = False
+        self._skipping = False
+
+    @staticmethod
+    def _last_text(element):
+        """Return the last text node directly in `element`: the tail of its
+        last child or its text."""
+        if len(element):
+            return element[-1].tail
+        return element.text
+
+    def _process_events(self):
+        """Pass the elements parsed so far to the handler."""
+        limits = self.limits
+        for event, element in self.parser.read_events():
+            if event == "start":
+                if not self._level:
+                    self._root = element
+                    self.handler.stream_start(lxml_etree.Element(element.tag,
+                                        element.attrib, nsmap = element.nsmap))
+                else:
+                    if self._level == 1:
+                        limits.reset()
+                        self._skipping = bool(self.filters) and drop_stanza(
+                                self.filters, element.tag, element.attrib)
+                    else:
+                        # the text node preceding this element is complete
+                        previous = element.getprevious()
+                        if previous is None:
+                            text = element.getparent().text
+                        else:
+                            text = previous.tail
+                        if text:
+                            limits.text = 0
+                            limits.data(text)
+                    limits.start(element.tag, element.attrib)
+                    self._open.append(element)
+                self._level += 1
+                continue
+            self._level -= 1
+            if self._level:
+                # the last text node is complete now
+                limits.end()
+                text = self._last_text(element)
+                if text:
+                    limits.text = 0
+                    limits.data(text)
+                self._open.pop()
+            if self._level == 1:
+                root = self._root
+                if self._skipping:
+                    while element.getprevious() is not None:
+                        del root[0]
+                    self.stanzas_dropped += 1
+                    continue
+                stanza = deepcopy(element)
+                stanza.tail = None
+                while element.getprevious() is not None:
+                    del root[0]
+                self.stanzas_parsed += 1
+                self.handler.stream_element(stanza)
+            elif not self._level:
+                self.handler.stream_end()
+        if self._open:
+            text = self._last_text(self._open[-1])
+            if text:
+                limits.pending(len(text))
+
+    def feed(self, data):
+        """Feed the parser with a chunk of data. Apropriate methods
+        of `handler` will be called whenever something interesting is
+        found.
+
+        :Parameters:
+            - `data`: the chunk of data to parse, empty at the end of input
+        :Types:
+            - `data`: `str` or a read-only buffer"""
+        if not isinstance(data, bytes):
+            data = bytes(data)
+        with self.lock:
+            if self.in_use:
+                raise StreamParseError("StreamReader.feed() is not reentrant!")
+            if self._failed:
+                return
+            self.in_use = True
+            try:
+                if not self._started:
+                    # encoding detection fails when the first chunk is big
+                    if len(data) > 1:
+                        self.parser.feed(data[:1])
+                        data = data[1:]
+                    self._started = True
+                if data:
+                    self.parser.feed(data)
+                else:
+                    self.parser.close()
+                self._process_events()
+            except StanzaLimitExceeded, err:
+                self._failed = True
+                self.parser = None
+                self._root = None
+                self._open = []
+                self.handler.stream_limit_exceeded(unicode(err))
+            except lxml_etree.ParseError, err:
+                self._failed = True
+                # events parsed before the error are still queued
+                self._process_events()
+                self.handler.stream_parse_error(unicode(err))
+            except:
+                self._failed = True
+                raise
+            finally:
+                self.in_use = False
+
+# vi: sts=4 et sw=4
@@ -29,6 +29,7 @@ import re
 from xml.sax.saxutils import escape, quoteattr
 
 from .constants import STANZA_NAMESPACES, STREAM_NS, XML_NS
+from .utils import MAX_INTERNED_NAMES
 
 __docformat__ = "restructuredtext en"
 
@@ -43,6 +44,68 @@ def remove_evil_characters(data):
     """Remove control characters (not allowed in XML) from a string."""
     return EVIL_CHARACTERS_RE.sub(u"\ufffd", data)
 
+TEXT_SPECIAL_RE = re.compile(u"[&<>\000-\010\013\014\016-\037]", re.UNICODE)
+ATTR_SPECIAL_RE = re.compile(u"[&<>\t\n\r\000-\010\013\014\016-\037]",
+                                                                    re.UNICODE)
+
+# replacements escaping XML text and attribute values (the same way as
+# :std:`xml.sax.saxutils.escape` and `quoteattr` do) and replacing the
+# control characters, all in one pass
+_TEXT_ESCAPES = dict((unichr(code), u"\ufffd") for code in range(32)
+                                            if code not in (9, 10, 13))
+_TEXT_ESCAPES.update({u"&": u"&amp;", u"<": u"&lt;", u">": u"&gt;"})
+_ATTR_ESCAPES = dict(_TEXT_ESCAPES)
+_ATTR_ESCAPES.update({u"\n": u"&#10;", u"\r": u"&#13;", u"\t": u"&#9;"})
+
+def _text_escape(match):
+    """Return the replacement of a character matched by `TEXT_SPECIAL_RE`."""
+    return _TEXT_ESCAPES[match.group()]
+
+def _attr_escape(match):
+    """Return the replacement of a character matched by `ATTR_SPECIAL_RE`."""
+    return _ATTR_ESCAPES[match.group()]
+
+def encode_text(data):
+    """Escape XML text, replace control characters and encode the result
+    to UTF-8.
+
+    The same as ``remove_evil_characters(escape(data)).encode("utf-8")``,
+    but done in one pass.
+
+    :Parameters:
+        - `data`: the text
+    :Types:
+        - `data`: `unicode`
+
+    :Returntype: `bytes`
+    """
+    if not isinstance(data, unicode):
+        data = unicode(data)
+    return TEXT_SPECIAL_RE.sub(_text_escape, data).encode("utf-8")
+
+def encode_attr(value):
+    """Quote and escape an XML attribute value, replace control characters
+    and encode the result to UTF-8.
+
+    The same as ``remove_evil_characters(quoteattr(data)).encode("utf-8")``.
+
+    :Parameters:
+        - `value`: the attribute value
+    :Types:
+        - `value`: `unicode`
+
+    :Returntype: `bytes`
+    """
+    if not isinstance(value, unicode):
+        value = unicode(value)
+    value = ATTR_SPECIAL_RE.sub(_attr_escape, value)
+    if u'"' in value:
+        if u"'" in value:
+            return (u'"' + value.replace(u'"', u"&quot;")
+                                                    + u'"').encode("utf-8")
+        return (u"'" + value + u"'").encode("utf-8")
+    return (u'"' + value + u'"').encode("utf-8")
+
 class XMPPSerializer(object):
     """Implementation of the XMPP serializer.
 
@@ -57,12 +120,17 @@ class XMPPSerializer(object):
         - `_head_emitted`: `True` if the stream start tag has been emitted
         - `_next_id`: the next sequence number to be used in auto-generated
           prefixes.
+        - `_raw_scopes`: cache of the `_raw_usable` results
+        - `_encoded_names`: cache of the UTF-8 encoded (prefixed) element and
+          attribute names
     :Types:
         - `stanza_namespace`: `unicode`
         - `_prefixes`: `dict`
         - `_root_prefixes`: `dict`
         - `_head_emitted`: `bool`
         - `_next_id`: `int`
+        - `_raw_scopes`: `dict`
+        - `_encoded_names`: `dict`
     """
     def __init__(self, stanza_namespace, extra_prefixes = None):
         """
@@ -84,6 +152,8 @@ class XMPPSerializer(object):
         self._root_prefixes = None
         self._head_emitted = False
         self._next_id = 1
+        self._raw_scopes = {}
+        self._encoded_names = {}
 
     def add_prefix(self, namespace, prefix):
         """Add a new namespace prefix.
@@ -324,11 +394,109 @@ class XMPPSerializer(object):
             tail = u""
         return start_tag + text + u''.join(children) + end_tag + tail
 
+    def _encode_name(self, name):
+        """Encode an element or attribute name to UTF-8, replacing the
+        control characters.
+
+        :Parameters:
+            - `name`: the (prefixed) name
+        :Types:
+            - `name`: `unicode`
+
+        :Returntype: `bytes`
+        """
+        encoded = self._encoded_names.get(name)
+        if encoded is None:
+            encoded = remove_evil_characters(name).encode("utf-8")
+            if len(self._encoded_names) < MAX_INTERNED_NAMES:
+                self._encoded_names[name] = encoded
+        return encoded
+
+    def _write_element(self, element, level, declared_prefixes, write):
+        """"Recursive XML element serializer writing UTF-8 data.
+
+        Produces the same output as `_emit_element` (with the control
+        characters replaced), but passes it to `write` piece by piece,
+        instead of building strings for every element.
+
+        :Parameters:
+            - `element`: the element to serialize
+            - `level`: nest level (0 - root element, 1 - stanzas, etc.)
+            - `declared_prefixes`: namespace to prefix mapping of already
+              declared prefixes.
+            - `write`: function to pass the serialized data to
+        :Types:
+            - `element`: :etree:`ElementTree.Element`
+            - `level`: `int`
+            - `declared_prefixes`: `unicode` to `unicode` dictionary
+            - `write`: callable
+        """
+        declarations = {}
+        declared_prefixes = dict(declared_prefixes)
+        tag = self._encode_name(self._make_prefixed(element.tag, True,
+                                            declared_prefixes, declarations))
+        write(b"<" + tag)
+        for name, value in element.items():
+            prefixed = self._make_prefixed(name, False, declared_prefixes,
+                                                                declarations)
+            write(b" " + self._encode_name(prefixed) + b"="
+                                                        + encode_attr(value))
+        if declarations:
+            declarations = self._make_ns_declarations(declarations,
+                                                        declared_prefixes)
+            write(remove_evil_characters(u" " + declarations).encode("utf-8"))
+        text = element.text
+        if not text and not len(element):
+            write(b"/>")
+        else:
+            write(b">")
+            if level > 0 and text:
+                write(encode_text(text))
+            for child in element:
+                self._write_element(child, level + 1, declared_prefixes,
+                                                                        write)
+            write(b"</" + tag + b">")
+        if level > 1 and element.tail:
+            write(encode_text(element.tail))
+
+    def _raw_usable(self, namespaces):
+        """Check if the raw XML of a received element
+        (`pyxmpp2.xmppreaders.LazyElement`) may be used as is in this stream.
+
+        That is when the stream root declarations it relies on mean the same
+        here.
+
+        :Parameters:
+            - `namespaces`: (prefix, namespace) pairs declared on the root of
+              the stream the element was received from
+        :Types:
+            - `namespaces`: `tuple`
+
+        :Returntype: `bool`
+        """
+        usable = self._raw_scopes.get(namespaces)
+        if usable is not None:
+            return usable
+        usable = False
+        for prefix, namespace in namespaces:
+            if prefix:
+                if self._root_prefixes.get(namespace) != prefix:
+                    usable = False
+                    break
+            elif (namespace == self.stanza_namespace
+                                        or namespace in STANZA_NAMESPACES):
+                usable = True
+        self._raw_scopes[namespaces] = usable
+        return usable
+
     def emit_stanza(self, element):
         """"Serialize a stanza.
 
         Must be called after `emit_head`.
 
+        An unmodified `pyxmpp2.xmppreaders.LazyElement` is emitted as received,
+        when `_raw_usable` allows that.
+
         :Parameters:
             - `element`: the element to serialize
         :Types:
@@ -339,10 +507,61 @@ class XMPPSerializer(object):
         """
         if not self._head_emitted:
             raise RuntimeError(".emit_head() must be called first.")
+        raw = getattr(element, "raw", None)
+        if raw is not None and self._raw_usable(element.namespaces):
+            return raw.decode("utf-8")
         string = self._emit_element(element, level = 1, 
                                     declared_prefixes = self._root_prefixes)
         return remove_evil_characters(string)
 
+    def write_stanza(self, element, output):
+        """"Serialize a stanza, appending UTF-8 data to `output`.
+
+        Must be called after `emit_head`.
+
+        The data written is the same as
+        ``emit_stanza(element).encode("utf-8")``, but no intermediate strings
+        are built for the whole stanza or its child elements, so `output` may
+        be reused for many stanzas.
+
+        :Parameters:
+            - `element`: the element to serialize
+            - `output`: the output buffer
+        :Types:
+            - `element`: :etree:`ElementTree.Element`
+            - `output`: `bytearray` or :std:`io.BytesIO`
+        """
+        if not self._head_emitted:
+            raise RuntimeError(".emit_head() must be called first.")
+        if isinstance(output, bytearray):
+            write = output.extend
+        else:
+            write = output.write
+        raw = getattr(element, "raw", None)
+        if raw is not None and self._raw_usable(element.namespaces):
+            write(raw)
+            return
+        self._write_element(element, 1, self._root_prefixes, write)
+
+    def emit_standalone(self, element):
+        """"Serialize an element as a self-contained XML document, with
+        all the namespaces declared on it, e.g. for a WebSocket frame
+        (:RFC:`7395`).
+
+        `emit_head` need not be called first.
+
+        :Parameters:
+            - `element`: the element to serialize
+        :Types:
+            - `element`: :etree:`ElementTree.Element`
+
+        :Return: serialized element
+        :Returntype: `unicode`
+        """
+        string = self._emit_element(element, level = 1,
+                                    declared_prefixes = {XML_NS: u"xml"})
+        return remove_evil_characters(string)
+
 
 # thread local data to store XMPPSerializer instance used by the `serialize`
 # function